@@ -14,11 +14,13 @@ from typing import Any, List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+from services.query_monitor import mongo_event_listeners
+
 load_dotenv()
 
 # MongoDB connection
 mongo_url: str = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client: Any = AsyncIOMotorClient(mongo_url)
+client: Any = AsyncIOMotorClient(mongo_url, event_listeners=mongo_event_listeners())
 db: Any = client[os.environ.get('DB_NAME', 'agricultural_management')]
 
 # Collections
@@ -10,6 +10,8 @@ import uuid
 import io
 
 from routes_auth import get_current_user
+from services.excel_export import ExcelExport
+from services.render_service import build_pdf
 
 router = APIRouter(
     prefix="/api/rrhh",
@@ -83,10 +85,6 @@ async def export_documentos_excel(
     tipo: Optional[str] = None,
     estado: Optional[str] = None
 ):
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from fastapi.responses import StreamingResponse
-    
     database = get_db()
     query = {}
     if empleado_id:
@@ -108,54 +106,29 @@ async def export_documentos_excel(
         if fecha_hasta:
             query["created_at"]["$lt"] = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
     
-    documentos = []
-    cursor = database.documentos_empleados.find(query).sort("created_at", -1)
-    async for doc in cursor:
-        documentos.append(doc)
-    
     empleados_dict = {}
-    async for emp in database.empleados.find({}):
+    async for emp in database.empleados.find({}, {"nombre": 1, "apellidos": 1}):
         empleados_dict[str(emp["_id"])] = f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Documentos"
-    
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    
-    headers = ["Documento", "Empleado", "Tipo", "Fecha Documento", "Fecha Registro", "Estado", "Archivo Adjunto"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = thin_border
-    
     tipos_doc = {'contrato': 'Contrato de Trabajo', 'anexo': 'Anexo Contrato', 'nomina': 'Nomina', 'certificado': 'Certificado', 'formacion': 'Formacion PRL', 'epi': 'Entrega EPI', 'otro': 'Otro'}
     
-    for row, doc in enumerate(documentos, 2):
+    def documento_row(doc):
         empleado_nombre = empleados_dict.get(doc.get("empleado_id", ""), "Desconocido")
         tipo_label = tipos_doc.get(doc.get("tipo", "otro"), doc.get("tipo", ""))
         fecha_doc = doc.get("fecha_creacion", "")
         fecha_registro = doc.get("created_at").strftime("%d/%m/%Y %H:%M") if doc.get("created_at") else ""
         estado_val = "Firmado" if doc.get("firmado") else ("Pendiente" if doc.get("requiere_firma") else "No requiere firma")
         archivo = "Si" if doc.get("archivo_url") else "No"
-        
-        for col, val in enumerate([doc.get("nombre", ""), empleado_nombre, tipo_label, fecha_doc, fecha_registro, estado_val, archivo], 1):
-            ws.cell(row=row, column=col, value=val).border = thin_border
+        return [doc.get("nombre", ""), empleado_nombre, tipo_label, fecha_doc, fecha_registro, estado_val, archivo]
     
-    for col_letter, width in [('A', 35), ('B', 25), ('C', 20), ('D', 15), ('E', 18), ('F', 18), ('G', 15)]:
-        ws.column_dimensions[col_letter].width = width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"documentos_rrhh_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    xl = ExcelExport(header_color="2E7D32")
+    ws = xl.add_sheet(
+        "Documentos",
+        ["Documento", "Empleado", "Tipo", "Fecha Documento", "Fecha Registro", "Estado", "Archivo Adjunto"],
+        widths=[35, 25, 20, 15, 18, 18, 15],
+    )
+    await ws.write(database.documentos_empleados.find(query).sort("created_at", -1), documento_row)
+    return await xl.response(f"documentos_rrhh_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
 
 
 @router.get("/documentos/export/pdf")
@@ -275,7 +248,7 @@ async def export_documentos_pdf(
     else:
         elements.append(Paragraph("No hay documentos con los filtros seleccionados.", styles['Normal']))
     
-    pdf_doc.build(elements)
+    await build_pdf(pdf_doc, elements)
     output.seek(0)
     filename = f"informe_documentos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     
@@ -9,6 +9,9 @@ from bson import ObjectId
 import io
 
 from routes_auth import get_current_user
+from services.render_service import build_pdf
+from services.entity_loader import Loaders
+from services.excel_export import ExcelExport, CELL, HEADER, PLAIN, StyledRow
 
 router = APIRouter(
     prefix="/api/rrhh",
@@ -49,14 +52,13 @@ async def get_fichajes(
     if parcela_id:
         query["parcela_id"] = parcela_id
     
-    fichajes = []
-    cursor = database.fichajes.find(query).sort([("fecha", -1), ("hora", -1)])
-    async for f in cursor:
+    fichajes = await database.fichajes.find(query).sort([("fecha", -1), ("hora", -1)]).to_list(None)
+    empleados = await Loaders().get(database.empleados).load_many(f.get("empleado_id") for f in fichajes)
+    for f in fichajes:
         f["_id"] = str(f["_id"])
-        emp = await database.empleados.find_one({"_id": ObjectId(f["empleado_id"])})
+        emp = empleados.get(str(f.get("empleado_id")))
         if emp:
             f["empleado_nombre"] = f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
-        fichajes.append(f)
     return {"success": True, "fichajes": fichajes, "total": len(fichajes)}
 
 
@@ -64,15 +66,14 @@ async def get_fichajes(
 async def get_fichajes_hoy():
     database = get_db()
     hoy = datetime.now().strftime("%Y-%m-%d")
-    fichajes = []
-    cursor = database.fichajes.find({"fecha": hoy}).sort("hora", -1)
-    async for f in cursor:
+    fichajes = await database.fichajes.find({"fecha": hoy}).sort("hora", -1).to_list(None)
+    empleados = await Loaders().get(database.empleados).load_many(f.get("empleado_id") for f in fichajes)
+    for f in fichajes:
         f["_id"] = str(f["_id"])
-        emp = await database.empleados.find_one({"_id": ObjectId(f["empleado_id"])})
+        emp = empleados.get(str(f.get("empleado_id")))
         if emp:
             f["empleado_nombre"] = f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
             f["empleado_foto"] = emp.get("foto_url")
-        fichajes.append(f)
     
     empleados_activos = await database.empleados.count_documents({"activo": True})
     empleados_fichados = len(set([f["empleado_id"] for f in fichajes if f["tipo"] == "entrada"]))
@@ -312,139 +313,89 @@ async def get_informe_control_horario(empleado_id: str, fecha_desde: str, fecha_
 
 @router.get("/fichajes/informe/excel")
 async def export_informe_control_horario_excel(empleado_id: str, fecha_desde: str, fecha_hasta: str):
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from fastapi.responses import StreamingResponse
+    from openpyxl.styles import Font, PatternFill
     
     database = get_db()
     empleado = await database.empleados.find_one({"_id": ObjectId(empleado_id)})
     if not empleado:
         raise HTTPException(status_code=404, detail="Empleado no encontrado")
     
-    fichajes_raw = []
-    cursor = database.fichajes.find({"empleado_id": empleado_id, "fecha": {"$gte": fecha_desde, "$lte": fecha_hasta}}).sort([("fecha", 1), ("hora", 1)])
-    async for f in cursor:
-        fichajes_raw.append(f)
-    
-    dias_trabajados = _agrupar_fichajes_por_dia(fichajes_raw)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Control Horario"
-    
-    title_font = Font(bold=True, size=14, color="FFFFFF")
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    warning_fill = PatternFill(start_color="FFEB3B", end_color="FFEB3B", fill_type="solid")
-    error_fill = PatternFill(start_color="FFCDD2", end_color="FFCDD2", fill_type="solid")
-    ok_fill = PatternFill(start_color="C8E6C9", end_color="C8E6C9", fill_type="solid")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    
-    ws.merge_cells('A1:G1')
-    ws['A1'] = "INFORME DE CONTROL HORARIO"
-    ws['A1'].font = title_font
-    ws['A1'].fill = header_fill
-    ws['A1'].alignment = Alignment(horizontal="center")
-    
-    ws['A3'] = "Empleado:"
-    ws['B3'] = f"{empleado.get('nombre', '')} {empleado.get('apellidos', '')}"
-    ws['A4'] = "DNI/NIE:"
-    ws['B4'] = empleado.get('dni_nie', '')
-    ws['A5'] = "Puesto:"
-    ws['B5'] = empleado.get('puesto', '')
-    ws['D3'] = "Periodo:"
-    ws['E3'] = f"{fecha_desde} a {fecha_hasta}"
-    
-    headers = ["Fecha", "Dia", "Entrada", "Salida", "Horas", "Min", "Total Horas", "Estado"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=7, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-        cell.alignment = Alignment(horizontal="center")
+    cursor = database.fichajes.find(
+        {"empleado_id": empleado_id, "fecha": {"$gte": fecha_desde, "$lte": fecha_hasta}},
+        {"fecha": 1, "tipo": 1, "hora": 1},
+    ).sort([("fecha", 1), ("hora", 1)])
+    dias_trabajados = _agrupar_fichajes_por_dia([f async for f in cursor])
+    
+    xl = ExcelExport(header_color="2E7D32")
+    banner = xl.add_style("control_banner", HEADER, font=Font(bold=True, size=14, color="FFFFFF"))
+    warning = xl.add_style("control_incompleto", CELL, fill=PatternFill(start_color="FFEB3B", end_color="FFEB3B", fill_type="solid"))
+    error = xl.add_style("control_ausencia", CELL, fill=PatternFill(start_color="FFCDD2", end_color="FFCDD2", fill_type="solid"))
+    ok = xl.add_style("control_ok", CELL, fill=PatternFill(start_color="C8E6C9", end_color="C8E6C9", fill_type="solid"))
+    resumen = xl.add_style("control_resumen", HEADER, alignment=None)
+    
+    ws = xl.add_sheet("Control Horario", [], widths=[12, 12, 10, 10, 8, 6, 12, 12])
+    ws.append(["INFORME DE CONTROL HORARIO"], style=banner)
+    ws.merge_last_row(1, 7)
+    ws.append([])
+    ws.append(["Empleado:", f"{empleado.get('nombre', '')} {empleado.get('apellidos', '')}", "",
+               "Periodo:", f"{fecha_desde} a {fecha_hasta}"], style=PLAIN)
+    ws.append(["DNI/NIE:", empleado.get('dni_nie', '')], style=PLAIN)
+    ws.append(["Puesto:", empleado.get('puesto', '')], style=PLAIN)
+    ws.append([])
+    ws.append(["Fecha", "Dia", "Entrada", "Salida", "Horas", "Min", "Total Horas", "Estado"], style=HEADER)
     
     dias_semana_es = {'Monday': 'Lunes', 'Tuesday': 'Martes', 'Wednesday': 'Miercoles', 'Thursday': 'Jueves', 'Friday': 'Viernes', 'Saturday': 'Sabado', 'Sunday': 'Domingo'}
     
-    row = 8
     total_horas = total_minutos = dias_ausencia = dias_incompletos = 0
     fecha_inicio = datetime.strptime(fecha_desde, "%Y-%m-%d").date()
     fecha_fin = datetime.strptime(fecha_hasta, "%Y-%m-%d").date()
-    current_date = fecha_inicio
     
-    while current_date <= fecha_fin:
-        if current_date.weekday() < 5:
-            fecha_str = current_date.strftime("%Y-%m-%d")
-            dia_semana = dias_semana_es.get(current_date.strftime("%A"), current_date.strftime("%A"))
-            
-            if fecha_str in dias_trabajados:
-                dia_data = dias_trabajados[fecha_str]
-                entrada = dia_data["entradas"][0] if dia_data["entradas"] else "-"
-                salida = dia_data["salidas"][-1] if dia_data["salidas"] else "-"
-                horas = minutos = 0
-                if entrada != "-" and salida != "-":
-                    horas, minutos = _calcular_horas(entrada, salida)
-                    total_horas += horas
-                    total_minutos += minutos
-                estado = "OK" if horas >= 8 else "Incompleto"
-                if horas < 8:
-                    dias_incompletos += 1
-                
-                ws.cell(row=row, column=1, value=fecha_str).border = thin_border
-                ws.cell(row=row, column=2, value=dia_semana).border = thin_border
-                ws.cell(row=row, column=3, value=entrada).border = thin_border
-                ws.cell(row=row, column=4, value=salida).border = thin_border
-                ws.cell(row=row, column=5, value=horas).border = thin_border
-                ws.cell(row=row, column=6, value=minutos).border = thin_border
-                ws.cell(row=row, column=7, value=f"{horas}:{minutos:02d}").border = thin_border
-                estado_cell = ws.cell(row=row, column=8, value=estado)
-                estado_cell.border = thin_border
-                estado_cell.fill = ok_fill if horas >= 8 else warning_fill
-            else:
-                dias_ausencia += 1
-                ws.cell(row=row, column=1, value=fecha_str).border = thin_border
-                ws.cell(row=row, column=2, value=dia_semana).border = thin_border
-                for c in range(3, 8):
-                    ws.cell(row=row, column=c, value="-" if c < 7 else "0:00" if c == 7 else "AUSENCIA").border = thin_border
-                ws.cell(row=row, column=5, value=0).border = thin_border
-                ws.cell(row=row, column=6, value=0).border = thin_border
-                ws.cell(row=row, column=7, value="0:00").border = thin_border
-                ausencia_cell = ws.cell(row=row, column=8, value="AUSENCIA")
-                ausencia_cell.border = thin_border
-                ausencia_cell.fill = error_fill
-            row += 1
-        current_date += timedelta(days=1)
+    def dias_laborables():
+        current_date = fecha_inicio
+        while current_date <= fecha_fin:
+            if current_date.weekday() < 5:
+                yield current_date
+            current_date += timedelta(days=1)
+    
+    def to_row(current_date):
+        nonlocal total_horas, total_minutos, dias_ausencia, dias_incompletos
+        fecha_str = current_date.strftime("%Y-%m-%d")
+        dia_semana = dias_semana_es.get(current_date.strftime("%A"), current_date.strftime("%A"))
+        
+        if fecha_str not in dias_trabajados:
+            dias_ausencia += 1
+            return StyledRow([fecha_str, dia_semana, "-", "-", 0, 0, "0:00", "AUSENCIA"], cell_styles={7: error})
+        
+        dia_data = dias_trabajados[fecha_str]
+        entrada = dia_data["entradas"][0] if dia_data["entradas"] else "-"
+        salida = dia_data["salidas"][-1] if dia_data["salidas"] else "-"
+        horas = minutos = 0
+        if entrada != "-" and salida != "-":
+            horas, minutos = _calcular_horas(entrada, salida)
+            total_horas += horas
+            total_minutos += minutos
+        estado = "OK" if horas >= 8 else "Incompleto"
+        if horas < 8:
+            dias_incompletos += 1
+        return StyledRow(
+            [fecha_str, dia_semana, entrada, salida, horas, minutos, f"{horas}:{minutos:02d}", estado],
+            cell_styles={7: ok if horas >= 8 else warning},
+        )
+    
+    await ws.write(dias_laborables(), to_row)
     
     total_horas += total_minutos // 60
     total_minutos = total_minutos % 60
     
-    row += 1
-    ws.merge_cells(f'A{row}:D{row}')
-    ws[f'A{row}'] = "RESUMEN"
-    ws[f'A{row}'].font = header_font
-    ws[f'A{row}'].fill = header_fill
-    for c in range(5, 9):
-        ws.cell(row=row, column=c).fill = header_fill
-    
-    row += 1
-    ws[f'A{row}'] = "Total Horas Trabajadas:"
-    ws[f'G{row}'] = f"{total_horas}:{total_minutos:02d}"
-    row += 1
-    ws[f'A{row}'] = "Dias con Ausencia:"
-    ws[f'G{row}'] = dias_ausencia
-    row += 1
-    ws[f'A{row}'] = "Dias Incompletos (<8h):"
-    ws[f'G{row}'] = dias_incompletos
-    
-    for col_letter, width in [('A', 12), ('B', 12), ('C', 10), ('D', 10), ('E', 8), ('F', 6), ('G', 12), ('H', 12)]:
-        ws.column_dimensions[col_letter].width = width
+    ws.append([])
+    ws.append(["RESUMEN", "", "", "", "", "", "", ""], style=resumen)
+    ws.merge_last_row(1, 4)
+    ws.append(["Total Horas Trabajadas:", "", "", "", "", "", f"{total_horas}:{total_minutos:02d}"], style=PLAIN)
+    ws.append(["Dias con Ausencia:", "", "", "", "", "", dias_ausencia], style=PLAIN)
+    ws.append(["Dias Incompletos (<8h):", "", "", "", "", "", dias_incompletos], style=PLAIN)
     
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
     nombre_archivo = f"control_horario_{empleado.get('apellidos', '')}_{fecha_desde}_{fecha_hasta}.xlsx".replace(" ", "_")
-    
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"})
+    return await xl.response(nombre_archivo)
 
 
 @router.get("/fichajes/informe/pdf")
@@ -547,7 +498,7 @@ async def export_informe_control_horario_pdf(empleado_id: str, fecha_desde: str,
     elements.append(Paragraph(f"Dias con ausencia: {dias_ausencia}", info_style))
     elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", info_style))
     
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     nombre_archivo = f"control_horario_{empleado.get('apellidos', '')}_{fecha_desde}_{fecha_hasta}.pdf".replace(" ", "_")
     
@@ -10,6 +10,9 @@ import io
 
 from utils.formatters import format_number_es
 from routes_auth import get_current_user
+from services.render_service import build_pdf, save_workbook
+from services.entity_loader import Loaders, iter_batches
+from services.excel_export import ExcelExport, CELL, HEADER, PLAIN, StyledRow
 
 router = APIRouter(
     prefix="/api/rrhh",
@@ -377,9 +380,7 @@ async def export_prenomina_excel(prenomina_id: str):
     ws.column_dimensions['D'].width = 12
     ws.column_dimensions['E'].width = 15
     
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    output = await save_workbook(wb)
     
     apellidos = empleado.get('apellidos', 'empleado').replace(' ', '_') if empleado else 'empleado'
     filename = f"prenomina_{apellidos}_{prenomina.get('periodo_mes', '')}_{prenomina.get('periodo_ano', '')}.xlsx"
@@ -460,7 +461,7 @@ async def export_prenomina_pdf(prenomina_id: str):
     ]))
     elements.append(resumen_table)
     
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     
     apellidos = empleado.get('apellidos', 'empleado').replace(' ', '_') if empleado else 'empleado'
@@ -697,170 +698,124 @@ async def export_prenominas_csv(mes: int, ano: int, formato: Optional[str] = "es
 @router.get("/prenominas/export/excel-masivo")
 async def export_prenominas_excel_masivo(mes: int, ano: int):
     """Exportar todas las prenóminas del periodo a un único archivo Excel"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.styles import Alignment, Font, PatternFill
     from openpyxl.utils import get_column_letter
     
     database = get_db()
-    
-    prenominas = []
-    cursor = database.prenominas.find({
-        "periodo_mes": mes,
-        "periodo_ano": ano
-    }).sort("empleado_id", 1)
-    
-    async for p in cursor:
-        emp = await database.empleados.find_one({"_id": ObjectId(p["empleado_id"])})
-        if emp:
-            prenominas.append({
-                "prenomina": p,
-                "empleado": emp
-            })
-    
-    if not prenominas:
+    periodo = {"periodo_mes": mes, "periodo_ano": ano}
+    
+    # Primera pasada (solo importes e ids) para el resumen de la cabecera:
+    # solo cuentan las prenóminas con empleado existente, como en el detalle.
+    loaders = Loaders()
+    empleados_ids = loaders.get(database.empleados, projection={"_id": 1})
+    num_empleados = 0
+    total_bruto = total_neto = 0
+    cursor = database.prenominas.find(periodo, {"empleado_id": 1, "importe_bruto": 1, "importe_neto": 1})
+    async for batch in iter_batches(cursor):
+        existentes = await empleados_ids.load_many(p.get("empleado_id") for p in batch)
+        for p in batch:
+            if existentes.get(str(p.get("empleado_id"))):
+                num_empleados += 1
+                total_bruto += p.get("importe_bruto", 0)
+                total_neto += p.get("importe_neto", 0)
+    
+    if not num_empleados:
         raise HTTPException(status_code=404, detail=f"No hay prenóminas para {mes}/{ano}")
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Prenóminas {mes}-{ano}"
-    
-    # Estilos
-    title_font = Font(bold=True, size=16, color="FFFFFF")
-    header_font = Font(bold=True, size=11, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    money_fill = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
-    alt_fill = PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
-    
     # Título
     meses = ["", "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", 
              "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
     mes_nombre = meses[mes] if 1 <= mes <= 12 else str(mes)
     
-    ws.merge_cells('A1:L1')
-    ws['A1'] = f"PRENÓMINAS - {mes_nombre} {ano}"
-    ws['A1'].font = title_font
-    ws['A1'].fill = header_fill
-    ws['A1'].alignment = Alignment(horizontal="center")
-    ws.row_dimensions[1].height = 30
-    
-    # Info resumen
-    ws['A3'] = f"Total empleados: {len(prenominas)}"
-    ws['A3'].font = Font(bold=True)
-    total_bruto = sum(item["prenomina"].get("importe_bruto", 0) for item in prenominas)
-    total_neto = sum(item["prenomina"].get("importe_neto", 0) for item in prenominas)
-    ws['C3'] = f"Total Bruto: {format_number_es(total_bruto)} €"
-    ws['C3'].font = Font(bold=True, color="2E7D32")
-    ws['F3'] = f"Total Neto: {format_number_es(total_neto)} €"
-    ws['F3'].font = Font(bold=True, color="2E7D32")
-    ws['I3'] = f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-    
-    # Encabezados
+    xl = ExcelExport(header_color="2E7D32")
+    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
+    centered = Alignment(horizontal="center")
+    banner = xl.add_style("prenomina_banner", HEADER, font=Font(bold=True, size=16, color="FFFFFF"))
+    info_bold = xl.add_style("prenomina_info", PLAIN, font=Font(bold=True))
+    info_green = xl.add_style("prenomina_info_verde", PLAIN, font=Font(bold=True, color="2E7D32"))
+    cell_num = xl.add_style("prenomina_num", CELL, alignment=centered)
+    alt = xl.add_style("prenomina_alt", CELL, fill=PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid"))
+    alt_num = xl.add_style("prenomina_alt_num", alt, alignment=centered)
+    neto = xl.add_style("prenomina_neto", cell_num, font=Font(bold=True),
+                        fill=PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid"))
+    total_label = xl.add_style("prenomina_total_label", PLAIN, font=Font(bold=True, size=12),
+                               alignment=Alignment(horizontal="right"))
+    total_num = xl.add_style("prenomina_total", CELL, font=Font(bold=True, color="FFFFFF"),
+                             fill=header_fill, alignment=centered)
+    
     headers = [
         "Código", "DNI/NIE", "Apellidos", "Nombre", "Puesto",
         "H. Normales", "H. Extra", "H. Nocturnas", "H. Festivos", "Total Horas",
         "Días Trab.", "Importe Bruto", "Deducciones", "Importe Neto", "Estado"
     ]
-    
-    row = 5
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = thin_border
-    ws.row_dimensions[row].height = 25
+    number_formats = {i: '#,##0.00' for i in range(5, 10)}
+    number_formats.update({i: '#,##0.00 €' for i in (11, 12, 13)})
+    
+    ws = xl.add_sheet(
+        f"Prenóminas {mes}-{ano}",
+        [],
+        widths=[12, 12, 18, 15, 15, 12, 10, 12, 12, 12, 10, 14, 12, 14, 12],
+        number_formats=number_formats,
+    )
+    ws.append([f"PRENÓMINAS - {mes_nombre} {ano}"], style=banner)
+    ws.merge_last_row(1, 12)
+    ws.append([])
+    ws.append([
+        f"Total empleados: {num_empleados}", "",
+        f"Total Bruto: {format_number_es(total_bruto)} €", "", "",
+        f"Total Neto: {format_number_es(total_neto)} €", "", "",
+        f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    ], style=PLAIN, cell_styles={0: info_bold, 2: info_green, 5: info_green})
+    ws.append([])
+    ws.append(headers, style=HEADER)
+    first_data_row = ws.row_number + 1
     
     # Datos
-    for idx, item in enumerate(prenominas):
-        row = 6 + idx
-        emp = item["empleado"]
-        p = item["prenomina"]
-        
-        data = [
-            emp.get("codigo", ""),
-            emp.get("dni_nie", ""),
-            emp.get("apellidos", ""),
-            emp.get("nombre", ""),
-            emp.get("puesto", ""),
-            p.get("horas_normales", 0),
-            p.get("horas_extra", 0),
-            p.get("horas_nocturnas", 0),
-            p.get("horas_festivos", 0),
-            p.get("total_horas", 0),
-            p.get("dias_trabajados", 0),
-            p.get("importe_bruto", 0),
-            p.get("deducciones", 0),
-            p.get("importe_neto", 0),
-            p.get("estado", "borrador").upper()
-        ]
-        
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.border = thin_border
+    empleados = loaders.get(database.empleados)
+    idx = 0
+    cursor = database.prenominas.find(periodo).sort("empleado_id", 1)
+    async for batch in iter_batches(cursor):
+        await empleados.load_many(p.get("empleado_id") for p in batch)
+        rows = []
+        for p in batch:
+            emp = await empleados.load(p.get("empleado_id"))
+            if not emp:
+                continue
             
-            # Alternar colores de fila
-            if idx % 2 == 1:
-                cell.fill = alt_fill
+            # Alternar colores de fila; números centrados
+            base, num = (alt, alt_num) if idx % 2 == 1 else (CELL, cell_num)
+            cell_styles = {i: num for i in range(5, 15)}
+            cell_styles[13] = neto
+            idx += 1
             
-            # Formato para columnas de dinero
-            if col in [12, 13, 14]:
-                cell.number_format = '#,##0.00 €'
-                if col == 14:  # Importe Neto
-                    cell.fill = money_fill
-                    cell.font = Font(bold=True)
-            
-            # Formato para horas
-            if col in [6, 7, 8, 9, 10]:
-                cell.number_format = '#,##0.00'
-            
-            # Centrar números
-            if col >= 6:
-                cell.alignment = Alignment(horizontal="center")
-    
-    # Fila de totales
-    total_row = 6 + len(prenominas)
-    ws.merge_cells(f'A{total_row}:E{total_row}')
-    ws[f'A{total_row}'] = "TOTALES"
-    ws[f'A{total_row}'].font = Font(bold=True, size=12)
-    ws[f'A{total_row}'].alignment = Alignment(horizontal="right")
-    
-    # Sumar columnas numéricas
+            rows.append(StyledRow([
+                emp.get("codigo", ""),
+                emp.get("dni_nie", ""),
+                emp.get("apellidos", ""),
+                emp.get("nombre", ""),
+                emp.get("puesto", ""),
+                p.get("horas_normales", 0),
+                p.get("horas_extra", 0),
+                p.get("horas_nocturnas", 0),
+                p.get("horas_festivos", 0),
+                p.get("total_horas", 0),
+                p.get("dias_trabajados", 0),
+                p.get("importe_bruto", 0),
+                p.get("deducciones", 0),
+                p.get("importe_neto", 0),
+                p.get("estado", "borrador").upper()
+            ], base, cell_styles))
+        await ws.write(rows, lambda row: row)
+    
+    # Fila de totales (sumas de las columnas numéricas)
+    last_data_row = ws.row_number
+    totales = []
     for col in range(6, 15):
-        cell = ws.cell(row=total_row, column=col)
-        start_row = 6
-        end_row = total_row - 1
         col_letter = get_column_letter(col)
-        cell.value = f"=SUM({col_letter}{start_row}:{col_letter}{end_row})"
-        cell.font = Font(bold=True)
-        cell.fill = header_fill
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.border = thin_border
-        cell.alignment = Alignment(horizontal="center")
-        
-        if col in [12, 13, 14]:
-            cell.number_format = '#,##0.00 €'
-        elif col in [6, 7, 8, 9, 10]:
-            cell.number_format = '#,##0.00'
-    
-    # Ajustar anchos de columna
-    column_widths = [12, 12, 18, 15, 15, 12, 10, 12, 12, 12, 10, 14, 12, 14, 12]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    # Guardar
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    filename = f"prenominas_{mes_nombre}_{ano}.xlsx"
+        totales.append(f"=SUM({col_letter}{first_data_row}:{col_letter}{last_data_row})")
+    ws.append(["TOTALES", "", "", "", "", *totales], style=total_num,
+              cell_styles={i: total_label for i in range(5)})
+    ws.merge_last_row(1, 5)
     
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await xl.response(f"prenominas_{mes_nombre}_{ano}.xlsx")
 
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from bson import ObjectId
 
 from routes_auth import get_current_user
+from services.entity_loader import Loaders
 
 router = APIRouter(
     prefix="/api/rrhh",
@@ -50,19 +51,13 @@ async def get_registros_productividad(
     if tipo_trabajo:
         query["tipo_trabajo"] = tipo_trabajo
     
-    registros = []
-    cursor = database.productividad.find(query).sort("fecha", -1)
-    async for r in cursor:
+    registros = await database.productividad.find(query).sort("fecha", -1).to_list(None)
+    empleados = await Loaders().get(database.empleados).load_many(r.get("empleado_id") for r in registros)
+    for r in registros:
         r["_id"] = str(r["_id"])
-        emp_id = r.get("empleado_id")
-        if emp_id:
-            try:
-                emp = await database.empleados.find_one({"_id": ObjectId(emp_id)})
-                if emp:
-                    r["empleado_nombre"] = f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
-            except Exception:
-                pass
-        registros.append(r)
+        emp = empleados.get(str(r.get("empleado_id")))
+        if emp:
+            r["empleado_nombre"] = f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
     return {"success": True, "registros": registros, "total": len(registros)}
 
 
@@ -98,9 +93,11 @@ async def get_productividad_stats(
         {"$group": {"_id": "$empleado_id", "total_kilos": {"$sum": {"$ifNull": ["$kilos_recogidos", 0]}}, "total_horas": {"$sum": {"$ifNull": ["$horas_trabajadas", 0]}}}},
         {"$sort": {"total_kilos": -1}}, {"$limit": 10}
     ]
+    top_docs = await database.productividad.aggregate(pipeline).to_list(None)
+    empleados = await Loaders().get(database.empleados).load_many(doc["_id"] for doc in top_docs)
     top_empleados = []
-    async for doc in database.productividad.aggregate(pipeline):
-        emp = await database.empleados.find_one({"_id": ObjectId(doc["_id"])})
+    for doc in top_docs:
+        emp = empleados.get(str(doc["_id"]))
         if emp:
             top_empleados.append({
                 "empleado_id": doc["_id"],
@@ -130,11 +127,18 @@ async def get_productividad_tiempo_real():
         {"$group": {"_id": "$empleado_id", "ultimo_fichaje": {"$first": "$tipo"}, "hora_entrada": {"$last": "$hora"}}},
         {"$match": {"ultimo_fichaje": "entrada"}}
     ]
+    trabajando = await database.fichajes.aggregate(pipeline).to_list(None)
+    loaders = Loaders()
+    empleado_ids = [doc["_id"] for doc in trabajando]
+    empleados = await loaders.get(database.empleados).load_many(empleado_ids)
+    produccion_hoy = await loaders.get(
+        database.productividad, key="empleado_id", filter={"fecha": hoy}
+    ).load_many(empleado_ids)
     empleados_trabajando = []
-    async for doc in database.fichajes.aggregate(pipeline):
-        emp = await database.empleados.find_one({"_id": ObjectId(doc["_id"])})
+    for doc in trabajando:
+        emp = empleados.get(str(doc["_id"]))
         if emp:
-            prod = await database.productividad.find_one({"empleado_id": doc["_id"], "fecha": hoy})
+            prod = produccion_hoy.get(str(doc["_id"]))
             empleados_trabajando.append({
                 "empleado_id": doc["_id"],
                 "empleado_nombre": f"{emp.get('nombre', '')} {emp.get('apellidos', '')}",
@@ -13,6 +13,7 @@ import uuid
 from database import db, serialize_doc
 from routes_auth import get_current_user
 from rbac_guards import RequireCreate, RequireEdit, RequireDelete
+from services.sequences import next_value
 
 router = APIRouter(prefix="/api", tags=["agentes"])
 
@@ -125,21 +126,7 @@ async def get_agente(
 async def generate_codigo_agente(tipo: str) -> str:
     """Genera código único para el agente: AC-001 (Compra) o AV-001 (Venta)"""
     prefix = "AC" if tipo == "Compra" else "AV"
-    
-    last_agente = await agentes_collection.find_one(
-        {"codigo": {"$regex": f"^{prefix}-"}},
-        sort=[("codigo", -1)]
-    )
-    
-    if last_agente:
-        try:
-            last_num = int(last_agente["codigo"].split("-")[1])
-            next_num = last_num + 1
-        except (IndexError, ValueError):
-            next_num = 1
-    else:
-        next_num = 1
-    
+    next_num = await next_value("agentes", scope=prefix)
     return f"{prefix}-{next_num:03d}"
 
 
@@ -21,11 +21,13 @@ from __future__ import annotations
 
 import io
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -45,6 +47,10 @@ from rbac_guards import (
     get_current_user,
 )
 from utils.formatters import format_number_es
+from services.render_service import build_pdf
+from services.entity_loader import Loaders, iter_batches
+from services.job_service import JobContext, get_job, register_job_handler, serialize_job, submit_job
+from services.sequences import allocate_block, next_value
 
 
 router = APIRouter(prefix="/api/albaranes-comision", tags=["albaranes-comision"])
@@ -56,25 +62,20 @@ agentes_collection = db["agentes"]
 proveedores_collection = db["proveedores"]
 clientes_collection = db["clientes"]
 
+REGENERAR_JOB_KIND = "albaranes_comision_regenerar"
+
 
 # ---------------------------------------------------------------------------
 # Utilidades internas
 # ---------------------------------------------------------------------------
 
+def _format_numero_acm(num: int) -> str:
+    return f"ACM-{num:06d}"
+
+
 async def _next_numero_acm() -> str:
-    """Genera el siguiente numero ACM-000001 buscando el maximo existente."""
-    last = await comisiones_collection.find_one(
-        {"numero_albaran_comision": {"$regex": "^ACM-"}},
-        sort=[("numero_albaran_comision", -1)],
-        projection={"_id": 0, "numero_albaran_comision": 1},
-    )
-    if last and last.get("numero_albaran_comision"):
-        try:
-            num = int(last["numero_albaran_comision"].split("-")[1])
-            return f"ACM-{num + 1:06d}"
-        except (IndexError, ValueError):
-            pass
-    return "ACM-000001"
+    """Genera el siguiente numero ACM-000001 (contador atomico `albaranes_comision`)."""
+    return _format_numero_acm(await next_value("albaranes_comision"))
 
 
 async def _ensure_numero_acm(comision_doc: dict) -> Optional[str]:
@@ -82,10 +83,16 @@ async def _ensure_numero_acm(comision_doc: dict) -> Optional[str]:
     if comision_doc.get("numero_albaran_comision"):
         return comision_doc["numero_albaran_comision"]
     numero = await _next_numero_acm()
-    await comisiones_collection.update_one(
-        {"_id": comision_doc["_id"]},
+    result = await comisiones_collection.update_one(
+        {"_id": comision_doc["_id"], "numero_albaran_comision": {"$in": [None, ""]}},
         {"$set": {"numero_albaran_comision": numero}},
     )
+    if result.modified_count == 0:
+        # Otra peticion lo numero a la vez: nos quedamos con el suyo
+        current = await comisiones_collection.find_one(
+            {"_id": comision_doc["_id"]}, {"numero_albaran_comision": 1},
+        )
+        numero = (current or {}).get("numero_albaran_comision") or numero
     return numero
 
 
@@ -220,182 +227,232 @@ async def get_albaran_comision(
     return serialize_doc(doc)
 
 
-@router.post("/regenerar")
+def _calcular_comision(
+    alb: dict,
+    contrato: Optional[dict],
+    agentes: Dict[str, Optional[dict]],
+    proveedores: Dict[str, Optional[dict]],
+    clientes: Dict[str, Optional[dict]],
+) -> Optional[dict]:
+    """Campos de la comision de un albaran, o None si no le corresponde ninguna.
+
+    Funcion pura: todas las relaciones llegan ya precargadas.
+    """
+    albaran_id = str(alb["_id"])
+    if not contrato:
+        return None
+
+    tipo_albaran = (alb.get("tipo_albaran") or alb.get("tipo") or "").strip()
+    es_compra = tipo_albaran in ("Compra", "Entrada", "Albarán de compra")
+    es_venta = tipo_albaran in ("Venta", "Salida", "Albarán de venta")
+
+    if es_compra and contrato.get("agente_compra"):
+        agente_id = contrato["agente_compra"]
+        tipo_comision = contrato.get("comision_compra_tipo") or contrato.get("comision_tipo")
+        valor_comision = contrato.get("comision_compra_valor") or contrato.get("comision_valor") or 0
+        tipo_agente = "compra"
+    elif es_venta and contrato.get("agente_venta"):
+        agente_id = contrato["agente_venta"]
+        tipo_comision = contrato.get("comision_venta_tipo")
+        valor_comision = contrato.get("comision_venta_valor") or 0
+        tipo_agente = "venta"
+    else:
+        return None
+
+    if not agente_id or float(valor_comision or 0) <= 0:
+        return None
+
+    kilos_netos = float(alb.get("kilos_netos") or 0)
+    if kilos_netos <= 0:
+        kilos_netos = sum(
+            (i.get("cantidad") or 0)
+            for i in alb.get("items", [])
+            if not i.get("es_destare")
+        )
+    importe_albaran = float(alb.get("total_albaran") or 0)
+    precio_kg = importe_albaran / kilos_netos if kilos_netos > 0 else 0
+    importe_comision = _calc_importe_comision(tipo_comision, valor_comision, kilos_netos, precio_kg)
+    if importe_comision <= 0:
+        return None
+
+    proveedor_nombre = None
+    cliente_nombre = None
+    if tipo_agente == "compra":
+        prov = alb.get("proveedor")
+        if prov:
+            proveedor_nombre = (proveedores.get(str(prov)) or {}).get("nombre", prov) if ObjectId.is_valid(prov) else prov
+    else:
+        cli = alb.get("cliente")
+        if cli:
+            cliente_nombre = (clientes.get(str(cli)) or {}).get("nombre", cli) if ObjectId.is_valid(cli) else cli
+
+    return {
+        "albaran_id": albaran_id,
+        "numero_albaran": alb.get("numero_albaran") or f"ALB-{albaran_id[-6:].upper()}",
+        "contrato_id": alb.get("contrato_id"),
+        "contrato_numero": (
+            contrato.get("numero_contrato")
+            or contrato.get("numero")
+            or contrato.get("codigo")
+        ),
+        "agente_id": agente_id,
+        "agente_nombre": (agentes.get(str(agente_id)) or {}).get("nombre"),
+        "tipo_agente": tipo_agente,
+        "fecha_albaran": alb.get("fecha_albaran") or alb.get("fecha") or "",
+        "campana": alb.get("campana") or contrato.get("campana"),
+        "proveedor": alb.get("proveedor") if tipo_agente == "compra" else None,
+        "proveedor_nombre": proveedor_nombre,
+        "cliente": alb.get("cliente") if tipo_agente == "venta" else None,
+        "cliente_nombre": cliente_nombre,
+        "cultivo": alb.get("cultivo") or contrato.get("cultivo"),
+        "kilos_brutos": float(alb.get("kilos_brutos") or 0),
+        "kilos_destare": float(alb.get("kilos_destare") or 0),
+        "kilos_netos": kilos_netos,
+        "precio_kg": round(precio_kg, 4),
+        "comision_tipo": tipo_comision,
+        "comision_valor": valor_comision,
+        "comision_importe": importe_comision,
+    }
+
+
+async def _run_regenerar_job(ctx: JobContext) -> dict:
+    """Handler del worker de jobs: crea/actualiza los albaranes de comision.
+
+    Por cada lote de albaranes: precarga contratos, comisiones existentes,
+    agentes, proveedores y clientes con una consulta `$in` por coleccion,
+    calcula las comisiones en memoria, reserva de una vez los numeros ACM
+    que hacen falta y escribe todo con un solo `bulk_write`.
+    """
+    solo_faltantes = bool(ctx.params.get("solo_faltantes", True))
+    created_by = ctx.user.get("email") or "regenerar"
+    query = {"contrato_id": {"$exists": True, "$nin": [None, ""]}}
+    total = await albaranes_collection.count_documents(query)
+    resumen = {"creados": 0, "actualizados": 0, "saltados": 0, "errores": []}
+    procesados = 0
+
+    # Contratos, agentes, proveedores y clientes se repiten entre lotes: un
+    # loader para todo el job. Las comisiones se consultan lote a lote.
+    loaders = Loaders()
+    contratos = loaders.get(contratos_collection)
+    agentes = loaders.get(agentes_collection, projection={"nombre": 1})
+    proveedores = loaders.get(proveedores_collection, projection={"nombre": 1})
+    clientes = loaders.get(clientes_collection, projection={"nombre": 1})
+
+    async for lote in iter_batches(albaranes_collection.find(query)):
+        contratos_lote = await contratos.load_many(
+            a.get("contrato_id") for a in lote if ObjectId.is_valid(a.get("contrato_id") or "")
+        )
+        agentes_lote = await agentes.load_many(
+            c.get(campo) for c in contratos_lote.values() if c
+            for campo in ("agente_compra", "agente_venta")
+        )
+        proveedores_lote = await proveedores.load_many(a.get("proveedor") for a in lote)
+        clientes_lote = await clientes.load_many(a.get("cliente") for a in lote)
+        existentes: Dict[str, dict] = {}
+        async for c in comisiones_collection.find({"albaran_id": {"$in": [str(a["_id"]) for a in lote]}}):
+            existentes.setdefault(c["albaran_id"], c)
+
+        now = datetime.now(timezone.utc)
+        nuevos: List[dict] = []
+        actualizaciones: List[UpdateOne] = []
+        sin_numero: List[ObjectId] = []
+        for alb in lote:
+            try:
+                calc = _calcular_comision(
+                    alb, contratos_lote.get(str(alb.get("contrato_id"))),
+                    agentes_lote, proveedores_lote, clientes_lote,
+                )
+                if calc is None:
+                    resumen["saltados"] += 1
+                    continue
+                existing = existentes.get(calc["albaran_id"])
+                if existing:
+                    if not existing.get("numero_albaran_comision"):
+                        sin_numero.append(existing["_id"])
+                    # Solo se recalculan las pendientes (no tocar pagadas)
+                    if solo_faltantes or existing.get("estado") != "pendiente":
+                        resumen["saltados"] += 1
+                        continue
+                    actualizaciones.append(UpdateOne({"_id": existing["_id"]}, {"$set": {
+                        **{k: calc[k] for k in ("kilos_netos", "precio_kg", "comision_tipo", "comision_valor",
+                                                "comision_importe", "proveedor_nombre", "cliente_nombre")},
+                        "agente_nombre": calc["agente_nombre"] or existing.get("agente_nombre") or "Agente",
+                        "updated_at": now,
+                    }}))
+                    continue
+                calc["agente_nombre"] = calc["agente_nombre"] or "Agente"
+                nuevos.append({**calc, "estado": "pendiente", "created_at": now, "created_by": created_by})
+            except Exception as e:  # noqa: BLE001
+                resumen["errores"].append(f"Albarán {alb.get('_id')}: {e}")
+
+        # Numeros ACM del lote en un solo $inc
+        numeros = iter(await allocate_block("albaranes_comision", len(nuevos) + len(sin_numero)))
+        ops: List[Any] = [InsertOne({**doc, "numero_albaran_comision": _format_numero_acm(next(numeros))})
+                          for doc in nuevos]
+        ops += [UpdateOne({"_id": _id, "numero_albaran_comision": {"$in": [None, ""]}},
+                          {"$set": {"numero_albaran_comision": _format_numero_acm(next(numeros))}})
+                for _id in sin_numero]
+        inicio_actualizaciones = len(ops)
+        ops += actualizaciones
+        if ops:
+            try:
+                await comisiones_collection.bulk_write(ops, ordered=False)
+                resumen["creados"] += len(nuevos)
+                resumen["actualizados"] += len(actualizaciones)
+            except BulkWriteError as e:
+                details = e.details or {}
+                fallidas = {err.get("index") for err in details.get("writeErrors", [])}
+                resumen["creados"] += details.get("nInserted", 0)
+                resumen["actualizados"] += sum(
+                    1 for i in range(inicio_actualizaciones, len(ops)) if i not in fallidas
+                )
+                resumen["errores"].extend(
+                    f"Escritura {err.get('index')}: {err.get('errmsg')}" for err in details.get("writeErrors", [])
+                )
+
+        procesados += len(lote)
+        await ctx.progress(procesados, total, f"{resumen['creados']} creados, {resumen['actualizados']} actualizados")
+
+    resumen["total_errores"] = len(resumen["errores"])
+    resumen["errores"] = resumen["errores"][:20]
+    return resumen
+
+
+register_job_handler(REGENERAR_JOB_KIND, _run_regenerar_job)
+
+
+@router.post("/regenerar", status_code=202)
 async def regenerar_albaranes_comision(
     solo_faltantes: bool = True,
     current_user: dict = Depends(RequireEdit),
 ):
     """
     Recorre todos los albaranes que tengan contrato y comisionista y asegura
-    que exista su albarán de comisión correspondiente.
+    que exista su albarán de comisión correspondiente. Se ejecuta en segundo
+    plano: devuelve el job y su estado se consulta en GET /regenerar/{job_id}.
 
     - solo_faltantes=True (default): solo crea los que faltan. No recalcula los
       existentes para no perder ajustes manuales de estado.
-    - solo_faltantes=False: borra los existentes (solo estado=pendiente, para no
-      tocar los ya pagados) y recrea.
+    - solo_faltantes=False: recalcula los existentes (solo estado=pendiente,
+      para no tocar los ya pagados) y crea los que faltan.
     """
     # noqa: tipo_operacion — batch admin operation que recorre TODOS los albaranes
     # (compra + venta) para regenerar sus comisiones derivadas. No crea documentos
     # de venta nuevos; opera sobre datos ya existentes y solo recalcula comisiones.
-    creados = 0
-    actualizados = 0
-    saltados = 0
-    errores: List[str] = []
-
-    async for alb in albaranes_collection.find({
-        "contrato_id": {"$exists": True, "$nin": [None, ""]}
-    }):
-        try:
-            albaran_id = str(alb["_id"])
-            contrato_id = alb.get("contrato_id")
-            if not contrato_id or not ObjectId.is_valid(contrato_id):
-                saltados += 1
-                continue
-
-            contrato = await contratos_collection.find_one({"_id": ObjectId(contrato_id)})
-            if not contrato:
-                saltados += 1
-                continue
-
-            tipo_albaran = (alb.get("tipo_albaran") or alb.get("tipo") or "").strip()
-            es_compra = tipo_albaran in ("Compra", "Entrada", "Albarán de compra")
-            es_venta = tipo_albaran in ("Venta", "Salida", "Albarán de venta")
-
-            if es_compra and contrato.get("agente_compra"):
-                agente_id = contrato["agente_compra"]
-                tipo_comision = contrato.get("comision_compra_tipo") or contrato.get("comision_tipo")
-                valor_comision = contrato.get("comision_compra_valor") or contrato.get("comision_valor") or 0
-                tipo_agente = "compra"
-            elif es_venta and contrato.get("agente_venta"):
-                agente_id = contrato["agente_venta"]
-                tipo_comision = contrato.get("comision_venta_tipo")
-                valor_comision = contrato.get("comision_venta_valor") or 0
-                tipo_agente = "venta"
-            else:
-                saltados += 1
-                continue
-
-            if not agente_id or float(valor_comision or 0) <= 0:
-                saltados += 1
-                continue
-
-            # ¿Ya existe una comisión para este albarán?
-            existing = await comisiones_collection.find_one({"albaran_id": albaran_id})
-
-            kilos_netos = float(alb.get("kilos_netos") or 0)
-            if kilos_netos <= 0:
-                kilos_netos = sum(
-                    (i.get("cantidad") or 0)
-                    for i in alb.get("items", [])
-                    if not i.get("es_destare")
-                )
-            importe_albaran = float(alb.get("total_albaran") or 0)
-            precio_kg = importe_albaran / kilos_netos if kilos_netos > 0 else 0
-            importe_comision = _calc_importe_comision(tipo_comision, valor_comision, kilos_netos, precio_kg)
-
-            if importe_comision <= 0:
-                saltados += 1
-                continue
-
-            # Resolver nombres
-            agente_doc = None
-            if ObjectId.is_valid(agente_id):
-                agente_doc = await agentes_collection.find_one({"_id": ObjectId(agente_id)})
-            agente_nombre = (agente_doc or {}).get("nombre") or (existing or {}).get("agente_nombre") or "Agente"
-
-            proveedor_nombre = None
-            cliente_nombre = None
-            if tipo_agente == "compra":
-                prov = alb.get("proveedor")
-                if prov:
-                    if ObjectId.is_valid(prov):
-                        p = await proveedores_collection.find_one({"_id": ObjectId(prov)})
-                        proveedor_nombre = (p or {}).get("nombre", prov)
-                    else:
-                        proveedor_nombre = prov
-            else:
-                cli = alb.get("cliente")
-                if cli:
-                    if ObjectId.is_valid(cli):
-                        c = await clientes_collection.find_one({"_id": ObjectId(cli)})
-                        cliente_nombre = (c or {}).get("nombre", cli)
-                    else:
-                        cliente_nombre = cli
-
-            numero_albaran = alb.get("numero_albaran") or f"ALB-{albaran_id[-6:].upper()}"
-
-            if existing:
-                if solo_faltantes:
-                    # Asegurar que al menos tiene número ACM
-                    await _ensure_numero_acm(existing)
-                    saltados += 1
-                    continue
-                # Regenerar SOLO si está pendiente (no tocar pagadas)
-                if existing.get("estado") != "pendiente":
-                    saltados += 1
-                    continue
-                await comisiones_collection.update_one(
-                    {"_id": existing["_id"]},
-                    {"$set": {
-                        "kilos_netos": kilos_netos,
-                        "precio_kg": round(precio_kg, 4),
-                        "comision_tipo": tipo_comision,
-                        "comision_valor": valor_comision,
-                        "comision_importe": importe_comision,
-                        "agente_nombre": agente_nombre,
-                        "proveedor_nombre": proveedor_nombre,
-                        "cliente_nombre": cliente_nombre,
-                        "updated_at": datetime.now(timezone.utc),
-                    }},
-                )
-                await _ensure_numero_acm(existing)
-                actualizados += 1
-                continue
-
-            numero_acm = await _next_numero_acm()
-            record = {
-                "numero_albaran_comision": numero_acm,
-                "albaran_id": albaran_id,
-                "numero_albaran": numero_albaran,
-                "contrato_id": contrato_id,
-                "contrato_numero": (
-                    contrato.get("numero_contrato")
-                    or contrato.get("numero")
-                    or contrato.get("codigo")
-                ),
-                "agente_id": agente_id,
-                "agente_nombre": agente_nombre,
-                "tipo_agente": tipo_agente,
-                "fecha_albaran": alb.get("fecha_albaran") or alb.get("fecha") or "",
-                "campana": alb.get("campana") or contrato.get("campana"),
-                "proveedor": alb.get("proveedor") if tipo_agente == "compra" else None,
-                "proveedor_nombre": proveedor_nombre,
-                "cliente": alb.get("cliente") if tipo_agente == "venta" else None,
-                "cliente_nombre": cliente_nombre,
-                "cultivo": alb.get("cultivo") or contrato.get("cultivo"),
-                "kilos_brutos": float(alb.get("kilos_brutos") or 0),
-                "kilos_destare": float(alb.get("kilos_destare") or 0),
-                "kilos_netos": kilos_netos,
-                "precio_kg": round(precio_kg, 4),
-                "comision_tipo": tipo_comision,
-                "comision_valor": valor_comision,
-                "comision_importe": importe_comision,
-                "estado": "pendiente",
-                "created_at": datetime.now(timezone.utc),
-                "created_by": current_user.get("email", "regenerar"),
-            }
-            await comisiones_collection.insert_one(record)
-            creados += 1
-        except Exception as e:  # noqa: BLE001
-            errores.append(f"Albarán {alb.get('_id')}: {e}")
+    job = await submit_job(REGENERAR_JOB_KIND, {"solo_faltantes": solo_faltantes}, current_user)
+    return serialize_job(job)
 
-    return {
-        "success": True,
-        "creados": creados,
-        "actualizados": actualizados,
-        "saltados": saltados,
-        "errores": errores[:20],
-    }
+
+@router.get("/regenerar/{job_id}")
+async def estado_regenerar_albaranes_comision(
+    job_id: str,
+    current_user: dict = Depends(RequireAlbaranesAccess),
+):
+    """Progreso y resumen (creados, actualizados, saltados, errores) de una regeneración."""
+    job = await get_job(job_id)
+    if not job or job.get("kind") != REGENERAR_JOB_KIND:
+        raise HTTPException(status_code=404, detail="Regeneración no encontrada")
+    return serialize_job(job)
 
 
 @router.get("/{acm_id}/pdf")
@@ -598,7 +655,7 @@ async def albaran_comision_pdf(
         subtitle,
     ))
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     buf.seek(0)
     return StreamingResponse(
         buf,
@@ -764,7 +821,7 @@ async def factura_resumen_pdf(
         subtitle,
     ))
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     buf.seek(0)
     safe_nombre = "".join(ch if ch.isalnum() else "_" for ch in agente_nombre)[:40]
     return StreamingResponse(
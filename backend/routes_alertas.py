@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 
 from database import db, serialize_docs, serialize_doc, maquinaria_collection
 from rbac_guards import get_current_user
+from services.kpi_snapshots import record_kpi_insert
 
 router = APIRouter(prefix="/api", tags=["alertas"])
 
@@ -206,6 +207,7 @@ async def crear_tarea_desde_alerta(
     }
 
     result = await tareas_collection.insert_one(tarea)
+    await record_kpi_insert("tareas", tarea)
     created = await tareas_collection.find_one({"_id": result.inserted_id}, {"_id": 0})
 
     return {
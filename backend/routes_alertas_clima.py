@@ -5,14 +5,15 @@ Integrates with OpenWeatherMap API and supports manual data entry
 
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timedelta
-import httpx
-import os
+import re
 
 from database import db
 from routes_auth import get_current_user
+from services.weather_service import obtener_clima, obtener_clima_parcelas
 
 router = APIRouter(prefix="/api/alertas-clima", tags=["alertas-clima"])
 
@@ -23,9 +24,10 @@ plantillas_collection = db['plantillas_recomendaciones']
 datos_clima_collection = db['datos_clima']
 config_alertas_collection = db['config_alertas']
 
-# OpenWeatherMap API - Free tier (1000 calls/day)
-OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY', '')  # Set in .env file
-OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+# Parcela fields used by the climate checks
+PARCELA_CLIMA_FIELDS = {"codigo_plantacion": 1, "cultivo": 1, "latitud": 1, "longitud": 1}
+
+# OpenWeatherMap API - Free tier (1000 calls/day); see services/weather_service.py
 
 # Default alert rules - maps conditions to plantilla suggestions
 DEFAULT_ALERT_RULES = [
@@ -192,112 +194,189 @@ def evaluar_condicion(regla: dict, datos_clima: dict) -> bool:
 
 
 async def obtener_clima_api(lat: float, lon: float) -> Optional[dict]:
-    """Get weather data from OpenWeatherMap API"""
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            params = {
-                "lat": lat,
-                "lon": lon,
-                "appid": OPENWEATHER_API_KEY,
-                "units": "metric",
-                "lang": "es"
+    """Get weather data from OpenWeatherMap API (cached per grid cell)"""
+    return await obtener_clima(lat, lon)
+
+
+async def obtener_datos_clima_parcelas(parcelas: List[dict]) -> Dict[str, dict]:
+    """
+    Weather data for each parcela: {parcela_id: datos_clima}.
+    API data is fetched once per grid cell; parcelas without API data fall
+    back to their latest manual record (one aggregation for all of them).
+    """
+    datos_por_parcela = await obtener_clima_parcelas(parcelas)
+    
+    sin_datos = [str(p["_id"]) for p in parcelas if str(p["_id"]) not in datos_por_parcela]
+    if sin_datos:
+        pipeline = [
+            {"$match": {"parcela_id": {"$in": sin_datos}}},
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": "$parcela_id", "manual": {"$first": "$$ROOT"}}}
+        ]
+        async for row in datos_clima_collection.aggregate(pipeline):
+            manual = row["manual"]
+            datos_por_parcela[row["_id"]] = {
+                "temperatura": manual.get("temperatura"),
+                "humedad": manual.get("humedad"),
+                "lluvia": manual.get("lluvia", 0),
+                "viento": manual.get("viento", 0),
+                "fuente": "manual"
             }
-            response = await client.get(OPENWEATHER_BASE_URL, params=params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "temperatura": data["main"]["temp"],
-                    "humedad": data["main"]["humidity"],
-                    "lluvia": data.get("rain", {}).get("1h", 0),
-                    "viento": data["wind"]["speed"] * 3.6,  # Convert m/s to km/h
-                    "descripcion": data["weather"][0]["description"],
-                    "icono": data["weather"][0]["icon"],
-                    "ubicacion": data.get("name", ""),
-                    "fuente": "openweathermap",
-                    "timestamp": datetime.utcnow()
-                }
-            else:
-                print(f"OpenWeatherMap API error: {response.status_code}")
-                return None
-    except Exception as e:
-        print(f"Error fetching weather data: {e}")
-        return None
+    
+    return datos_por_parcela
 
 
-async def generar_alertas_para_parcela(parcela: dict, datos_clima: dict, user: dict) -> List[dict]:
-    """Generate alerts for a parcela based on weather data"""
-    alertas_generadas = []
-    
-    # Get active rules config
+def _valor_actual(regla: dict, datos_clima: dict):
+    return datos_clima.get(
+        "temperatura" if regla["condicion"] == "temperature" else
+        "humedad" if regla["condicion"] == "humidity" else
+        "lluvia" if regla["condicion"] == "rain" else
+        "viento"
+    )
+
+
+def _dedup_key(parcela_id: str, regla_id: str) -> str:
+    return f"{parcela_id}:{regla_id}"
+
+
+async def cargar_reglas_activas() -> List[dict]:
+    """
+    Active rules for one run: disabled rules removed, custom thresholds applied
+    and the suggested plantilla resolved (one read of each collection).
+    """
     config = await config_alertas_collection.find_one({"tipo": "reglas_activas"})
     reglas_desactivadas = config.get("desactivadas", []) if config else []
     
+    custom_thresholds = {}
+    async for doc in config_alertas_collection.find({"tipo": "umbral_personalizado"}):
+        if doc.get("valor"):
+            custom_thresholds[doc["rule_id"]] = doc["valor"]
+    
+    plantillas = await plantillas_collection.find({"activo": True}, {"nombre": 1}).to_list(None)
+    
+    reglas = []
     for regla in DEFAULT_ALERT_RULES:
-        # Skip disabled rules
         if regla["id"] in reglas_desactivadas:
             continue
+        if regla["id"] in custom_thresholds:
+            regla = {**regla, "valor": custom_thresholds[regla["id"]]}
         
-        # Check custom threshold
-        custom_config = await config_alertas_collection.find_one({
-            "tipo": "umbral_personalizado",
-            "rule_id": regla["id"]
-        })
-        if custom_config and custom_config.get("valor"):
-            regla = {**regla, "valor": custom_config["valor"]}
-        
-        # Evaluate condition
-        if evaluar_condicion(regla, datos_clima):
-            # Check if similar alert already exists (not resolved) in last 24h
-            existing = await alertas_collection.find_one({
-                "parcela_id": str(parcela["_id"]),
+        # Same match as the former {"nombre": {"$regex": ..., "$options": "i"}} query
+        plantilla = None
+        if regla.get("plantilla_sugerida"):
+            patron = re.compile(regla["plantilla_sugerida"], re.IGNORECASE)
+            plantilla = next((p for p in plantillas if patron.search(p.get("nombre") or "")), None)
+        reglas.append({**regla, "_plantilla": plantilla})
+    
+    return reglas
+
+
+async def _claves_abiertas(parcela_ids: List[str]) -> set:
+    """
+    (parcela_id, regla_id) pairs that already have an open alert from the last
+    24h. Older or closed alerts still holding a dedup key release it, so a new
+    alert can be raised, as before.
+    """
+    limite = datetime.utcnow() - timedelta(hours=24)
+    cerradas = ["resuelta", "ignorada"]
+    abiertas = set()
+    caducadas = []
+    cursor = alertas_collection.find(
+        {
+            "parcela_id": {"$in": parcela_ids},
+            "$or": [
+                {"estado": {"$nin": cerradas}, "created_at": {"$gte": limite}},
+                {"_dedup_key": {"$exists": True}}
+            ]
+        },
+        {"parcela_id": 1, "regla_id": 1, "estado": 1, "created_at": 1, "_dedup_key": 1}
+    )
+    async for a in cursor:
+        reciente = a.get("created_at") is not None and a["created_at"] >= limite
+        if reciente and a.get("estado") not in cerradas:
+            abiertas.add((a["parcela_id"], a["regla_id"]))
+        elif "_dedup_key" in a:
+            caducadas.append(a["_id"])
+    
+    if caducadas:
+        await alertas_collection.update_many({"_id": {"$in": caducadas}}, {"$unset": {"_dedup_key": ""}})
+    return abiertas
+
+
+async def generar_alertas_lote(parcelas_datos: List[tuple], user: dict, reglas: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Evaluate every (parcela, datos_clima) pair against every active rule and
+    insert the new alerts with a single insert_many.
+    
+    Open alerts are read once for all the parcelas; the unique `_dedup_key`
+    index rejects an alert that a concurrent run has just created.
+    """
+    if not parcelas_datos:
+        return []
+    if reglas is None:
+        reglas = await cargar_reglas_activas()
+    
+    parcela_ids = list({str(parcela["_id"]) for parcela, _ in parcelas_datos})
+    abiertas = await _claves_abiertas(parcela_ids)
+    
+    ahora = datetime.utcnow()
+    nuevas = []
+    for parcela, datos_clima in parcelas_datos:
+        parcela_id = str(parcela["_id"])
+        for regla in reglas:
+            if (parcela_id, regla["id"]) in abiertas or not evaluar_condicion(regla, datos_clima):
+                continue
+            abiertas.add((parcela_id, regla["id"]))
+            plantilla = regla["_plantilla"]
+            nuevas.append({
+                "parcela_id": parcela_id,
+                "parcela_codigo": parcela.get("codigo_plantacion", ""),
+                "parcela_cultivo": parcela.get("cultivo", ""),
                 "regla_id": regla["id"],
-                "estado": {"$nin": ["resuelta", "ignorada"]},
-                "created_at": {"$gte": datetime.utcnow() - timedelta(hours=24)}
+                "nombre": regla["nombre"],
+                "descripcion": regla["descripcion"],
+                "condicion_detectada": f"{regla['condicion']} {regla['operador']} {regla['valor']} {regla['unidad']}",
+                "valor_actual": _valor_actual(regla, datos_clima),
+                "plantilla_id": str(plantilla["_id"]) if plantilla else None,
+                "plantilla_nombre": plantilla.get("nombre") if plantilla else regla.get("plantilla_sugerida"),
+                "prioridad": regla["prioridad"],
+                "icono": regla["icono"],
+                "color": regla["color"],
+                "datos_clima": datos_clima,
+                "estado": "pendiente",
+                "created_at": ahora,
+                "created_by": user.get("username", "sistema"),
+                "created_by_id": str(user.get("_id", "")),
+                "_dedup_key": _dedup_key(parcela_id, regla["id"])
             })
-            
-            if not existing:
-                # Find matching plantilla
-                plantilla = None
-                if regla.get("plantilla_sugerida"):
-                    plantilla = await plantillas_collection.find_one({
-                        "nombre": {"$regex": regla["plantilla_sugerida"], "$options": "i"},
-                        "activo": True
-                    })
-                
-                alerta = {
-                    "parcela_id": str(parcela["_id"]),
-                    "parcela_codigo": parcela.get("codigo_plantacion", ""),
-                    "parcela_cultivo": parcela.get("cultivo", ""),
-                    "regla_id": regla["id"],
-                    "nombre": regla["nombre"],
-                    "descripcion": regla["descripcion"],
-                    "condicion_detectada": f"{regla['condicion']} {regla['operador']} {regla['valor']} {regla['unidad']}",
-                    "valor_actual": datos_clima.get(
-                        "temperatura" if regla["condicion"] == "temperature" else
-                        "humedad" if regla["condicion"] == "humidity" else
-                        "lluvia" if regla["condicion"] == "rain" else
-                        "viento"
-                    ),
-                    "plantilla_id": str(plantilla["_id"]) if plantilla else None,
-                    "plantilla_nombre": plantilla.get("nombre") if plantilla else regla.get("plantilla_sugerida"),
-                    "prioridad": regla["prioridad"],
-                    "icono": regla["icono"],
-                    "color": regla["color"],
-                    "datos_clima": datos_clima,
-                    "estado": "pendiente",
-                    "created_at": datetime.utcnow(),
-                    "created_by": user.get("username", "sistema"),
-                    "created_by_id": str(user.get("_id", ""))
-                }
-                
-                result = await alertas_collection.insert_one(alerta)
-                alerta["_id"] = str(result.inserted_id)
-                alertas_generadas.append(alerta)
     
+    if not nuevas:
+        return []
+    
+    duplicadas = set()
+    try:
+        await alertas_collection.insert_many(nuevas, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            duplicadas.add(error["index"])
+    
+    alertas_generadas = []
+    for i, alerta in enumerate(nuevas):
+        if i in duplicadas:
+            continue
+        alerta["_id"] = str(alerta["_id"])
+        alerta.pop("_dedup_key", None)
+        alertas_generadas.append(alerta)
     return alertas_generadas
 
 
+async def generar_alertas_para_parcela(parcela: dict, datos_clima: dict, user: dict) -> List[dict]:
+    """Generate alerts for a parcela based on weather data"""
+    return await generar_alertas_lote([(parcela, datos_clima)], user)
+
+
 # ==================== ENDPOINTS ====================
 
 # GET active alerts
@@ -324,7 +403,7 @@ async def get_alertas(
     if prioridad:
         query["prioridad"] = prioridad
     
-    alertas = await alertas_collection.find(query).sort("created_at", -1).limit(limit).to_list(limit)
+    alertas = await alertas_collection.find(query, {"_dedup_key": 0}).sort("created_at", -1).limit(limit).to_list(limit)
     
     # Count by priority
     total_alta = await alertas_collection.count_documents({**query, "prioridad": "Alta"})
@@ -429,10 +508,10 @@ async def registrar_clima_manual(
             alertas_generadas.extend(alertas)
     else:
         # All parcelas
-        parcelas = await parcelas_collection.find().to_list(500)
-        for parcela in parcelas:
-            alertas = await generar_alertas_para_parcela(parcela, registro, current_user)
-            alertas_generadas.extend(alertas)
+        parcelas = await parcelas_collection.find({}, PARCELA_CLIMA_FIELDS).to_list(500)
+        alertas_generadas = await generar_alertas_lote(
+            [(parcela, registro) for parcela in parcelas], current_user
+        )
     
     return {
         "success": True,
@@ -447,41 +526,22 @@ async def verificar_clima_todas_parcelas(
     current_user: dict = Depends(get_current_user)
 ):
     """Check weather conditions for all parcelas and generate alerts"""
-    parcelas = await parcelas_collection.find().to_list(500)
+    parcelas = await parcelas_collection.find({}, PARCELA_CLIMA_FIELDS).to_list(500)
     
     alertas_generadas = []
-    parcelas_procesadas = 0
     errores = []
     
-    for parcela in parcelas:
-        datos_clima = None
-        
-        # Try API first
-        if parcela.get("latitud") and parcela.get("longitud"):
-            datos_clima = await obtener_clima_api(parcela["latitud"], parcela["longitud"])
-        
-        # Fallback to latest manual data
-        if not datos_clima:
-            manual = await datos_clima_collection.find_one(
-                {"parcela_id": str(parcela["_id"])},
-                sort=[("timestamp", -1)]
-            )
-            if manual:
-                datos_clima = {
-                    "temperatura": manual.get("temperatura"),
-                    "humedad": manual.get("humedad"),
-                    "lluvia": manual.get("lluvia", 0),
-                    "viento": manual.get("viento", 0),
-                    "fuente": "manual"
-                }
-        
-        if datos_clima:
-            try:
-                alertas = await generar_alertas_para_parcela(parcela, datos_clima, current_user)
-                alertas_generadas.extend(alertas)
-                parcelas_procesadas += 1
-            except Exception as e:
-                errores.append(f"Parcela {parcela.get('codigo_plantacion')}: {str(e)}")
+    datos_por_parcela = await obtener_datos_clima_parcelas(parcelas)
+    parcelas_datos = [
+        (parcela, datos_por_parcela[str(parcela["_id"])])
+        for parcela in parcelas if datos_por_parcela.get(str(parcela["_id"]))
+    ]
+    parcelas_procesadas = len(parcelas_datos)
+    
+    try:
+        alertas_generadas = await generar_alertas_lote(parcelas_datos, current_user)
+    except Exception as e:
+        errores.append(f"Error generando alertas: {str(e)}")
     
     return {
         "success": True,
@@ -517,12 +577,14 @@ async def update_alerta(
         if data.estado == "resuelta":
             update_data["resuelto_at"] = datetime.utcnow()
         
-        await alertas_collection.update_one(
-            {"_id": ObjectId(alerta_id)},
-            {"$set": update_data}
-        )
+        update = {"$set": update_data}
+        if data.estado in ("resuelta", "ignorada"):
+            # A closed alert no longer blocks new ones for its parcela/rule
+            update["$unset"] = {"_dedup_key": ""}
+        
+        await alertas_collection.update_one({"_id": ObjectId(alerta_id)}, update)
         
-        updated = await alertas_collection.find_one({"_id": ObjectId(alerta_id)})
+        updated = await alertas_collection.find_one({"_id": ObjectId(alerta_id)}, {"_dedup_key": 0})
         
         return {
             "success": True,
@@ -10,6 +10,7 @@ from pydantic import BaseModel, Field
 
 from database import db, serialize_doc, serialize_docs
 from rbac_guards import RequireCreate, RequireEdit, RequireDelete, get_current_user
+from services.sequences import next_value
 
 router = APIRouter(prefix="/api", tags=["articulos"])
 
@@ -69,23 +70,8 @@ CATEGORIA_PREFIXES = {
 async def generate_codigo(categoria: str) -> str:
     """Genera un código único para el artículo basado en la categoría"""
     prefix = CATEGORIA_PREFIXES.get(categoria, "ART")
-    
-    # Buscar el último código con este prefijo
-    last_articulo = await articulos_collection.find_one(
-        {"codigo": {"$regex": f"^{prefix}-"}},
-        sort=[("codigo", -1)]
-    )
-    
-    if last_articulo:
-        # Extraer el número del último código
-        try:
-            last_num = int(last_articulo["codigo"].split("-")[1])
-            next_num = last_num + 1
-        except (IndexError, ValueError):
-            next_num = 1
-    else:
-        next_num = 1
-    
+    # Contador atómico por prefijo (services/sequences.py)
+    next_num = await next_value("articulos", scope=prefix)
     return f"{prefix}-{next_num:04d}"
 
 
@@ -13,6 +13,7 @@ from auth_utils import (
 )
 from database import db, serialize_doc
 from rbac_config import get_role_permissions
+from services.principal_cache import get_principal, invalidate_principal, token_version
 
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 security = HTTPBearer()
@@ -37,11 +38,24 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if email is None:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user = await users_collection.find_one({"email": email})
+    async def load_user():
+        user = await users_collection.find_one({"email": email})
+        return serialize_doc(user) if user else None
+    
+    # Cached per email; a token carrying a newer `ver` forces a reload
+    user = await get_principal(email, load_user, min_version=payload.get("ver"))
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     
-    return serialize_doc(user)
+    return user
+
+
+def _user_changed(user_id: str, *emails: Optional[str]) -> None:
+    """Drop the cached principal after a user document was modified"""
+    invalidate_principal(user_id=user_id)
+    for email in emails:
+        if email:
+            invalidate_principal(email=email)
 
 # Optional auth (for public endpoints that can use auth)
 async def get_current_user_optional(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[dict]:
@@ -88,7 +102,7 @@ async def register(user_data: UserCreate, current_user: dict = Depends(get_curre
     
     # Create token
     access_token = create_access_token(
-        data={"sub": created_user["email"]},
+        data={"sub": created_user["email"], "ver": token_version(created_user)},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -125,7 +139,7 @@ async def login(credentials: UserLogin):
     
     # Create token
     access_token = create_access_token(
-        data={"sub": user["email"]},
+        data={"sub": user["email"], "ver": token_version(user)},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -181,17 +195,20 @@ async def update_user(user_id: str, user_update: dict, current_user: dict = Depe
     if user_update.get("smtp_password") == "":
         user_update.pop("smtp_password")
     user_update.pop("smtp_password_set", None)  # campo derivado, no persistir
+    user_update.pop("token_version", None)  # lo gestiona el servidor
     user_update["updated_at"] = datetime.now()
     
-    result = await users_collection.update_one(
+    previous_user = await users_collection.find_one_and_update(
         {"_id": ObjectId(user_id)},
-        {"$set": user_update}
+        {"$set": user_update, "$inc": {"token_version": 1}},
+        projection={"email": 1}
     )
     
-    if result.matched_count == 0:
+    if previous_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    _user_changed(user_id, previous_user.get("email"), updated_user.get("email") if updated_user else None)
     user_response = serialize_doc(updated_user)
     user_response.pop("hashed_password", None)
     
@@ -207,9 +224,12 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=400, detail="Invalid user ID")
     if user_id == current_user["_id"]:
         raise HTTPException(status_code=400, detail="No puedes eliminar tu propio usuario")
-    result = await users_collection.delete_one({"_id": ObjectId(user_id)})
-    if result.deleted_count == 0:
+    deleted_user = await users_collection.find_one_and_delete(
+        {"_id": ObjectId(user_id)}, projection={"email": 1}
+    )
+    if deleted_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    _user_changed(user_id, deleted_user.get("email"))
     await db["user_column_config"].delete_many({"user_id": user_id})
     return {"success": True, "message": "Usuario eliminado permanentemente"}
 
@@ -237,11 +257,13 @@ async def change_user_password(
     
     result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": {"hashed_password": hashed_password, "updated_at": datetime.now()}}
+        {"$set": {"hashed_password": hashed_password, "updated_at": datetime.now()},
+         "$inc": {"token_version": 1}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    _user_changed(user_id)
     
     return {"success": True, "message": "Contraseña actualizada correctamente"}
 
@@ -294,8 +316,10 @@ async def update_menu_permissions(
     
     result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": {"menu_permissions": menu_permissions, "updated_at": datetime.now()}}
+        {"$set": {"menu_permissions": menu_permissions, "updated_at": datetime.now()},
+         "$inc": {"token_version": 1}}
     )
+    _user_changed(user_id, user.get("email"))
     
     updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
     user_response = serialize_doc(updated_user)
@@ -325,13 +349,15 @@ async def update_tipo_operacion(
     
     result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": {"tipo_operacion": tipo_operacion, "updated_at": datetime.now()}}
+        {"$set": {"tipo_operacion": tipo_operacion, "updated_at": datetime.now()},
+         "$inc": {"token_version": 1}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
     updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    _user_changed(user_id, updated_user.get("email") if updated_user else None)
     user_response = serialize_doc(updated_user)
     user_response.pop("hashed_password", None)
     
@@ -418,13 +444,14 @@ async def vincular_empleado(
     
     result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"token_version": 1}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
     updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    _user_changed(user_id, updated_user.get("email") if updated_user else None)
     user_response = serialize_doc(updated_user)
     user_response.pop("hashed_password", None)
     
@@ -5,6 +5,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from bson import ObjectId
 from rbac_guards import get_current_user
 from database import db
+from services.albaranes_cube import load_cube_sources, record_albaranes_change
+from services.kpi_snapshots import load_kpi_sources, record_kpi_changes
 
 router = APIRouter(prefix="/api", tags=["bulk-operations"])
 
@@ -56,7 +58,13 @@ async def bulk_delete(module: str, data: dict, current_user: dict = Depends(get_
     if not object_ids:
         raise HTTPException(status_code=400, detail="No se encontraron IDs validos")
 
+    cube_sources = await load_cube_sources(object_ids) if module == "albaranes" else []
+    kpi_sources = await load_kpi_sources(collection_name, object_ids)
     result = await collection.delete_many({"_id": {"$in": object_ids}})
+    if cube_sources:
+        await record_albaranes_change(cube_sources, [])
+    if kpi_sources:
+        await record_kpi_changes(collection_name, [(doc, None) for doc in kpi_sources])
 
     # Cascada opcional: al borrar albaranes, eliminar tambien sus ACM huerfanos
     cascaded_acm = 0
@@ -15,6 +15,9 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     get_current_user
 )
+from services.excel_export import ExcelExport
+from services.pagination import paginate
+from services.sequences import next_value
 
 router = APIRouter(prefix="/api", tags=["catalogos"])
 
@@ -214,20 +217,8 @@ async def create_proveedor(
 ):
     proveedor_dict = proveedor.dict()
     
-    # Auto-generate codigo_proveedor
-    last = await proveedores_collection.find_one(
-        {"codigo_proveedor": {"$exists": True, "$ne": None}},
-        sort=[("codigo_proveedor", -1)]
-    )
-    if last and last.get("codigo_proveedor"):
-        try:
-            next_num = int(last["codigo_proveedor"]) + 1
-        except ValueError:
-            next_num = 1
-    else:
-        count = await proveedores_collection.count_documents({})
-        next_num = count + 1
-    proveedor_dict['codigo_proveedor'] = str(next_num).zfill(6)
+    # Auto-generate codigo_proveedor (contador atómico, services/sequences.py)
+    proveedor_dict['codigo_proveedor'] = str(await next_value("proveedores")).zfill(6)
     
     proveedor_dict['created_at'] = datetime.now()
     proveedor_dict['updated_at'] = datetime.now()
@@ -244,6 +235,8 @@ async def create_proveedor(
 async def get_proveedores(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     activo: Optional[bool] = None,
     current_user: dict = Depends(get_current_user)
 ):
@@ -251,12 +244,13 @@ async def get_proveedores(
     if activo is not None:
         query['activo'] = activo
     
-    proveedores = await proveedores_collection.find(query).skip(skip).limit(limit).to_list(limit)
-    total = await proveedores_collection.count_documents(query)
+    page = await paginate(proveedores_collection, query, [("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
     
     return {
-        "proveedores": serialize_docs(proveedores),
-        "total": total
+        "proveedores": serialize_docs(page["items"]),
+        "total": page["total"],
+        "next_cursor": page["next_cursor"]
     }
 
 
@@ -627,42 +621,19 @@ async def export_proveedores_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Exportar proveedores a Excel"""
-    from fastapi.responses import StreamingResponse
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    import io
-    
     query = {}
     if activo is not None:
         query['activo'] = activo
     
-    proveedores = await proveedores_collection.find(query).sort("nombre", 1).to_list(1000)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Proveedores"
-    
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
+    xl = ExcelExport(header_color="2E7D32")
+    ws = xl.add_sheet(
+        "Proveedores",
+        ["Nombre", "CIF/NIF", "Dirección", "Población", "Provincia", "C.P.", "Teléfono", "Email", "Contacto", "Estado"],
+        widths=[25, 15, 30, 20, 15, 10, 15, 25, 20, 10],
     )
-    
-    # Encabezados
-    headers = ["Nombre", "CIF/NIF", "Dirección", "Población", "Provincia", "C.P.", "Teléfono", "Email", "Contacto", "Estado"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = thin_border
-    
-    # Datos
-    for row_idx, prov in enumerate(proveedores, 2):
-        data = [
+    await ws.write(
+        proveedores_collection.find(query).sort("nombre", 1),
+        lambda prov: [
             prov.get("nombre", ""),
             prov.get("cif_nif", ""),
             prov.get("direccion", ""),
@@ -673,25 +644,10 @@ async def export_proveedores_excel(
             prov.get("email", ""),
             prov.get("persona_contacto", ""),
             "Activo" if prov.get("activo", True) else "Inactivo"
-        ]
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row_idx, column=col, value=value)
-            cell.border = thin_border
-    
-    # Ajustar anchos
-    column_widths = [25, 15, 30, 20, 15, 10, 15, 25, 20, 10]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=proveedores_{datetime.now().strftime('%Y%m%d')}.xlsx"}
+        ],
     )
+    
+    return await xl.response(f"proveedores_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 # ============================================================================
@@ -15,6 +15,8 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     get_current_user
 )
+from services.excel_export import ExcelExport
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["clientes"])
 
@@ -153,6 +155,8 @@ async def create_cliente(
 async def get_clientes(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     search: Optional[str] = None,
     activo: Optional[bool] = None,
     tipo: Optional[str] = None,
@@ -180,10 +184,10 @@ async def get_clientes(
     if provincia:
         query["provincia"] = provincia
     
-    clientes = await clientes_collection.find(query).sort("codigo_num", 1).skip(skip).limit(limit).to_list(limit)
-    total = await clientes_collection.count_documents(query)
+    page = await paginate(clientes_collection, query, [("codigo_num", 1), ("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
     
-    return {"clientes": serialize_docs(clientes), "total": total}
+    return {"clientes": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/clientes/activos")
@@ -551,39 +555,19 @@ async def export_clientes_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Exportar clientes a Excel"""
-    from fastapi.responses import StreamingResponse
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    import io
-    
     query = {}
     if activo is not None:
         query['activo'] = activo
     
-    clientes = await clientes_collection.find(query).sort("nombre", 1).to_list(1000)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Clientes"
-    
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="1976D2", end_color="1976D2", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
+    xl = ExcelExport(header_color="1976D2")
+    ws = xl.add_sheet(
+        "Clientes",
+        ["Código", "Nombre", "CIF/NIF", "Dirección", "Población", "Provincia", "C.P.", "Teléfono", "Email", "Contacto", "Estado"],
+        widths=[10, 25, 15, 30, 20, 15, 10, 15, 25, 20, 10],
     )
-    
-    headers = ["Código", "Nombre", "CIF/NIF", "Dirección", "Población", "Provincia", "C.P.", "Teléfono", "Email", "Contacto", "Estado"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = thin_border
-    
-    for row_idx, cli in enumerate(clientes, 2):
-        data = [
+    await ws.write(
+        clientes_collection.find(query).sort("nombre", 1),
+        lambda cli: [
             cli.get("codigo", ""),
             cli.get("nombre", ""),
             cli.get("cif_nif", ""),
@@ -595,21 +579,7 @@ async def export_clientes_excel(
             cli.get("email", ""),
             cli.get("persona_contacto", ""),
             "Activo" if cli.get("activo", True) else "Inactivo"
-        ]
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row_idx, column=col, value=value)
-            cell.border = thin_border
-    
-    column_widths = [10, 25, 15, 30, 20, 15, 10, 15, 25, 20, 10]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=clientes_{datetime.now().strftime('%Y%m%d')}.xlsx"}
+        ],
     )
+    
+    return await xl.response(f"clientes_{datetime.now().strftime('%Y%m%d')}.xlsx")
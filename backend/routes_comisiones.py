@@ -11,6 +11,8 @@ from datetime import datetime
 from collections import defaultdict
 
 from database import db, serialize_doc, serialize_docs
+from services.albaranes_cube import albaranes_diario_collection, cube_match, ensure_albaranes_cube
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["comisiones"])
 
@@ -18,6 +20,9 @@ router = APIRouter(prefix="/api", tags=["comisiones"])
 contratos_collection = db['contratos']
 agentes_collection = db['agentes']
 albaranes_collection = db['albaranes']
+comisiones_generadas_collection = db['comisiones_generadas']
+
+RESUMEN_FUENTES = ("albaranes", "ledger")
 
 
 from utils.formatters import format_number_es  # noqa: E402
@@ -53,12 +58,295 @@ async def get_resumen_comisiones(
     tipo_agente: Optional[str] = None,  # 'compra' o 'venta'
     fecha_desde: Optional[str] = None,
     fecha_hasta: Optional[str] = None,
+    detalle: bool = False,
+    fuente: str = "albaranes",
+    estado: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Obtiene el resumen de comisiones agrupado por agente.
     Las comisiones se calculan a partir de los ALBARANES asociados a contratos.
+
+    Los totales salen del cubo diario de albaranes (`albaranes_diario`). Con
+    `detalle=true` se incluye además la lista de albaranes de cada agente,
+    calculada albarán a albarán.
+
+    Con `fuente=ledger` el resumen se agrega directamente sobre los importes
+    ya registrados en `comisiones_generadas` (un registro por albarán), con
+    desglose por campaña y filtro opcional por `estado`. La lista de
+    albaranes de cada agente se pide paginada en /comisiones/resumen/albaranes.
+    """
+    if fuente not in RESUMEN_FUENTES:
+        raise HTTPException(status_code=400, detail=f"fuente debe ser uno de: {', '.join(RESUMEN_FUENTES)}")
+    if fuente == "ledger":
+        return await _resumen_comisiones_ledger(campana, agente_id, tipo_agente, fecha_desde, fecha_hasta, estado)
+    if detalle:
+        return await _resumen_comisiones_detalle(campana, agente_id, tipo_agente, fecha_desde, fecha_hasta)
+
+    await ensure_albaranes_cube()
+    match_query = cube_match(fecha_desde, fecha_hasta, campana=campana)
+    match_query["contrato_id"] = {"$nin": [None, ""]}
+    grupos = await albaranes_diario_collection.aggregate([
+        {"$match": match_query},
+        {"$group": {
+            "_id": {"contrato_id": "$contrato_id", "operacion": "$operacion"},
+            "count": {"$sum": "$count"},
+            "importe": {"$sum": "$importe"},
+            "kilos": {"$sum": "$kilos_comision"},
+            "importe_comisionable": {"$sum": "$importe_comisionable"},
+        }},
+    ]).to_list(None)
+    
+    contrato_ids = list({g["_id"]["contrato_id"] for g in grupos})
+    contratos = {}
+    if contrato_ids:
+        contrato_docs = await contratos_collection.find(
+            {"_id": {"$in": [ObjectId(cid) for cid in contrato_ids if ObjectId.is_valid(cid)]}},
+            {"agente_compra": 1, "agente_venta": 1, "comision_compra_tipo": 1, "comision_tipo": 1,
+             "comision_compra_valor": 1, "comision_valor": 1, "comision_venta_tipo": 1, "comision_venta_valor": 1}
+        ).to_list(None)
+        contratos = {str(c["_id"]): c for c in contrato_docs}
+    
+    agentes_map = await _agentes_map()
+    
+    resumen = {}
+    for g in grupos:
+        contrato = contratos.get(g["_id"]["contrato_id"])
+        if not contrato:
+            continue
+        tipo = g["_id"].get("operacion") or "compra"
+        if tipo_agente and tipo_agente != tipo:
+            continue
+        if tipo == "compra":
+            aid = contrato.get("agente_compra")
+            com_tipo = contrato.get("comision_compra_tipo") or contrato.get("comision_tipo")
+            com_valor = contrato.get("comision_compra_valor") or contrato.get("comision_valor") or 0
+        else:
+            aid = contrato.get("agente_venta")
+            com_tipo = contrato.get("comision_venta_tipo")
+            com_valor = contrato.get("comision_venta_valor") or 0
+        if not aid or (agente_id and agente_id != aid):
+            continue
+        
+        kilos = g["kilos"]
+        precio_kg = g["importe_comisionable"] / kilos if kilos > 0 else 0
+        key = (aid, tipo)
+        if key not in resumen:
+            resumen[key] = {
+                "agente_id": aid,
+                "agente_nombre": agentes_map.get(aid, {}).get("nombre", "Agente desconocido"),
+                "tipo": tipo,
+                "albaranes": [],
+                "num_albaranes": 0,
+                "total_kg": 0,
+                "total_importe_albaranes": 0,
+                "total_comision": 0
+            }
+        agente_data = resumen[key]
+        agente_data["num_albaranes"] += g["count"]
+        agente_data["total_kg"] += kilos
+        agente_data["total_importe_albaranes"] += g["importe"]
+        agente_data["total_comision"] += calcular_comision(com_tipo, com_valor, kilos, precio_kg)
+    
+    resultado = (
+        [c for (aid, tipo), c in resumen.items() if tipo == "compra"]
+        + [c for (aid, tipo), c in resumen.items() if tipo == "venta"]
+    )
+    total_comision_compra = sum(c["total_comision"] for c in resultado if c["tipo"] == "compra")
+    total_comision_venta = sum(c["total_comision"] for c in resultado if c["tipo"] == "venta")
+    
+    return {
+        "success": True,
+        "comisiones": resultado,
+        "totales": {
+            "total_comision_compra": round(total_comision_compra, 2),
+            "total_comision_venta": round(total_comision_venta, 2),
+            "total_general": round(total_comision_compra + total_comision_venta, 2)
+        }
+    }
+
+
+def _ledger_match(
+    campana: Optional[str],
+    agente_id: Optional[str],
+    tipo_agente: Optional[str],
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    estado: Optional[str],
+) -> dict:
+    """Filtro sobre `comisiones_generadas`. Sin `estado` se excluyen las anuladas."""
+    match: dict = {"estado": estado} if estado else {"estado": {"$ne": "anulada"}}
+    if campana:
+        match["campana"] = campana
+    if agente_id:
+        match["agente_id"] = agente_id
+    if tipo_agente:
+        match["tipo_agente"] = tipo_agente
+    if fecha_desde or fecha_hasta:
+        fecha_query = {}
+        if fecha_desde:
+            fecha_query["$gte"] = fecha_desde
+        if fecha_hasta:
+            fecha_query["$lte"] = fecha_hasta
+        match["fecha_albaran"] = fecha_query
+    return match
+
+
+async def _resumen_comisiones_ledger(
+    campana: Optional[str],
+    agente_id: Optional[str],
+    tipo_agente: Optional[str],
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    estado: Optional[str],
+):
+    """Resumen por agente, tipo y campaña agregado en Mongo sobre el ledger.
+
+    `total_importe_albaranes` se reconstruye como kilos × precio_kg guardado
+    (4 decimales); los importes de comisión son los registrados.
+    """
+    match = _ledger_match(campana, agente_id, tipo_agente, fecha_desde, fecha_hasta, estado)
+    grupos = await comisiones_generadas_collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"agente_id": "$agente_id", "tipo": "$tipo_agente", "campana": "$campana"},
+            "agente_nombre": {"$max": "$agente_nombre"},
+            "num_albaranes": {"$sum": 1},
+            "total_kg": {"$sum": {"$ifNull": ["$kilos_netos", 0]}},
+            "total_importe_albaranes": {"$sum": {"$multiply": [
+                {"$ifNull": ["$kilos_netos", 0]}, {"$ifNull": ["$precio_kg", 0]},
+            ]}},
+            "total_comision": {"$sum": {"$ifNull": ["$comision_importe", 0]}},
+            "comision_pendiente": {"$sum": {"$cond": [
+                {"$eq": ["$estado", "pendiente"]}, {"$ifNull": ["$comision_importe", 0]}, 0,
+            ]}},
+            "comision_pagada": {"$sum": {"$cond": [
+                {"$eq": ["$estado", "pagada"]}, {"$ifNull": ["$comision_importe", 0]}, 0,
+            ]}},
+        }},
+        {"$sort": {"_id.tipo": 1, "_id.agente_id": 1, "_id.campana": -1}},
+    ]).to_list(None)
+
+    # Nombres actuales de los agentes del resultado (el ledger guarda el del momento)
+    agente_ids = [ObjectId(g["_id"]["agente_id"]) for g in grupos if ObjectId.is_valid(g["_id"].get("agente_id") or "")]
+    nombres = {
+        str(a["_id"]): a.get("nombre")
+        async for a in agentes_collection.find({"_id": {"$in": agente_ids}}, {"nombre": 1})
+    } if agente_ids else {}
+
+    totales_campo = ("num_albaranes", "total_kg", "total_importe_albaranes", "total_comision",
+                     "comision_pendiente", "comision_pagada")
+    resumen: dict = {}
+    for g in grupos:
+        aid, tipo = g["_id"].get("agente_id"), g["_id"].get("tipo") or "compra"
+        agente_data = resumen.setdefault((aid, tipo), {
+            "agente_id": aid,
+            "agente_nombre": nombres.get(aid) or g.get("agente_nombre") or "Agente desconocido",
+            "tipo": tipo,
+            "campanas": [],
+            **{campo: 0 for campo in totales_campo},
+        })
+        agente_data["campanas"].append({
+            "campana": g["_id"].get("campana"),
+            **{campo: round(g[campo], 2) if campo != "num_albaranes" else g[campo] for campo in totales_campo},
+        })
+        for campo in totales_campo:
+            agente_data[campo] += g[campo]
+
+    resultado = sorted(resumen.values(), key=lambda c: (c["tipo"] != "compra", -c["total_comision"]))
+    for c in resultado:
+        for campo in totales_campo[1:]:
+            c[campo] = round(c[campo], 2)
+    total_comision_compra = sum(c["total_comision"] for c in resultado if c["tipo"] == "compra")
+    total_comision_venta = sum(c["total_comision"] for c in resultado if c["tipo"] == "venta")
+
+    return {
+        "success": True,
+        "fuente": "ledger",
+        "comisiones": resultado,
+        "totales": {
+            "total_comision_compra": round(total_comision_compra, 2),
+            "total_comision_venta": round(total_comision_venta, 2),
+            "total_general": round(total_comision_compra + total_comision_venta, 2),
+            "total_pendiente": round(sum(c["comision_pendiente"] for c in resultado), 2),
+            "total_pagada": round(sum(c["comision_pagada"] for c in resultado), 2),
+            "num_albaranes": sum(c["num_albaranes"] for c in resultado),
+        }
+    }
+
+
+@router.get("/comisiones/resumen/albaranes")
+async def get_resumen_comisiones_albaranes(
+    agente_id: str,
+    tipo_agente: Optional[str] = None,
+    campana: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    estado: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     """
+    Albaranes (líneas del ledger `comisiones_generadas`) de un agente, paginados
+    por cursor y ordenados por fecha de albarán descendente. Es el desglose del
+    resumen con `fuente=ledger`.
+    """
+    match = _ledger_match(campana, agente_id, tipo_agente, fecha_desde, fecha_hasta, estado)
+    page = await paginate(comisiones_generadas_collection, match, [("fecha_albaran", -1)],
+                          limit=min(limit, 500), cursor=cursor, count=count)
+    albaranes = [{
+        "comision_id": str(c["_id"]),
+        "albaran_id": c.get("albaran_id"),
+        "numero": c.get("numero_albaran") or f"ALB-{str(c.get('albaran_id') or '')[-6:].upper()}",
+        "numero_albaran_comision": c.get("numero_albaran_comision"),
+        "fecha": c.get("fecha_albaran") or "",
+        "contrato_numero": c.get("contrato_numero"),
+        "contrato_id": c.get("contrato_id"),
+        "campana": c.get("campana"),
+        "tipo": c.get("tipo_agente"),
+        "proveedor": c.get("proveedor_nombre") or c.get("proveedor"),
+        "cliente": c.get("cliente_nombre") or c.get("cliente"),
+        "cultivo": c.get("cultivo"),
+        "cantidad_kg": c.get("kilos_netos", 0),
+        "precio_kg": c.get("precio_kg", 0),
+        "comision_tipo": c.get("comision_tipo"),
+        "comision_valor": c.get("comision_valor"),
+        "importe_comision": c.get("comision_importe", 0),
+        "estado": c.get("estado"),
+    } for c in page["items"]]
+    return {"success": True, "albaranes": albaranes, "total": page["total"], "next_cursor": page["next_cursor"]}
+
+
+async def _agentes_map() -> dict:
+    """Agentes por id; nombres de agentes eliminados desde las comisiones históricas."""
+    agentes = await agentes_collection.find({}).to_list(100)
+    agentes_map = {str(a["_id"]): a for a in agentes}
+
+    # Fallback: recoger nombres desde las comisiones_generadas previas
+    # (por si el agente fue eliminado pero aun existen comisiones historicas con su nombre)
+    try:
+        comisiones_historicas = db['comisiones_generadas']
+        async for c in comisiones_historicas.aggregate([
+            {"$match": {"agente_id": {"$nin": list(agentes_map)}, "agente_nombre": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$agente_id", "agente_nombre": {"$first": "$agente_nombre"}}},
+        ]):
+            if c["_id"]:
+                agentes_map[c["_id"]] = {"nombre": c["agente_nombre"]}
+    except Exception:
+        pass
+    return agentes_map
+
+
+async def _resumen_comisiones_detalle(
+    campana: Optional[str],
+    agente_id: Optional[str],
+    tipo_agente: Optional[str],
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+):
+    """Resumen con la lista de albaranes de cada agente (cálculo albarán a albarán)."""
     # Build filter for albaranes
     albaran_query = {}
     if fecha_desde or fecha_hasta:
@@ -77,7 +365,7 @@ async def get_resumen_comisiones(
     
     # Get all albaranes with contrato_id
     albaran_query["contrato_id"] = {"$exists": True, "$nin": [None, ""]}
-    albaranes = await albaranes_collection.find(albaran_query).to_list(1000)
+    albaranes = await albaranes_collection.find(albaran_query).to_list(None)
     
     # Get all contracts for commission info
     contrato_ids = list(set([a.get("contrato_id") for a in albaranes if a.get("contrato_id")]))
@@ -85,23 +373,11 @@ async def get_resumen_comisiones(
     if contrato_ids:
         contrato_docs = await contratos_collection.find({
             "_id": {"$in": [ObjectId(cid) for cid in contrato_ids if ObjectId.is_valid(cid)]}
-        }).to_list(1000)
+        }).to_list(None)
         contratos = {str(c["_id"]): c for c in contrato_docs}
     
     # Get all agents for name lookup
-    agentes = await agentes_collection.find({}).to_list(100)
-    agentes_map = {str(a["_id"]): a for a in agentes}
-
-    # Fallback: recoger nombres desde las comisiones_generadas previas
-    # (por si el agente fue eliminado pero aun existen comisiones historicas con su nombre)
-    try:
-        comisiones_historicas = db['comisiones_generadas']
-        async for c in comisiones_historicas.find({}, {"_id": 0, "agente_id": 1, "agente_nombre": 1}):
-            aid = c.get("agente_id")
-            if aid and aid not in agentes_map and c.get("agente_nombre"):
-                agentes_map[aid] = {"nombre": c["agente_nombre"]}
-    except Exception:
-        pass
+    agentes_map = await _agentes_map()
     
     # Group commissions by agent from albaranes
     comisiones_compra = defaultdict(lambda: {
@@ -227,11 +503,9 @@ async def get_resumen_comisiones(
     
     # Combine results
     resultado = []
-    for agente_data in comisiones_compra.values():
-        if agente_data["albaranes"]:
-            resultado.append(agente_data)
-    for agente_data in comisiones_venta.values():
+    for agente_data in list(comisiones_compra.values()) + list(comisiones_venta.values()):
         if agente_data["albaranes"]:
+            agente_data["num_albaranes"] = len(agente_data["albaranes"])
             resultado.append(agente_data)
     
     # Calculate totals
@@ -334,7 +608,7 @@ async def generate_liquidacion_pdf(
     Genera un PDF de liquidación de comisiones para un agente
     basado en los ALBARANES asociados a sus contratos
     """
-    from weasyprint import HTML, CSS
+    from services.render_service import render_html_pdf
     from io import BytesIO
     
     # Get agent info (fallback: buscar en comisiones_generadas si fue eliminado)
@@ -576,8 +850,7 @@ async def generate_liquidacion_pdf(
     """
     
     # Generate PDF
-    html = HTML(string=html_content)
-    pdf_bytes = html.write_pdf()
+    pdf_bytes = await render_html_pdf(html_content)
     
     filename = f"Liquidacion_{agente.get('nombre', 'Agente').replace(' ', '_')}_{tipo_agente}_{datetime.now().strftime('%Y%m%d')}.pdf"
     
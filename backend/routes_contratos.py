@@ -17,6 +17,11 @@ from rbac_guards import (
     RequireContratosAccess, get_current_user, ensure_tipo_operacion
 )
 from services.audit_service import create_audit_log, calculate_changes
+from services.excel_export import TOTAL, ExcelExport
+from services.kpi_snapshots import record_kpi_change, record_kpi_insert
+from services.pagination import paginate
+from services.sequences import SequenceBlock, ensure_at_least, next_value, peek_next
+from services.webhook_outbox import enqueue_webhook_event
 
 router = APIRouter(prefix="/api", tags=["contratos"])
 
@@ -36,14 +41,9 @@ async def create_contrato(
     ensure_tipo_operacion(current_user, contrato.tipo)
 
     # Generación atómica del número de contrato dentro del año actual:
-    # MP-{año}-{numero:06d}. Se busca el mayor "numero" del año en curso
-    # para evitar colisiones con contratos de otros años.
+    # MP-{año}-{numero:06d}, con un contador por año (services/sequences.py).
     current_year = datetime.now().year
-    last_contrato_year = await contratos_collection.find_one(
-        {"año": current_year},
-        sort=[("numero", -1)],
-    )
-    next_numero = (last_contrato_year.get("numero", 0) if last_contrato_year else 0) + 1
+    next_numero = await next_value("contratos", scope=current_year)
     numero_contrato = f"MP-{current_year}-{str(next_numero).zfill(6)}"
 
     # Lookup proveedor name (para contratos de Compra)
@@ -86,6 +86,8 @@ async def create_contrato(
     
     result = await contratos_collection.insert_one(contrato_dict)
     created = await contratos_collection.find_one({"_id": result.inserted_id})
+    await record_kpi_insert("contratos", created)
+    await enqueue_webhook_event("create", "contratos", serialize_doc(created.copy()))
     
     # Registrar en auditoría
     await create_audit_log(
@@ -164,19 +166,11 @@ async def import_contratos_excel(
     prov_cache: dict[str, str] = {}
     cult_cache: dict[str, str] = {}
     
-    # Estado del contador global de codigo_proveedor (incremental durante la
-    # importación para evitar hacer N queries de "último código")
-    _last_prov = await proveedores_collection.find_one(
-        {"codigo_proveedor": {"$exists": True, "$ne": None}},
-        sort=[("codigo_proveedor", -1)],
-    )
-    _next_cp = 1
-    if _last_prov and _last_prov.get("codigo_proveedor"):
-        try:
-            _next_cp = int(_last_prov["codigo_proveedor"]) + 1
-        except (ValueError, TypeError):
-            _next_cp = (await proveedores_collection.count_documents({})) + 1
-    codigo_counter = {'next': _next_cp}
+    # Códigos de proveedor reservados por bloques del contador global
+    # (un $inc cada 50 proveedores nuevos en vez de uno por fila)
+    codigos_proveedor = SequenceBlock("proveedores")
+    # Mayor número importado por año, para adelantar el contador de contratos
+    max_numero_por_año: dict[int, int] = {}
 
     async def resolve_proveedor(nombre: str) -> str:
         nonlocal created_provs
@@ -188,12 +182,11 @@ async def import_contratos_excel(
             new_doc = {
                 "nombre": nombre.strip(),
                 "tipo_proveedor": "Agricultor",
-                "codigo_proveedor": str(codigo_counter['next']).zfill(6),
+                "codigo_proveedor": str(await codigos_proveedor.next()).zfill(6),
                 "activo": True,
                 "created_at": datetime.now(),
                 "updated_at": datetime.now(),
             }
-            codigo_counter['next'] += 1
             r = await proveedores_collection.insert_one(new_doc)
             created_provs += 1
             _id = str(r.inserted_id)
@@ -317,10 +310,18 @@ async def import_contratos_excel(
                 "updated_at": datetime.now(),
             }
             await contratos_collection.insert_one(doc)
+            await record_kpi_insert("contratos", doc)
+            max_numero_por_año[año] = max(max_numero_por_año.get(año, 0), numero)
             imported += 1
         except Exception as e:
             errors.append({"row": row_num, "error": str(e)})
 
+    await codigos_proveedor.release()
+    # Los contratos importados traen su propio número: el siguiente alta del
+    # año debe continuar detrás del mayor importado.
+    for año, numero in max_numero_por_año.items():
+        await ensure_at_least("contratos", numero, scope=año)
+
     return {
         "success": True,
         "imported": imported,
@@ -336,6 +337,8 @@ async def import_contratos_excel(
 async def get_contratos(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     campana: Optional[str] = None,
     proveedor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
@@ -347,8 +350,9 @@ async def get_contratos(
     if proveedor:
         query["proveedor"] = {"$regex": proveedor, "$options": "i"}
     
-    contratos = await contratos_collection.find(query).skip(skip).limit(limit).to_list(limit)
-    return {"contratos": serialize_docs(contratos), "total": await contratos_collection.count_documents(query)}
+    page = await paginate(contratos_collection, query, [("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"contratos": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/contratos/next-numero")
@@ -367,11 +371,7 @@ async def get_next_numero_contrato(
     ObjectId y devuelve "Invalid ID".
     """
     current_year = datetime.now().year
-    last_contrato = await contratos_collection.find_one(
-        {"año": current_year},
-        sort=[("numero", -1)],
-    )
-    next_numero = (last_contrato.get("numero", 0) if last_contrato else 0) + 1
+    next_numero = await peek_next("contratos", scope=current_year)
     return {
         "year": current_year,
         "numero": next_numero,
@@ -454,6 +454,8 @@ async def update_contrato(
         raise HTTPException(status_code=404, detail="Contrato not found")
     
     updated = await contratos_collection.find_one({"_id": ObjectId(contrato_id)})
+    await record_kpi_change("contratos", old_doc, updated)
+    await enqueue_webhook_event("update", "contratos", serialize_doc(updated.copy()))
     
     # Calcular cambios y registrar en auditoría
     changes = calculate_changes(serialize_doc(old_doc.copy()), serialize_doc(updated.copy()))
@@ -488,6 +490,8 @@ async def delete_contrato(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Contrato not found")
+    await record_kpi_change("contratos", old_doc, None)
+    await enqueue_webhook_event("delete", "contratos", serialize_doc(old_doc.copy()))
     
     # Registrar eliminación en auditoría
     await create_audit_log(
@@ -571,7 +575,7 @@ async def export_contratos_pdf(
     current_user: dict = Depends(get_current_user)
 ):
     """Exporta el listado de contratos filtrado a PDF"""
-    from weasyprint import HTML
+    from services.render_service import render_html_pdf
     from fastapi.responses import Response
     
     # Build query
@@ -711,7 +715,7 @@ async def export_contratos_pdf(
     """
     
     # Generate PDF
-    pdf = HTML(string=html_content).write_pdf()
+    pdf = await render_html_pdf(html_content)
     
     return Response(
         content=pdf,
@@ -731,12 +735,6 @@ async def export_contratos_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Exporta el listado de contratos filtrado a Excel"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    from openpyxl.utils import get_column_letter
-    from io import BytesIO
-    from fastapi.responses import Response
-    
     # Build query
     query = {}
     if proveedor:
@@ -755,72 +753,35 @@ async def export_contratos_excel(
             date_filter["$lte"] = fecha_hasta
         query["fecha_contrato"] = date_filter
     
-    # Get contracts
-    contratos = await contratos_collection.find(query).sort("fecha_contrato", -1).to_list(1000)
-    
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Contratos"
-    
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2563EB", end_color="2563EB", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+    xl = ExcelExport(header_color="2563EB")
+    ws = xl.add_sheet(
+        "Contratos",
+        ["Nº Contrato", "Tipo", "Campaña", "Proveedor/Cliente", "Cultivo", "Cantidad (kg)", "Precio (€/kg)", "Total (€)", "Fecha"],
+        widths=[18, 10, 12, 25, 15, 15, 15, 15, 12],
     )
     
-    # Headers
-    headers = ["Nº Contrato", "Tipo", "Campaña", "Proveedor/Cliente", "Cultivo", "Cantidad (kg)", "Precio (€/kg)", "Total (€)", "Fecha"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = border
-    
-    # Data rows
-    for row, c in enumerate(contratos, 2):
+    total_cantidad = 0
+    total_importe = 0
+    
+    def contrato_row(c):
+        nonlocal total_cantidad, total_importe
         cantidad = c.get("cantidad", 0) or 0
         precio = c.get("precio", 0) or 0
-        total = cantidad * precio
-        proveedor_cliente = c.get("proveedor") or c.get("cliente") or ""
-        
-        ws.cell(row=row, column=1, value=c.get('numero_contrato', '')).border = border
-        ws.cell(row=row, column=2, value=c.get('tipo', '')).border = border
-        ws.cell(row=row, column=3, value=c.get('campana', '')).border = border
-        ws.cell(row=row, column=4, value=proveedor_cliente).border = border
-        ws.cell(row=row, column=5, value=c.get('cultivo', '')).border = border
-        ws.cell(row=row, column=6, value=cantidad).border = border
-        ws.cell(row=row, column=7, value=precio).border = border
-        ws.cell(row=row, column=8, value=total).border = border
-        ws.cell(row=row, column=9, value=c.get('fecha_contrato', '')).border = border
-    
-    # Totals row
-    total_row = len(contratos) + 2
-    total_cantidad = sum(c.get("cantidad", 0) or 0 for c in contratos)
-    total_importe = sum((c.get("cantidad", 0) or 0) * (c.get("precio", 0) or 0) for c in contratos)
-    
-    ws.cell(row=total_row, column=5, value="TOTALES:").font = Font(bold=True)
-    ws.cell(row=total_row, column=6, value=total_cantidad).font = Font(bold=True)
-    ws.cell(row=total_row, column=8, value=total_importe).font = Font(bold=True)
-    
-    # Adjust column widths
-    column_widths = [18, 10, 12, 25, 15, 15, 15, 15, 12]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(i)].width = width
-    
-    # Save to bytes
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return Response(
-        content=output.getvalue(),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=contratos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
-    )
\ No newline at end of file
+        total_cantidad += cantidad
+        total_importe += cantidad * precio
+        return [
+            c.get('numero_contrato', ''),
+            c.get('tipo', ''),
+            c.get('campana', ''),
+            c.get("proveedor") or c.get("cliente") or "",
+            c.get('cultivo', ''),
+            cantidad,
+            precio,
+            cantidad * precio,
+            c.get('fecha_contrato', ''),
+        ]
+    
+    await ws.write(contratos_collection.find(query).sort("fecha_contrato", -1), contrato_row)
+    ws.append(["", "", "", "", "TOTALES:", total_cantidad, "", total_importe], style=TOTAL)
+    
+    return await xl.response(f"contratos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
\ No newline at end of file
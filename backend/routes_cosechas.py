@@ -21,6 +21,9 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireCosechasAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["cosechas"])
 
@@ -71,6 +74,7 @@ async def create_cosecha(
     }
     
     result = await cosechas_collection.insert_one(cosecha_dict)
+    await record_kpi_insert("cosechas", cosecha_dict)
     created = await cosechas_collection.find_one({"_id": result.inserted_id})
     
     return {"success": True, "data": serialize_doc(created)}
@@ -80,6 +84,8 @@ async def create_cosecha(
 async def get_cosechas(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     contrato_id: Optional[str] = None,
     proveedor: Optional[str] = None,
     campana: Optional[str] = None,
@@ -98,8 +104,9 @@ async def get_cosechas(
     if estado:
         query["estado"] = estado
     
-    cosechas = await cosechas_collection.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return {"cosechas": serialize_docs(cosechas), "total": await cosechas_collection.count_documents(query)}
+    page = await paginate(cosechas_collection, query, [("created_at", -1), ("_id", -1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"cosechas": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/cosechas/{cosecha_id}")
@@ -139,10 +146,11 @@ async def update_cosecha(
         kilos = sum(p.get("kilos_estimados", 0) for p in update_data["planificaciones"])
         update_data["kilos_totales_estimados"] = kilos
     
-    result = await cosechas_collection.update_one(
-        {"_id": ObjectId(cosecha_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("cosechas", cosecha_id):
+        result = await cosechas_collection.update_one(
+            {"_id": ObjectId(cosecha_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cosecha not found")
@@ -226,20 +234,21 @@ async def add_carga_cosecha(
     estado = "en_curso" if cargas else "planificada"
     
     # Actualizar cosecha
-    await cosechas_collection.update_one(
-        {"_id": ObjectId(cosecha_id)},
-        {"$set": {
-            "cargas": cargas,
-            "kilos_totales_reales": kilos_positivos,
-            "kilos_descuentos": kilos_descuentos,
-            "kilos_netos": kilos_netos,
-            "importe_bruto": importe_bruto,
-            "importe_descuentos": importe_descuentos,
-            "importe_neto": importe_neto,
-            "estado": estado,
-            "updated_at": datetime.now()
-        }}
-    )
+    async with track_kpi_change("cosechas", cosecha_id):
+        await cosechas_collection.update_one(
+            {"_id": ObjectId(cosecha_id)},
+            {"$set": {
+                "cargas": cargas,
+                "kilos_totales_reales": kilos_positivos,
+                "kilos_descuentos": kilos_descuentos,
+                "kilos_netos": kilos_netos,
+                "importe_bruto": importe_bruto,
+                "importe_descuentos": importe_descuentos,
+                "importe_neto": importe_neto,
+                "estado": estado,
+                "updated_at": datetime.now()
+            }}
+        )
     
     updated = await cosechas_collection.find_one({"_id": ObjectId(cosecha_id)})
     return {"success": True, "data": serialize_doc(updated)}
@@ -274,20 +283,21 @@ async def delete_carga_cosecha(
     
     estado = "en_curso" if cargas else "planificada"
     
-    await cosechas_collection.update_one(
-        {"_id": ObjectId(cosecha_id)},
-        {"$set": {
-            "cargas": cargas,
-            "kilos_totales_reales": kilos_positivos,
-            "kilos_descuentos": kilos_descuentos,
-            "kilos_netos": kilos_netos,
-            "importe_bruto": importe_bruto,
-            "importe_descuentos": importe_descuentos,
-            "importe_neto": importe_neto,
-            "estado": estado,
-            "updated_at": datetime.now()
-        }}
-    )
+    async with track_kpi_change("cosechas", cosecha_id):
+        await cosechas_collection.update_one(
+            {"_id": ObjectId(cosecha_id)},
+            {"$set": {
+                "cargas": cargas,
+                "kilos_totales_reales": kilos_positivos,
+                "kilos_descuentos": kilos_descuentos,
+                "kilos_netos": kilos_netos,
+                "importe_bruto": importe_bruto,
+                "importe_descuentos": importe_descuentos,
+                "importe_neto": importe_neto,
+                "estado": estado,
+                "updated_at": datetime.now()
+            }}
+        )
     
     return {"success": True, "message": "Carga eliminada"}
 
@@ -302,10 +312,11 @@ async def completar_cosecha(
     if not ObjectId.is_valid(cosecha_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    result = await cosechas_collection.update_one(
-        {"_id": ObjectId(cosecha_id)},
-        {"$set": {"estado": "completada", "updated_at": datetime.now()}}
-    )
+    async with track_kpi_change("cosechas", cosecha_id):
+        result = await cosechas_collection.update_one(
+            {"_id": ObjectId(cosecha_id)},
+            {"$set": {"estado": "completada", "updated_at": datetime.now()}}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cosecha not found")
@@ -323,7 +334,8 @@ async def delete_cosecha(
     if not ObjectId.is_valid(cosecha_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    result = await cosechas_collection.delete_one({"_id": ObjectId(cosecha_id)})
+    async with track_kpi_change("cosechas", cosecha_id):
+        result = await cosechas_collection.delete_one({"_id": ObjectId(cosecha_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cosecha not found")
@@ -432,11 +444,10 @@ async def export_cosechas_excel(
     if campana:
         query["campana"] = campana
     
-    cosechas = await cosechas_collection.find(query).sort("created_at", -1).to_list(1000)
-    
-    # Preparar datos para Excel
+    # Preparar datos para Excel (el frontend genera el fichero). Se recorre el
+    # cursor entero: antes se cortaba en 1000 cosechas sin avisar.
     rows = []
-    for c in cosechas:
+    async for c in cosechas_collection.find(query).sort("created_at", -1):
         # Datos base de la cosecha
         base_row = {
             "id": str(c.get("_id", "")),
@@ -569,7 +580,7 @@ async def export_cosechas_pdf(
     ]))
     elements.append(doc_table)
     
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"cosechas_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
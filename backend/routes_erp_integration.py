@@ -6,15 +6,23 @@ externos puedan crear/actualizar datos en el sistema FRUVECO.
 Autenticación: API Key en header "X-API-Key"
 """
 
-from fastapi import APIRouter, HTTPException, Header, Depends
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Header, Depends, Query, Request, Response
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import InsertOne, UpdateOne
+from typing import Any, Awaitable, Callable, Dict, Optional, List, Tuple, Type
 from bson import ObjectId
 from datetime import datetime
 import hashlib
+import json
 import os
 
 from database import db, serialize_doc
+from services.erp_bulk import (
+    ERP_BULK_BATCH_SIZE, ERP_BULK_MAX_LINES, NDJSON_MEDIA_TYPE,
+    ErpRefs, NdjsonLineError, bulk_write_lines, iter_ndjson,
+)
+from services.kpi_snapshots import record_kpi_changes, record_kpi_insert, track_kpi_change
+from services.sequences import allocate_block, next_value
 
 router = APIRouter(prefix="/api/erp", tags=["erp-integration"])
 
@@ -148,6 +156,137 @@ async def verify_api_key(x_api_key: str = Header(..., description="API Key para
     return {"api_key": x_api_key, "erp_name": ERP_API_KEYS[x_api_key]}
 
 
+# === CONSTRUCCIÓN DE DOCUMENTOS ===
+# Compartida por los endpoints de registro único y las cargas masivas (/bulk)
+
+def _alta_doc(model: BaseModel, auth: dict) -> dict:
+    """Documento de alta de proveedor/cliente/cultivo."""
+    doc = model.dict()
+    doc.update({
+        "activo": True,
+        "created_at": datetime.now(),
+        "created_by": f"ERP Integration ({auth['erp_name']})"
+    })
+    return doc
+
+
+def _modificacion_doc(model: BaseModel, auth: dict) -> dict:
+    """`$set` de una modificación de proveedor/cliente/cultivo (solo los campos enviados)."""
+    update_data = model.dict(exclude_unset=True)
+    update_data["updated_at"] = datetime.now()
+    update_data["updated_by"] = f"ERP Integration ({auth['erp_name']})"
+    return update_data
+
+
+async def _refs_contratos(contratos: List[ContratoERP]) -> ErpRefs:
+    """Proveedores, clientes, cultivos y agentes de los contratos; crea los proveedores/clientes nuevos."""
+    compras = [c for c in contratos if c.tipo == "Compra"]
+    ventas = [c for c in contratos if c.tipo == "Venta"]
+    refs = await ErpRefs().load(
+        proveedor_cifs=[c.proveedor_cif for c in compras],
+        proveedor_nombres=[c.proveedor_nombre for c in compras if not c.proveedor_cif],
+        cliente_cifs=[c.cliente_cif for c in ventas],
+        cliente_nombres=[c.cliente_nombre for c in ventas if not c.cliente_cif],
+        cultivo_codigos=[c.cultivo_codigo for c in contratos],
+        cultivo_nombres=[c.cultivo_nombre for c in contratos if not c.cultivo_codigo],
+        agente_codigos=[c.agente_compra_codigo for c in contratos] + [c.agente_venta_codigo for c in contratos],
+    )
+    # Si no existe y viene el CIF, se crea automáticamente
+    await refs.create_missing("proveedores", [(c.proveedor_cif, c.proveedor_nombre) for c in compras])
+    await refs.create_missing("clientes", [(c.cliente_cif, c.cliente_nombre) for c in ventas])
+    return refs
+
+
+def _contrato_doc(contrato: ContratoERP, refs: ErpRefs, numero: int, year: int, auth: dict) -> dict:
+    """Documento de un contrato nuevo con sus referencias ya resueltas en `refs`."""
+    # Proveedor (para contratos de Compra): por CIF primero, luego por nombre
+    proveedor_id = None
+    proveedor_nombre = contrato.proveedor_nombre or ""
+    proveedor = refs.proveedor(contrato.proveedor_cif, contrato.proveedor_nombre) if contrato.tipo == "Compra" else None
+    if proveedor:
+        proveedor_id = str(proveedor["_id"])
+        proveedor_nombre = proveedor.get("nombre", "")
+    
+    # Cliente (para contratos de Venta)
+    cliente_id = None
+    cliente_nombre = contrato.cliente_nombre or ""
+    cliente = refs.cliente(contrato.cliente_cif, contrato.cliente_nombre) if contrato.tipo == "Venta" else None
+    if cliente:
+        cliente_id = str(cliente["_id"])
+        cliente_nombre = cliente.get("nombre", "")
+    
+    # Cultivo: por código si viene, si no por nombre
+    cultivo_id = None
+    cultivo_nombre = contrato.cultivo_nombre
+    cultivo = refs.cultivo(contrato.cultivo_codigo, contrato.cultivo_nombre)
+    if cultivo:
+        cultivo_id = str(cultivo["_id"])
+        cultivo_nombre = cultivo.get("nombre", contrato.cultivo_nombre)
+    
+    agente_compra = refs.agente(contrato.agente_compra_codigo)
+    agente_venta = refs.agente(contrato.agente_venta_codigo)
+    
+    return {
+        "serie": "MP",
+        "año": year,
+        "numero": numero,
+        "numero_contrato": f"MP-{year}-{str(numero).zfill(6)}",
+        "referencia_erp": contrato.referencia_erp,
+        "tipo": contrato.tipo,
+        "campana": contrato.campana,
+        "procedencia": contrato.procedencia,
+        "fecha_contrato": contrato.fecha_contrato,
+        "periodo_desde": contrato.periodo_desde,
+        "periodo_hasta": contrato.periodo_hasta,
+        "proveedor_id": proveedor_id,
+        "proveedor": proveedor_nombre,
+        "cliente_id": cliente_id,
+        "cliente": cliente_nombre,
+        "cultivo_id": cultivo_id,
+        "cultivo": cultivo_nombre,
+        "cantidad": contrato.cantidad,
+        "precio": contrato.precio,
+        "moneda": contrato.moneda,
+        "agente_compra": str(agente_compra["_id"]) if agente_compra else None,
+        "comision_compra_tipo": "porcentaje" if contrato.comision_compra_porcentaje else None,
+        "comision_compra_valor": contrato.comision_compra_porcentaje,
+        "agente_venta": str(agente_venta["_id"]) if agente_venta else None,
+        "comision_venta_tipo": "porcentaje" if contrato.comision_venta_porcentaje else None,
+        "comision_venta_valor": contrato.comision_venta_porcentaje,
+        "forma_pago": contrato.forma_pago,
+        "descuento_destare": contrato.descuento_destare,
+        "condiciones_entrega": contrato.condiciones_entrega,
+        "transporte_por_cuenta": contrato.transporte_por_cuenta,
+        "envases_por_cuenta": contrato.envases_por_cuenta,
+        "cargas_granel": contrato.cargas_granel,
+        "precios_calidad": [p.dict() for p in contrato.precios_calidad] if contrato.precios_calidad else [],
+        "observaciones": contrato.observaciones,
+        "estado": "Activo",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+        "created_by": f"ERP Integration ({auth['erp_name']})"
+    }
+
+
+def _contrato_update(contrato: ContratoERP, auth: dict) -> dict:
+    """`$set` de la actualización de un contrato (PUT)."""
+    update_data = {
+        "cantidad": contrato.cantidad,
+        "precio": contrato.precio,
+        "periodo_desde": contrato.periodo_desde,
+        "periodo_hasta": contrato.periodo_hasta,
+        "forma_pago": contrato.forma_pago,
+        "descuento_destare": contrato.descuento_destare,
+        "condiciones_entrega": contrato.condiciones_entrega,
+        "observaciones": contrato.observaciones,
+        "updated_at": datetime.now(),
+        "updated_by": f"ERP Integration ({auth['erp_name']})"
+    }
+    if contrato.precios_calidad:
+        update_data["precios_calidad"] = [p.dict() for p in contrato.precios_calidad]
+    return update_data
+
+
 # === ENDPOINTS DE CONTRATOS ===
 
 @router.post("/contratos", response_model=dict)
@@ -174,141 +313,13 @@ async def crear_contrato_erp(
                 detail=f"Ya existe un contrato con referencia ERP: {contrato.referencia_erp}"
             )
         
-        # Buscar o crear proveedor (para contratos de Compra)
-        proveedor_id = None
-        proveedor_nombre = contrato.proveedor_nombre or ""
-        if contrato.tipo == "Compra" and (contrato.proveedor_cif or contrato.proveedor_nombre):
-            # Buscar por CIF primero, luego por nombre
-            query = {}
-            if contrato.proveedor_cif:
-                query = {"cif_nif": contrato.proveedor_cif}
-            elif contrato.proveedor_nombre:
-                query = {"nombre": {"$regex": f"^{contrato.proveedor_nombre}$", "$options": "i"}}
-            
-            proveedor = await proveedores_collection.find_one(query)
-            if proveedor:
-                proveedor_id = str(proveedor["_id"])
-                proveedor_nombre = proveedor.get("nombre", "")
-            elif contrato.proveedor_cif:
-                # Crear proveedor automáticamente
-                new_prov = {
-                    "nombre": contrato.proveedor_nombre or f"Proveedor {contrato.proveedor_cif}",
-                    "cif_nif": contrato.proveedor_cif,
-                    "activo": True,
-                    "created_at": datetime.now(),
-                    "created_by": "ERP Integration"
-                }
-                result = await proveedores_collection.insert_one(new_prov)
-                proveedor_id = str(result.inserted_id)
-                proveedor_nombre = new_prov["nombre"]
-        
-        # Buscar o crear cliente (para contratos de Venta)
-        cliente_id = None
-        cliente_nombre = contrato.cliente_nombre or ""
-        if contrato.tipo == "Venta" and (contrato.cliente_cif or contrato.cliente_nombre):
-            query = {}
-            if contrato.cliente_cif:
-                query = {"cif_nif": contrato.cliente_cif}
-            elif contrato.cliente_nombre:
-                query = {"nombre": {"$regex": f"^{contrato.cliente_nombre}$", "$options": "i"}}
-            
-            cliente = await clientes_collection.find_one(query)
-            if cliente:
-                cliente_id = str(cliente["_id"])
-                cliente_nombre = cliente.get("nombre", "")
-            elif contrato.cliente_cif:
-                # Crear cliente automáticamente
-                new_cli = {
-                    "nombre": contrato.cliente_nombre or f"Cliente {contrato.cliente_cif}",
-                    "cif_nif": contrato.cliente_cif,
-                    "activo": True,
-                    "created_at": datetime.now(),
-                    "created_by": "ERP Integration"
-                }
-                result = await clientes_collection.insert_one(new_cli)
-                cliente_id = str(result.inserted_id)
-                cliente_nombre = new_cli["nombre"]
-        
-        # Buscar cultivo
-        cultivo_id = None
-        cultivo_nombre = contrato.cultivo_nombre
-        if contrato.cultivo_codigo:
-            cultivo = await cultivos_collection.find_one({"codigo": contrato.cultivo_codigo})
-            if cultivo:
-                cultivo_id = str(cultivo["_id"])
-                cultivo_nombre = cultivo.get("nombre", contrato.cultivo_nombre)
-        else:
-            # Buscar por nombre
-            cultivo = await cultivos_collection.find_one({
-                "nombre": {"$regex": f"^{contrato.cultivo_nombre}$", "$options": "i"}
-            })
-            if cultivo:
-                cultivo_id = str(cultivo["_id"])
-                cultivo_nombre = cultivo.get("nombre", contrato.cultivo_nombre)
-        
-        # Buscar agentes
-        agente_compra_id = None
-        if contrato.agente_compra_codigo:
-            agente = await agentes_collection.find_one({"codigo": contrato.agente_compra_codigo})
-            if agente:
-                agente_compra_id = str(agente["_id"])
-        
-        agente_venta_id = None
-        if contrato.agente_venta_codigo:
-            agente = await agentes_collection.find_one({"codigo": contrato.agente_venta_codigo})
-            if agente:
-                agente_venta_id = str(agente["_id"])
-        
-        # Obtener siguiente número de contrato
-        last_contrato = await contratos_collection.find_one(sort=[("numero", -1)])
-        next_numero = (last_contrato.get("numero", 0) if last_contrato else 0) + 1
+        refs = await _refs_contratos([contrato])
         year = datetime.now().year
-        numero_contrato = f"MP-{year}-{str(next_numero).zfill(6)}"
-        
-        # Construir documento del contrato
-        contrato_doc = {
-            "serie": "MP",
-            "año": year,
-            "numero": next_numero,
-            "numero_contrato": numero_contrato,
-            "referencia_erp": contrato.referencia_erp,
-            "tipo": contrato.tipo,
-            "campana": contrato.campana,
-            "procedencia": contrato.procedencia,
-            "fecha_contrato": contrato.fecha_contrato,
-            "periodo_desde": contrato.periodo_desde,
-            "periodo_hasta": contrato.periodo_hasta,
-            "proveedor_id": proveedor_id,
-            "proveedor": proveedor_nombre,
-            "cliente_id": cliente_id,
-            "cliente": cliente_nombre,
-            "cultivo_id": cultivo_id,
-            "cultivo": cultivo_nombre,
-            "cantidad": contrato.cantidad,
-            "precio": contrato.precio,
-            "moneda": contrato.moneda,
-            "agente_compra": agente_compra_id,
-            "comision_compra_tipo": "porcentaje" if contrato.comision_compra_porcentaje else None,
-            "comision_compra_valor": contrato.comision_compra_porcentaje,
-            "agente_venta": agente_venta_id,
-            "comision_venta_tipo": "porcentaje" if contrato.comision_venta_porcentaje else None,
-            "comision_venta_valor": contrato.comision_venta_porcentaje,
-            "forma_pago": contrato.forma_pago,
-            "descuento_destare": contrato.descuento_destare,
-            "condiciones_entrega": contrato.condiciones_entrega,
-            "transporte_por_cuenta": contrato.transporte_por_cuenta,
-            "envases_por_cuenta": contrato.envases_por_cuenta,
-            "cargas_granel": contrato.cargas_granel,
-            "precios_calidad": [p.dict() for p in contrato.precios_calidad] if contrato.precios_calidad else [],
-            "observaciones": contrato.observaciones,
-            "estado": "Activo",
-            "created_at": datetime.now(),
-            "updated_at": datetime.now(),
-            "created_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        contrato_doc = _contrato_doc(contrato, refs, await next_value("contratos", scope=year), year, auth)
         
         # Insertar contrato
         result = await contratos_collection.insert_one(contrato_doc)
+        await record_kpi_insert("contratos", contrato_doc)
         created = await contratos_collection.find_one({"_id": result.inserted_id})
         
         return {
@@ -316,11 +327,11 @@ async def crear_contrato_erp(
             "message": "Contrato creado correctamente",
             "data": {
                 "id": str(result.inserted_id),
-                "numero_contrato": numero_contrato,
+                "numero_contrato": contrato_doc["numero_contrato"],
                 "referencia_erp": contrato.referencia_erp,
-                "proveedor_id": proveedor_id,
-                "cliente_id": cliente_id,
-                "cultivo_id": cultivo_id
+                "proveedor_id": contrato_doc["proveedor_id"],
+                "cliente_id": contrato_doc["cliente_id"],
+                "cultivo_id": contrato_doc["cultivo_id"]
             }
         }
         
@@ -351,26 +362,13 @@ async def actualizar_contrato_erp(
             )
         
         # Actualizar campos
-        update_data = {
-            "cantidad": contrato.cantidad,
-            "precio": contrato.precio,
-            "periodo_desde": contrato.periodo_desde,
-            "periodo_hasta": contrato.periodo_hasta,
-            "forma_pago": contrato.forma_pago,
-            "descuento_destare": contrato.descuento_destare,
-            "condiciones_entrega": contrato.condiciones_entrega,
-            "observaciones": contrato.observaciones,
-            "updated_at": datetime.now(),
-            "updated_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        update_data = _contrato_update(contrato, auth)
         
-        if contrato.precios_calidad:
-            update_data["precios_calidad"] = [p.dict() for p in contrato.precios_calidad]
-        
-        await contratos_collection.update_one(
-            {"_id": existing["_id"]},
-            {"$set": update_data}
-        )
+        async with track_kpi_change("contratos", existing["_id"]):
+            await contratos_collection.update_one(
+                {"_id": existing["_id"]},
+                {"$set": update_data}
+            )
         
         return {
             "success": True,
@@ -429,15 +427,16 @@ async def eliminar_contrato_erp(
         )
     
     # Marcar como eliminado en lugar de borrar físicamente
-    await contratos_collection.update_one(
-        {"_id": contrato["_id"]},
-        {"$set": {
-            "estado": "Cancelado",
-            "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
-            "updated_at": datetime.now(),
-            "deleted_by": "ERP Integration"
-        }}
-    )
+    async with track_kpi_change("contratos", contrato["_id"]):
+        await contratos_collection.update_one(
+            {"_id": contrato["_id"]},
+            {"$set": {
+                "estado": "Cancelado",
+                "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
+                "updated_at": datetime.now(),
+                "deleted_by": "ERP Integration"
+            }}
+        )
     
     return {
         "success": True,
@@ -471,12 +470,7 @@ async def crear_proveedor_erp(
             detail="Ya existe un proveedor con esta referencia o CIF/NIF"
         )
     
-    proveedor_doc = proveedor.dict()
-    proveedor_doc.update({
-        "activo": True,
-        "created_at": datetime.now(),
-        "created_by": f"ERP Integration ({auth['erp_name']})"
-    })
+    proveedor_doc = _alta_doc(proveedor, auth)
     
     result = await proveedores_collection.insert_one(proveedor_doc)
     
@@ -502,9 +496,7 @@ async def actualizar_proveedor_erp(
     if not existing:
         raise HTTPException(status_code=404, detail="Proveedor no encontrado")
     
-    update_data = proveedor.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.now()
-    update_data["updated_by"] = f"ERP Integration ({auth['erp_name']})"
+    update_data = _modificacion_doc(proveedor, auth)
     
     await proveedores_collection.update_one(
         {"_id": existing["_id"]},
@@ -534,12 +526,7 @@ async def crear_cliente_erp(
             detail="Ya existe un cliente con esta referencia o CIF/NIF"
         )
     
-    cliente_doc = cliente.dict()
-    cliente_doc.update({
-        "activo": True,
-        "created_at": datetime.now(),
-        "created_by": f"ERP Integration ({auth['erp_name']})"
-    })
+    cliente_doc = _alta_doc(cliente, auth)
     
     result = await clientes_collection.insert_one(cliente_doc)
     
@@ -569,12 +556,7 @@ async def crear_cultivo_erp(
             detail=f"Ya existe un cultivo con código: {cultivo.codigo}"
         )
     
-    cultivo_doc = cultivo.dict()
-    cultivo_doc.update({
-        "activo": True,
-        "created_at": datetime.now(),
-        "created_by": f"ERP Integration ({auth['erp_name']})"
-    })
+    cultivo_doc = _alta_doc(cultivo, auth)
     
     result = await cultivos_collection.insert_one(cultivo_doc)
     
@@ -732,6 +714,182 @@ class ParcelaERP(BaseModel):
     observaciones: Optional[str] = Field(None, description="Observaciones adicionales")
 
 
+# === CONSTRUCCIÓN DE DOCUMENTOS DE FINCAS Y PARCELAS ===
+
+async def _codigos_erp(sequence: str, prefix: str, codigos: List[Optional[str]]) -> List[str]:
+    """El código que manda el ERP o, si no viene, el siguiente FIN-/PAR- (un solo `$inc`)."""
+    block = iter(await allocate_block(sequence, sum(1 for c in codigos if not c)))
+    return [c or f"{prefix}-{str(next(block)).zfill(3)}" for c in codigos]
+
+
+def _finca_doc(finca: FincaERP, refs: ErpRefs, codigo: str, auth: dict) -> dict:
+    """Documento de una finca nueva; el propietario se busca por CIF en `refs`."""
+    proveedor = refs.proveedor(finca.propietario_cif) if finca.propietario_cif else None
+    return {
+        "referencia_erp": finca.referencia_erp,
+        "codigo": codigo,
+        "denominacion": finca.denominacion,
+        "provincia": finca.provincia,
+        "poblacion": finca.poblacion,
+        "direccion": finca.direccion,
+        "codigo_postal": finca.codigo_postal,
+        "poligono": finca.poligono,
+        "parcela": finca.parcela_catastral,
+        "hectareas": finca.hectareas,
+        "propietario": finca.propietario,
+        "propietario_id": str(proveedor["_id"]) if proveedor else None,
+        "finca_propia": finca.finca_propia,
+        "observaciones": finca.observaciones,
+        "activo": True,
+        "created_at": datetime.now(),
+        "created_by": f"ERP Integration ({auth['erp_name']})"
+    }
+
+
+def _finca_update(finca: FincaERP, auth: dict) -> dict:
+    return {
+        "denominacion": finca.denominacion,
+        "provincia": finca.provincia,
+        "poblacion": finca.poblacion,
+        "direccion": finca.direccion,
+        "codigo_postal": finca.codigo_postal,
+        "poligono": finca.poligono,
+        "parcela": finca.parcela_catastral,
+        "hectareas": finca.hectareas,
+        "propietario": finca.propietario,
+        "finca_propia": finca.finca_propia,
+        "observaciones": finca.observaciones,
+        "updated_at": datetime.now(),
+        "updated_by": f"ERP Integration ({auth['erp_name']})"
+    }
+
+
+async def _refs_parcelas(parcelas: List[ParcelaERP]) -> ErpRefs:
+    """Fincas, contratos, proveedores y cultivos de las parcelas; crea los proveedores nuevos."""
+    refs = await ErpRefs().load(
+        finca_refs=[p.finca_referencia_erp for p in parcelas],
+        finca_nombres=[p.finca_nombre for p in parcelas if not p.finca_referencia_erp],
+        contrato_refs=[p.contrato_referencia_erp for p in parcelas],
+        proveedor_cifs=[p.proveedor_cif for p in parcelas],
+        cultivo_codigos=[p.cultivo_codigo for p in parcelas],
+        cultivo_nombres=[p.cultivo_nombre for p in parcelas if not p.cultivo_codigo],
+    )
+    await refs.create_missing("proveedores", [(p.proveedor_cif, p.proveedor_nombre) for p in parcelas])
+    return refs
+
+
+def _parcela_doc(parcela: ParcelaERP, refs: ErpRefs, codigo: str, auth: dict) -> dict:
+    """Documento de una parcela nueva con finca/contrato/proveedor/cultivo resueltos en `refs`."""
+    # Finca: por referencia ERP o, si no viene, por nombre
+    finca_id = None
+    finca_nombre = parcela.finca_nombre or ""
+    finca = refs.finca(parcela.finca_referencia_erp, parcela.finca_nombre)
+    if finca:
+        finca_id = str(finca["_id"])
+        finca_nombre = finca.get("denominacion", "")
+    
+    contrato = refs.contrato(parcela.contrato_referencia_erp)
+    
+    proveedor_id = None
+    proveedor_nombre = parcela.proveedor_nombre or ""
+    proveedor = refs.proveedor(parcela.proveedor_cif) if parcela.proveedor_cif else None
+    if proveedor:
+        proveedor_id = str(proveedor["_id"])
+        proveedor_nombre = proveedor.get("nombre", "")
+    
+    cultivo_id = None
+    cultivo_nombre = parcela.cultivo_nombre
+    cultivo = refs.cultivo(parcela.cultivo_codigo, parcela.cultivo_nombre)
+    if cultivo:
+        cultivo_id = str(cultivo["_id"])
+        cultivo_nombre = cultivo.get("nombre", parcela.cultivo_nombre)
+    
+    # Construir geometría si se proporcionan coordenadas
+    geometry = None
+    if parcela.latitud and parcela.longitud:
+        # Crear un polígono pequeño alrededor del punto central
+        delta = 0.005  # Aproximadamente 500m
+        geometry = {
+            "type": "Polygon",
+            "coordinates": [[
+                [parcela.longitud - delta, parcela.latitud - delta],
+                [parcela.longitud + delta, parcela.latitud - delta],
+                [parcela.longitud + delta, parcela.latitud + delta],
+                [parcela.longitud - delta, parcela.latitud + delta],
+                [parcela.longitud - delta, parcela.latitud - delta]
+            ]]
+        }
+    
+    # Construir datos SIGPAC si se proporcionan
+    recintos = []
+    if parcela.sigpac_provincia and parcela.sigpac_municipio and parcela.sigpac_poligono and parcela.sigpac_parcela:
+        recintos.append({
+            "provincia": parcela.sigpac_provincia,
+            "municipio": parcela.sigpac_municipio,
+            "agregado": parcela.sigpac_agregado or "0",
+            "zona": parcela.sigpac_zona or "0",
+            "poligono": parcela.sigpac_poligono,
+            "parcela": parcela.sigpac_parcela,
+            "recinto": parcela.sigpac_recinto or "1"
+        })
+    
+    return {
+        "referencia_erp": parcela.referencia_erp,
+        "codigo": codigo,
+        "nombre": parcela.nombre,
+        "finca_id": finca_id,
+        "finca": finca_nombre,
+        "contrato_id": str(contrato["_id"]) if contrato else None,
+        "numero_contrato": contrato.get("numero_contrato") if contrato else None,
+        "proveedor_id": proveedor_id,
+        "proveedor": proveedor_nombre,
+        "cultivo_id": cultivo_id,
+        "cultivo": cultivo_nombre,
+        "variedad": parcela.variedad,
+        "campana": parcela.campana,
+        "superficie": parcela.superficie,
+        "superficie_unidad": parcela.superficie_unidad,
+        "plantas_hectarea": parcela.plantas_hectarea,
+        "sistema_riego": parcela.sistema_riego,
+        "fecha_siembra": parcela.fecha_siembra,
+        "fecha_cosecha_prevista": parcela.fecha_cosecha_prevista,
+        "estado": parcela.estado or "Activa",
+        "geometry": geometry,
+        "recintos": recintos,
+        "observaciones": parcela.observaciones,
+        "activo": True,
+        "created_at": datetime.now(),
+        "created_by": f"ERP Integration ({auth['erp_name']})"
+    }
+
+
+def _parcela_update(parcela: ParcelaERP, existing: dict, refs: ErpRefs, auth: dict) -> dict:
+    """`$set` de la actualización de una parcela; el cultivo solo cambia si viene su código."""
+    cultivo_id = existing.get("cultivo_id")
+    cultivo_nombre = parcela.cultivo_nombre
+    cultivo = refs.cultivo(parcela.cultivo_codigo, None) if parcela.cultivo_codigo else None
+    if cultivo:
+        cultivo_id = str(cultivo["_id"])
+        cultivo_nombre = cultivo.get("nombre", parcela.cultivo_nombre)
+    return {
+        "nombre": parcela.nombre,
+        "cultivo_id": cultivo_id,
+        "cultivo": cultivo_nombre,
+        "variedad": parcela.variedad,
+        "campana": parcela.campana,
+        "superficie": parcela.superficie,
+        "superficie_unidad": parcela.superficie_unidad,
+        "plantas_hectarea": parcela.plantas_hectarea,
+        "sistema_riego": parcela.sistema_riego,
+        "fecha_siembra": parcela.fecha_siembra,
+        "fecha_cosecha_prevista": parcela.fecha_cosecha_prevista,
+        "estado": parcela.estado,
+        "observaciones": parcela.observaciones,
+        "updated_at": datetime.now(),
+        "updated_by": f"ERP Integration ({auth['erp_name']})"
+    }
+
+
 # === ENDPOINTS DE FINCAS ===
 
 @router.post("/fincas", response_model=dict)
@@ -753,48 +911,12 @@ async def crear_finca_erp(
                 detail=f"Ya existe una finca con referencia ERP: {finca.referencia_erp}"
             )
         
-        # Buscar proveedor si se proporciona CIF
-        proveedor_id = None
-        if finca.propietario_cif:
-            proveedor = await proveedores_collection.find_one({"cif_nif": finca.propietario_cif})
-            if proveedor:
-                proveedor_id = str(proveedor["_id"])
-        
-        # Generar código si no se proporciona
-        codigo = finca.codigo
-        if not codigo:
-            last_finca = await fincas_collection.find_one(sort=[("codigo", -1)])
-            if last_finca and last_finca.get("codigo"):
-                try:
-                    num = int(last_finca["codigo"].replace("FIN", "").replace("-", "")) + 1
-                except:
-                    num = 1
-            else:
-                num = 1
-            codigo = f"FIN-{str(num).zfill(3)}"
-        
-        # Construir documento
-        finca_doc = {
-            "referencia_erp": finca.referencia_erp,
-            "codigo": codigo,
-            "denominacion": finca.denominacion,
-            "provincia": finca.provincia,
-            "poblacion": finca.poblacion,
-            "direccion": finca.direccion,
-            "codigo_postal": finca.codigo_postal,
-            "poligono": finca.poligono,
-            "parcela": finca.parcela_catastral,
-            "hectareas": finca.hectareas,
-            "propietario": finca.propietario,
-            "propietario_id": proveedor_id,
-            "finca_propia": finca.finca_propia,
-            "observaciones": finca.observaciones,
-            "activo": True,
-            "created_at": datetime.now(),
-            "created_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        refs = await ErpRefs().load(proveedor_cifs=[finca.propietario_cif])
+        codigo = (await _codigos_erp("fincas", "FIN", [finca.codigo]))[0]
+        finca_doc = _finca_doc(finca, refs, codigo, auth)
         
         result = await fincas_collection.insert_one(finca_doc)
+        await record_kpi_insert("fincas", finca_doc)
         
         return {
             "success": True,
@@ -832,26 +954,13 @@ async def actualizar_finca_erp(
                 detail=f"No se encontró finca con referencia ERP: {referencia_erp}"
             )
         
-        update_data = {
-            "denominacion": finca.denominacion,
-            "provincia": finca.provincia,
-            "poblacion": finca.poblacion,
-            "direccion": finca.direccion,
-            "codigo_postal": finca.codigo_postal,
-            "poligono": finca.poligono,
-            "parcela": finca.parcela_catastral,
-            "hectareas": finca.hectareas,
-            "propietario": finca.propietario,
-            "finca_propia": finca.finca_propia,
-            "observaciones": finca.observaciones,
-            "updated_at": datetime.now(),
-            "updated_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        update_data = _finca_update(finca, auth)
         
-        await fincas_collection.update_one(
-            {"_id": existing["_id"]},
-            {"$set": update_data}
-        )
+        async with track_kpi_change("fincas", existing["_id"]):
+            await fincas_collection.update_one(
+                {"_id": existing["_id"]},
+                {"$set": update_data}
+            )
         
         return {
             "success": True,
@@ -909,15 +1018,16 @@ async def eliminar_finca_erp(
             detail=f"No se encontró finca con referencia ERP: {referencia_erp}"
         )
     
-    await fincas_collection.update_one(
-        {"_id": finca["_id"]},
-        {"$set": {
-            "activo": False,
-            "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
-            "updated_at": datetime.now(),
-            "deleted_by": "ERP Integration"
-        }}
-    )
+    async with track_kpi_change("fincas", finca["_id"]):
+        await fincas_collection.update_one(
+            {"_id": finca["_id"]},
+            {"$set": {
+                "activo": False,
+                "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
+                "updated_at": datetime.now(),
+                "deleted_by": "ERP Integration"
+            }}
+        )
     
     return {
         "success": True,
@@ -954,141 +1064,12 @@ async def crear_parcela_erp(
                 detail=f"Ya existe una parcela con referencia ERP: {parcela.referencia_erp}"
             )
         
-        # Buscar finca si se proporciona referencia ERP
-        finca_id = None
-        finca_nombre = parcela.finca_nombre or ""
-        if parcela.finca_referencia_erp:
-            finca = await fincas_collection.find_one({"referencia_erp": parcela.finca_referencia_erp})
-            if finca:
-                finca_id = str(finca["_id"])
-                finca_nombre = finca.get("denominacion", "")
-        elif parcela.finca_nombre:
-            finca = await fincas_collection.find_one({
-                "denominacion": {"$regex": f"^{parcela.finca_nombre}$", "$options": "i"}
-            })
-            if finca:
-                finca_id = str(finca["_id"])
-                finca_nombre = finca.get("denominacion", "")
-        
-        # Buscar contrato si se proporciona referencia ERP
-        contrato_id = None
-        numero_contrato = None
-        if parcela.contrato_referencia_erp:
-            contrato = await contratos_collection.find_one({"referencia_erp": parcela.contrato_referencia_erp})
-            if contrato:
-                contrato_id = str(contrato["_id"])
-                numero_contrato = contrato.get("numero_contrato")
-        
-        # Buscar o crear proveedor
-        proveedor_id = None
-        proveedor_nombre = parcela.proveedor_nombre or ""
-        if parcela.proveedor_cif:
-            proveedor = await proveedores_collection.find_one({"cif_nif": parcela.proveedor_cif})
-            if proveedor:
-                proveedor_id = str(proveedor["_id"])
-                proveedor_nombre = proveedor.get("nombre", "")
-            else:
-                # Crear proveedor automáticamente
-                new_prov = {
-                    "nombre": parcela.proveedor_nombre or f"Proveedor {parcela.proveedor_cif}",
-                    "cif_nif": parcela.proveedor_cif,
-                    "activo": True,
-                    "created_at": datetime.now(),
-                    "created_by": "ERP Integration"
-                }
-                result_prov = await proveedores_collection.insert_one(new_prov)
-                proveedor_id = str(result_prov.inserted_id)
-                proveedor_nombre = new_prov["nombre"]
-        
-        # Buscar cultivo
-        cultivo_id = None
-        cultivo_nombre = parcela.cultivo_nombre
-        if parcela.cultivo_codigo:
-            cultivo = await cultivos_collection.find_one({"codigo": parcela.cultivo_codigo})
-            if cultivo:
-                cultivo_id = str(cultivo["_id"])
-                cultivo_nombre = cultivo.get("nombre", parcela.cultivo_nombre)
-        else:
-            cultivo = await cultivos_collection.find_one({
-                "nombre": {"$regex": f"^{parcela.cultivo_nombre}$", "$options": "i"}
-            })
-            if cultivo:
-                cultivo_id = str(cultivo["_id"])
-                cultivo_nombre = cultivo.get("nombre", parcela.cultivo_nombre)
-        
-        # Generar código si no se proporciona
-        codigo = parcela.codigo
-        if not codigo:
-            last_parcela = await parcelas_collection.find_one(sort=[("codigo", -1)])
-            if last_parcela and last_parcela.get("codigo"):
-                try:
-                    num = int(last_parcela["codigo"].replace("PAR-", "").replace("PAR", "")) + 1
-                except:
-                    num = 1
-            else:
-                num = 1
-            codigo = f"PAR-{str(num).zfill(3)}"
-        
-        # Construir geometría si se proporcionan coordenadas
-        geometry = None
-        if parcela.latitud and parcela.longitud:
-            # Crear un polígono pequeño alrededor del punto central
-            delta = 0.005  # Aproximadamente 500m
-            geometry = {
-                "type": "Polygon",
-                "coordinates": [[
-                    [parcela.longitud - delta, parcela.latitud - delta],
-                    [parcela.longitud + delta, parcela.latitud - delta],
-                    [parcela.longitud + delta, parcela.latitud + delta],
-                    [parcela.longitud - delta, parcela.latitud + delta],
-                    [parcela.longitud - delta, parcela.latitud - delta]
-                ]]
-            }
-        
-        # Construir datos SIGPAC si se proporcionan
-        recintos = []
-        if parcela.sigpac_provincia and parcela.sigpac_municipio and parcela.sigpac_poligono and parcela.sigpac_parcela:
-            recintos.append({
-                "provincia": parcela.sigpac_provincia,
-                "municipio": parcela.sigpac_municipio,
-                "agregado": parcela.sigpac_agregado or "0",
-                "zona": parcela.sigpac_zona or "0",
-                "poligono": parcela.sigpac_poligono,
-                "parcela": parcela.sigpac_parcela,
-                "recinto": parcela.sigpac_recinto or "1"
-            })
-        
-        # Construir documento
-        parcela_doc = {
-            "referencia_erp": parcela.referencia_erp,
-            "codigo": codigo,
-            "nombre": parcela.nombre,
-            "finca_id": finca_id,
-            "finca": finca_nombre,
-            "contrato_id": contrato_id,
-            "numero_contrato": numero_contrato,
-            "proveedor_id": proveedor_id,
-            "proveedor": proveedor_nombre,
-            "cultivo_id": cultivo_id,
-            "cultivo": cultivo_nombre,
-            "variedad": parcela.variedad,
-            "campana": parcela.campana,
-            "superficie": parcela.superficie,
-            "superficie_unidad": parcela.superficie_unidad,
-            "plantas_hectarea": parcela.plantas_hectarea,
-            "sistema_riego": parcela.sistema_riego,
-            "fecha_siembra": parcela.fecha_siembra,
-            "fecha_cosecha_prevista": parcela.fecha_cosecha_prevista,
-            "estado": parcela.estado or "Activa",
-            "geometry": geometry,
-            "recintos": recintos,
-            "observaciones": parcela.observaciones,
-            "activo": True,
-            "created_at": datetime.now(),
-            "created_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        refs = await _refs_parcelas([parcela])
+        codigo = (await _codigos_erp("parcelas", "PAR", [parcela.codigo]))[0]
+        parcela_doc = _parcela_doc(parcela, refs, codigo, auth)
         
         result = await parcelas_collection.insert_one(parcela_doc)
+        await record_kpi_insert("parcelas", parcela_doc)
         
         return {
             "success": True,
@@ -1098,10 +1079,10 @@ async def crear_parcela_erp(
                 "codigo": codigo,
                 "referencia_erp": parcela.referencia_erp,
                 "nombre": parcela.nombre,
-                "finca_id": finca_id,
-                "contrato_id": contrato_id,
-                "proveedor_id": proveedor_id,
-                "cultivo_id": cultivo_id
+                "finca_id": parcela_doc["finca_id"],
+                "contrato_id": parcela_doc["contrato_id"],
+                "proveedor_id": parcela_doc["proveedor_id"],
+                "cultivo_id": parcela_doc["cultivo_id"]
             }
         }
         
@@ -1131,36 +1112,14 @@ async def actualizar_parcela_erp(
             )
         
         # Buscar cultivo actualizado
-        cultivo_id = existing.get("cultivo_id")
-        cultivo_nombre = parcela.cultivo_nombre
-        if parcela.cultivo_codigo:
-            cultivo = await cultivos_collection.find_one({"codigo": parcela.cultivo_codigo})
-            if cultivo:
-                cultivo_id = str(cultivo["_id"])
-                cultivo_nombre = cultivo.get("nombre", parcela.cultivo_nombre)
-        
-        update_data = {
-            "nombre": parcela.nombre,
-            "cultivo_id": cultivo_id,
-            "cultivo": cultivo_nombre,
-            "variedad": parcela.variedad,
-            "campana": parcela.campana,
-            "superficie": parcela.superficie,
-            "superficie_unidad": parcela.superficie_unidad,
-            "plantas_hectarea": parcela.plantas_hectarea,
-            "sistema_riego": parcela.sistema_riego,
-            "fecha_siembra": parcela.fecha_siembra,
-            "fecha_cosecha_prevista": parcela.fecha_cosecha_prevista,
-            "estado": parcela.estado,
-            "observaciones": parcela.observaciones,
-            "updated_at": datetime.now(),
-            "updated_by": f"ERP Integration ({auth['erp_name']})"
-        }
+        refs = await ErpRefs().load(cultivo_codigos=[parcela.cultivo_codigo])
+        update_data = _parcela_update(parcela, existing, refs, auth)
         
-        await parcelas_collection.update_one(
-            {"_id": existing["_id"]},
-            {"$set": update_data}
-        )
+        async with track_kpi_change("parcelas", existing["_id"]):
+            await parcelas_collection.update_one(
+                {"_id": existing["_id"]},
+                {"$set": update_data}
+            )
         
         return {
             "success": True,
@@ -1218,16 +1177,17 @@ async def eliminar_parcela_erp(
             detail=f"No se encontró parcela con referencia ERP: {referencia_erp}"
         )
     
-    await parcelas_collection.update_one(
-        {"_id": parcela["_id"]},
-        {"$set": {
-            "activo": False,
-            "estado": "Baja",
-            "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
-            "updated_at": datetime.now(),
-            "deleted_by": "ERP Integration"
-        }}
-    )
+    async with track_kpi_change("parcelas", parcela["_id"]):
+        await parcelas_collection.update_one(
+            {"_id": parcela["_id"]},
+            {"$set": {
+                "activo": False,
+                "estado": "Baja",
+                "fecha_baja": datetime.now().strftime("%Y-%m-%d"),
+                "updated_at": datetime.now(),
+                "deleted_by": "ERP Integration"
+            }}
+        )
     
     return {
         "success": True,
@@ -1290,3 +1250,315 @@ async def listar_parcelas_erp(
             for p in parcelas
         ]
     }
+
+
+# === CARGAS MASIVAS (NDJSON) ===
+# POST /api/erp/{entidad}/bulk: un registro JSON por línea, mismo modelo y mismas
+# validaciones que el endpoint de registro único. Se procesa por lotes de
+# ERP_BULK_BATCH_SIZE líneas (referencias resueltas con una consulta por
+# colección y escrituras con un bulk_write no ordenado) y se devuelve un
+# resultado por línea, también en NDJSON, más una última línea con el resumen.
+
+BULK_MODOS = ("upsert", "create", "update")
+
+_BULK_OPENAPI: Dict[str, Any] = {
+    "requestBody": {
+        "required": True,
+        "content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}},
+    }
+}
+
+# (nº de línea, registro validado)
+BulkLote = List[Tuple[int, Any]]
+BulkProcesador = Callable[[BulkLote, str, dict], Awaitable[List[dict]]]
+
+_KPI_COLLECTIONS = ("contratos", "fincas", "parcelas")
+
+
+def _bulk_error(line: int, key_field: str, clave: Optional[str], status_code: int, detail: Any) -> dict:
+    return {"line": line, key_field: clave, "status": "error", "status_code": status_code, "detail": detail}
+
+
+async def _existentes(collection: Any, field: str, valores: List[str]) -> Dict[str, dict]:
+    docs: Dict[str, dict] = {}
+    async for doc in collection.find({field: {"$in": valores}}):
+        docs.setdefault(doc[field], doc)
+    return docs
+
+
+def _clasificar(lote: BulkLote, existentes: Dict[str, dict], modo: str, key_field: str,
+                conflicto: str, no_encontrado: str) -> Tuple[BulkLote, List[Tuple[int, Any, dict]], List[dict]]:
+    """Reparte el lote en altas y modificaciones según el modo; 409/404 como los endpoints únicos."""
+    altas: BulkLote = []
+    cambios: List[Tuple[int, Any, dict]] = []
+    errores: List[dict] = []
+    for line, item in lote:
+        clave = getattr(item, key_field)
+        existing = existentes.get(clave)
+        if existing is not None and modo == "create":
+            errores.append(_bulk_error(line, key_field, clave, 409, conflicto.format(clave)))
+        elif existing is None and modo == "update":
+            errores.append(_bulk_error(line, key_field, clave, 404, no_encontrado.format(clave)))
+        elif existing is not None:
+            cambios.append((line, item, existing))
+        else:
+            altas.append((line, item))
+    return altas, cambios, errores
+
+
+async def _escribir_lote(
+    collection: Any,
+    key_field: str,
+    altas: List[Tuple[int, Any, dict]],
+    cambios: List[Tuple[int, Any, dict, dict]],
+    extra: Callable[[dict], dict],
+) -> List[dict]:
+    """Escribe altas `(línea, item, doc)` y cambios `(línea, item, existente, $set)` en un bulk_write."""
+    ops: List[Any] = []
+    resultados: List[dict] = []
+    kpi: List[Tuple[Optional[dict], dict]] = []
+    for line, item, doc in altas:
+        doc.setdefault("_id", ObjectId())
+        ops.append(InsertOne(doc))
+        resultados.append({"line": line, key_field: getattr(item, key_field), "status": "created",
+                           "id": str(doc["_id"]), **extra(doc)})
+        kpi.append((None, doc))
+    for line, item, existing, update_data in cambios:
+        ops.append(UpdateOne({"_id": existing["_id"]}, {"$set": update_data}))
+        after = {**existing, **update_data}
+        resultados.append({"line": line, key_field: getattr(item, key_field), "status": "updated",
+                           "id": str(existing["_id"]), **extra(after)})
+        kpi.append((existing, after))
+    
+    fallos = await bulk_write_lines(collection, ops)
+    for index, mensaje in fallos.items():
+        resultado = resultados[index]
+        resultados[index] = _bulk_error(resultado["line"], key_field, resultado[key_field],
+                                        409 if "E11000" in mensaje else 500, mensaje)
+    escritos = [pair for i, pair in enumerate(kpi) if i not in fallos]
+    if escritos and collection.name in _KPI_COLLECTIONS:
+        await record_kpi_changes(collection.name, escritos)
+    return resultados
+
+
+async def _procesar_bulk(
+    request: Request,
+    modelo: Type[BaseModel],
+    key_field: str,
+    modo: str,
+    auth: dict,
+    procesar_lote: BulkProcesador,
+) -> Response:
+    if modo not in BULK_MODOS:
+        raise HTTPException(status_code=400, detail=f"modo debe ser uno de: {', '.join(BULK_MODOS)}")
+    
+    resultados: List[dict] = []
+    lote: BulkLote = []
+    claves: set = set()
+    lineas = 0
+    truncado = False
+    
+    async def vaciar() -> None:
+        if not lote:
+            return
+        try:
+            resultados.extend(await procesar_lote(lote, modo, auth))
+        except Exception as e:
+            print(f"[ERP Bulk] {modelo.__name__} batch failed: {e}")
+            resultados.extend(_bulk_error(line, key_field, getattr(item, key_field), 500, str(e))
+                              for line, item in lote)
+        lote.clear()
+        claves.clear()
+    
+    async for line, obj in iter_ndjson(request.stream()):
+        lineas += 1
+        if lineas > ERP_BULK_MAX_LINES:
+            resultados.append(_bulk_error(
+                line, key_field, None, 413,
+                f"Se ha superado el máximo de {ERP_BULK_MAX_LINES} líneas por petición; el resto no se ha procesado",
+            ))
+            truncado = True
+            break
+        if isinstance(obj, NdjsonLineError):
+            resultados.append(_bulk_error(line, key_field, None, 400, str(obj)))
+            continue
+        try:
+            item = modelo(**obj)
+        except ValidationError as e:
+            resultados.append(_bulk_error(line, key_field, obj.get(key_field), 422,
+                                          e.errors(include_url=False, include_input=False)))
+            continue
+        clave = getattr(item, key_field)
+        # Una misma referencia dos veces en el lote: se escribe la primera antes de seguir
+        if clave in claves or len(lote) >= ERP_BULK_BATCH_SIZE:
+            await vaciar()
+        lote.append((line, item))
+        claves.add(clave)
+    await vaciar()
+    
+    resultados.sort(key=lambda r: r["line"])
+    resumen = {
+        "lineas": lineas if not truncado else lineas - 1,
+        "creados": sum(1 for r in resultados if r["status"] == "created"),
+        "actualizados": sum(1 for r in resultados if r["status"] == "updated"),
+        "errores": sum(1 for r in resultados if r["status"] == "error"),
+        "truncado": truncado,
+    }
+    body = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n"
+                   for r in [*resultados, {"resumen": resumen}])
+    return Response(content=body, media_type=NDJSON_MEDIA_TYPE)
+
+
+async def _bulk_contratos(lote: BulkLote, modo: str, auth: dict) -> List[dict]:
+    existentes = await _existentes(contratos_collection, "referencia_erp", [c.referencia_erp for _, c in lote])
+    altas, cambios, errores = _clasificar(
+        lote, existentes, modo, "referencia_erp",
+        "Ya existe un contrato con referencia ERP: {}", "No se encontró contrato con referencia ERP: {}",
+    )
+    docs: List[Tuple[int, Any, dict]] = []
+    if altas:
+        refs = await _refs_contratos([c for _, c in altas])
+        year = datetime.now().year
+        numeros = iter(await allocate_block("contratos", len(altas), scope=year))
+        docs = [(line, c, _contrato_doc(c, refs, next(numeros), year, auth)) for line, c in altas]
+    return errores + await _escribir_lote(
+        contratos_collection, "referencia_erp", docs,
+        [(line, c, existing, _contrato_update(c, auth)) for line, c, existing in cambios],
+        lambda doc: {"numero_contrato": doc.get("numero_contrato")},
+    )
+
+
+def _bulk_terceros(collection: Any, etiqueta: str) -> BulkProcesador:
+    """Proveedores y clientes: alta si no existe la referencia ni el CIF/NIF (como el POST)."""
+    async def procesar(lote: BulkLote, modo: str, auth: dict) -> List[dict]:
+        existentes = await _existentes(collection, "referencia_erp", [p.referencia_erp for _, p in lote])
+        altas, cambios, errores = _clasificar(
+            lote, existentes, modo, "referencia_erp",
+            f"Ya existe un {etiqueta} con esta referencia o CIF/NIF", f"{etiqueta.capitalize()} no encontrado",
+        )
+        cifs = set((await _existentes(collection, "cif_nif", [p.cif_nif for _, p in altas])).keys()) if altas else set()
+        docs: List[Tuple[int, Any, dict]] = []
+        for line, item in altas:
+            if item.cif_nif in cifs:
+                errores.append(_bulk_error(line, "referencia_erp", item.referencia_erp, 409,
+                                           f"Ya existe un {etiqueta} con esta referencia o CIF/NIF"))
+                continue
+            cifs.add(item.cif_nif)
+            docs.append((line, item, _alta_doc(item, auth)))
+        return errores + await _escribir_lote(
+            collection, "referencia_erp", docs,
+            [(line, item, existing, _modificacion_doc(item, auth)) for line, item, existing in cambios],
+            lambda doc: {"cif_nif": doc.get("cif_nif")},
+        )
+    return procesar
+
+
+async def _bulk_cultivos(lote: BulkLote, modo: str, auth: dict) -> List[dict]:
+    existentes = await _existentes(cultivos_collection, "codigo", [c.codigo for _, c in lote])
+    altas, cambios, errores = _clasificar(
+        lote, existentes, modo, "codigo",
+        "Ya existe un cultivo con código: {}", "No se encontró cultivo con código: {}",
+    )
+    return errores + await _escribir_lote(
+        cultivos_collection, "codigo",
+        [(line, c, _alta_doc(c, auth)) for line, c in altas],
+        [(line, c, existing, _modificacion_doc(c, auth)) for line, c, existing in cambios],
+        lambda doc: {"nombre": doc.get("nombre")},
+    )
+
+
+async def _bulk_fincas(lote: BulkLote, modo: str, auth: dict) -> List[dict]:
+    existentes = await _existentes(fincas_collection, "referencia_erp", [f.referencia_erp for _, f in lote])
+    altas, cambios, errores = _clasificar(
+        lote, existentes, modo, "referencia_erp",
+        "Ya existe una finca con referencia ERP: {}", "No se encontró finca con referencia ERP: {}",
+    )
+    docs: List[Tuple[int, Any, dict]] = []
+    if altas:
+        refs = await ErpRefs().load(proveedor_cifs=[f.propietario_cif for _, f in altas])
+        codigos = await _codigos_erp("fincas", "FIN", [f.codigo for _, f in altas])
+        docs = [(line, f, _finca_doc(f, refs, codigo, auth)) for (line, f), codigo in zip(altas, codigos)]
+    return errores + await _escribir_lote(
+        fincas_collection, "referencia_erp", docs,
+        [(line, f, existing, _finca_update(f, auth)) for line, f, existing in cambios],
+        lambda doc: {"codigo": doc.get("codigo")},
+    )
+
+
+async def _bulk_parcelas(lote: BulkLote, modo: str, auth: dict) -> List[dict]:
+    existentes = await _existentes(parcelas_collection, "referencia_erp", [p.referencia_erp for _, p in lote])
+    altas, cambios, errores = _clasificar(
+        lote, existentes, modo, "referencia_erp",
+        "Ya existe una parcela con referencia ERP: {}", "No se encontró parcela con referencia ERP: {}",
+    )
+    docs: List[Tuple[int, Any, dict]] = []
+    if altas:
+        refs = await _refs_parcelas([p for _, p in altas])
+        codigos = await _codigos_erp("parcelas", "PAR", [p.codigo for _, p in altas])
+        docs = [(line, p, _parcela_doc(p, refs, codigo, auth)) for (line, p), codigo in zip(altas, codigos)]
+    updates: List[Tuple[int, Any, dict, dict]] = []
+    if cambios:
+        refs_cambios = await ErpRefs().load(cultivo_codigos=[p.cultivo_codigo for _, p, _ in cambios])
+        updates = [(line, p, existing, _parcela_update(p, existing, refs_cambios, auth))
+                   for line, p, existing in cambios]
+    return errores + await _escribir_lote(
+        parcelas_collection, "referencia_erp", docs, updates,
+        lambda doc: {"codigo": doc.get("codigo"), "finca_id": doc.get("finca_id"),
+                     "contrato_id": doc.get("contrato_id")},
+    )
+
+
+_MODO_QUERY = Query("upsert", description="upsert: crea o actualiza; create: solo altas (409 si existe); update: solo modificaciones (404 si no existe)")
+
+
+@router.post("/contratos/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_contratos_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """
+    Alta/actualización masiva de contratos desde un flujo NDJSON (un ContratoERP por línea).
+    
+    **Autenticación**: Requiere header `X-API-Key`
+    """
+    return await _procesar_bulk(request, ContratoERP, "referencia_erp", modo, auth, _bulk_contratos)
+
+
+@router.post("/proveedores/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_proveedores_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """Alta/actualización masiva de proveedores (NDJSON, un ProveedorERP por línea)."""
+    return await _procesar_bulk(request, ProveedorERP, "referencia_erp", modo, auth,
+                                _bulk_terceros(proveedores_collection, "proveedor"))
+
+
+@router.post("/clientes/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_clientes_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """Alta/actualización masiva de clientes (NDJSON, un ClienteERP por línea)."""
+    return await _procesar_bulk(request, ClienteERP, "referencia_erp", modo, auth,
+                                _bulk_terceros(clientes_collection, "cliente"))
+
+
+@router.post("/cultivos/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_cultivos_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """Alta/actualización masiva de cultivos por código (NDJSON, un CultivoERP por línea)."""
+    return await _procesar_bulk(request, CultivoERP, "codigo", modo, auth, _bulk_cultivos)
+
+
+@router.post("/fincas/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_fincas_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """
+    Alta/actualización masiva de fincas desde un flujo NDJSON (un FincaERP por línea).
+    
+    **Autenticación**: Requiere header `X-API-Key`
+    """
+    return await _procesar_bulk(request, FincaERP, "referencia_erp", modo, auth, _bulk_fincas)
+
+
+@router.post("/parcelas/bulk", openapi_extra=_BULK_OPENAPI)
+async def bulk_parcelas_erp(request: Request, modo: str = _MODO_QUERY, auth: dict = Depends(verify_api_key)):
+    """
+    Alta/actualización masiva de parcelas desde un flujo NDJSON (un ParcelaERP por línea).
+    
+    Las fincas, contratos, proveedores y cultivos de cada lote se resuelven con
+    una consulta por colección; los proveedores nuevos se crean una sola vez.
+    
+    **Autenticación**: Requiere header `X-API-Key`
+    """
+    return await _procesar_bulk(request, ParcelaERP, "referencia_erp", modo, auth, _bulk_parcelas)
@@ -10,9 +10,15 @@ from typing import Optional, List
 from datetime import datetime, timezone
 import secrets
 import hashlib
-import httpx
 
 from database import db, serialize_doc, serialize_docs
+from services.http_clients import http_request
+from services.pagination import paginate
+from services.webhook_outbox import (
+    WEBHOOK_EVENTS, WEBHOOK_MODULES, encode_webhook_body, enqueue_webhook_event,
+    get_outbox_stats, invalidate_webhook_subscriptions, outbox_collection,
+    retry_dead_deliveries, webhook_headers,
+)
 from routes_auth import get_current_user
 
 router = APIRouter(prefix="/api/erp/sync", tags=["erp-sync"])
@@ -55,9 +61,10 @@ class WebhookCreate(BaseModel):
     url: str = Field(..., description="URL del webhook (HTTPS recomendado)")
     nombre: str = Field(..., description="Nombre descriptivo")
     eventos: List[str] = Field(..., description="Eventos: create, update, delete")
-    modulos: List[str] = Field(..., description="Modulos a monitorear")
+    modulos: List[str] = Field(..., description="Modulos a monitorear: contratos, fincas")
     activo: bool = True
     secret: Optional[str] = Field(None, description="Secret para firma HMAC (se genera automaticamente si no se proporciona)")
+    max_batch: int = Field(1, ge=1, le=50, description="Eventos por POST (1 = un evento por peticion)")
 
 
 # === API KEYS MANAGEMENT ===
@@ -150,6 +157,7 @@ async def list_webhooks(current_user: dict = Depends(get_current_user)):
             "last_triggered": w.get("last_triggered", "").isoformat() if isinstance(w.get("last_triggered"), datetime) else None,
             "trigger_count": w.get("trigger_count", 0),
             "last_status": w.get("last_status"),
+            "max_batch": w.get("max_batch", 1),
         })
     return {"success": True, "data": result}
 
@@ -159,6 +167,17 @@ async def create_webhook(data: WebhookCreate, current_user: dict = Depends(get_c
     if current_user.get("role") != "Admin":
         raise HTTPException(status_code=403, detail="Solo administradores")
     
+    # Un webhook suscrito a un módulo que no emite eventos no se dispararía nunca
+    for campo, valores, disponibles in (("modulos", data.modulos, WEBHOOK_MODULES),
+                                        ("eventos", data.eventos, WEBHOOK_EVENTS)):
+        invalidos = sorted(set(valores) - set(disponibles))
+        if not valores or invalidos:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{campo} no soportados: {', '.join(invalidos) or 'lista vacia'}. "
+                       f"Disponibles: {', '.join(disponibles)}",
+            )
+    
     webhook_secret = data.secret or secrets.token_urlsafe(24)
     
     doc = {
@@ -168,11 +187,13 @@ async def create_webhook(data: WebhookCreate, current_user: dict = Depends(get_c
         "modulos": data.modulos,
         "activo": data.activo,
         "secret": webhook_secret,
+        "max_batch": data.max_batch,
         "created_at": datetime.now(timezone.utc),
         "created_by": current_user.get("email"),
         "trigger_count": 0,
     }
     result = await erp_webhooks_collection.insert_one(doc)
+    invalidate_webhook_subscriptions()
     
     return {
         "success": True,
@@ -194,6 +215,7 @@ async def delete_webhook(webhook_id: str, current_user: dict = Depends(get_curre
     result = await erp_webhooks_collection.delete_one({"_id": ObjectId(webhook_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Webhook no encontrado")
+    invalidate_webhook_subscriptions()
     return {"success": True, "message": "Webhook eliminado"}
 
 
@@ -210,6 +232,7 @@ async def toggle_webhook(webhook_id: str, current_user: dict = Depends(get_curre
         {"_id": ObjectId(webhook_id)},
         {"$set": {"activo": new_state}}
     )
+    invalidate_webhook_subscriptions()
     return {"success": True, "activo": new_state}
 
 
@@ -228,22 +251,16 @@ async def test_webhook(webhook_id: str, current_user: dict = Depends(get_current
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "data": {"message": "Test webhook desde FRUVECO"},
     }
+    body = encode_webhook_body(test_payload)
     
-    signature = hashlib.sha256(
-        (webhook.get("secret", "") + str(test_payload)).encode()
-    ).hexdigest()
-    
+    # La prueba se envia en directo (el admin espera el resultado), con la misma firma que el outbox
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post(
-                webhook["url"],
-                json=test_payload,
-                headers={
-                    "X-Webhook-Signature": signature,
-                    "X-Webhook-Event": "test",
-                    "Content-Type": "application/json",
-                }
-            )
+        resp = await http_request(
+            "webhooks", "POST", webhook["url"],
+            content=body,
+            headers=webhook_headers(webhook.get("secret", ""), "test", body),
+            timeout=10.0,
+        )
         status = resp.status_code
         success = 200 <= status < 300
     except Exception:
@@ -273,6 +290,8 @@ async def export_module_data(
     modificados_desde: Optional[str] = Query(None, description="Solo registros modificados desde (YYYY-MM-DD)"),
     limite: int = Query(1000, le=5000),
     pagina: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto en next_cursor (sustituye a pagina)"),
+    count: Optional[str] = Query(None, description="exact | estimated | none"),
     current_user: dict = Depends(get_current_user),
 ):
     if module not in MODULE_COLLECTIONS:
@@ -294,11 +313,14 @@ async def export_module_data(
         query["updated_at"] = {"$gte": datetime.fromisoformat(modificados_desde)}
     
     skip = (pagina - 1) * limite
-    total = await collection.count_documents(query)
-    docs = await collection.find(query, {"_id": 0}).skip(skip).limit(limite).to_list(limite)
+    page = await paginate(collection, query, [("_id", 1)],
+                          limit=limite, skip=skip, cursor=cursor, count=count)
+    total = page["total"]
+    docs = page["items"]
     
     # Serializar ObjectId en subdocumentos
     for doc in docs:
+        doc.pop("_id", None)
         for key, val in list(doc.items()):
             if hasattr(val, '__str__') and type(val).__name__ == 'ObjectId':
                 doc[key] = str(val)
@@ -322,7 +344,8 @@ async def export_module_data(
         "total": total,
         "pagina": pagina,
         "limite": limite,
-        "paginas_total": (total + limite - 1) // limite,
+        "paginas_total": (total + limite - 1) // limite if total is not None else None,
+        "next_cursor": page["next_cursor"],
         "data": docs,
     }
 
@@ -389,53 +412,66 @@ async def get_sync_stats(current_user: dict = Depends(get_current_user)):
     }
 
 
+# === WEBHOOK OUTBOX ===
+
+@router.get("/outbox/stats")
+async def outbox_stats(current_user: dict = Depends(get_current_user)):
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    return {"success": True, "data": await get_outbox_stats()}
+
+
+@router.get("/outbox")
+async def list_outbox(
+    estado: Optional[str] = Query(None, description="pending, sending, delivered, dead"),
+    webhook_id: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    current_user: dict = Depends(get_current_user),
+):
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    from bson import ObjectId
+    query: dict = {}
+    if estado:
+        query["status"] = estado
+    if webhook_id:
+        if not ObjectId.is_valid(webhook_id):
+            raise HTTPException(status_code=400, detail="webhook_id invalido")
+        query["webhook_id"] = ObjectId(webhook_id)
+    page = await paginate(outbox_collection, query, [("created_at", -1)], limit=limit, cursor=cursor)
+    items = serialize_docs(page["items"])
+    for item in items:
+        item["webhook_id"] = str(item.get("webhook_id"))
+    return {"success": True, "data": items, "total": page["total"], "next_cursor": page["next_cursor"]}
+
+
+@router.post("/outbox/retry")
+async def retry_outbox(
+    delivery_id: Optional[str] = Query(None, description="Reintentar una entrega concreta"),
+    webhook_id: Optional[str] = Query(None, description="Reintentar todas las dead de un webhook"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Return dead-lettered deliveries to the queue (all of them if no filter is given)."""
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    from bson import ObjectId
+    query: dict = {}
+    for field, value in (("_id", delivery_id), ("webhook_id", webhook_id)):
+        if value:
+            if not ObjectId.is_valid(value):
+                raise HTTPException(status_code=400, detail="ID invalido")
+            query[field] = ObjectId(value)
+    retried = await retry_dead_deliveries(query)
+    return {"success": True, "reintentadas": retried}
+
+
 # === WEBHOOK DISPATCHER (utility function) ===
 
-async def dispatch_webhook(event: str, module: str, data: dict):
-    """Fire webhooks for a given event. Called from other routes after CRUD ops."""
-    webhooks = await erp_webhooks_collection.find({
-        "activo": True,
-        "eventos": event,
-        "modulos": module,
-    }).to_list(50)
-    
-    for wh in webhooks:
-        payload = {
-            "event": event,
-            "module": module,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "data": data,
-        }
-        signature = hashlib.sha256(
-            (wh.get("secret", "") + str(payload)).encode()
-        ).hexdigest()
-        
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.post(
-                    wh["url"],
-                    json=payload,
-                    headers={
-                        "X-Webhook-Signature": signature,
-                        "X-Webhook-Event": event,
-                    }
-                )
-            status = resp.status_code
-        except Exception:
-            status = 0
-        
-        await erp_webhooks_collection.update_one(
-            {"_id": wh["_id"]},
-            {"$set": {"last_triggered": datetime.now(timezone.utc), "last_status": status},
-             "$inc": {"trigger_count": 1}}
-        )
-        
-        await erp_sync_log_collection.insert_one({
-            "tipo": "webhook",
-            "modulo": module,
-            "evento": event,
-            "webhook_url": wh["url"],
-            "estado": "ok" if 200 <= status < 300 else "error",
-            "status_code": status,
-            "timestamp": datetime.now(timezone.utc),
-        })
+async def dispatch_webhook(event: str, module: str, data: dict, session=None) -> int:
+    """Queue webhooks for a given event. Called from other routes after CRUD ops.
+
+    Only writes to the outbox; delivery happens in the background dispatcher
+    (services/webhook_outbox.py), so a slow ERP never delays the caller.
+    """
+    return await enqueue_webhook_event(event, module, data, session=session)
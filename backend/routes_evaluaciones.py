@@ -12,6 +12,11 @@ from rbac_guards import RequireCreate, RequireEdit, RequireDelete, get_current_u
 from models_evaluaciones import (
     SeccionRespuesta, EvaluacionCreate, PreguntaConfig, PREGUNTAS_DEFAULT,
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
+from services.entity_loader import Loaders
+from services.pagination import paginate
+from services.pdf_cache import get_cached_pdf, invalidate_pdf_cache, pdf_fingerprint, store_pdf
 
 router = APIRouter(prefix="/api", tags=["evaluaciones"])
 
@@ -259,6 +264,8 @@ async def create_evaluacion(
 async def get_evaluaciones(
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     parcela_id: Optional[str] = None,
     campana: Optional[str] = None,
     estado: Optional[str] = None,
@@ -273,10 +280,10 @@ async def get_evaluaciones(
     if estado:
         query["estado"] = estado
     
-    evaluaciones = await evaluaciones_collection.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await evaluaciones_collection.count_documents(query)
+    page = await paginate(evaluaciones_collection, query, [("created_at", -1), ("_id", -1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
     
-    return {"evaluaciones": serialize_docs(evaluaciones), "total": total}
+    return {"evaluaciones": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/evaluaciones/{evaluacion_id}")
@@ -382,6 +389,7 @@ async def delete_evaluacion(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Evaluación no encontrada")
     
+    await invalidate_pdf_cache("evaluacion", evaluacion_id)
     return {"success": True, "message": "Evaluación eliminada"}
 
 
@@ -437,7 +445,7 @@ async def export_evaluaciones_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"evaluaciones_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -516,7 +524,7 @@ async def generate_evaluacion_pdf(
 ):
     """Generar PDF de la hoja de evaluación con visitas y tratamientos"""
     from fastapi.responses import Response
-    from weasyprint import HTML
+    from services.render_service import render_html_pdf
     from database import visitas_collection, tratamientos_collection, maquinaria_collection
     import io
     
@@ -532,10 +540,6 @@ async def generate_evaluacion_pdf(
     
     parcela_id = evaluacion.get("parcela_id", "")
     
-    # Ficheros temporales que se generan durante el render del PDF
-    # (mapas satelitales de `staticmap`) y hay que borrar tras `write_pdf`.
-    _pdf_temp_files: list[str] = []
-    
     # Obtener datos completos de la parcela incluyendo geometría
     parcela_data = None
     if parcela_id and ObjectId.is_valid(parcela_id):
@@ -635,23 +639,25 @@ async def generate_evaluacion_pdf(
             tratamientos = await tratamientos_collection.find({"contrato_id": contrato_id_ev}).sort("fecha_tratamiento", 1).to_list(100)
     
     # Para cada tratamiento, obtener los datos completos del aplicador y la máquina
+    # (una consulta $in por colección para todos los tratamientos)
+    loaders = Loaders()
+    aplicadores = await loaders.get(tecnicos_aplicadores_collection).load_many(
+        trat.get("tecnico_aplicador_id") or trat.get("aplicador_id") for trat in tratamientos
+    )
+    maquinas = await loaders.get(maquinaria_collection).load_many(trat.get("maquina_id") for trat in tratamientos)
     tratamientos_enriquecidos = []
     for trat in tratamientos:
         trat_data = dict(trat)
         
         # Obtener datos del aplicador (el campo es tecnico_aplicador_id)
-        aplicador_id = trat.get("tecnico_aplicador_id") or trat.get("aplicador_id")
-        if aplicador_id and ObjectId.is_valid(aplicador_id):
-            aplicador = await tecnicos_aplicadores_collection.find_one({"_id": ObjectId(aplicador_id)})
-            if aplicador:
-                trat_data["aplicador_completo"] = serialize_doc(aplicador)
+        aplicador = aplicadores.get(str(trat.get("tecnico_aplicador_id") or trat.get("aplicador_id")))
+        if aplicador:
+            trat_data["aplicador_completo"] = serialize_doc(dict(aplicador))
         
         # Obtener datos de la máquina
-        maquina_id = trat.get("maquina_id")
-        if maquina_id and ObjectId.is_valid(maquina_id):
-            maquina = await maquinaria_collection.find_one({"_id": ObjectId(maquina_id)})
-            if maquina:
-                trat_data["maquina_completa"] = serialize_doc(maquina)
+        maquina = maquinas.get(str(trat.get("maquina_id")))
+        if maquina:
+            trat_data["maquina_completa"] = serialize_doc(dict(maquina))
         
         tratamientos_enriquecidos.append(trat_data)
     
@@ -688,6 +694,39 @@ async def generate_evaluacion_pdf(
     visitas = [_overlay_inherited(v) for v in visitas]
     tratamientos = [_overlay_inherited(t) for t in tratamientos]
     
+    # Orden global de preguntas guardado en configuración (se usa más abajo)
+    try:
+        _cfg = await evaluaciones_config_collection.find_one({"tipo": "preguntas"})
+    except Exception:
+        _cfg = None
+    
+    filename = f"cuaderno_campo_{evaluacion.get('codigo_plantacion', 'sin_codigo')}_{evaluacion.get('campana', 'sin_campana')}.pdf"
+    
+    # PDF cacheado: la huella cubre todos los documentos que alimentan la
+    # plantilla, así que cualquier edición produce un PDF nuevo. Las
+    # evaluaciones transientes (cuaderno de campo sin evaluación) no se cachean.
+    cacheable = not evaluacion.get("_transient")
+    fingerprint = pdf_fingerprint(
+        "evaluacion", evaluacion, parcela_data, variedad_resuelta, visitas, tratamientos,
+        (_cfg or {}).get("orden_global", []), _get_fruveco_logo_data_uri(),
+    )
+    if cacheable:
+        cached_pdf = await get_cached_pdf("evaluacion", fingerprint)
+        if cached_pdf is not None:
+            return Response(
+                content=cached_pdf,
+                media_type="application/pdf",
+                headers={
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                    "X-PDF-Cache": "hit",
+                }
+            )
+    
+    # Mapa satélite de la parcela: "hit"/"miss" en la caché de mapas (cabecera
+    # X-Map-Cache), "none" si la parcela no tiene geometría y "failed" si el
+    # render falló y se usó el diagrama SVG (ese PDF no se guarda en caché)
+    map_cache_status = "none"
+    
     # Irrigaciones y Cosechas: eliminadas del cuaderno de campo (no se incluyen
     # en el PDF según requerimientos de usuario).
     # La paginación se calcula dinámicamente con counter(page)/counter(pages) en CSS.
@@ -1333,77 +1372,10 @@ async def generate_evaluacion_pdf(
             # editor Leaflet Avanzado. Fallback a SVG si falla la red.
             satelite_ok = False
             try:
-                from staticmap import StaticMap, Polygon as SmPolygon, CircleMarker
-                import uuid as _uuid
-                # Esri World Imagery (satélite gratuito)
-                esri_url = "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
-                sm = StaticMap(900, 540, url_template=esri_url)
-                pts = [(p.get('lng', 0), p.get('lat', 0)) for p in geometria]
-                # Cerrar el anillo si no viene cerrado
-                if pts and pts[0] != pts[-1]:
-                    pts.append(pts[0])
-                # Polígono verde translúcido con borde oscuro
-                # NOTA: staticmap/PIL requieren color hex (#rrggbbaa) — no acepta rgba(..., 0.85)
-                # Polygon(coords, fill_color, outline_color)
-                sm.add_polygon(SmPolygon(pts, '#4CAF5066', '#2E7D32', simplify=False))
-                # Marcador de centro (azul con núcleo blanco tipo Leaflet)
-                sm.add_marker(CircleMarker((center_lng, center_lat), '#1565C0', 14))
-                sm.add_marker(CircleMarker((center_lng, center_lat), '#FFFFFF', 8))
-                img = sm.render()
-                # === Overlay estilo SIGPAC: brújula N↑ y barra de escala ===
-                try:
-                    from PIL import ImageDraw, ImageFont
-                    import math as _math
-                    draw = ImageDraw.Draw(img, 'RGBA')
-                    try:
-                        font_bold = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 16)
-                        font_scale = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 12)
-                    except Exception:
-                        font_bold = ImageFont.load_default()
-                        font_scale = ImageFont.load_default()
-                    W, H = img.size
-
-                    # --- Brújula (esquina superior derecha) ---
-                    cx, cy, r = W - 45, 45, 26
-                    # Halo blanco semitransparente + círculo blanco con borde
-                    draw.ellipse((cx-r-2, cy-r-2, cx+r+2, cy+r+2), fill=(255, 255, 255, 220), outline=(60, 60, 60, 255), width=2)
-                    # Flecha norte (roja arriba, gris abajo) — polígono romboidal
-                    draw.polygon([(cx, cy-r+6), (cx+7, cy+2), (cx, cy-2), (cx-7, cy+2)], fill=(198, 40, 40, 255))
-                    draw.polygon([(cx, cy+r-6), (cx+7, cy-2), (cx, cy+2), (cx-7, cy-2)], fill=(90, 90, 90, 255))
-                    # Etiqueta N en negrita encima
-                    draw.text((cx-5, cy-r-2), "N", fill=(20, 20, 20, 255), font=font_bold)
-
-                    # --- Barra de escala (esquina inferior izquierda) ---
-                    # metros/pixel (Web Mercator): 156543.03392 * cos(lat) / 2^zoom
-                    lat_rad = _math.radians(center_lat)
-                    mpp = 156543.03392 * _math.cos(lat_rad) / (2 ** sm.zoom)
-                    # Elegir una distancia "bonita" ≈ 150 px
-                    target_px = 150
-                    target_m = target_px * mpp
-                    nice_values_m = [50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000]
-                    scale_m = min(nice_values_m, key=lambda v: abs(v - target_m))
-                    scale_px = int(round(scale_m / mpp))
-                    label = f"{scale_m/1000:.1f} km" if scale_m >= 1000 else f"{scale_m} m"
-
-                    bx, by = 20, H - 40
-                    bw, bh = scale_px, 10
-                    # Fondo blanco semitransparente
-                    draw.rectangle((bx-6, by-22, bx+bw+6, by+bh+6), fill=(255, 255, 255, 220), outline=(60, 60, 60, 255), width=1)
-                    # Barra bicolor: mitad blanca / mitad negra
-                    half = bw // 2
-                    draw.rectangle((bx, by, bx+half, by+bh), fill=(255, 255, 255, 255), outline=(20, 20, 20, 255), width=1)
-                    draw.rectangle((bx+half, by, bx+bw, by+bh), fill=(20, 20, 20, 255), outline=(20, 20, 20, 255), width=1)
-                    # Etiquetas: 0 · mitad · total
-                    draw.text((bx-3, by-16), "0", fill=(20, 20, 20, 255), font=font_scale)
-                    draw.text((bx+bw-len(label)*6, by-16), label, fill=(20, 20, 20, 255), font=font_scale)
-                except Exception as _ov_err:
-                    print(f"[PDF] map overlay (compass/scale) failed: {_ov_err}")
-
-                out_dir = "/app/uploads/evaluaciones/pdf_maps"
-                os.makedirs(out_dir, exist_ok=True)
-                out_path = os.path.join(out_dir, f"map_{_uuid.uuid4().hex}.png")
-                img.save(out_path)
-                _pdf_temp_files.append(out_path)
+                from services.map_render_cache import get_parcel_map_png
+                # Teselas y mapa renderizado cacheados en disco (mismo polígono = mismo PNG)
+                out_path, map_cached = await get_parcel_map_png(geometria)
+                map_cache_status = "hit" if map_cached else "miss"
                 map_html = f'''
                     <div style="border:2px solid #ccc; border-radius:8px; overflow:hidden;">
                         <img src="file://{out_path}" style="width:100%; display:block;" alt="Mapa satélite de la parcela" />
@@ -1416,6 +1388,7 @@ async def generate_evaluacion_pdf(
             except Exception as _e:
                 print(f"[PDF] staticmap satelite failed, falling back to SVG: {_e}")
                 satelite_ok = False
+                map_cache_status = "failed"
             
             if not satelite_ok:
                 # ---- Fallback SVG diagrama (código legacy) ----
@@ -1538,11 +1511,7 @@ async def generate_evaluacion_pdf(
     # Aplicar orden_global (mismo que la UI): las preguntas con posición en
     # orden_global van primero según ese orden; las que no aparezcan mantienen
     # el orden de sección + índice original al final.
-    try:
-        _cfg = await evaluaciones_config_collection.find_one({"tipo": "preguntas"})
-        _orden_global = (_cfg or {}).get("orden_global", []) if _cfg else []
-    except Exception:
-        _orden_global = []
+    _orden_global = (_cfg or {}).get("orden_global", []) if _cfg else []
     if _orden_global:
         _pos = {pid: i for i, pid in enumerate(_orden_global)}
         # Precompute stable fallback index (id(r) del objeto) para preguntas que
@@ -2098,7 +2067,9 @@ async def generate_evaluacion_pdf(
         </div>
             """
     
-    # Footer final
+    # Footer final. Un PDF servido desde caché conserva la fecha en que se
+    # generó (la huella no incluye la hora); se regenera al editar cualquier
+    # documento de origen.
     html_content += f"""
         <div class="footer">
             <p>Documento generado automáticamente por FRUVECO - Cuaderno de Campo</p>
@@ -2111,32 +2082,27 @@ async def generate_evaluacion_pdf(
     
     # Generar PDF
     try:
-        pdf_buffer = io.BytesIO()
-        HTML(string=html_content).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
+        pdf_buffer = io.BytesIO(await render_html_pdf(html_content))
         
-        filename = f"cuaderno_campo_{evaluacion.get('codigo_plantacion', 'sin_codigo')}_{evaluacion.get('campana', 'sin_campana')}.pdf"
+        # Con el mapa degradado a SVG por un fallo transitorio no se cachea:
+        # la siguiente descarga reintenta el satélite
+        store = cacheable and map_cache_status != "failed"
+        if store:
+            await store_pdf("evaluacion", fingerprint, evaluacion_id, pdf_buffer.getvalue(), filename)
         
         return Response(
             content=pdf_buffer.getvalue(),
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "X-PDF-Cache": "miss" if store else "bypass",
+                "X-Map-Cache": map_cache_status,
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando PDF: {str(e)}")
-    finally:
-        # Limpieza inmediata de mapas temporales — el PNG solo hace falta
-        # mientras WeasyPrint lo lee vía file://. Después se puede borrar
-        # para evitar que /app/uploads/evaluaciones/pdf_maps/ crezca sin
-        # control con un UUID por cada exportación.
-        for _tf in _pdf_temp_files:
-            try:
-                if _tf and os.path.exists(_tf):
-                    os.remove(_tf)
-            except Exception as _cleanup_err:
-                print(f"[PDF] cleanup failed for {_tf}: {_cleanup_err}")
 
 
 def _extract_emails_from_proveedor(proveedor: Optional[dict]) -> List[dict]:
@@ -2249,7 +2215,8 @@ async def send_evaluacion_by_email(
     subject = (payload or {}).get("subject") or "Hoja de Evaluacion / Cuaderno de Campo"
     body_msg = (payload or {}).get("message") or ""
 
-    # Generar el PDF reutilizando la funcion existente (misma logica que el GET)
+    # Generar el PDF reutilizando la funcion existente (misma logica que el GET,
+    # servido desde la cache de PDF si ningun dato ha cambiado)
     resp = await generate_evaluacion_pdf(evaluacion_id, current_user)
     pdf_bytes = resp.body if hasattr(resp, "body") else b""
     if not pdf_bytes:
@@ -2335,49 +2302,24 @@ async def export_evaluaciones_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Export evaluaciones to Excel"""
-    from fastapi.responses import StreamingResponse
-    import io as _io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
-    evaluaciones_list = await evaluaciones_collection.find({}).sort("created_at", -1).to_list(5000)
-    evaluaciones_raw = serialize_docs(evaluaciones_list)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Evaluaciones"
-
-    headers = ["Titulo", "Parcela", "Cultivo", "Proveedor", "Campana", "Estado", "Puntuacion", "Fecha", "Evaluador"]
-    header_fill = PatternFill(start_color="4A148C", end_color="4A148C", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
+    xl = ExcelExport(header_color="4A148C")
+    ws = xl.add_sheet(
+        "Evaluaciones",
+        ["Titulo", "Parcela", "Cultivo", "Proveedor", "Campana", "Estado", "Puntuacion", "Fecha", "Evaluador"],
+        widths=18,
+    )
 
-    for idx, e in enumerate(evaluaciones_raw, 2):
-        row = [
+    def to_row(doc):
+        e = serialize_doc(doc)
+        return [
             e.get("titulo", ""), e.get("parcela_codigo", ""), e.get("cultivo", ""),
             e.get("proveedor", ""), e.get("campana", ""), e.get("estado", ""),
             e.get("puntuacion_total", 0),
             e.get("created_at", "")[:10] if e.get("created_at") else "",
             e.get("evaluador", "")
         ]
-        for col, val in enumerate(row, 1):
-            cell = ws.cell(row=idx, column=col, value=val)
-            cell.border = thin_border
 
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[chr(64 + col)].width = 18
+    await ws.write(evaluaciones_collection.find({}).sort("created_at", -1), to_row)
 
-    output = _io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"evaluaciones_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return await xl.response(f"evaluaciones_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from datetime import datetime
 import io
 
@@ -13,6 +13,11 @@ from database import (
     albaranes_collection, maquinaria_collection, evaluaciones_collection
 )
 from rbac_guards import get_current_user
+from services.render_service import build_pdf, save_workbook
+from services.job_service import (
+    JobContext, JobFile, register_job_handler, submit_job, get_job, list_jobs,
+    cancel_job, delete_job, open_job_result, serialize_job
+)
 
 router = APIRouter(prefix="/api", tags=["exports"])
 
@@ -113,6 +118,12 @@ MODULES_CONFIG = {
 }
 
 
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Callback opcional de progreso: (módulos procesados, total, mensaje)
+ProgressCallback = Optional[Callable[[int, int, str], Awaitable[None]]]
+
+
 class CombinedExportRequest(BaseModel):
     modules: List[str]
     format: str = "excel"
@@ -139,18 +150,33 @@ async def export_combined(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate a combined export with multiple modules"""
-    valid_modules = [m for m in request.modules if m in MODULES_CONFIG]
+    valid_modules = _validate_modules(request.modules)
+    filename, media_type, content = await _render_combined(valid_modules, request.format)
+    return StreamingResponse(
+        io.BytesIO(content),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+def _validate_modules(modules: List[str]) -> List[str]:
+    valid_modules = [m for m in modules if m in MODULES_CONFIG]
     if not valid_modules:
-        from fastapi import HTTPException
         raise HTTPException(status_code=400, detail="No valid modules selected")
+    return valid_modules
 
-    if request.format == "excel":
-        return await _generate_combined_excel(valid_modules)
-    else:
-        return await _generate_combined_pdf(valid_modules)
 
+async def _render_combined(modules: List[str], fmt: str, on_progress: ProgressCallback = None):
+    """Genera el informe combinado y devuelve (filename, media_type, bytes)."""
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    if fmt == "excel":
+        content = await _generate_combined_excel(modules, on_progress)
+        return f"fruveco_informe_combinado_{stamp}.xlsx", EXCEL_MEDIA_TYPE, content
+    content = await _generate_combined_pdf(modules, on_progress)
+    return f"fruveco_informe_combinado_{stamp}.pdf", "application/pdf", content
 
-async def _generate_combined_excel(modules: List[str]):
+
+async def _generate_combined_excel(modules: List[str], on_progress: ProgressCallback = None) -> bytes:
     from openpyxl import Workbook
     from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
@@ -165,8 +191,10 @@ async def _generate_combined_excel(modules: List[str]):
         "maquinaria": "37474F",
     }
 
-    for mod_key in modules:
+    for mod_idx, mod_key in enumerate(modules):
         config = MODULES_CONFIG[mod_key]
+        if on_progress:
+            await on_progress(mod_idx, len(modules) + 1, config["label"])
         coll = db[config["collection"]]
         docs = await coll.find({}).sort(config["sort_field"], -1).to_list(5000)
         data = serialize_docs(docs)
@@ -225,18 +253,13 @@ async def _generate_combined_excel(modules: List[str]):
     summary.column_dimensions['A'].width = 25
     summary.column_dimensions['B'].width = 15
 
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"fruveco_informe_combinado_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    if on_progress:
+        await on_progress(len(modules), len(modules) + 1, "Generando fichero")
+    output = await save_workbook(wb)
+    return output.getvalue()
 
 
-async def _generate_combined_pdf(modules: List[str]):
+async def _generate_combined_pdf(modules: List[str], on_progress: ProgressCallback = None) -> bytes:
     from reportlab.lib import colors as rl_colors
     from reportlab.lib.pagesizes import A4, landscape
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -291,8 +314,10 @@ async def _generate_combined_pdf(modules: List[str]):
         "maquinaria": '#37474F',
     }
 
-    for mod_key in modules:
+    for mod_idx, mod_key in enumerate(modules):
         config = MODULES_CONFIG[mod_key]
+        if on_progress:
+            await on_progress(mod_idx, len(modules) + 1, config["label"])
         coll = db[config["collection"]]
         docs = await coll.find({}).sort(config["sort_field"], -1).to_list(5000)
         data = serialize_docs(docs)
@@ -333,11 +358,84 @@ async def _generate_combined_pdf(modules: List[str]):
         ]))
         elements.append(doc_table)
 
-    pdf.build(elements)
-    output.seek(0)
-    filename = f"fruveco_informe_combinado_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
+    if on_progress:
+        await on_progress(len(modules), len(modules) + 1, "Generando fichero")
+    await build_pdf(pdf, elements)
+    return output.getvalue()
+
+
+# ============================================================================
+# EXPORT JOBS - Exportaciones asíncronas con resultado persistido (GridFS)
+# ============================================================================
+
+EXPORT_JOB_KIND = "export_combined"
+
+
+async def _run_export_job(ctx: JobContext) -> JobFile:
+    """Handler del worker de jobs: renderiza el informe y lo devuelve como fichero."""
+    modules = [m for m in ctx.params.get("modules", []) if m in MODULES_CONFIG]
+    filename, media_type, content = await _render_combined(modules, ctx.params.get("format", "excel"), ctx.progress)
+    return JobFile(filename=filename, media_type=media_type, content=content)
+
+
+register_job_handler(EXPORT_JOB_KIND, _run_export_job)
+
+
+async def _get_owned_export_job(job_id: str, current_user: dict) -> dict:
+    job = await get_job(job_id)
+    if not job or job.get("kind") != EXPORT_JOB_KIND:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if current_user.get("role") != "Admin" and (job.get("user") or {}).get("id") != current_user.get("_id"):
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+
+@router.post("/exports/jobs", status_code=202)
+async def create_export_job(
+    request: CombinedExportRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue an export (one or several MODULES_CONFIG modules) to be rendered in background"""
+    valid_modules = _validate_modules(request.modules)
+    fmt = "excel" if request.format == "excel" else "pdf"
+    job = await submit_job(EXPORT_JOB_KIND, {"modules": valid_modules, "format": fmt}, current_user)
+    return serialize_job(job)
+
+
+@router.get("/exports/jobs")
+async def get_export_jobs(current_user: dict = Depends(get_current_user)):
+    """List the export jobs of the current user (most recent first)"""
+    jobs = await list_jobs(user_id=current_user.get("_id"), kind=EXPORT_JOB_KIND)
+    return {"jobs": [serialize_job(j) for j in jobs]}
+
+
+@router.get("/exports/jobs/{job_id}")
+async def get_export_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Status and progress of an export job"""
+    job = await _get_owned_export_job(job_id, current_user)
+    return serialize_job(job)
+
+
+@router.get("/exports/jobs/{job_id}/download")
+async def download_export_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Download the rendered file of a completed export job (can be repeated until it expires)"""
+    job = await _get_owned_export_job(job_id, current_user)
+    if job.get("status") != "completed" or not job.get("result_file_id"):
+        raise HTTPException(status_code=409, detail=f"Export job is {job.get('status')}")
+    result = job.get("result") or {}
     return StreamingResponse(
-        output,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        open_job_result(job),
+        media_type=result.get("media_type", "application/octet-stream"),
+        headers={"Content-Disposition": f"attachment; filename={result.get('filename', 'export')}"}
     )
+
+
+@router.delete("/exports/jobs/{job_id}")
+async def delete_export_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Cancel a pending/running export job, or delete a finished one and its file"""
+    job = await _get_owned_export_job(job_id, current_user)
+    if job.get("status") in ("pending", "running"):
+        await cancel_job(job)
+        return {"message": "Export job cancelled", "job_id": job_id}
+    await delete_job(job)
+    return {"message": "Export job deleted", "job_id": job_id}
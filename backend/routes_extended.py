@@ -20,6 +20,11 @@ from rbac_guards import (
     RequireRecetasAccess, RequireAlbaranesAccess,
     get_current_user, ensure_tipo_operacion
 )
+from services.render_service import build_pdf
+from services.albaranes_cube import record_albaran_insert, track_albaran_change
+from services.pagination import paginate
+from services.entity_loader import Loaders, iter_batches
+from services.excel_export import ExcelExport, HEADER, TOTAL
 
 router = APIRouter(prefix="/api", tags=["extended"])
 
@@ -235,49 +240,25 @@ def calcular_comision_agente(tipo_comision: str, valor_comision: float, kilos_ne
 @router.get("/recetas/export/excel")
 async def export_recetas_excel(current_user: dict = Depends(get_current_user)):
     """Exportar recetas a Excel"""
-    import io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    
-    recetas_raw = await recetas_collection.find().sort("nombre", 1).to_list(1000)
-    recetas = serialize_docs(recetas_raw)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Recetas Fitosanitarias"
-    
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    
-    headers = ["Nombre", "Cultivo", "Tipo Tratamiento", "Objetivo", "Productos", "Plazo Seguridad (dias)", "Instrucciones", "Activa"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-        cell.alignment = Alignment(horizontal="center")
+    xl = ExcelExport(header_color="2E7D32")
+    ws = xl.add_sheet(
+        "Recetas Fitosanitarias",
+        ["Nombre", "Cultivo", "Tipo Tratamiento", "Objetivo", "Productos", "Plazo Seguridad (dias)", "Instrucciones", "Activa"],
+        widths=[30, 20, 20, 25, 50, 18, 40, 8],
+    )
     
-    for row, receta in enumerate(recetas, 2):
+    def to_row(receta):
         productos_str = "; ".join([f"{p.get('nombre_comercial','')} ({p.get('dosis','')} {p.get('unidad','')})" for p in receta.get("productos", [])])
-        values = [
+        return [
             receta.get("nombre", ""), receta.get("cultivo_objetivo", ""),
             receta.get("tipo_tratamiento", ""), receta.get("objetivo_tratamiento", ""),
             productos_str, receta.get("plazo_seguridad", 0),
             receta.get("instrucciones", ""), "Si" if receta.get("activa") else "No"
         ]
-        for col, val in enumerate(values, 1):
-            ws.cell(row=row, column=col, value=val).border = thin_border
     
-    for col_letter, width in [('A', 30), ('B', 20), ('C', 20), ('D', 25), ('E', 50), ('F', 18), ('G', 40), ('H', 8)]:
-        ws.column_dimensions[col_letter].width = width
+    await ws.write(recetas_collection.find().sort("nombre", 1), to_row)
     
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"recetas_fitosanitarias_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return await xl.response(f"recetas_fitosanitarias_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/recetas/export/pdf")
@@ -327,7 +308,7 @@ async def export_recetas_pdf(current_user: dict = Depends(get_current_user)):
     ]))
     elements.append(doc_table)
     
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"recetas_fitosanitarias_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -437,6 +418,7 @@ async def create_albaran(
     # Insertar albarán
     result = await albaranes_collection.insert_one(albaran_dict)
     albaran_id = str(result.inserted_id)
+    await record_albaran_insert(albaran_dict)
     
     # Generar registro de comisión si el contrato tiene agente
     if contrato and kilos_netos > 0:
@@ -572,6 +554,8 @@ async def create_albaran(
 async def get_albaranes(
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     tipo: Optional[str] = None,
     contrato_id: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
@@ -583,8 +567,9 @@ async def get_albaranes(
     if contrato_id:
         query["contrato_id"] = contrato_id
     
-    albaranes = await albaranes_collection.find(query).sort("fecha", -1).skip(skip).limit(limit).to_list(limit)
-    return {"albaranes": serialize_docs(albaranes), "total": await albaranes_collection.count_documents(query)}
+    page = await paginate(albaranes_collection, query, [("fecha", -1), ("_id", -1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"albaranes": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/albaranes/{albaran_id}")
@@ -613,7 +598,8 @@ async def delete_albaran(
     if not ObjectId.is_valid(albaran_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
 
-    result = await albaranes_collection.delete_one({"_id": ObjectId(albaran_id)})
+    async with track_albaran_change(albaran_id):
+        result = await albaranes_collection.delete_one({"_id": ObjectId(albaran_id)})
 
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Albaran not found")
@@ -725,10 +711,11 @@ async def update_albaran(
     
     update_data["updated_at"] = datetime.now()
     
-    result = await albaranes_collection.update_one(
-        {"_id": ObjectId(albaran_id)},
-        {"$set": update_data}
-    )
+    async with track_albaran_change(albaran_id):
+        result = await albaranes_collection.update_one(
+            {"_id": ObjectId(albaran_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Albaran not found")
@@ -1460,7 +1447,7 @@ async def export_comisiones_pdf(
     ]))
     elements.append(total_table)
     
-    doc.build(elements)
+    await build_pdf(doc, elements)
     buffer.seek(0)
     
     return StreamingResponse(
@@ -1483,11 +1470,6 @@ async def export_comisiones_excel(
     """
     Genera un Excel con el listado de comisiones filtrado.
     """
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    from openpyxl.utils import get_column_letter
-    import io
-    
     # Construir query
     query = {}
     if agente_id:
@@ -1507,167 +1489,98 @@ async def export_comisiones_excel(
         if fecha_query:
             query["fecha_albaran"] = fecha_query
     
-    comisiones = await comisiones_collection.find(query).sort([("agente_nombre", 1), ("fecha_albaran", 1)]).to_list(1000)
-    
-    # Enriquecer registros antiguos
-    for c in comisiones:
-        if not c.get("numero_albaran") and c.get("albaran_id"):
-            c["numero_albaran"] = f"ALB-{c['albaran_id'][-6:].upper()}"
-        
-        # Obtener nombre del proveedor/cliente si no existe
-        if not c.get("proveedor_nombre") and c.get("proveedor"):
-            proveedor_val = c["proveedor"]
-            if ObjectId.is_valid(proveedor_val):
-                try:
-                    proveedor_doc = await proveedores_collection.find_one({"_id": ObjectId(proveedor_val)})
-                    c["proveedor_nombre"] = proveedor_doc.get("nombre", proveedor_val) if proveedor_doc else proveedor_val
-                except:
-                    c["proveedor_nombre"] = proveedor_val
-            else:
-                c["proveedor_nombre"] = proveedor_val
-        
-        if not c.get("cliente_nombre") and c.get("cliente"):
-            cliente_val = c["cliente"]
-            if ObjectId.is_valid(cliente_val):
-                try:
-                    cliente_doc = await clientes_collection.find_one({"_id": ObjectId(cliente_val)})
-                    c["cliente_nombre"] = cliente_doc.get("nombre", cliente_val) if cliente_doc else cliente_val
-                except:
-                    c["cliente_nombre"] = cliente_val
-            else:
-                c["cliente_nombre"] = cliente_val
-    
-    # Crear workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Comisiones"
-    
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="1976D2", end_color="1976D2", fill_type="solid")
-    total_fill = PatternFill(start_color="E3F2FD", end_color="E3F2FD", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Título
-    ws.merge_cells('A1:I1')
-    ws['A1'] = "LISTADO DE COMISIONES"
-    ws['A1'].font = Font(bold=True, size=14)
-    ws['A1'].alignment = Alignment(horizontal='center')
-    
     # Subtítulo con filtros
     filtros = []
     if fecha_desde:
         filtros.append(f"Desde: {fecha_desde}")
     if fecha_hasta:
         filtros.append(f"Hasta: {fecha_hasta}")
-    ws.merge_cells('A2:I2')
-    ws['A2'] = " | ".join(filtros) if filtros else "Todos los registros"
-    ws['A2'].alignment = Alignment(horizontal='center')
-    
-    # Headers
-    headers = ['Agente', 'Nº Albarán', 'Fecha', 'Proveedor/Cliente', 'Cultivo', 'Kg Netos', 'Comisión', 'Importe', 'Estado']
-    row = 4
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-    
-    # Datos
-    row = 5
+    
+    xl = ExcelExport(header_color="1976D2", total_color="E3F2FD")
+    ws = xl.add_sheet(
+        "Comisiones",
+        ['Agente', 'Nº Albarán', 'Fecha', 'Proveedor/Cliente', 'Cultivo', 'Kg Netos', 'Comisión', 'Importe', 'Estado'],
+        widths=[20, 12, 12, 25, 15, 12, 15, 12, 12],
+        number_formats={5: '#,##0', 7: '#,##0.00 €'},
+        preamble=["LISTADO DE COMISIONES", " | ".join(filtros) if filtros else "Todos los registros"],
+    )
+    
+    def subtotal_row(agente, totals):
+        return ["", "", "", "", f"Subtotal {agente}:", totals["kilos"], "", totals["importe"], ""]
+    
+    loaders = Loaders()
+    proveedores = loaders.get(proveedores_collection, projection={"nombre": 1})
+    clientes = loaders.get(clientes_collection, projection={"nombre": 1})
+    
     current_agente = None
-    agente_start_row = row
     agente_totals = {"kilos": 0, "importe": 0}
-    
-    for c in comisiones:
-        agente = c.get("agente_nombre", "Sin Agente")
-        
-        # Si cambia el agente, agregar subtotal del anterior
-        if current_agente and agente != current_agente:
-            ws.cell(row=row, column=1).value = ""
-            ws.cell(row=row, column=5).value = f"Subtotal {current_agente}:"
-            ws.cell(row=row, column=5).font = Font(bold=True)
-            ws.cell(row=row, column=6).value = agente_totals["kilos"]
-            ws.cell(row=row, column=6).number_format = '#,##0'
-            ws.cell(row=row, column=8).value = agente_totals["importe"]
-            ws.cell(row=row, column=8).number_format = '#,##0.00 €'
-            for col in range(1, 10):
-                ws.cell(row=row, column=col).fill = total_fill
-            row += 1
-            agente_totals = {"kilos": 0, "importe": 0}
-        
-        current_agente = agente
-        
-        ws.cell(row=row, column=1, value=agente)
-        ws.cell(row=row, column=2, value=c.get("numero_albaran", "-"))
-        ws.cell(row=row, column=3, value=c.get("fecha_albaran", "-"))
-        ws.cell(row=row, column=4, value=c.get("proveedor_nombre", "-"))
-        ws.cell(row=row, column=5, value=c.get("cultivo", "-"))
-        ws.cell(row=row, column=6, value=c.get("kilos_netos", 0))
-        ws.cell(row=row, column=6).number_format = '#,##0'
-        ws.cell(row=row, column=7, value=f"{c.get('comision_tipo', '')} {c.get('comision_valor', 0)}")
-        ws.cell(row=row, column=8, value=c.get("comision_importe", 0))
-        ws.cell(row=row, column=8).number_format = '#,##0.00 €'
-        ws.cell(row=row, column=9, value=c.get("estado", "-").capitalize())
+    gran_total_kilos = 0
+    gran_total_importe = 0
+    
+    cursor = comisiones_collection.find(query).sort([("agente_nombre", 1), ("fecha_albaran", 1)])
+    async for batch in iter_batches(cursor):
+        # Enriquecer registros antiguos (nombres de proveedor/cliente en una consulta por lote)
+        await proveedores.load_many(
+            c["proveedor"] for c in batch
+            if not c.get("proveedor_nombre") and c.get("proveedor") and ObjectId.is_valid(c["proveedor"])
+        )
+        await clientes.load_many(
+            c["cliente"] for c in batch
+            if not c.get("cliente_nombre") and c.get("cliente") and ObjectId.is_valid(c["cliente"])
+        )
         
-        for col in range(1, 10):
-            ws.cell(row=row, column=col).border = thin_border
+        rows = []
+        for c in batch:
+            if not c.get("numero_albaran") and c.get("albaran_id"):
+                c["numero_albaran"] = f"ALB-{c['albaran_id'][-6:].upper()}"
+            
+            if not c.get("proveedor_nombre") and c.get("proveedor"):
+                proveedor_doc = await proveedores.load(c["proveedor"])
+                c["proveedor_nombre"] = proveedor_doc.get("nombre", c["proveedor"]) if proveedor_doc else c["proveedor"]
+            
+            if not c.get("cliente_nombre") and c.get("cliente"):
+                cliente_doc = await clientes.load(c["cliente"])
+                c["cliente_nombre"] = cliente_doc.get("nombre", c["cliente"]) if cliente_doc else c["cliente"]
+            
+            agente = c.get("agente_nombre", "Sin Agente")
+            
+            # Si cambia el agente, agregar subtotal del anterior
+            if current_agente and agente != current_agente:
+                await ws.write(rows, list)
+                rows = []
+                ws.append(subtotal_row(current_agente, agente_totals), style=TOTAL)
+                agente_totals = {"kilos": 0, "importe": 0}
+            
+            current_agente = agente
+            
+            rows.append([
+                agente,
+                c.get("numero_albaran", "-"),
+                c.get("fecha_albaran", "-"),
+                c.get("proveedor_nombre", "-"),
+                c.get("cultivo", "-"),
+                c.get("kilos_netos", 0),
+                f"{c.get('comision_tipo', '')} {c.get('comision_valor', 0)}",
+                c.get("comision_importe", 0),
+                c.get("estado", "-").capitalize()
+            ])
+            
+            agente_totals["kilos"] += c.get("kilos_netos", 0)
+            agente_totals["importe"] += c.get("comision_importe", 0)
+            gran_total_kilos += c.get("kilos_netos", 0)
+            gran_total_importe += c.get("comision_importe", 0)
         
-        agente_totals["kilos"] += c.get("kilos_netos", 0)
-        agente_totals["importe"] += c.get("comision_importe", 0)
-        row += 1
+        await ws.write(rows, list)
     
     # Último subtotal de agente
     if current_agente:
-        ws.cell(row=row, column=5).value = f"Subtotal {current_agente}:"
-        ws.cell(row=row, column=5).font = Font(bold=True)
-        ws.cell(row=row, column=6).value = agente_totals["kilos"]
-        ws.cell(row=row, column=6).number_format = '#,##0'
-        ws.cell(row=row, column=8).value = agente_totals["importe"]
-        ws.cell(row=row, column=8).number_format = '#,##0.00 €'
-        for col in range(1, 10):
-            ws.cell(row=row, column=col).fill = total_fill
-        row += 2
+        ws.append(subtotal_row(current_agente, agente_totals), style=TOTAL)
+        ws.append([])
     
     # Gran total
-    gran_total_kilos = sum(c.get("kilos_netos", 0) for c in comisiones)
-    gran_total_importe = sum(c.get("comision_importe", 0) for c in comisiones)
-    
-    ws.cell(row=row, column=5).value = "TOTAL GENERAL:"
-    ws.cell(row=row, column=5).font = Font(bold=True, color="FFFFFF")
-    ws.cell(row=row, column=5).fill = header_fill
-    ws.cell(row=row, column=6).value = gran_total_kilos
-    ws.cell(row=row, column=6).number_format = '#,##0'
-    ws.cell(row=row, column=6).font = Font(bold=True, color="FFFFFF")
-    ws.cell(row=row, column=6).fill = header_fill
-    ws.cell(row=row, column=8).value = gran_total_importe
-    ws.cell(row=row, column=8).number_format = '#,##0.00 €'
-    ws.cell(row=row, column=8).font = Font(bold=True, color="FFFFFF")
-    ws.cell(row=row, column=8).fill = header_fill
-    
-    # Ajustar ancho de columnas
-    column_widths = [20, 12, 12, 25, 15, 12, 15, 12, 12]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(i)].width = width
-    
-    # Guardar en buffer
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"comisiones_{fecha_desde or 'all'}_{fecha_hasta or 'all'}.xlsx"
+    ws.append(["", "", "", "", "TOTAL GENERAL:", gran_total_kilos, "", gran_total_importe], style=HEADER)
     
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await xl.response(f"comisiones_{fecha_desde or 'all'}_{fecha_hasta or 'all'}.xlsx")
 
 
 # ============================================================================
@@ -1689,7 +1602,7 @@ async def generate_albaran_pdf(
     El total se calcula como: (kilos_brutos - kilos_destare) * precio
     """
     from fastapi.responses import Response
-    from weasyprint import HTML
+    from services.render_service import render_html_pdf
     from io import BytesIO
     
     if not ObjectId.is_valid(albaran_id):
@@ -2016,9 +1929,7 @@ async def generate_albaran_pdf(
     """
     
     # Generar PDF
-    pdf_buffer = BytesIO()
-    HTML(string=html_content).write_pdf(pdf_buffer)
-    pdf_buffer.seek(0)
+    pdf_buffer = BytesIO(await render_html_pdf(html_content))
     
     filename = f"albaran_{str(albaran['_id'])[-6:]}_{fecha.replace('-', '')}.pdf"
     
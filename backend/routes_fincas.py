@@ -11,6 +11,9 @@ from datetime import datetime
 
 from models import FincaCreate, FincaUpdate, DatosSIGPAC
 from database import db
+from services.kpi_snapshots import record_kpi_change, record_kpi_insert, touch_kpi_views
+from services.pagination import paginate
+from services.webhook_outbox import enqueue_webhook_event
 from rbac_guards import (
     RequireCreate, RequireDelete,
     RequireFincasAccess, get_current_user
@@ -92,6 +95,8 @@ async def create_finca(
             pass
     
     created = await fincas_collection.find_one({"_id": result.inserted_id})
+    await record_kpi_insert("fincas", created)
+    await enqueue_webhook_event("create", "fincas", serialize_doc(created.copy()))
     
     return {"success": True, "data": serialize_doc(created), "message": "Finca creada correctamente"}
 
@@ -100,6 +105,8 @@ async def create_finca(
 async def get_fincas(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     search: Optional[str] = None,
     provincia: Optional[str] = None,
     poblacion: Optional[str] = None,
@@ -135,8 +142,9 @@ async def get_fincas(
     if campana:
         query["campana"] = campana
     
-    total = await fincas_collection.count_documents(query)
-    fincas = await fincas_collection.find(query).sort([("denominacion", 1), ("nombre", 1)]).skip(skip).limit(limit).to_list(limit)
+    page = await paginate(fincas_collection, query, [("denominacion", 1), ("nombre", 1), ("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    fincas = page["items"]
     
     # Enrich with parcelas info
     for finca in fincas:
@@ -164,9 +172,10 @@ async def get_fincas(
     
     return {
         "fincas": [serialize_doc(f) for f in fincas],
-        "total": total,
+        "total": page["total"],
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
     }
 
 
@@ -351,6 +360,8 @@ async def update_finca(
     )
     
     updated = await fincas_collection.find_one({"_id": ObjectId(finca_id)})
+    await record_kpi_change("fincas", existing, updated)
+    await enqueue_webhook_event("update", "fincas", serialize_doc(updated.copy()))
     
     return {
         "success": True,
@@ -385,6 +396,8 @@ async def delete_finca(
             pass
     
     await fincas_collection.delete_one({"_id": ObjectId(finca_id)})
+    await record_kpi_change("fincas", existing, None)
+    await enqueue_webhook_event("delete", "fincas", serialize_doc(existing.copy()))
     
     return {"success": True, "message": "Finca eliminada"}
 
@@ -428,6 +441,7 @@ async def add_parcela_to_finca(
         {"_id": ObjectId(parcela_id)},
         {"$set": {"finca_id": finca_id}}
     )
+    await touch_kpi_views()
     
     return {
         "success": True,
@@ -464,6 +478,7 @@ async def remove_parcela_from_finca(
         {"_id": ObjectId(parcela_id)},
         {"$unset": {"finca_id": ""}}
     )
+    await touch_kpi_views()
     
     return {
         "success": True,
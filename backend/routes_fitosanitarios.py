@@ -31,6 +31,7 @@ from bs4 import BeautifulSoup
 
 from database import db
 from routes_auth import get_current_user
+from services.http_clients import http_request
 
 router = APIRouter(prefix="/api/fitosanitarios", tags=["fitosanitarios"])
 
@@ -642,91 +643,90 @@ async def sync_with_mapa(
         # MAPA doesn't have a public API, so we'll use their search page
         # This is a simplified example - in production you'd need to handle their specific form
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Search for products
-            search_url = f"{MAPA_BASE_URL}"
-            params = {
-                "nombre": search_term,
-                "formulado": "",
-                "sustancia": "",
-                "cultivo": "",
-                "plaga": ""
-            }
-            
-            response = await client.get(search_url, params=params)
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=502, detail="Error conectando con el servidor del MAPA")
-            
-            # Parse HTML response
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find product tables (structure depends on MAPA's current HTML)
-            productos_encontrados = []
-            
-            # Look for product rows in the results table
-            table = soup.find('table', {'class': 'listado'})
-            if table:
-                rows = table.find_all('tr')[1:]  # Skip header
-                for row in rows:
-                    cols = row.find_all('td')
-                    if len(cols) >= 4:
-                        producto = {
-                            "numero_registro": cols[0].get_text(strip=True),
-                            "nombre_comercial": cols[1].get_text(strip=True),
-                            "empresa": cols[2].get_text(strip=True) if len(cols) > 2 else "",
-                            "tipo": cols[3].get_text(strip=True) if len(cols) > 3 else "Fitosanitario"
-                        }
-                        productos_encontrados.append(producto)
-            
-            # If no table found, try alternative parsing
-            if not productos_encontrados:
-                # Return info that search was performed but no results in expected format
-                return {
-                    "success": True,
-                    "message": "Búsqueda realizada. El MAPA no proporciona una API pública, se recomienda usar la importación desde Excel con datos descargados manualmente.",
-                    "mapa_url": "https://www.mapa.gob.es/es/agricultura/temas/sanidad-vegetal/productos-fitosanitarios/registro-productos/",
-                    "productos_encontrados": 0,
-                    "nota": "Para obtener datos actualizados, visite el enlace del MAPA y exporte los datos a Excel."
-                }
-            
-            # Insert or update products found
-            inserted = 0
-            updated = 0
-            
-            for prod in productos_encontrados:
-                existing = await fitosanitarios_collection.find_one({
-                    "numero_registro": prod["numero_registro"]
-                })
-                
-                if existing:
-                    # Update existing
-                    await fitosanitarios_collection.update_one(
-                        {"_id": existing["_id"]},
-                        {"$set": {
-                            "nombre_comercial": prod["nombre_comercial"],
-                            "empresa": prod["empresa"],
-                            "updated_at": datetime.utcnow(),
-                            "source": "MAPA"
-                        }}
-                    )
-                    updated += 1
-                else:
-                    # Insert new
-                    prod["activo"] = True
-                    prod["created_at"] = datetime.utcnow()
-                    prod["source"] = "MAPA"
-                    await fitosanitarios_collection.insert_one(prod)
-                    inserted += 1
-            
+        # Search for products
+        search_url = f"{MAPA_BASE_URL}"
+        params = {
+            "nombre": search_term,
+            "formulado": "",
+            "sustancia": "",
+            "cultivo": "",
+            "plaga": ""
+        }
+        
+        response = await http_request("mapa", "GET", search_url, params=params, timeout=30.0)
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail="Error conectando con el servidor del MAPA")
+        
+        # Parse HTML response
+        soup = BeautifulSoup(response.text, 'html.parser')
+        
+        # Find product tables (structure depends on MAPA's current HTML)
+        productos_encontrados = []
+        
+        # Look for product rows in the results table
+        table = soup.find('table', {'class': 'listado'})
+        if table:
+            rows = table.find_all('tr')[1:]  # Skip header
+            for row in rows:
+                cols = row.find_all('td')
+                if len(cols) >= 4:
+                    producto = {
+                        "numero_registro": cols[0].get_text(strip=True),
+                        "nombre_comercial": cols[1].get_text(strip=True),
+                        "empresa": cols[2].get_text(strip=True) if len(cols) > 2 else "",
+                        "tipo": cols[3].get_text(strip=True) if len(cols) > 3 else "Fitosanitario"
+                    }
+                    productos_encontrados.append(producto)
+        
+        # If no table found, try alternative parsing
+        if not productos_encontrados:
+            # Return info that search was performed but no results in expected format
             return {
                 "success": True,
-                "message": "Sincronización completada",
-                "inserted": inserted,
-                "updated": updated,
-                "total_encontrados": len(productos_encontrados)
+                "message": "Búsqueda realizada. El MAPA no proporciona una API pública, se recomienda usar la importación desde Excel con datos descargados manualmente.",
+                "mapa_url": "https://www.mapa.gob.es/es/agricultura/temas/sanidad-vegetal/productos-fitosanitarios/registro-productos/",
+                "productos_encontrados": 0,
+                "nota": "Para obtener datos actualizados, visite el enlace del MAPA y exporte los datos a Excel."
             }
+        
+        # Insert or update products found
+        inserted = 0
+        updated = 0
+        
+        for prod in productos_encontrados:
+            existing = await fitosanitarios_collection.find_one({
+                "numero_registro": prod["numero_registro"]
+            })
             
+            if existing:
+                # Update existing
+                await fitosanitarios_collection.update_one(
+                    {"_id": existing["_id"]},
+                    {"$set": {
+                        "nombre_comercial": prod["nombre_comercial"],
+                        "empresa": prod["empresa"],
+                        "updated_at": datetime.utcnow(),
+                        "source": "MAPA"
+                    }}
+                )
+                updated += 1
+            else:
+                # Insert new
+                prod["activo"] = True
+                prod["created_at"] = datetime.utcnow()
+                prod["source"] = "MAPA"
+                await fitosanitarios_collection.insert_one(prod)
+                inserted += 1
+        
+        return {
+            "success": True,
+            "message": "Sincronización completada",
+            "inserted": inserted,
+            "updated": updated,
+            "total_encontrados": len(productos_encontrados)
+        }
+        
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout conectando con el servidor del MAPA")
     except Exception as e:
@@ -1229,35 +1229,35 @@ async def verify_producto_mapa(
         
         # Try to do a basic verification via web request
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(
-                    MAPA_CONSULTA_URL,
-                    params={"nombre": nombre_comercial},
-                    follow_redirects=True
-                )
+            response = await http_request(
+                "mapa", "GET", MAPA_CONSULTA_URL,
+                params={"nombre": nombre_comercial},
+                follow_redirects=True,
+                timeout=15.0,
+            )
+            
+            if response.status_code == 200:
+                html_content = response.text.lower()
                 
-                if response.status_code == 200:
-                    html_content = response.text.lower()
+                # Check if product name appears in results
+                if nombre_comercial.lower() in html_content:
+                    verification_result["verificacion_automatica"] = "ENCONTRADO"
+                    verification_result["mensaje"] = "El producto parece estar en el registro. Verifique manualmente para confirmar estado."
                     
-                    # Check if product name appears in results
-                    if nombre_comercial.lower() in html_content:
-                        verification_result["verificacion_automatica"] = "ENCONTRADO"
-                        verification_result["mensaje"] = "El producto parece estar en el registro. Verifique manualmente para confirmar estado."
-                        
-                        # Check for common status indicators
-                        if 'autorizado' in html_content:
-                            verification_result["estado_probable"] = "Autorizado"
-                        elif 'cancelado' in html_content or 'revocado' in html_content:
-                            verification_result["estado_probable"] = "Posiblemente cancelado"
-                        elif 'caducado' in html_content:
-                            verification_result["estado_probable"] = "Posiblemente caducado"
-                    else:
-                        verification_result["verificacion_automatica"] = "NO_ENCONTRADO"
-                        verification_result["mensaje"] = "El producto no se encontró con ese nombre exacto. Puede haber cambiado de nombre o estar dado de baja."
+                    # Check for common status indicators
+                    if 'autorizado' in html_content:
+                        verification_result["estado_probable"] = "Autorizado"
+                    elif 'cancelado' in html_content or 'revocado' in html_content:
+                        verification_result["estado_probable"] = "Posiblemente cancelado"
+                    elif 'caducado' in html_content:
+                        verification_result["estado_probable"] = "Posiblemente caducado"
                 else:
-                    verification_result["verificacion_automatica"] = "ERROR_CONEXION"
-                    verification_result["mensaje"] = "No se pudo conectar con el servidor del MAPA. Use el enlace para verificar manualmente."
-                    
+                    verification_result["verificacion_automatica"] = "NO_ENCONTRADO"
+                    verification_result["mensaje"] = "El producto no se encontró con ese nombre exacto. Puede haber cambiado de nombre o estar dado de baja."
+            else:
+                verification_result["verificacion_automatica"] = "ERROR_CONEXION"
+                verification_result["mensaje"] = "No se pudo conectar con el servidor del MAPA. Use el enlace para verificar manualmente."
+                
         except httpx.TimeoutException:
             verification_result["verificacion_automatica"] = "TIMEOUT"
             verification_result["mensaje"] = "Tiempo de espera agotado. Use el enlace para verificar manualmente."
@@ -1311,45 +1311,45 @@ async def bulk_verify_mapa(
         "detalles": []
     }
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        for producto in productos:
-            nombre = producto.get("nombre_comercial", "")
-            if not nombre:
-                continue
-                
-            try:
-                response = await client.get(
-                    MAPA_CONSULTA_URL,
-                    params={"nombre": nombre},
-                    follow_redirects=True
-                )
-                
-                if response.status_code == 200 and nombre.lower() in response.text.lower():
-                    status = "ENCONTRADO"
-                    results["encontrados"] += 1
-                else:
-                    status = "NO_ENCONTRADO"
-                    results["no_encontrados"] += 1
-                    
-            except Exception:
-                status = "ERROR"
-                results["errores"] += 1
-            
-            results["detalles"].append({
-                "id": str(producto["_id"]),
-                "nombre": nombre,
-                "status": status
-            })
-            results["total_verificados"] += 1
+    for producto in productos:
+        nombre = producto.get("nombre_comercial", "")
+        if not nombre:
+            continue
             
-            # Update product
-            await fitosanitarios_collection.update_one(
-                {"_id": producto["_id"]},
-                {"$set": {
-                    "last_mapa_verification": datetime.utcnow(),
-                    "mapa_status": status
-                }}
+        try:
+            response = await http_request(
+                "mapa", "GET", MAPA_CONSULTA_URL,
+                params={"nombre": nombre},
+                follow_redirects=True,
+                timeout=10.0,
             )
+            
+            if response.status_code == 200 and nombre.lower() in response.text.lower():
+                status = "ENCONTRADO"
+                results["encontrados"] += 1
+            else:
+                status = "NO_ENCONTRADO"
+                results["no_encontrados"] += 1
+                
+        except Exception:
+            status = "ERROR"
+            results["errores"] += 1
+        
+        results["detalles"].append({
+            "id": str(producto["_id"]),
+            "nombre": nombre,
+            "status": status
+        })
+        results["total_verificados"] += 1
+        
+        # Update product
+        await fitosanitarios_collection.update_one(
+            {"_id": producto["_id"]},
+            {"$set": {
+                "last_mapa_verification": datetime.utcnow(),
+                "mapa_status": status
+            }}
+        )
     
     return {
         "success": True,
@@ -8,6 +8,11 @@ from database import (
 )
 from rbac_guards import RequireAlbaranesAccess, get_current_user
 from utils.formatters import format_number_es
+from services.excel_export import ExcelExport, PLAIN, TITLE
+from services.gastos_resumen import (
+    build_gastos_match, aggregate_gastos, format_resumen, format_proveedor,
+    format_contrato, format_cultivo, format_parcela
+)
 
 router = APIRouter(prefix="/api/gastos", tags=["gastos"])
 
@@ -37,101 +42,15 @@ async def get_resumen_gastos(
     """
     Obtiene un resumen general de gastos con totales por proveedor, contrato, cultivo y parcela.
     """
-    # Build match query
-    match_query = {}
-    
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    if contrato_id:
-        match_query["contrato_id"] = contrato_id
-    if cultivo:
-        match_query["cultivo"] = cultivo
-    if proveedor:
-        match_query["proveedor"] = proveedor
-    if parcela_codigo:
-        match_query["parcela_codigo"] = parcela_codigo
-    
-    # Get all albaranes matching criteria
-    albaranes = await albaranes_collection.find(match_query).to_list(1000)
-    
-    # Aggregate by different dimensions
-    por_proveedor = {}
-    por_contrato = {}
-    por_cultivo = {}
-    por_parcela = {}
-    total_general = 0
-    total_albaranes = len(albaranes)
-    
-    for albaran in albaranes:
-        total = albaran.get("total_albaran", 0) or 0
-        total_general += total
-        
-        # Por proveedor
-        proveedor = albaran.get("proveedor") or "Sin proveedor"
-        if proveedor not in por_proveedor:
-            por_proveedor[proveedor] = {"total": 0, "count": 0, "albaranes": []}
-        por_proveedor[proveedor]["total"] += total
-        por_proveedor[proveedor]["count"] += 1
-        
-        # Por contrato
-        contrato_id = albaran.get("contrato_id")
-        if contrato_id:
-            if contrato_id not in por_contrato:
-                por_contrato[contrato_id] = {"total": 0, "count": 0, "proveedor": proveedor}
-            por_contrato[contrato_id]["total"] += total
-            por_contrato[contrato_id]["count"] += 1
-        
-        # Por cultivo
-        cultivo = albaran.get("cultivo") or "Sin cultivo"
-        if cultivo not in por_cultivo:
-            por_cultivo[cultivo] = {"total": 0, "count": 0}
-        por_cultivo[cultivo]["total"] += total
-        por_cultivo[cultivo]["count"] += 1
-        
-        # Por parcela
-        parcela = albaran.get("parcela_codigo") or "Sin parcela"
-        if parcela not in por_parcela:
-            por_parcela[parcela] = {"total": 0, "count": 0, "cultivo": cultivo}
-        por_parcela[parcela]["total"] += total
-        por_parcela[parcela]["count"] += 1
-    
-    # Enrich contract data with contract info
-    contratos_enriched = []
-    for contrato_id, data in por_contrato.items():
-        try:
-            contrato = await contratos_collection.find_one({"_id": ObjectId(contrato_id)})
-            contratos_enriched.append({
-                "contrato_id": contrato_id,
-                "numero_contrato": contrato.get("numero_contrato") if contrato else None,
-                "proveedor": data["proveedor"],
-                "cultivo": contrato.get("cultivo") if contrato else None,
-                "campana": contrato.get("campana") if contrato else None,
-                "total": data["total"],
-                "count": data["count"]
-            })
-        except Exception:
-            contratos_enriched.append({
-                "contrato_id": contrato_id,
-                "total": data["total"],
-                "count": data["count"],
-                "proveedor": data["proveedor"]
-            })
-    
-    return {
-        "total_general": total_general,
-        "total_albaranes": total_albaranes,
-        "por_proveedor": [{"proveedor": k, **v} for k, v in sorted(por_proveedor.items(), key=lambda x: -x[1]["total"])],
-        "por_contrato": sorted(contratos_enriched, key=lambda x: -x["total"]),
-        "por_cultivo": [{"cultivo": k, **v} for k, v in sorted(por_cultivo.items(), key=lambda x: -x[1]["total"])],
-        "por_parcela": [{"parcela": k, **v} for k, v in sorted(por_parcela.items(), key=lambda x: -x[1]["total"])]
-    }
+    match_query = build_gastos_match(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, campana=campana,
+        contrato_id=contrato_id, cultivo=cultivo, proveedor=proveedor,
+        parcela_codigo=parcela_codigo
+    )
+    facets = await aggregate_gastos(
+        match_query, ["totales", "por_proveedor", "por_contrato", "por_cultivo", "por_parcela"]
+    )
+    return format_resumen(facets)
 
 
 @router.get("/por-proveedor")
@@ -147,49 +66,11 @@ async def get_gastos_por_proveedor(
     Obtiene detalle de gastos agrupados por proveedor.
     Si se especifica proveedor, devuelve el detalle de ese proveedor.
     """
-    match_query = {}
-    if proveedor:
-        match_query["proveedor"] = proveedor
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$proveedor",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "cultivos": {"$addToSet": "$cultivo"},
-            "contratos": {"$addToSet": "$contrato_id"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
-    
-    return {
-        "gastos_por_proveedor": [
-            {
-                "proveedor": r["_id"] or "Sin proveedor",
-                "total": r["total"],
-                "count": r["count"],
-                "cultivos": [c for c in r["cultivos"] if c],
-                "num_contratos": len([c for c in r["contratos"] if c]),
-                "primer_albaran": r["primer_albaran"],
-                "ultimo_albaran": r["ultimo_albaran"]
-            }
-            for r in results
-        ]
-    }
+    match_query = build_gastos_match(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, campana=campana, proveedor=proveedor
+    )
+    facets = await aggregate_gastos(match_query, ["por_proveedor"])
+    return {"gastos_por_proveedor": [format_proveedor(r) for r in facets["por_proveedor"]]}
 
 
 @router.get("/por-contrato")
@@ -204,65 +85,11 @@ async def get_gastos_por_contrato(
     Obtiene detalle de gastos agrupados por contrato.
     Si se especifica contrato_id, devuelve el detalle de ese contrato.
     """
-    match_query = {}
-    if contrato_id:
-        match_query["contrato_id"] = contrato_id
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$contrato_id",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "proveedor": {"$first": "$proveedor"},
-            "cultivo": {"$first": "$cultivo"},
-            "campana": {"$first": "$campana"},
-            "parcela": {"$first": "$parcela_codigo"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
-    
-    # Enrich with contract details
-    enriched_results = []
-    for r in results:
-        contrato_info = {}
-        if r["_id"]:
-            try:
-                contrato = await contratos_collection.find_one({"_id": ObjectId(r["_id"])})
-                if contrato:
-                    contrato_info = {
-                        "numero_contrato": contrato.get("numero_contrato"),
-                        "precio": contrato.get("precio"),
-                        "superficie": contrato.get("superficie")
-                    }
-            except Exception:
-                pass
-        
-        enriched_results.append({
-            "contrato_id": r["_id"],
-            **contrato_info,
-            "proveedor": r["proveedor"],
-            "cultivo": r["cultivo"],
-            "campana": r["campana"],
-            "parcela": r["parcela"],
-            "total": r["total"],
-            "count": r["count"],
-            "primer_albaran": r["primer_albaran"],
-            "ultimo_albaran": r["ultimo_albaran"]
-        })
-    
-    return {"gastos_por_contrato": enriched_results}
+    match_query = build_gastos_match(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, contrato_id=contrato_id
+    )
+    facets = await aggregate_gastos(match_query, ["por_contrato"])
+    return {"gastos_por_contrato": [format_contrato(r) for r in facets["por_contrato"]]}
 
 
 @router.get("/por-cultivo")
@@ -277,49 +104,11 @@ async def get_gastos_por_cultivo(
     """
     Obtiene detalle de gastos agrupados por cultivo.
     """
-    match_query = {}
-    if cultivo:
-        match_query["cultivo"] = cultivo
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$cultivo",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "proveedores": {"$addToSet": "$proveedor"},
-            "parcelas": {"$addToSet": "$parcela_codigo"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
-    
-    return {
-        "gastos_por_cultivo": [
-            {
-                "cultivo": r["_id"] or "Sin cultivo",
-                "total": r["total"],
-                "count": r["count"],
-                "num_proveedores": len([p for p in r["proveedores"] if p]),
-                "num_parcelas": len([p for p in r["parcelas"] if p]),
-                "primer_albaran": r["primer_albaran"],
-                "ultimo_albaran": r["ultimo_albaran"]
-            }
-            for r in results
-        ]
-    }
+    match_query = build_gastos_match(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, campana=campana, cultivo=cultivo
+    )
+    facets = await aggregate_gastos(match_query, ["por_cultivo"])
+    return {"gastos_por_cultivo": [format_cultivo(r) for r in facets["por_cultivo"]]}
 
 
 @router.get("/por-parcela")
@@ -334,73 +123,12 @@ async def get_gastos_por_parcela(
     """
     Obtiene detalle de gastos agrupados por parcela.
     """
-    match_query = {}
-    if parcela_codigo:
-        match_query["parcela_codigo"] = parcela_codigo
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    
-    # Get parcelas info for enrichment
-    parcelas_collection = db['parcelas']
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$parcela_codigo",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "cultivo": {"$first": "$cultivo"},
-            "proveedor": {"$first": "$proveedor"},
-            "campana": {"$first": "$campana"},
-            "parcela_id": {"$first": "$parcela_id"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
-    
-    # Enrich with parcela details (superficie)
-    enriched_results = []
-    for r in results:
-        parcela_info = {}
-        if r.get("parcela_id"):
-            try:
-                parcela = await parcelas_collection.find_one({"_id": ObjectId(r["parcela_id"])})
-                if parcela:
-                    parcela_info = {
-                        "superficie": parcela.get("superficie"),
-                        "finca": parcela.get("finca")
-                    }
-            except Exception:
-                pass
-        
-        coste_por_ha = None
-        if parcela_info.get("superficie") and parcela_info["superficie"] > 0:
-            coste_por_ha = round(r["total"] / parcela_info["superficie"], 2)
-        
-        enriched_results.append({
-            "parcela_codigo": r["_id"] or "Sin parcela",
-            "cultivo": r["cultivo"],
-            "proveedor": r["proveedor"],
-            "campana": r["campana"],
-            **parcela_info,
-            "total": r["total"],
-            "count": r["count"],
-            "coste_por_ha": coste_por_ha,
-            "primer_albaran": r["primer_albaran"],
-            "ultimo_albaran": r["ultimo_albaran"]
-        })
-    
-    return {"gastos_por_parcela": enriched_results}
+    match_query = build_gastos_match(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, campana=campana,
+        parcela_codigo=parcela_codigo
+    )
+    facets = await aggregate_gastos(match_query, ["por_parcela"])
+    return {"gastos_por_parcela": [format_parcela(r) for r in facets["por_parcela"]]}
 
 
 @router.get("/detalle-albaranes")
@@ -554,13 +282,8 @@ async def export_gastos_excel(
     """
     Exporta el informe de gastos a Excel.
     """
-    from fastapi.responses import StreamingResponse
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    import io
+    from openpyxl.styles import Font
     
-    # Get resumen data
     match_query = {}
     if fecha_desde:
         match_query["fecha"] = {"$gte": fecha_desde}
@@ -572,15 +295,29 @@ async def export_gastos_excel(
     if campana:
         match_query["campana"] = campana
     
-    albaranes = await albaranes_collection.find(match_query).to_list(1000)
+    currency_format = '#,##0.00 €'
+    percent_format = '0.0%'
+    
+    xl = ExcelExport(header_color="166534")
+    # Las hojas se crean en el orden final; el detalle se escribe primero
+    # (en streaming) y los resúmenes después, con los acumulados.
+    ws = xl.add_sheet("Resumen", [], widths=[20, 30, 20, 20])
+    ws_prov = xl.add_sheet("Por Proveedor", ["Proveedor", "Albaranes", "Total", "%"],
+                           widths=20, number_formats={2: currency_format, 3: percent_format})
+    ws_cult = xl.add_sheet("Por Cultivo", ["Cultivo", "Albaranes", "Total", "%"],
+                           widths=20, number_formats={2: currency_format, 3: percent_format})
+    ws_parc = xl.add_sheet("Por Parcela", ["Parcela", "Cultivo", "Albaranes", "Total"],
+                           widths=20, number_formats={3: currency_format})
+    ws_det = xl.add_sheet("Detalle Albaranes", ["Fecha", "Tipo", "Proveedor", "Cultivo", "Parcela", "Total"],
+                          widths=18, number_formats={5: currency_format})
     
-    # Aggregate data
     por_proveedor = {}
     por_cultivo = {}
     por_parcela = {}
     total_general = 0
     
-    for albaran in albaranes:
+    def acumular(albaran):
+        nonlocal total_general
         total = albaran.get("total_albaran", 0) or 0
         total_general += total
         
@@ -601,147 +338,47 @@ async def export_gastos_excel(
             por_parcela[parcela] = {"total": 0, "count": 0, "cultivo": cultivo}
         por_parcela[parcela]["total"] += total
         por_parcela[parcela]["count"] += 1
+        
+        return [
+            albaran.get("fecha", ""),
+            albaran.get("tipo", ""),
+            albaran.get("proveedor", ""),
+            albaran.get("cultivo", ""),
+            albaran.get("parcela_codigo", ""),
+            albaran.get("total_albaran", 0)
+        ]
     
-    # Create workbook
-    wb = Workbook()
-    
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="166534", end_color="166534", fill_type="solid")
-    currency_format = '#,##0.00 €'
-    percent_format = '0.0%'
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+    num_albaranes = await ws_det.write(
+        albaranes_collection.find(match_query).sort("fecha", -1),
+        acumular,
     )
     
-    # Sheet 1: Resumen
-    ws = wb.active
-    ws.title = "Resumen"
-    
-    ws['A1'] = "INFORME DE GASTOS - FRUVECO"
-    ws['A1'].font = Font(bold=True, size=16)
-    ws.merge_cells('A1:D1')
-    
-    ws['A3'] = "Período:"
-    ws['B3'] = f"{fecha_desde or 'Inicio'} - {fecha_hasta or 'Fin'}"
-    ws['A4'] = "Campaña:"
-    ws['B4'] = campana or "Todas"
-    ws['A5'] = "Total Gastos:"
-    ws['B5'] = total_general
-    ws['B5'].number_format = currency_format
-    ws['B5'].font = Font(bold=True, size=14, color="166534")
-    ws['A6'] = "Total Albaranes:"
-    ws['B6'] = len(albaranes)
-    
-    # Sheet 2: Por Proveedor
-    ws_prov = wb.create_sheet("Por Proveedor")
-    headers = ["Proveedor", "Albaranes", "Total", "%"]
-    for col, header in enumerate(headers, 1):
-        cell = ws_prov.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    row = 2
-    for prov, data in sorted(por_proveedor.items(), key=lambda x: -x[1]["total"]):
-        ws_prov.cell(row=row, column=1, value=prov).border = thin_border
-        ws_prov.cell(row=row, column=2, value=data["count"]).border = thin_border
-        cell_total = ws_prov.cell(row=row, column=3, value=data["total"])
-        cell_total.number_format = currency_format
-        cell_total.border = thin_border
-        cell_pct = ws_prov.cell(row=row, column=4, value=data["total"]/total_general if total_general > 0 else 0)
-        cell_pct.number_format = percent_format
-        cell_pct.border = thin_border
-        row += 1
-    
-    for col in range(1, 5):
-        ws_prov.column_dimensions[get_column_letter(col)].width = 20
-    
-    # Sheet 3: Por Cultivo
-    ws_cult = wb.create_sheet("Por Cultivo")
-    headers = ["Cultivo", "Albaranes", "Total", "%"]
-    for col, header in enumerate(headers, 1):
-        cell = ws_cult.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    row = 2
-    for cult, data in sorted(por_cultivo.items(), key=lambda x: -x[1]["total"]):
-        ws_cult.cell(row=row, column=1, value=cult).border = thin_border
-        ws_cult.cell(row=row, column=2, value=data["count"]).border = thin_border
-        cell_total = ws_cult.cell(row=row, column=3, value=data["total"])
-        cell_total.number_format = currency_format
-        cell_total.border = thin_border
-        cell_pct = ws_cult.cell(row=row, column=4, value=data["total"]/total_general if total_general > 0 else 0)
-        cell_pct.number_format = percent_format
-        cell_pct.border = thin_border
-        row += 1
-    
-    for col in range(1, 5):
-        ws_cult.column_dimensions[get_column_letter(col)].width = 20
-    
-    # Sheet 4: Por Parcela
-    ws_parc = wb.create_sheet("Por Parcela")
-    headers = ["Parcela", "Cultivo", "Albaranes", "Total"]
-    for col, header in enumerate(headers, 1):
-        cell = ws_parc.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    row = 2
-    for parc, data in sorted(por_parcela.items(), key=lambda x: -x[1]["total"]):
-        ws_parc.cell(row=row, column=1, value=parc).border = thin_border
-        ws_parc.cell(row=row, column=2, value=data["cultivo"]).border = thin_border
-        ws_parc.cell(row=row, column=3, value=data["count"]).border = thin_border
-        cell_total = ws_parc.cell(row=row, column=4, value=data["total"])
-        cell_total.number_format = currency_format
-        cell_total.border = thin_border
-        row += 1
-    
-    for col in range(1, 5):
-        ws_parc.column_dimensions[get_column_letter(col)].width = 20
-    
-    # Sheet 5: Detalle Albaranes
-    ws_det = wb.create_sheet("Detalle Albaranes")
-    headers = ["Fecha", "Tipo", "Proveedor", "Cultivo", "Parcela", "Total"]
-    for col, header in enumerate(headers, 1):
-        cell = ws_det.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = thin_border
-    
-    row = 2
-    for alb in sorted(albaranes, key=lambda x: x.get("fecha", ""), reverse=True):
-        ws_det.cell(row=row, column=1, value=alb.get("fecha", "")).border = thin_border
-        ws_det.cell(row=row, column=2, value=alb.get("tipo", "")).border = thin_border
-        ws_det.cell(row=row, column=3, value=alb.get("proveedor", "")).border = thin_border
-        ws_det.cell(row=row, column=4, value=alb.get("cultivo", "")).border = thin_border
-        ws_det.cell(row=row, column=5, value=alb.get("parcela_codigo", "")).border = thin_border
-        cell_total = ws_det.cell(row=row, column=6, value=alb.get("total_albaran", 0))
-        cell_total.number_format = currency_format
-        cell_total.border = thin_border
-        row += 1
-    
-    for col in range(1, 7):
-        ws_det.column_dimensions[get_column_letter(col)].width = 18
-    
-    # Save to buffer
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"informe_gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    total_style = xl.style_for(xl.add_style("gastos_total", PLAIN, font=Font(bold=True, size=14, color="166534")), currency_format)
+    ws.append(["INFORME DE GASTOS - FRUVECO"], style=TITLE)
+    ws.merge_last_row(1, 4)
+    ws.append([])
+    ws.append(["Período:", f"{fecha_desde or 'Inicio'} - {fecha_hasta or 'Fin'}"], style=PLAIN)
+    ws.append(["Campaña:", campana or "Todas"], style=PLAIN)
+    ws.append(["Total Gastos:", round(total_general, 2)], style=PLAIN, cell_styles={1: total_style})
+    ws.append(["Total Albaranes:", num_albaranes], style=PLAIN)
+    
+    def pct(data):
+        return data["total"] / total_general if total_general > 0 else 0
+    
+    await ws_prov.write(
+        sorted(por_proveedor.items(), key=lambda x: -x[1]["total"]),
+        lambda item: [item[0], item[1]["count"], item[1]["total"], pct(item[1])],
+    )
+    await ws_cult.write(
+        sorted(por_cultivo.items(), key=lambda x: -x[1]["total"]),
+        lambda item: [item[0], item[1]["count"], item[1]["total"], pct(item[1])],
     )
+    await ws_parc.write(
+        sorted(por_parcela.items(), key=lambda x: -x[1]["total"]),
+        lambda item: [item[0], item[1]["cultivo"], item[1]["count"], item[1]["total"]],
+    )
+    
+    return await xl.response(f"informe_gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
 
 
 @router.get("/export/pdf")
@@ -756,7 +393,7 @@ async def export_gastos_pdf(
     Exporta el informe de gastos a PDF.
     """
     from fastapi.responses import StreamingResponse
-    from weasyprint import HTML
+    from services.render_service import render_html_pdf
     import io
     
     # Get data
@@ -951,9 +588,7 @@ async def export_gastos_pdf(
     """
     
     # Generate PDF
-    pdf_buffer = io.BytesIO()
-    HTML(string=html_content).write_pdf(pdf_buffer)
-    pdf_buffer.seek(0)
+    pdf_buffer = io.BytesIO(await render_html_pdf(html_content))
     
     filename = f"informe_gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     
@@ -13,6 +13,7 @@ import sys
 sys.path.append('/app/backend')
 from routes_auth import get_current_user
 from database import parcelas_collection
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
 
 router = APIRouter(prefix="/api", tags=["Geo Import"])
 
@@ -311,6 +312,7 @@ async def create_parcelas_from_import(
             }
             
             result = await parcelas_collection.insert_one(parcela_doc)
+            await record_kpi_insert("parcelas", parcela_doc)
             
             created_parcelas.append({
                 "_id": str(result.inserted_id),
@@ -369,10 +371,11 @@ async def import_polygon_to_existing_parcela(
         }]
     }
     
-    await parcelas_collection.update_one(
-        {"_id": ObjectId(parcela_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("parcelas", parcela_id):
+        await parcelas_collection.update_one(
+            {"_id": ObjectId(parcela_id)},
+            {"$set": update_data}
+        )
     
     return {
         "success": True,
@@ -10,6 +10,8 @@ from database import (
     serialize_doc, serialize_docs, db
 )
 from rbac_guards import RequireAlbaranesAccess, get_current_user
+from services.excel_export import TOTAL, ExcelExport
+from services.albaranes_cube import aggregate_cube, cube_match
 
 router = APIRouter(prefix="/api/ingresos", tags=["ingresos"])
 
@@ -24,6 +26,19 @@ def parse_date(date_str: str) -> datetime:
 # INFORMES DE INGRESOS (Albaranes de Venta)
 # ============================================================================
 
+TIPO_VENTA = "Albarán de venta"
+SIN_CLIENTE = "Sin cliente"
+
+
+def _ingresos_match(fecha_desde=None, fecha_hasta=None, **dims) -> dict:
+    """Filtro sobre el cubo de albaranes - Solo albaranes de venta"""
+    return cube_match(fecha_desde, fecha_hasta, tipo=TIPO_VENTA, **dims)
+
+
+async def _aggregate_ingresos(match_query: dict, facets: List[str]) -> dict:
+    return await aggregate_cube(match_query, facets, tercero="cliente", sin_tercero=SIN_CLIENTE)
+
+
 @router.get("/resumen")
 async def get_resumen_ingresos(
     fecha_desde: Optional[str] = None,
@@ -39,100 +54,43 @@ async def get_resumen_ingresos(
     """
     Obtiene un resumen general de ingresos (albaranes de venta) con totales por cliente, contrato, cultivo y parcela.
     """
-    # Build match query - Solo albaranes de venta
-    match_query = {"tipo": "Albarán de venta"}
-    
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    if contrato_id:
-        match_query["contrato_id"] = contrato_id
-    if cultivo:
-        match_query["cultivo"] = cultivo
-    if cliente:
-        match_query["cliente"] = cliente
-    if parcela_codigo:
-        match_query["parcela_codigo"] = parcela_codigo
-    
-    # Get all albaranes de venta matching criteria
-    albaranes = await albaranes_collection.find(match_query).to_list(1000)
-    
-    # Aggregate by different dimensions
-    por_cliente = {}
-    por_contrato = {}
-    por_cultivo = {}
-    por_parcela = {}
-    total_general = 0
-    total_albaranes = len(albaranes)
-    
-    for albaran in albaranes:
-        total = albaran.get("total_albaran", 0) or 0
-        total_general += total
-        
-        # Por cliente
-        cliente_nombre = albaran.get("cliente") or "Sin cliente"
-        if cliente_nombre not in por_cliente:
-            por_cliente[cliente_nombre] = {"total": 0, "count": 0, "albaranes": []}
-        por_cliente[cliente_nombre]["total"] += total
-        por_cliente[cliente_nombre]["count"] += 1
-        
-        # Por contrato
-        contrato_id = albaran.get("contrato_id")
-        if contrato_id:
-            if contrato_id not in por_contrato:
-                por_contrato[contrato_id] = {"total": 0, "count": 0, "cliente": cliente_nombre}
-            por_contrato[contrato_id]["total"] += total
-            por_contrato[contrato_id]["count"] += 1
-        
-        # Por cultivo
-        cultivo = albaran.get("cultivo") or "Sin cultivo"
-        if cultivo not in por_cultivo:
-            por_cultivo[cultivo] = {"total": 0, "count": 0}
-        por_cultivo[cultivo]["total"] += total
-        por_cultivo[cultivo]["count"] += 1
-        
-        # Por parcela
-        parcela = albaran.get("parcela_codigo") or "Sin parcela"
-        if parcela not in por_parcela:
-            por_parcela[parcela] = {"total": 0, "count": 0, "cultivo": cultivo}
-        por_parcela[parcela]["total"] += total
-        por_parcela[parcela]["count"] += 1
+    match_query = _ingresos_match(
+        fecha_desde, fecha_hasta, campana=campana, contrato_id=contrato_id,
+        cultivo=cultivo, cliente=cliente, parcela_codigo=parcela_codigo
+    )
+    facets = await _aggregate_ingresos(
+        match_query, ["totales", "por_tercero", "por_contrato", "por_cultivo", "por_parcela"]
+    )
+    totales = (facets["totales"] or [{}])[0]
     
-    # Enrich contract data with contract info
     contratos_enriched = []
-    for contrato_id, data in por_contrato.items():
-        try:
-            contrato = await contratos_collection.find_one({"_id": ObjectId(contrato_id)})
-            contratos_enriched.append({
-                "contrato_id": contrato_id,
-                "numero_contrato": contrato.get("numero_contrato") if contrato else None,
-                "cliente": data["cliente"],
-                "cultivo": contrato.get("cultivo") if contrato else None,
-                "campana": contrato.get("campana") if contrato else None,
-                "total": data["total"],
-                "count": data["count"]
-            })
-        except Exception:
-            contratos_enriched.append({
-                "contrato_id": contrato_id,
-                "total": data["total"],
-                "count": data["count"],
-                "cliente": data["cliente"]
-            })
+    for r in facets["por_contrato"]:
+        if not r["_id"]:
+            continue
+        contrato = (r.get("contrato") or [{}])[0]
+        contratos_enriched.append({
+            "contrato_id": r["_id"],
+            "numero_contrato": contrato.get("numero_contrato"),
+            "cliente": r["tercero_resumen"],
+            "cultivo": contrato.get("cultivo"),
+            "campana": contrato.get("campana"),
+            "total": r["total"],
+            "count": r["count"]
+        })
     
     return {
-        "total_general": total_general,
-        "total_albaranes": total_albaranes,
-        "por_cliente": [{"cliente": k, **v} for k, v in sorted(por_cliente.items(), key=lambda x: -x[1]["total"])],
-        "por_contrato": sorted(contratos_enriched, key=lambda x: -x["total"]),
-        "por_cultivo": [{"cultivo": k, **v} for k, v in sorted(por_cultivo.items(), key=lambda x: -x[1]["total"])],
-        "por_parcela": [{"parcela": k, **v} for k, v in sorted(por_parcela.items(), key=lambda x: -x[1]["total"])]
+        "total_general": totales.get("total", 0),
+        "total_albaranes": totales.get("count", 0),
+        "por_cliente": [
+            {"cliente": r["_id"], "total": r["total"], "count": r["count"], "albaranes": []}
+            for r in facets["por_tercero"]
+        ],
+        "por_contrato": contratos_enriched,
+        "por_cultivo": [{"cultivo": r["_id"], "total": r["total"], "count": r["count"]} for r in facets["por_cultivo"]],
+        "por_parcela": [
+            {"parcela": r["_id"], "total": r["total"], "count": r["count"], "cultivo": r["cultivo_resumen"]}
+            for r in facets["por_parcela"]
+        ]
     }
 
 
@@ -149,39 +107,13 @@ async def get_ingresos_por_cliente(
     Obtiene detalle de ingresos agrupados por cliente.
     Si se especifica cliente, devuelve el detalle de ese cliente.
     """
-    match_query = {"tipo": "Albarán de venta"}
-    if cliente:
-        match_query["cliente"] = cliente
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    if campana:
-        match_query["campana"] = campana
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$cliente",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "cultivos": {"$addToSet": "$cultivo"},
-            "contratos": {"$addToSet": "$contrato_id"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
+    match_query = _ingresos_match(fecha_desde, fecha_hasta, campana=campana, cliente=cliente)
+    facets = await _aggregate_ingresos(match_query, ["por_tercero"])
     
     return {
         "ingresos_por_cliente": [
             {
-                "cliente": r["_id"] or "Sin cliente",
+                "cliente": r["_id"],
                 "total": r["total"],
                 "count": r["count"],
                 "cultivos": [c for c in r["cultivos"] if c],
@@ -189,7 +121,7 @@ async def get_ingresos_por_cliente(
                 "primer_albaran": r["primer_albaran"],
                 "ultimo_albaran": r["ultimo_albaran"]
             }
-            for r in results
+            for r in facets["por_tercero"]
         ]
     }
 
@@ -205,54 +137,23 @@ async def get_ingresos_por_contrato(
     """
     Obtiene detalle de ingresos agrupados por contrato de venta.
     """
-    match_query = {"tipo": "Albarán de venta"}
-    if contrato_id:
-        match_query["contrato_id"] = contrato_id
-    if fecha_desde:
-        match_query["fecha"] = {"$gte": fecha_desde}
-    if fecha_hasta:
-        if "fecha" in match_query:
-            match_query["fecha"]["$lte"] = fecha_hasta
-        else:
-            match_query["fecha"] = {"$lte": fecha_hasta}
-    
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$contrato_id",
-            "total": {"$sum": "$total_albaran"},
-            "count": {"$sum": 1},
-            "cliente": {"$first": "$cliente"},
-            "cultivo": {"$first": "$cultivo"},
-            "campana": {"$first": "$campana"},
-            "parcela": {"$first": "$parcela_codigo"},
-            "primer_albaran": {"$min": "$fecha"},
-            "ultimo_albaran": {"$max": "$fecha"}
-        }},
-        {"$sort": {"total": -1}}
-    ]
-    
-    results = await albaranes_collection.aggregate(pipeline).to_list(100)
+    match_query = _ingresos_match(fecha_desde, fecha_hasta, contrato_id=contrato_id)
+    facets = await _aggregate_ingresos(match_query, ["por_contrato"])
     
-    # Enrich with contract details
     enriched_results = []
-    for r in results:
+    for r in facets["por_contrato"]:
         contrato_info = {}
-        if r["_id"]:
-            try:
-                contrato = await contratos_collection.find_one({"_id": ObjectId(r["_id"])})
-                if contrato:
-                    contrato_info = {
-                        "numero_contrato": contrato.get("numero_contrato"),
-                        "precio": contrato.get("precio"),
-                        "cantidad": contrato.get("cantidad")
-                    }
-            except Exception:
-                pass
+        if r.get("contrato"):
+            contrato = r["contrato"][0]
+            contrato_info = {
+                "numero_contrato": contrato.get("numero_contrato"),
+                "precio": contrato.get("precio"),
+                "cantidad": contrato.get("cantidad")
+            }
         
         enriched_results.append({
             "contrato_id": r["_id"] or "Sin contrato",
-            "cliente": r["cliente"] or "Sin cliente",
+            "cliente": r["tercero"] or SIN_CLIENTE,
             "cultivo": r["cultivo"],
             "campana": r["campana"],
             "parcela": r["parcela"],
@@ -379,9 +280,6 @@ async def export_ingresos_excel(
 ):
     """Exporta los ingresos a Excel"""
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        
         # Build match query
         match_query = {"tipo": "Albarán de venta"}
         if fecha_desde:
@@ -398,75 +296,34 @@ async def export_ingresos_excel(
         if cultivo:
             match_query["cultivo"] = cultivo
         
-        albaranes = await albaranes_collection.find(match_query).sort("fecha", -1).to_list(1000)
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Ingresos"
-        
-        # Styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="16a34a", end_color="16a34a", fill_type="solid")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        xl = ExcelExport(header_color="16a34a")
+        ws = xl.add_sheet(
+            "Ingresos",
+            ["Fecha", "Nº Albarán", "Cliente", "Cultivo", "Parcela", "Campaña", "Total (€)"],
+            widths=[12, 15, 25, 20, 15, 12, 15],
+            number_formats={6: '#,##0.00 €'},
         )
         
-        # Headers
-        headers = ["Fecha", "Nº Albarán", "Cliente", "Cultivo", "Parcela", "Campaña", "Total (€)"]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal='center')
-            cell.border = border
-        
-        # Data
         total_general = 0
-        for row, albaran in enumerate(albaranes, 2):
+        
+        def albaran_row(albaran):
+            nonlocal total_general
             total = albaran.get("total_albaran", 0) or 0
             total_general += total
-            
-            ws.cell(row=row, column=1, value=albaran.get("fecha", "")).border = border
-            ws.cell(row=row, column=2, value=albaran.get("numero_albaran", "")).border = border
-            ws.cell(row=row, column=3, value=albaran.get("cliente", "")).border = border
-            ws.cell(row=row, column=4, value=albaran.get("cultivo", "")).border = border
-            ws.cell(row=row, column=5, value=albaran.get("parcela_codigo", "")).border = border
-            ws.cell(row=row, column=6, value=albaran.get("campana", "")).border = border
-            cell = ws.cell(row=row, column=7, value=total)
-            cell.number_format = '#,##0.00 €'
-            cell.border = border
-        
-        # Total row
-        total_row = len(albaranes) + 2
-        ws.cell(row=total_row, column=6, value="TOTAL:").font = Font(bold=True)
-        total_cell = ws.cell(row=total_row, column=7, value=total_general)
-        total_cell.font = Font(bold=True)
-        total_cell.number_format = '#,##0.00 €'
-        
-        # Adjust column widths
-        ws.column_dimensions['A'].width = 12
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 25
-        ws.column_dimensions['D'].width = 20
-        ws.column_dimensions['E'].width = 15
-        ws.column_dimensions['F'].width = 12
-        ws.column_dimensions['G'].width = 15
+            return [
+                albaran.get("fecha", ""),
+                albaran.get("numero_albaran", ""),
+                albaran.get("cliente", ""),
+                albaran.get("cultivo", ""),
+                albaran.get("parcela_codigo", ""),
+                albaran.get("campana", ""),
+                total,
+            ]
         
-        # Save to buffer
-        buffer = io.BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
+        await ws.write(albaranes_collection.find(match_query).sort("fecha", -1), albaran_row)
+        ws.append(["", "", "", "", "", "TOTAL:", total_general], style=TOTAL)
         
-        filename = f"ingresos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return StreamingResponse(
-            buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return await xl.response(f"ingresos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando Excel: {str(e)}")
@@ -484,7 +341,7 @@ async def export_ingresos_pdf(
 ):
     """Exporta los ingresos a PDF"""
     try:
-        from weasyprint import HTML, CSS
+        from services.render_service import render_html_pdf
         
         # Build match query
         match_query = {"tipo": "Albarán de venta"}
@@ -639,7 +496,7 @@ async def export_ingresos_pdf(
         """
         
         # Generate PDF
-        pdf = HTML(string=html_content).write_pdf()
+        pdf = await render_html_pdf(html_content)
         
         filename = f"ingresos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
@@ -649,5 +506,7 @@ async def export_ingresos_pdf(
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando PDF: {str(e)}")
@@ -3,7 +3,6 @@ Routes for Irrigaciones module - Enhanced with planning, calculations, history,
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Query
-from fastapi.responses import StreamingResponse
 from typing import Optional, List
 from bson import ObjectId
 from datetime import datetime, timedelta
@@ -20,6 +19,10 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireIrrigacionesAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["irrigaciones"])
 
@@ -62,6 +65,7 @@ async def create_irrigacion(
     })
     
     result = await irrigaciones_collection.insert_one(irrigacion_dict)
+    await record_kpi_insert("irrigaciones", irrigacion_dict)
     created = await irrigaciones_collection.find_one({"_id": result.inserted_id})
     
     return {"success": True, "data": serialize_doc(created)}
@@ -71,6 +75,8 @@ async def create_irrigacion(
 async def get_irrigaciones(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     parcela_id: Optional[str] = None,
     sistema: Optional[str] = None,
     estado: Optional[str] = None,
@@ -111,10 +117,10 @@ async def get_irrigaciones(
     if es_planificada is not None:
         query["es_planificada"] = es_planificada
     
-    irrigaciones = await irrigaciones_collection.find(query).sort("fecha", -1).skip(skip).limit(limit).to_list(limit)
-    total = await irrigaciones_collection.count_documents(query)
+    page = await paginate(irrigaciones_collection, query, [("fecha", -1), ("_id", -1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
     
-    return {"irrigaciones": serialize_docs(irrigaciones), "total": total}
+    return {"irrigaciones": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/irrigaciones/planificadas")
@@ -382,10 +388,11 @@ async def update_irrigacion(
     
     irrigacion_dict["updated_at"] = datetime.now()
     
-    result = await irrigaciones_collection.update_one(
-        {"_id": ObjectId(irrigacion_id)},
-        {"$set": irrigacion_dict}
-    )
+    async with track_kpi_change("irrigaciones", irrigacion_id):
+        result = await irrigaciones_collection.update_one(
+            {"_id": ObjectId(irrigacion_id)},
+            {"$set": irrigacion_dict}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Irrigación no encontrada")
@@ -415,10 +422,11 @@ async def update_irrigacion_estado(
     elif estado == "en_curso":
         update_data["hora_inicio"] = datetime.now().strftime("%H:%M")
     
-    result = await irrigaciones_collection.update_one(
-        {"_id": ObjectId(irrigacion_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("irrigaciones", irrigacion_id):
+        result = await irrigaciones_collection.update_one(
+            {"_id": ObjectId(irrigacion_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Irrigación no encontrada")
@@ -435,7 +443,8 @@ async def delete_irrigacion(
     if not ObjectId.is_valid(irrigacion_id):
         raise HTTPException(status_code=400, detail="ID de irrigación inválido")
     
-    result = await irrigaciones_collection.delete_one({"_id": ObjectId(irrigacion_id)})
+    async with track_kpi_change("irrigaciones", irrigacion_id):
+        result = await irrigaciones_collection.delete_one({"_id": ObjectId(irrigacion_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Irrigación no encontrada")
@@ -456,12 +465,6 @@ async def export_irrigaciones_excel(
     _access: dict = Depends(RequireIrrigacionesAccess)
 ):
     """Export irrigations to Excel"""
-    try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill
-    except ImportError:
-        raise HTTPException(status_code=500, detail="openpyxl not installed")
-    
     query = {}
     if parcela_id:
         query["parcela_id"] = parcela_id
@@ -473,49 +476,29 @@ async def export_irrigaciones_excel(
         else:
             query["fecha"] = {"$lte": fecha_hasta}
     
-    irrigaciones = await irrigaciones_collection.find(query).sort("fecha", -1).to_list(1000)
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Irrigaciones"
-    
-    # Headers
-    headers = ["Fecha", "Parcela", "Cultivo", "Sistema", "Duración (h)", "Volumen (m³)", "m³/ha", "Coste (€)", "Estado", "Observaciones"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="1976d2", end_color="1976d2", fill_type="solid")
-        cell.font = Font(bold=True, color="FFFFFF")
-    
-    # Data
-    for row, irrig in enumerate(irrigaciones, 2):
-        ws.cell(row=row, column=1, value=irrig.get("fecha", ""))
-        ws.cell(row=row, column=2, value=irrig.get("parcela_codigo", ""))
-        ws.cell(row=row, column=3, value=irrig.get("cultivo", ""))
-        ws.cell(row=row, column=4, value=irrig.get("sistema", ""))
-        ws.cell(row=row, column=5, value=irrig.get("duracion", 0))
-        ws.cell(row=row, column=6, value=irrig.get("volumen", 0))
-        ws.cell(row=row, column=7, value=irrig.get("consumo_por_ha", 0))
-        ws.cell(row=row, column=8, value=irrig.get("coste", 0))
-        ws.cell(row=row, column=9, value=irrig.get("estado", "completado"))
-        ws.cell(row=row, column=10, value=irrig.get("observaciones", ""))
-    
-    # Auto-width
-    for col in ws.columns:
-        max_length = max(len(str(cell.value or "")) for cell in col)
-        ws.column_dimensions[col[0].column_letter].width = min(max_length + 2, 40)
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    filename = f"irrigaciones_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    xl = ExcelExport(header_color="1976D2")
+    ws = xl.add_sheet(
+        "Irrigaciones",
+        ["Fecha", "Parcela", "Cultivo", "Sistema", "Duración (h)", "Volumen (m³)", "m³/ha", "Coste (€)", "Estado", "Observaciones"],
+        widths=[12, 15, 18, 15, 12, 14, 10, 12, 14, 40],
     )
+    await ws.write(
+        irrigaciones_collection.find(query).sort("fecha", -1),
+        lambda irrig: [
+            irrig.get("fecha", ""),
+            irrig.get("parcela_codigo", ""),
+            irrig.get("cultivo", ""),
+            irrig.get("sistema", ""),
+            irrig.get("duracion", 0),
+            irrig.get("volumen", 0),
+            irrig.get("consumo_por_ha", 0),
+            irrig.get("coste", 0),
+            irrig.get("estado", "completado"),
+            irrig.get("observaciones", "")
+        ],
+    )
+    
+    return await xl.response(f"irrigaciones_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/irrigaciones/export/pdf")
@@ -579,7 +562,7 @@ async def export_irrigaciones_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"irrigaciones_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -8,6 +8,8 @@ import uuid
 from models_tratamientos import MaquinariaCreate, MaquinariaInDB
 from database import maquinaria_collection, serialize_doc, serialize_docs
 from rbac_guards import RequireCreate, RequireEdit, RequireDelete, get_current_user
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
 
 router = APIRouter(prefix="/api", tags=["maquinaria"])
 
@@ -366,39 +368,19 @@ async def export_maquinaria_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Exportar maquinaria a Excel"""
-    from fastapi.responses import StreamingResponse
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    import io
-    
     query = {}
     if estado:
         query['estado'] = estado
     
-    maquinaria = await maquinaria_collection.find(query).sort("nombre", 1).to_list(1000)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Maquinaria"
-    
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="FF5722", end_color="FF5722", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
+    xl = ExcelExport(header_color="FF5722")
+    ws = xl.add_sheet(
+        "Maquinaria",
+        ["Nombre", "Tipo", "Marca", "Modelo", "Matrícula", "Nº Serie", "Año", "Potencia", "Capacidad", "Estado", "ITV", "Seguro"],
+        widths=[25, 15, 15, 15, 12, 18, 8, 10, 12, 15, 12, 12],
     )
-    
-    headers = ["Nombre", "Tipo", "Marca", "Modelo", "Matrícula", "Nº Serie", "Año", "Potencia", "Capacidad", "Estado", "ITV", "Seguro"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = thin_border
-    
-    for row_idx, maq in enumerate(maquinaria, 2):
-        data = [
+    await ws.write(
+        maquinaria_collection.find(query).sort("nombre", 1),
+        lambda maq: [
             maq.get("nombre", ""),
             maq.get("tipo", ""),
             maq.get("marca", ""),
@@ -408,27 +390,13 @@ async def export_maquinaria_excel(
             maq.get("ano_fabricacion", ""),
             maq.get("potencia_cv", ""),
             maq.get("capacidad", ""),
-            maq.get("estado", "activa").replace("_", " ").title(),
+            (maq.get("estado") or "activa").replace("_", " ").title(),
             maq.get("fecha_proxima_itv", "-"),
             maq.get("fecha_vencimiento_seguro", "-")
-        ]
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row_idx, column=col, value=value)
-            cell.border = thin_border
-    
-    column_widths = [25, 15, 15, 15, 12, 18, 8, 10, 12, 15, 12, 12]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=maquinaria_{datetime.now().strftime('%Y%m%d')}.xlsx"}
+        ],
     )
+    
+    return await xl.response(f"maquinaria_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/maquinaria/export/pdf")
@@ -479,7 +447,7 @@ async def export_maquinaria_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"maquinaria_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
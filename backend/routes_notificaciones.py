@@ -14,6 +14,7 @@ import os
 
 from database import db
 from routes_auth import get_current_user
+from services.scheduler_leader import get_job_runs, get_last_runs_by_job, get_lease_status, track_job_run
 
 router = APIRouter(prefix="/api/notificaciones", tags=["notificaciones"])
 
@@ -150,7 +151,7 @@ async def ejecutar_verificacion_clima_programada():
     Execute scheduled climate verification
     This function is called by the scheduler
     """
-    from routes_alertas_clima import obtener_clima_api, generar_alertas_para_parcela, datos_clima_collection
+    from routes_alertas_clima import obtener_datos_clima_parcelas, generar_alertas_lote, PARCELA_CLIMA_FIELDS
     
     print(f"[{datetime.utcnow()}] Executing scheduled climate check...")
     
@@ -161,43 +162,26 @@ async def ejecutar_verificacion_clima_programada():
         return
     
     # Get all parcelas
-    parcelas = await parcelas_collection.find().to_list(500)
+    parcelas = await parcelas_collection.find({}, PARCELA_CLIMA_FIELDS).to_list(500)
     
     alertas_generadas = []
-    parcelas_procesadas = 0
     
     # Create a system user context for the operation
     system_user = {"username": "sistema", "_id": "sistema", "role": "Admin"}
     
-    for parcela in parcelas:
-        datos_clima = None
-        
-        # Try API first if parcela has coordinates
-        if parcela.get("latitud") and parcela.get("longitud"):
-            datos_clima = await obtener_clima_api(parcela["latitud"], parcela["longitud"])
-        
-        # Fallback to latest manual data
-        if not datos_clima:
-            manual = await datos_clima_collection.find_one(
-                {"parcela_id": str(parcela["_id"])},
-                sort=[("timestamp", -1)]
-            )
-            if manual:
-                datos_clima = {
-                    "temperatura": manual.get("temperatura"),
-                    "humedad": manual.get("humedad"),
-                    "lluvia": manual.get("lluvia", 0),
-                    "viento": manual.get("viento", 0),
-                    "fuente": "manual"
-                }
-        
-        if datos_clima:
-            try:
-                alertas = await generar_alertas_para_parcela(parcela, datos_clima, system_user)
-                alertas_generadas.extend(alertas)
-                parcelas_procesadas += 1
-            except Exception as e:
-                print(f"Error processing parcela {parcela.get('codigo_plantacion')}: {e}")
+    # Weather per grid cell (API, concurrent and cached) with manual fallback
+    datos_por_parcela = await obtener_datos_clima_parcelas(parcelas)
+    parcelas_datos = [
+        (parcela, datos_por_parcela[str(parcela["_id"])])
+        for parcela in parcelas if datos_por_parcela.get(str(parcela["_id"]))
+    ]
+    parcelas_procesadas = len(parcelas_datos)
+    
+    # All rules evaluated in memory, one insert_many for the new alerts
+    try:
+        alertas_generadas = await generar_alertas_lote(parcelas_datos, system_user)
+    except Exception as e:
+        print(f"Error generating climate alerts: {e}")
     
     # Generate summary
     resumen = {
@@ -500,8 +484,11 @@ async def ejecutar_verificacion_manual(
     if current_user.get("role") not in ["Admin", "Manager"]:
         raise HTTPException(status_code=403, detail="Solo Admin y Manager pueden ejecutar verificación manual")
     
-    # Run in background
-    background_tasks.add_task(ejecutar_verificacion_clima_programada)
+    # Run in background (recorded in the scheduler run history, not leader-gated)
+    background_tasks.add_task(
+        track_job_run, "climate_check", ejecutar_verificacion_clima_programada,
+        trigger="manual", require_leader=False,
+    )
     
     return {
         "success": True,
@@ -514,14 +501,29 @@ async def ejecutar_verificacion_manual(
 async def get_scheduler_status(
     current_user: dict = Depends(get_current_user)
 ):
-    """Get current scheduler status"""
+    """Get current scheduler status, leader lease and per-job run history"""
+    from scheduler_service import scheduler
+
     config = await config_scheduler_collection.find_one({"tipo": "verificacion_clima"})
+    ultimas = await get_last_runs_by_job()
+    jobs = [
+        {
+            "id": job.id,
+            "nombre": job.name,
+            "proxima_ejecucion": job.next_run_time.isoformat() if job.next_run_time else None,
+            "ultima_ejecucion": ultimas.get(job.id),
+        }
+        for job in scheduler.get_jobs()
+    ]
     
     return {
         "activo": config.get("activa", False) if config else False,
         "ultima_ejecucion": config.get("ultima_ejecucion").isoformat() if config and config.get("ultima_ejecucion") else None,
         "ultimo_resultado": config.get("ultimo_resultado") if config else None,
-        "proxima_ejecucion": calcular_proxima_ejecucion(config) if config else None
+        "proxima_ejecucion": calcular_proxima_ejecucion(config) if config else None,
+        "lider": await get_lease_status(),
+        "jobs": jobs,
+        "historial": await get_job_runs(limit=20),
     }
 
 
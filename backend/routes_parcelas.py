@@ -14,6 +14,10 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireParcelasAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["parcelas"])
 
@@ -34,6 +38,7 @@ async def create_parcela(
     
     result = await parcelas_collection.insert_one(parcela_dict)
     created = await parcelas_collection.find_one({"_id": result.inserted_id})
+    await record_kpi_insert("parcelas", created)
     
     return {"success": True, "data": serialize_doc(created)}
 
@@ -42,6 +47,8 @@ async def create_parcela(
 async def get_parcelas(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     campana: Optional[str] = None,
     proveedor: Optional[str] = None,
     contrato_id: Optional[str] = None,
@@ -56,8 +63,9 @@ async def get_parcelas(
     if contrato_id:
         query["contrato_id"] = contrato_id
     
-    parcelas = await parcelas_collection.find(query).skip(skip).limit(limit).to_list(limit)
-    return {"parcelas": serialize_docs(parcelas), "total": await parcelas_collection.count_documents(query)}
+    page = await paginate(parcelas_collection, query, [("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"parcelas": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/parcelas/{parcela_id}")
@@ -140,10 +148,11 @@ async def update_parcela(
     update_data = {k: v for k, v in parcela.dict().items() if v is not None}
     update_data["updated_at"] = datetime.now()
     
-    result = await parcelas_collection.update_one(
-        {"_id": ObjectId(parcela_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("parcelas", parcela_id):
+        result = await parcelas_collection.update_one(
+            {"_id": ObjectId(parcela_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Parcela not found")
@@ -161,7 +170,8 @@ async def delete_parcela(
     if not ObjectId.is_valid(parcela_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    result = await parcelas_collection.delete_one({"_id": ObjectId(parcela_id)})
+    async with track_kpi_change("parcelas", parcela_id):
+        result = await parcelas_collection.delete_one({"_id": ObjectId(parcela_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Parcela not found")
@@ -176,54 +186,26 @@ async def export_parcelas_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Export parcelas to Excel"""
-    from fastapi.responses import StreamingResponse
-    import io as _io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
     query = {}
     if campana:
         query["campana"] = campana
 
-    parcelas_list = await parcelas_collection.find(query).sort("created_at", -1).to_list(5000)
-    parcelas_raw = serialize_docs(parcelas_list)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Parcelas"
-
-    headers = ["Codigo", "Proveedor", "Finca", "Cultivo", "Variedad", "Superficie (ha)", "N Plantas", "Campana", "Zonas"]
-    header_fill = PatternFill(start_color="1B5E20", end_color="1B5E20", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-
-    for idx, p in enumerate(parcelas_raw, 2):
-        row = [
+    xl = ExcelExport(header_color="1B5E20")
+    ws = xl.add_sheet(
+        "Parcelas",
+        ["Codigo", "Proveedor", "Finca", "Cultivo", "Variedad", "Superficie (ha)", "N Plantas", "Campana", "Zonas"],
+    )
+    await ws.write(
+        parcelas_collection.find(query).sort("created_at", -1),
+        lambda p: [
             p.get("codigo_plantacion", ""), p.get("proveedor", ""), p.get("finca", ""),
             p.get("cultivo", ""), p.get("variedad", ""),
             p.get("superficie_total", 0), p.get("num_plantas", 0),
             p.get("campana", ""), len(p.get("recintos", []))
-        ]
-        for col, val in enumerate(row, 1):
-            cell = ws.cell(row=idx, column=col, value=val)
-            cell.border = thin_border
-
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[chr(64 + col)].width = 18
+        ],
+    )
 
-    output = _io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"parcelas_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return await xl.response(f"parcelas_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/parcelas/export/pdf")
@@ -286,7 +268,7 @@ async def export_parcelas_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"parcelas_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -11,6 +11,7 @@ from datetime import datetime
 
 from database import db
 from routes_auth import get_current_user
+from services.kpi_snapshots import record_kpi_insert
 
 router = APIRouter(prefix="/api/recomendaciones", tags=["recomendaciones"])
 
@@ -379,6 +380,7 @@ async def generar_tratamiento(
         
         # Insert treatment
         result = await tratamientos_collection.insert_one(tratamiento)
+        await record_kpi_insert("tratamientos", tratamiento)
         tratamiento_id = str(result.inserted_id)
         
         # Update recommendation
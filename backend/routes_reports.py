@@ -13,7 +13,7 @@ from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from bson import ObjectId
-from weasyprint import HTML
+from services.render_service import render_html_pdf, save_workbook
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 from openpyxl.utils import get_column_letter
@@ -303,8 +303,7 @@ async def generate_pdf(request: PDFRequest):
         """
         
         # Generate PDF
-        html = HTML(string=html_content)
-        pdf_bytes = html.write_pdf()
+        pdf_bytes = await render_html_pdf(html_content)
         
         return StreamingResponse(
             BytesIO(pdf_bytes),
@@ -312,6 +311,8 @@ async def generate_pdf(request: PDFRequest):
             headers={"Content-Disposition": f"attachment; filename=cuaderno_{parcela.get('codigo_plantacion', 'parcela')}.pdf"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -409,9 +410,7 @@ async def generate_excel(request: ExcelRequest):
                 ])
         
         # Save to bytes
-        excel_bytes = BytesIO()
-        wb.save(excel_bytes)
-        excel_bytes.seek(0)
+        excel_bytes = await save_workbook(wb)
         
         return StreamingResponse(
             excel_bytes,
@@ -419,5 +418,7 @@ async def generate_excel(request: ExcelRequest):
             headers={"Content-Disposition": "attachment; filename=datos_agricolas.xlsx"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -7,16 +7,33 @@ Endpoints:
 - GET /api/sigpac/recintos - Obtener recintos de una parcela  
 - POST /api/sigpac/importar - Importar parcela SIGPAC al sistema
 - GET /api/sigpac/wms-config - Obtener URL de WMS para mapa
+- POST /api/sigpac/cache/prewarm - Precargar la cache de una provincia/municipio
+
+Las respuestas de SIGPAC se cachean en memoria y en Mongo (services/sigpac_cache.py).
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime, timezone
+import asyncio
 import httpx
 
 from database import db, serialize_doc
 from routes_auth import get_current_user
+from services.job_service import JobContext, get_job, register_job_handler, serialize_job, submit_job
+from services.sigpac_cache import (
+    cache_collection,
+    clear_sigpac_cache,
+    geometry_contains,
+    geometry_tiles,
+    get_sigpac_cache_stats,
+    point_tile,
+    ref_key,
+    sigpac_get_json,
+    tile_key,
+)
+from services.kpi_snapshots import record_kpi_insert
 
 router = APIRouter(prefix="/api/sigpac", tags=["sigpac"])
 
@@ -37,6 +54,12 @@ class SIGPACRef(BaseModel):
     recinto: Optional[str] = Field(None, description="Recinto (opcional)")
 
 
+class SIGPACPrewarm(BaseModel):
+    provincia: str = Field(..., description="Codigo provincia (2 digitos)")
+    municipio: Optional[str] = Field(None, description="Codigo municipio (3 digitos); vacio = toda la provincia")
+    max_referencias: int = Field(500, ge=1, le=5000)
+
+
 class SIGPACImport(BaseModel):
     sigpac_ref: SIGPACRef
     nombre: Optional[str] = None
@@ -61,18 +84,18 @@ async def consulta_sigpac(
     url = f"{SIGPAC_REST_BASE}/refcatparcela/{provincia}/{municipio}/{agregado}/{zona}/{poligono}/{parcela}.json"
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.get(url, headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        status, data = await sigpac_get_json(
+            ref_key("refcat.json", provincia, municipio, agregado, zona, poligono, parcela), url, timeout=15.0,
+            headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"},
+        )
         
-        if resp.status_code != 200:
+        if status != 200:
             return {
                 "success": False,
-                "message": f"SIGPAC devolvio status {resp.status_code}",
+                "message": f"SIGPAC devolvio status {status}",
                 "data": None,
             }
         
-        data = resp.json()
-        
         # SIGPAC returns an array of objects, each with provincia/municipio/poligono/parcela/referencia_cat
         if isinstance(data, list):
             results = []
@@ -151,13 +174,14 @@ async def obtener_recintos_geojson(
     url = f"{SIGPAC_REST_BASE}/refcatparcela/{provincia}/{municipio}/{agregado}/{zona}/{poligono}/{parcela}.geojson"
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.get(url, headers={"Accept": "application/geo+json"})
+        status, geojson = await sigpac_get_json(
+            ref_key("refcat.geojson", provincia, municipio, agregado, zona, poligono, parcela), url, timeout=15.0,
+            headers={"Accept": "application/geo+json"},
+        )
         
-        if resp.status_code != 200:
-            return {"success": False, "message": f"SIGPAC devolvio status {resp.status_code}"}
+        if status != 200:
+            return {"success": False, "message": f"SIGPAC devolvio status {status}"}
         
-        geojson = resp.json()
         return {"success": True, "geojson": geojson}
     except Exception as e:
         return {"success": False, "message": str(e)}
@@ -184,10 +208,11 @@ async def importar_parcela_sigpac(
     recintos_sigpac = []
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.get(url)
-        if resp.status_code == 200:
-            geojson = resp.json()
+        status, geojson = await sigpac_get_json(
+            ref_key("refcat.geojson", ref.provincia, ref.municipio, ref.agregado, ref.zona, ref.poligono, ref.parcela),
+            url, timeout=15.0, headers={"Accept": "application/geo+json"},
+        )
+        if status == 200:
             features = geojson.get("features", []) if isinstance(geojson, dict) else []
             for feat in features:
                 geom = feat.get("geometry")
@@ -267,6 +292,7 @@ async def importar_parcela_sigpac(
     }
     
     result = await parcelas_collection.insert_one(parcela_doc)
+    await record_kpi_insert("parcelas", parcela_doc)
     
     return {
         "success": True,
@@ -298,6 +324,18 @@ async def get_wms_config(current_user: dict = Depends(get_current_user)):
 
 
 SIGPAC_OGC_BASE = "https://sigpac-hubcloud.es/ogcapi"
+SIGPAC_TILE_FEATURES_LIMIT = 50
+
+
+async def _consultar_tesela(lat: float, lng: float, refresh: bool = False):
+    """Recintos de la tesela que contiene el punto (cacheada, ver services/sigpac_cache.py)."""
+    tile = point_tile(lat, lng)
+    bbox = ",".join(f"{v:.6f}" for v in tile)
+    url = f"{SIGPAC_OGC_BASE}/collections/recintos/items?f=json&bbox={bbox}&limit={SIGPAC_TILE_FEATURES_LIMIT}"
+    return await sigpac_get_json(
+        tile_key(tile), url, timeout=12.0, refresh=refresh,
+        headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"},
+    )
 
 
 @router.get("/info-punto")
@@ -307,26 +345,19 @@ async def get_info_por_coordenadas(
     current_user: dict = Depends(get_current_user),
 ):
     """Consultar recinto SIGPAC por coordenadas GPS (click en mapa)"""
-    # Create a small bbox around the click point (~50m)
-    delta = 0.0005  # approx 50m
-    bbox = f"{lng - delta},{lat - delta},{lng + delta},{lat + delta}"
-    url = f"{SIGPAC_OGC_BASE}/collections/recintos/items?f=json&bbox={bbox}&limit=5"
-    
     try:
-        async with httpx.AsyncClient(timeout=12.0) as client:
-            resp = await client.get(url, headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        status, data = await _consultar_tesela(lat, lng)
         
-        if resp.status_code != 200:
-            return {"success": False, "message": f"SIGPAC OGC devolvio status {resp.status_code}"}
+        if status != 200:
+            return {"success": False, "message": f"SIGPAC OGC devolvio status {status}"}
         
-        data = resp.json()
         features = data.get("features", [])
         
         if not features:
             return {"success": True, "encontrado": False, "message": "No se encontro ningun recinto en este punto"}
         
-        # Find the closest feature to the click point
-        best = features[0]
+        # The tile holds every recinto around the click: the one containing the point goes first
+        features = sorted(features, key=lambda f: not geometry_contains(f.get("geometry"), lat, lng))
         results = []
         for feat in features:
             props = feat.get("properties", {})
@@ -362,10 +393,10 @@ async def get_info_por_coordenadas(
         
         detail_url = f"{SIGPAC_REST_BASE}/recinfo/{pr}/{mu}/{ag}/{zo}/{po}/{pa}/{rec}.json"
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                detail_resp = await client.get(detail_url)
-            if detail_resp.status_code == 200:
-                detail_data = detail_resp.json()
+            detail_status, detail_data = await sigpac_get_json(
+                ref_key("recinfo.json", pr, mu, ag, zo, po, pa, rec), detail_url, timeout=10.0,
+            )
+            if detail_status == 200:
                 if isinstance(detail_data, list) and detail_data:
                     d = detail_data[0]
                     main["uso_sigpac"] = d.get("uso_sigpac", d.get("uso", ""))
@@ -438,12 +469,10 @@ async def get_municipios(provincia: str, current_user: dict = Depends(get_curren
     try:
         pr = provincia.zfill(2)
         url = f"{SIGPAC_REST_BASE}/municipios/{pr}.json"
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url)
-            if response.status_code != 200:
-                return {"success": False, "municipios": []}
-            data = response.json()
-            return {"success": True, "provincia": pr, "municipios": data if isinstance(data, list) else []}
+        status, data = await sigpac_get_json(f"municipios:{pr}", url, timeout=10.0)
+        if status != 200:
+            return {"success": False, "municipios": []}
+        return {"success": True, "provincia": pr, "municipios": data if isinstance(data, list) else []}
     except Exception as e:
         return {"success": False, "municipios": [], "error": str(e)}
 
@@ -455,3 +484,144 @@ async def get_usos(current_user: dict = Depends(get_current_user)):
         "success": True,
         "usos": [{"codigo": k, "descripcion": v} for k, v in sorted(USOS_SIGPAC.items())]
     }
+
+
+# === CACHE (services/sigpac_cache.py) ===
+
+SIGPAC_PREWARM_JOB_KIND = "sigpac_prewarm"
+SIGPAC_PREWARM_CONCURRENCY = 4
+
+
+def _codigos(valor: str) -> list:
+    """Variantes con las que puede estar guardado un codigo ("03", "3", 3)."""
+    variantes = {valor, valor.lstrip("0") or "0"}
+    if valor.isdigit():
+        return list(variantes) + [int(valor)]
+    return list(variantes)
+
+
+async def _referencias_conocidas(provincia: str, municipio: Optional[str], limite: int) -> list:
+    """Referencias SIGPAC de parcelas y fincas del sistema en la provincia/municipio."""
+    pr = provincia.zfill(2)
+    mu = municipio.zfill(3) if municipio else None
+    candidatas = []
+
+    parcelas = db["parcelas"].find(
+        {"$or": [
+            {"sigpac_provincia": {"$in": _codigos(pr)}},
+            {"recintos.provincia_sigpac": {"$in": _codigos(pr)}},
+            {"recintos.provincia": {"$in": _codigos(pr)}},
+        ]},
+        {"sigpac_provincia": 1, "sigpac_municipio": 1, "sigpac_agregado": 1, "sigpac_zona": 1,
+         "sigpac_poligono": 1, "sigpac_parcela": 1, "recintos": 1},
+    )
+    async for p in parcelas:
+        candidatas.append((p.get("sigpac_provincia"), p.get("sigpac_municipio"), p.get("sigpac_agregado"),
+                           p.get("sigpac_zona"), p.get("sigpac_poligono"), p.get("sigpac_parcela")))
+        for r in p.get("recintos") or []:
+            if not isinstance(r, dict):
+                continue
+            candidatas.append((r.get("provincia_sigpac"), r.get("municipio_sigpac"), r.get("agregado_sigpac"),
+                               r.get("zona_sigpac"), r.get("poligono_sigpac"), r.get("parcela_sigpac")))
+            candidatas.append((r.get("provincia"), r.get("municipio"), r.get("agregado"),
+                               r.get("zona"), r.get("poligono"), r.get("parcela")))
+
+    async for f in db["fincas"].find({"sigpac.provincia": {"$in": _codigos(pr)}}, {"sigpac": 1}):
+        sp = f.get("sigpac") or {}
+        candidatas.append((sp.get("provincia"), sp.get("municipio"), sp.get("cod_agregado"),
+                           sp.get("zona"), sp.get("poligono"), sp.get("parcela")))
+
+    referencias = {}
+    for prov, muni, agr, zon, pol, par in candidatas:
+        if not (prov and muni and pol and par):
+            continue
+        ref = (str(prov).zfill(2), str(muni).zfill(3), str(agr or 0), str(zon or 0), str(pol), str(par))
+        if ref[0] != pr or (mu and ref[1] != mu):
+            continue
+        referencias.setdefault(ref_key("ref", *ref), ref)
+    return list(referencias.values())[:limite]
+
+
+async def _run_prewarm_job(ctx: JobContext) -> dict:
+    """Handler del worker de jobs: precarga municipios, referencias y teselas."""
+    provincia = str(ctx.params["provincia"])
+    municipio = ctx.params.get("municipio")
+    pr = provincia.zfill(2)
+    resumen = {"provincia": pr, "municipio": municipio, "referencias": 0, "teselas": 0, "errores": 0}
+
+    await sigpac_get_json(f"municipios:{pr}", f"{SIGPAC_REST_BASE}/municipios/{pr}.json", timeout=10.0, refresh=True)
+    referencias = await _referencias_conocidas(provincia, municipio, int(ctx.params.get("max_referencias", 500)))
+    semaforo = asyncio.Semaphore(SIGPAC_PREWARM_CONCURRENCY)
+
+    async def precargar(ref: tuple) -> None:
+        base = f"{SIGPAC_REST_BASE}/refcatparcela/{'/'.join(ref)}"
+        async with semaforo:
+            try:
+                await sigpac_get_json(ref_key("refcat.json", *ref), f"{base}.json", timeout=15.0, refresh=True,
+                                      headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+                status, geojson = await sigpac_get_json(ref_key("refcat.geojson", *ref), f"{base}.geojson",
+                                                        timeout=15.0, refresh=True,
+                                                        headers={"Accept": "application/geo+json"})
+                resumen["referencias"] += 1
+                features = geojson.get("features", []) if status == 200 and isinstance(geojson, dict) else []
+                for feat in features:
+                    for tile in geometry_tiles(feat.get("geometry")):
+                        await _consultar_tesela((tile[1] + tile[3]) / 2, (tile[0] + tile[2]) / 2, refresh=True)
+                        resumen["teselas"] += 1
+            except Exception as e:
+                resumen["errores"] += 1
+                print(f"[SIGPAC Cache] Prewarm failed for {'/'.join(ref)}: {e}")
+
+    total = len(referencias)
+    for i in range(0, total, SIGPAC_PREWARM_CONCURRENCY * 5):
+        await asyncio.gather(*(precargar(ref) for ref in referencias[i:i + SIGPAC_PREWARM_CONCURRENCY * 5]))
+        await ctx.progress(min(i + SIGPAC_PREWARM_CONCURRENCY * 5, total), total, f"{resumen['teselas']} teselas")
+    return resumen
+
+
+register_job_handler(SIGPAC_PREWARM_JOB_KIND, _run_prewarm_job)
+
+
+def _require_admin(current_user: dict) -> None:
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden gestionar la cache SIGPAC")
+
+
+@router.post("/cache/prewarm", status_code=202)
+async def precalentar_cache_sigpac(
+    data: SIGPACPrewarm,
+    current_user: dict = Depends(get_current_user),
+):
+    """Precargar en cache las referencias SIGPAC conocidas de una provincia o municipio (en segundo plano)"""
+    _require_admin(current_user)
+    params = {"provincia": data.provincia, "municipio": data.municipio, "max_referencias": data.max_referencias}
+    job = await submit_job(SIGPAC_PREWARM_JOB_KIND, params, current_user)
+    return serialize_job(job)
+
+
+@router.get("/cache/prewarm/{job_id}")
+async def estado_precalentamiento(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Estado y resumen de un precalentamiento de la cache"""
+    _require_admin(current_user)
+    job = await get_job(job_id)
+    if not job or job.get("kind") != SIGPAC_PREWARM_JOB_KIND:
+        raise HTTPException(status_code=404, detail="Precalentamiento no encontrado")
+    return serialize_job(job)
+
+
+@router.get("/cache/stats")
+async def estadisticas_cache_sigpac(current_user: dict = Depends(get_current_user)):
+    """Aciertos, fallos y tamano de la cache SIGPAC"""
+    return {
+        "success": True,
+        **get_sigpac_cache_stats(),
+        "mongo_entries": await cache_collection.estimated_document_count(),
+    }
+
+
+@router.delete("/cache")
+async def vaciar_cache_sigpac(current_user: dict = Depends(get_current_user)):
+    """Vaciar la cache SIGPAC (memoria de este proceso y coleccion compartida)"""
+    _require_admin(current_user)
+    borradas = await clear_sigpac_cache()
+    return {"success": True, "borradas": borradas}
@@ -5,6 +5,10 @@ Exposes lightweight, public information about the running deployment so the
 frontend can display a "version badge" in the header (last deploy date, commit
 hash, etc.). Intentionally read-only and unauthenticated (only public metadata
 is returned — no secrets, paths, or stack info).
+
+The exceptions are `/render-metrics`, which requires an authenticated user
+and reports the state of the shared export render pool, and `/indexes`
+(Admin only), which reports MongoDB index drift.
 """
 
 import os
@@ -12,7 +16,15 @@ import subprocess
 from datetime import datetime, timezone
 from functools import lru_cache
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+
+from rbac_guards import get_current_user
+from services.http_clients import get_http_metrics
+from services.index_registry import ensure_indexes, get_index_report
+from services.map_render_cache import get_map_cache_stats
+from services.pdf_cache import get_pdf_cache_stats
+from services.render_service import get_render_metrics
+from services.weather_service import get_weather_cache_stats
 
 router = APIRouter(prefix="/api/system", tags=["system"])
 
@@ -62,3 +74,52 @@ def _build_version_payload() -> dict:
 async def get_version() -> dict:
     """Return public deploy metadata for the version badge."""
     return _build_version_payload()
+
+
+@router.get("/render-metrics")
+async def get_render_pool_metrics(current_user: dict = Depends(get_current_user)) -> dict:
+    """Queue depth, throughput and timings of the shared PDF/Excel render pool."""
+    return get_render_metrics()
+
+
+@router.get("/weather-cache")
+async def get_weather_cache_metrics(current_user: dict = Depends(get_current_user)) -> dict:
+    """Hit/miss counters and size of the per-grid-cell weather cache."""
+    return get_weather_cache_stats()
+
+
+@router.get("/http-clients")
+async def get_http_client_metrics(current_user: dict = Depends(get_current_user)) -> dict:
+    """Requests, retries and latency of the shared outbound HTTP clients."""
+    return get_http_metrics()
+
+
+@router.get("/map-cache")
+async def get_map_cache_metrics(current_user: dict = Depends(get_current_user)) -> dict:
+    """Size, hits and evictions of the satellite tile and rendered parcel-map caches."""
+    return get_map_cache_stats()
+
+
+@router.get("/pdf-cache")
+async def get_pdf_cache_metrics(current_user: dict = Depends(get_current_user)) -> dict:
+    """Entries, size and hit rate of the cache of generated evaluación PDFs."""
+    return await get_pdf_cache_stats()
+
+
+def _require_admin(current_user: dict) -> None:
+    if current_user.get("role") != "Admin":
+        raise HTTPException(status_code=403, detail="Only admins can inspect database indexes")
+
+
+@router.get("/indexes")
+async def get_indexes_report(current_user: dict = Depends(get_current_user)) -> dict:
+    """Last index drift report produced at startup (declared vs existing indexes)."""
+    _require_admin(current_user)
+    return get_index_report() or {"checked_at": None, "message": "Index check still running"}
+
+
+@router.post("/indexes/ensure")
+async def run_indexes_check(current_user: dict = Depends(get_current_user)) -> dict:
+    """Re-run the index registry now: create missing indexes and report drift."""
+    _require_admin(current_user)
+    return await ensure_indexes()
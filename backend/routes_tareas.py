@@ -19,6 +19,9 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireTareasAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
 
 router = APIRouter(prefix="/api", tags=["tareas"])
 
@@ -62,6 +65,7 @@ async def create_tarea(
     })
     
     result = await tareas_collection.insert_one(tarea_dict)
+    await record_kpi_insert("tareas", tarea_dict)
     created = await tareas_collection.find_one({"_id": result.inserted_id})
     
     return {"success": True, "data": serialize_doc(created)}
@@ -318,10 +322,11 @@ async def update_tarea(
     
     tarea_dict["updated_at"] = datetime.now()
     
-    result = await tareas_collection.update_one(
-        {"_id": ObjectId(tarea_id)},
-        {"$set": tarea_dict}
-    )
+    async with track_kpi_change("tareas", tarea_id):
+        result = await tareas_collection.update_one(
+            {"_id": ObjectId(tarea_id)},
+            {"$set": tarea_dict}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
@@ -350,10 +355,11 @@ async def update_tarea_estado(
         update_data["realizada"] = True
         update_data["fecha_completada"] = datetime.now().strftime("%Y-%m-%d")
     
-    result = await tareas_collection.update_one(
-        {"_id": ObjectId(tarea_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("tareas", tarea_id):
+        result = await tareas_collection.update_one(
+            {"_id": ObjectId(tarea_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
@@ -389,10 +395,11 @@ async def toggle_subtarea(
                 st["completada_fecha"] = None
             break
     
-    await tareas_collection.update_one(
-        {"_id": ObjectId(tarea_id)},
-        {"$set": {"subtareas": subtareas, "updated_at": datetime.now()}}
-    )
+    async with track_kpi_change("tareas", tarea_id):
+        await tareas_collection.update_one(
+            {"_id": ObjectId(tarea_id)},
+            {"$set": {"subtareas": subtareas, "updated_at": datetime.now()}}
+        )
     
     return {"success": True, "subtareas": subtareas}
 
@@ -406,7 +413,8 @@ async def delete_tarea(
     if not ObjectId.is_valid(tarea_id):
         raise HTTPException(status_code=400, detail="ID de tarea inválido")
     
-    result = await tareas_collection.delete_one({"_id": ObjectId(tarea_id)})
+    async with track_kpi_change("tareas", tarea_id):
+        result = await tareas_collection.delete_one({"_id": ObjectId(tarea_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
@@ -426,63 +434,37 @@ async def export_tareas_excel(
     _access: dict = Depends(RequireTareasAccess)
 ):
     """Export tasks to Excel"""
-    try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill, Alignment
-    except ImportError:
-        raise HTTPException(status_code=500, detail="openpyxl not installed")
-    
     query = {}
     if estado:
         query["estado"] = estado
     if prioridad:
         query["prioridad"] = prioridad
     
-    tareas = await tareas_collection.find(query).to_list(1000)
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Tareas"
-    
-    # Headers
-    headers = ["Nombre", "Tipo", "Prioridad", "Estado", "Asignado a", "Fecha Inicio", "Fecha Vencimiento", "Cultivo", "Campaña", "Coste Est.", "Coste Real", "Observaciones"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="2d5a27", end_color="2d5a27", fill_type="solid")
-        cell.font = Font(bold=True, color="FFFFFF")
-    
-    # Data
-    for row, tarea in enumerate(tareas, 2):
-        ws.cell(row=row, column=1, value=tarea.get("nombre", ""))
-        ws.cell(row=row, column=2, value=tarea.get("tipo_tarea", "general"))
-        ws.cell(row=row, column=3, value=tarea.get("prioridad", "media"))
-        ws.cell(row=row, column=4, value=tarea.get("estado", "pendiente"))
-        ws.cell(row=row, column=5, value=tarea.get("asignado_nombre", ""))
-        ws.cell(row=row, column=6, value=tarea.get("fecha_inicio", ""))
-        ws.cell(row=row, column=7, value=tarea.get("fecha_vencimiento", ""))
-        ws.cell(row=row, column=8, value=tarea.get("cultivo", ""))
-        ws.cell(row=row, column=9, value=tarea.get("campana", ""))
-        ws.cell(row=row, column=10, value=tarea.get("coste_estimado", 0))
-        ws.cell(row=row, column=11, value=tarea.get("coste_real", 0))
-        ws.cell(row=row, column=12, value=tarea.get("observaciones", ""))
-    
-    # Auto-width columns
-    for col in ws.columns:
-        max_length = max(len(str(cell.value or "")) for cell in col)
-        ws.column_dimensions[col[0].column_letter].width = min(max_length + 2, 50)
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    filename = f"tareas_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    xl = ExcelExport(header_color="2d5a27")
+    ws = xl.add_sheet(
+        "Tareas",
+        ["Nombre", "Tipo", "Prioridad", "Estado", "Asignado a", "Fecha Inicio", "Fecha Vencimiento", "Cultivo", "Campaña", "Coste Est.", "Coste Real", "Observaciones"],
+        widths=[30, 14, 11, 12, 22, 14, 18, 16, 11, 12, 12, 50],
     )
+    await ws.write(
+        tareas_collection.find(query),
+        lambda tarea: [
+            tarea.get("nombre", ""),
+            tarea.get("tipo_tarea", "general"),
+            tarea.get("prioridad", "media"),
+            tarea.get("estado", "pendiente"),
+            tarea.get("asignado_nombre", ""),
+            tarea.get("fecha_inicio", ""),
+            tarea.get("fecha_vencimiento", ""),
+            tarea.get("cultivo", ""),
+            tarea.get("campana", ""),
+            tarea.get("coste_estimado", 0),
+            tarea.get("coste_real", 0),
+            tarea.get("observaciones", ""),
+        ],
+    )
+    
+    return await xl.response(f"tareas_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 
@@ -540,7 +522,7 @@ async def export_tareas_pdf(
     ]))
     elements.append(doc_table)
     
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"tareas_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
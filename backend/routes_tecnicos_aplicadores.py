@@ -16,6 +16,8 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     get_current_user
 )
+from services.excel_export import ExcelExport
+from services.render_service import build_pdf
 
 router = APIRouter(prefix="/api", tags=["tecnicos_aplicadores"])
 
@@ -355,51 +357,24 @@ async def export_tecnicos_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Export tecnicos aplicadores to Excel"""
-    from fastapi.responses import StreamingResponse
-    import io as _io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
-    tecnicos_list = await tecnicos_aplicadores_collection.find({}).sort("nombre", 1).to_list(5000)
-    tecnicos_raw = serialize_docs(tecnicos_list)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Tecnicos Aplicadores"
-
-    headers = ["Nombre", "Apellidos", "DNI/NIE", "Nivel", "N Carnet", "Caducidad Carnet", "Telefono", "Email", "Activo"]
-    header_fill = PatternFill(start_color="E65100", end_color="E65100", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-
-    for idx, t in enumerate(tecnicos_raw, 2):
-        row = [
+    def tecnico_row(doc):
+        t = serialize_doc(doc)
+        return [
             t.get("nombre", ""), t.get("apellidos", ""), t.get("dni_nie", ""),
             t.get("nivel_capacitacion", ""), t.get("numero_carnet", ""),
             t.get("fecha_caducidad_carnet", "")[:10] if t.get("fecha_caducidad_carnet") else "",
             t.get("telefono", ""), t.get("email", ""),
             "Si" if t.get("activo") else "No"
         ]
-        for col, val in enumerate(row, 1):
-            cell = ws.cell(row=idx, column=col, value=val)
-            cell.border = thin_border
 
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[chr(64 + col)].width = 20
-
-    output = _io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"tecnicos_aplicadores_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    xl = ExcelExport(header_color="E65100")
+    ws = xl.add_sheet(
+        "Tecnicos Aplicadores",
+        ["Nombre", "Apellidos", "DNI/NIE", "Nivel", "N Carnet", "Caducidad Carnet", "Telefono", "Email", "Activo"],
+        widths=20,
+    )
+    await ws.write(tecnicos_aplicadores_collection.find({}).sort("nombre", 1), tecnico_row)
+    return await xl.response(f"tecnicos_aplicadores_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/tecnicos-aplicadores/export/pdf")
@@ -452,7 +427,7 @@ async def export_tecnicos_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"tecnicos_aplicadores_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -9,13 +9,14 @@ from datetime import datetime, timezone
 from bson import ObjectId
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from services.query_monitor import mongo_event_listeners
 
 router = APIRouter(prefix="/api/translations", tags=["translations"])
 
 # MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL')
 DB_NAME = os.environ.get('DB_NAME', 'fruveco_db')
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=mongo_event_listeners())
 db = client[DB_NAME]
 
 # Supported languages
@@ -18,6 +18,10 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireTratamientosAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
+from services.kpi_snapshots import record_kpi_insert, track_kpi_change
+from services.pagination import paginate
 
 router = APIRouter(prefix="/api", tags=["tratamientos"])
 
@@ -91,6 +95,7 @@ async def create_tratamiento(
     })
     
     result = await tratamientos_collection.insert_one(tratamiento_dict)
+    await record_kpi_insert("tratamientos", tratamiento_dict)
     created = await tratamientos_collection.find_one({"_id": result.inserted_id})
     
     return {"success": True, "data": serialize_doc(created)}
@@ -100,6 +105,8 @@ async def create_tratamiento(
 async def get_tratamientos(
     skip: int = 0,
     limit: int = 10000,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     parcela_id: Optional[str] = None,
     campana: Optional[str] = None,
     cultivo_id: Optional[str] = None,
@@ -119,8 +126,9 @@ async def get_tratamientos(
     
     # Orden por created_at DESC (mas nuevos primero). Fallback a _id para
     # documentos sin created_at (compatible con MongoDB monotonico por _id).
-    tratamientos = await tratamientos_collection.find(query).sort([("created_at", -1), ("_id", -1)]).skip(skip).limit(limit).to_list(limit)
-    return {"tratamientos": serialize_docs(tratamientos), "total": await tratamientos_collection.count_documents(query)}
+    page = await paginate(tratamientos_collection, query, [("created_at", -1), ("_id", -1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"tratamientos": serialize_docs(page["items"]), "total": page["total"], "next_cursor": page["next_cursor"]}
 
 
 @router.get("/tratamientos/{tratamiento_id}")
@@ -160,10 +168,11 @@ async def update_tratamiento(
     update_data["maquina_nombre"] = maquina_nombre
     update_data["updated_at"] = datetime.now()
     
-    result = await tratamientos_collection.update_one(
-        {"_id": ObjectId(tratamiento_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("tratamientos", tratamiento_id):
+        result = await tratamientos_collection.update_one(
+            {"_id": ObjectId(tratamiento_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Tratamiento not found")
@@ -181,7 +190,8 @@ async def delete_tratamiento(
     if not ObjectId.is_valid(tratamiento_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    result = await tratamientos_collection.delete_one({"_id": ObjectId(tratamiento_id)})
+    async with track_kpi_change("tratamientos", tratamiento_id):
+        result = await tratamientos_collection.delete_one({"_id": ObjectId(tratamiento_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Tratamiento not found")
@@ -223,10 +233,11 @@ async def update_tratamiento_estado(
         update_data["realizado"] = False
         update_data["cancelado"] = False
     
-    result = await tratamientos_collection.update_one(
-        {"_id": ObjectId(tratamiento_id)},
-        {"$set": update_data}
-    )
+    async with track_kpi_change("tratamientos", tratamiento_id):
+        result = await tratamientos_collection.update_one(
+            {"_id": ObjectId(tratamiento_id)},
+            {"$set": update_data}
+        )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Tratamiento not found")
@@ -414,49 +425,15 @@ async def export_tratamientos_excel(
     """
     Exportar tratamientos a Excel.
     """
-    from io import BytesIO
-    from fastapi.responses import StreamingResponse
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    
     query = {}
     if campana:
         query["campana"] = campana
     
-    tratamientos = await tratamientos_collection.find(query).sort("fecha_tratamiento", -1).to_list(1000)
-    
-    # Create workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Tratamientos"
-    
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="1a5276", end_color="1a5276", fill_type="solid")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Headers
-    headers = ["Fecha", "Tipo", "Subtipo", "Parcelas", "Cultivo", "Campaña", 
-               "Producto", "Dosis", "Superficie (ha)", "Aplicador", "Realizado"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-    
-    # Data rows
-    for row, t in enumerate(tratamientos, 2):
+    def to_row(t):
         parcelas = ", ".join(t.get("parcelas_ids", [])[:3])
         if len(t.get("parcelas_ids", [])) > 3:
             parcelas += "..."
-        
-        data = [
+        return [
             t.get("fecha_tratamiento", ""),
             t.get("tipo_tratamiento", ""),
             t.get("subtipo", ""),
@@ -469,35 +446,18 @@ async def export_tratamientos_excel(
             t.get("aplicador_nombre", ""),
             "Sí" if t.get("realizado") else "No"
         ]
-        for col, value in enumerate(data, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='left')
-    
-    # Adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        ws.column_dimensions[column].width = min(max_length + 2, 40)
-    
-    # Save to buffer
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"tratamientos_{campana or 'todos'}_{datetime.now().strftime('%Y%m%d')}.xlsx"
     
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    xl = ExcelExport(header_color="1a5276")
+    ws = xl.add_sheet(
+        "Tratamientos",
+        ["Fecha", "Tipo", "Subtipo", "Parcelas", "Cultivo", "Campaña",
+         "Producto", "Dosis", "Superficie (ha)", "Aplicador", "Realizado"],
+        widths=[12, 16, 16, 30, 16, 12, 30, 14, 14, 22, 10],
     )
+    await ws.write(tratamientos_collection.find(query).sort("fecha_tratamiento", -1), to_row)
+    
+    filename = f"tratamientos_{campana or 'todos'}_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return await xl.response(filename)
 
 
 @router.get("/tratamientos/export/pdf")
@@ -556,7 +516,7 @@ async def export_tratamientos_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"tratamientos_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
@@ -18,6 +18,8 @@ from rbac_guards import (
     RequireCreate, RequireEdit, RequireDelete,
     RequireVisitasAccess, get_current_user
 )
+from services.render_service import build_pdf
+from services.excel_export import ExcelExport
 
 router = APIRouter(prefix="/api", tags=["visitas"])
 
@@ -303,54 +305,27 @@ async def export_visitas_excel(
     current_user: dict = Depends(get_current_user)
 ):
     """Export visitas to Excel"""
-    from fastapi.responses import StreamingResponse
-    import io as _io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
     query = {}
     if campana:
         query["campana"] = campana
 
-    visitas_list = await visitas_collection.find(query).sort("fecha", -1).to_list(5000)
-    visitas_raw = serialize_docs(visitas_list)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Visitas"
-
-    headers = ["Fecha", "Parcela", "Proveedor", "Cultivo", "Campaña", "Objetivo", "Observaciones", "Estado Cultivo"]
-    header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-
-    for idx, v in enumerate(visitas_raw, 2):
-        row = [
+    def to_row(v):
+        v = serialize_doc(v)
+        return [
             v.get("fecha", "")[:10] if v.get("fecha") else "",
             v.get("parcela_codigo", v.get("codigo_plantacion", "")),
             v.get("proveedor", ""), v.get("cultivo", ""), v.get("campana", ""),
-            v.get("objetivo", ""), v.get("observaciones", "")[:100], v.get("estado_cultivo", "")
+            v.get("objetivo", ""), (v.get("observaciones") or "")[:100], v.get("estado_cultivo", "")
         ]
-        for col, val in enumerate(row, 1):
-            cell = ws.cell(row=idx, column=col, value=val)
-            cell.border = thin_border
 
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[chr(64 + col)].width = 18
+    xl = ExcelExport(header_color="2E7D32")
+    ws = xl.add_sheet(
+        "Visitas",
+        ["Fecha", "Parcela", "Proveedor", "Cultivo", "Campaña", "Objetivo", "Observaciones", "Estado Cultivo"],
+    )
+    await ws.write(visitas_collection.find(query).sort("fecha", -1), to_row)
 
-    output = _io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    filename = f"visitas_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return await xl.response(f"visitas_{datetime.now().strftime('%Y%m%d')}.xlsx")
 
 
 @router.get("/visitas/export/pdf")
@@ -406,7 +381,7 @@ async def export_visitas_pdf(
     ]))
     elements.append(doc_table)
 
-    pdf.build(elements)
+    await build_pdf(pdf, elements)
     output.seek(0)
     filename = f"visitas_{datetime.now().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(output, media_type="application/pdf",
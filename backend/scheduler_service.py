@@ -10,6 +10,12 @@ from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime
 import asyncio
 
+from services.scheduler_leader import (
+    start_leader_election,
+    stop_leader_election,
+    track_job_run,
+)
+
 scheduler = AsyncIOScheduler()
 
 # Flag to track if scheduler is initialized
@@ -18,11 +24,8 @@ _scheduler_initialized = False
 
 async def scheduled_climate_check():
     """Wrapper function to run the scheduled climate check"""
-    try:
-        from routes_notificaciones import ejecutar_verificacion_clima_programada
-        await ejecutar_verificacion_clima_programada()
-    except Exception as e:
-        print(f"[Scheduler Error] Climate check failed: {e}")
+    from routes_notificaciones import ejecutar_verificacion_clima_programada
+    await track_job_run('climate_check', ejecutar_verificacion_clima_programada)
 
 
 def run_async_task(coro):
@@ -46,17 +49,16 @@ def sync_climate_check():
 def cleanup_pdf_map_tempfiles():
     """
     Elimina PNGs de mapas satelitales (Cuaderno de Campo PDF) con >1h de
-    antigüedad en /app/uploads/evaluaciones/pdf_maps/. Estos archivos son
-    temporales — se generan durante `generate_evaluacion_pdf` y se borran
-    en el `finally` inmediato. Este job es solo red de seguridad para
-    orfanatos cuando el PDF falla antes del cleanup inline.
+    antigüedad en /app/uploads/evaluaciones/pdf_maps/. `generate_evaluacion_pdf`
+    ya no escribe ahí (usa la caché acotada de `services/map_render_cache.py`);
+    el job queda para retirar los PNG temporales de versiones anteriores.
     """
     import os
     import time
 
     map_dir = "/app/uploads/evaluaciones/pdf_maps"
     if not os.path.isdir(map_dir):
-        return
+        return 0
 
     cutoff = time.time() - 3600  # 1 hora
     removed = 0
@@ -72,6 +74,68 @@ def cleanup_pdf_map_tempfiles():
             print(f"[PDF Cleanup] failed for {path}: {e}")
     if removed:
         print(f"[PDF Cleanup] removed {removed} orphaned map tempfile(s) from {map_dir}")
+    return removed
+
+
+async def scheduled_pdf_map_cleanup():
+    """Limpieza de PNGs temporales de mapas (en un hilo: recorre el disco)."""
+    await track_job_run('pdf_map_cleanup', lambda: asyncio.to_thread(cleanup_pdf_map_tempfiles))
+
+
+def sync_pdf_map_cleanup():
+    """Sync wrapper for the PDF map tempfiles cleanup."""
+    run_async_task(scheduled_pdf_map_cleanup())
+
+
+async def scheduled_purge_expired_jobs():
+    """Elimina jobs en segundo plano caducados y sus ficheros de GridFS."""
+    from services.job_service import purge_expired_jobs
+
+    async def run():
+        removed = await purge_expired_jobs()
+        if removed:
+            print(f"[Jobs Cleanup] removed {removed} expired job(s)")
+        return removed
+
+    await track_job_run('expired_jobs_cleanup', run)
+
+
+def sync_purge_expired_jobs():
+    """Sync wrapper for the async expired jobs cleanup."""
+    run_async_task(scheduled_purge_expired_jobs())
+
+
+async def scheduled_kpi_reconcile():
+    """Recalcula el snapshot de KPIs del dashboard y corrige la deriva."""
+    from services.kpi_snapshots import reconcile_kpi_snapshot
+    await track_job_run('kpi_snapshot_reconcile', reconcile_kpi_snapshot)
+
+
+def sync_kpi_reconcile():
+    """Sync wrapper for the async KPI snapshot reconciliation."""
+    run_async_task(scheduled_kpi_reconcile())
+
+
+async def scheduled_kpi_views_refresh():
+    """Refresca las vistas del snapshot de KPIs si están obsoletas o son de otro día."""
+    from services.kpi_snapshots import refresh_kpi_views
+    await track_job_run('kpi_views_refresh', refresh_kpi_views)
+
+
+def sync_kpi_views_refresh():
+    """Sync wrapper for the async KPI views refresh."""
+    run_async_task(scheduled_kpi_views_refresh())
+
+
+async def scheduled_albaranes_cube_rebuild():
+    """Reconstruye el cubo diario de albaranes (corrige la deriva incremental)."""
+    from services.albaranes_cube import rebuild_albaranes_cube
+    await track_job_run('albaranes_cube_rebuild', rebuild_albaranes_cube)
+
+
+def sync_albaranes_cube_rebuild():
+    """Sync wrapper for the async albaranes cube rebuild."""
+    run_async_task(scheduled_albaranes_cube_rebuild())
 
 
 # -----------------------------------------------------------------------------
@@ -82,59 +146,62 @@ def cleanup_pdf_map_tempfiles():
 # para que vuelvan a importar el listado oficial actualizado.
 async def scheduled_mapa_import_reminder():
     """Aviso semanal a Admin si la última importación MAPA es > 7 días."""
-    try:
-        from database import db
-        from routes_notificaciones import crear_notificacion_interna
+    await track_job_run('mapa_import_reminder', _mapa_import_reminder)
+
+
+async def _mapa_import_reminder():
+    """Devuelve el número de Admin avisados (0 si la importación es reciente)."""
+    from database import db
+    from routes_notificaciones import crear_notificacion_interna
+
+    # Considerar tanto `imported_at` (importaciones) como `updated_at` (cualquier cambio)
+    latest = await db.fitosanitarios.find_one(
+        {"imported_at": {"$exists": True}},
+        sort=[("imported_at", -1)],
+    )
+    last_import_at = latest.get("imported_at") if latest else None
+    days_since = None
+    if last_import_at:
+        delta = datetime.utcnow() - last_import_at
+        days_since = delta.days
 
-        # Considerar tanto `imported_at` (importaciones) como `updated_at` (cualquier cambio)
-        latest = await db.fitosanitarios.find_one(
-            {"imported_at": {"$exists": True}},
-            sort=[("imported_at", -1)],
+    # Recolectar IDs de admins para destinatarios
+    admin_ids = [
+        str(u["_id"]) async for u in db.users.find(
+            {"role": "Admin"}, {"_id": 1}
         )
-        last_import_at = latest.get("imported_at") if latest else None
-        days_since = None
-        if last_import_at:
-            delta = datetime.utcnow() - last_import_at
-            days_since = delta.days
-
-        # Recolectar IDs de admins para destinatarios
-        admin_ids = [
-            str(u["_id"]) async for u in db.users.find(
-                {"role": "Admin"}, {"_id": 1}
-            )
-        ]
-
-        if last_import_at is None:
-            titulo = "Importa el registro MAPA"
-            mensaje = (
-                "Aún no se ha realizado ninguna importación del registro oficial "
-                "MAPA de productos fitosanitarios. Visita Fitosanitarios → MAPA "
-                "para subir el listado actualizado."
-            )
-        elif days_since is not None and days_since >= 7:
-            titulo = f"Registro MAPA pendiente de actualizar ({days_since} días)"
-            mensaje = (
-                f"La última importación del registro oficial MAPA fue hace {days_since} "
-                "días. El MAPA actualiza su base de datos cada viernes a las 14:00. "
-                "Recomendado: vuelve a importar el listado en Fitosanitarios → MAPA."
-            )
-        else:
-            # Importación reciente — no avisar
-            print(f"[Scheduler] MAPA import OK ({days_since} día(s) desde la última)")
-            return
-
-        await crear_notificacion_interna(
-            titulo=titulo,
-            mensaje=mensaje,
-            tipo="warning",
-            enlace="/fitosanitarios",
-            destinatarios=admin_ids or None,
-            prioridad="alta",
-            datos_extra={"days_since_import": days_since, "kind": "mapa_import_reminder"},
+    ]
+
+    if last_import_at is None:
+        titulo = "Importa el registro MAPA"
+        mensaje = (
+            "Aún no se ha realizado ninguna importación del registro oficial "
+            "MAPA de productos fitosanitarios. Visita Fitosanitarios → MAPA "
+            "para subir el listado actualizado."
         )
-        print(f"[Scheduler] MAPA reminder sent to {len(admin_ids)} admin(s)")
-    except Exception as e:
-        print(f"[Scheduler Error] MAPA reminder failed: {e}")
+    elif days_since is not None and days_since >= 7:
+        titulo = f"Registro MAPA pendiente de actualizar ({days_since} días)"
+        mensaje = (
+            f"La última importación del registro oficial MAPA fue hace {days_since} "
+            "días. El MAPA actualiza su base de datos cada viernes a las 14:00. "
+            "Recomendado: vuelve a importar el listado en Fitosanitarios → MAPA."
+        )
+    else:
+        # Importación reciente — no avisar
+        print(f"[Scheduler] MAPA import OK ({days_since} día(s) desde la última)")
+        return 0
+
+    await crear_notificacion_interna(
+        titulo=titulo,
+        mensaje=mensaje,
+        tipo="warning",
+        enlace="/fitosanitarios",
+        destinatarios=admin_ids or None,
+        prioridad="alta",
+        datos_extra={"days_since_import": days_since, "kind": "mapa_import_reminder"},
+    )
+    print(f"[Scheduler] MAPA reminder sent to {len(admin_ids)} admin(s)")
+    return len(admin_ids)
 
 
 def sync_mapa_import_reminder():
@@ -189,6 +256,18 @@ async def update_scheduler_from_config():
         print(f"[Scheduler Error] Failed to configure job: {e}")
 
 
+def _on_leadership_change(leader: bool):
+    """Reanuda los jobs al obtener el lease y los pausa al perderlo."""
+    if not scheduler.running:
+        return
+    if leader:
+        scheduler.resume()
+        print("[Scheduler] Leader: jobs resumed")
+    else:
+        scheduler.pause()
+        print("[Scheduler] Not leader: jobs paused")
+
+
 def init_scheduler():
     """Initialize the scheduler on app startup"""
     global _scheduler_initialized
@@ -198,9 +277,12 @@ def init_scheduler():
     
     try:
         if not scheduler.running:
-            scheduler.start()
+            # Arranca en pausa: solo el proceso que obtiene el lease en Mongo
+            # (services/scheduler_leader.py) reanuda y ejecuta los jobs.
+            scheduler.start(paused=True)
+            start_leader_election(_on_leadership_change)
             _scheduler_initialized = True
-            print("[Scheduler] Started successfully")
+            print("[Scheduler] Started successfully (paused until leader election)")
             
             # Schedule initial config load
             async def load_config():
@@ -225,13 +307,54 @@ def init_scheduler():
             # Red de seguridad para orfanatos si el PDF genera errores
             # antes de llegar al `finally` de limpieza inline.
             scheduler.add_job(
-                cleanup_pdf_map_tempfiles,
+                sync_pdf_map_cleanup,
                 trigger=IntervalTrigger(hours=1),
                 id='pdf_map_cleanup',
                 name='PDF Map Tempfiles Cleanup',
                 replace_existing=True,
             )
             print("[Scheduler] PDF map tempfile cleanup scheduled: every 1h")
+
+            # Limpieza de jobs en segundo plano (exportaciones) caducados:
+            # borra el documento del job y su fichero de resultado en GridFS.
+            scheduler.add_job(
+                sync_purge_expired_jobs,
+                trigger=IntervalTrigger(hours=1),
+                id='expired_jobs_cleanup',
+                name='Expired Background Jobs Cleanup',
+                replace_existing=True,
+            )
+            print("[Scheduler] Expired background jobs cleanup scheduled: every 1h")
+
+            # Snapshot de KPIs del dashboard: reconciliación completa periódica
+            # (corrige la deriva de los contadores incrementales) y refresco de
+            # las vistas dependientes de la fecha.
+            from services.kpi_snapshots import KPI_RECONCILE_MINUTES
+            scheduler.add_job(
+                sync_kpi_reconcile,
+                trigger=IntervalTrigger(minutes=KPI_RECONCILE_MINUTES),
+                id='kpi_snapshot_reconcile',
+                name='KPI Snapshot Reconciliation',
+                replace_existing=True,
+            )
+            scheduler.add_job(
+                sync_kpi_views_refresh,
+                trigger=IntervalTrigger(minutes=1),
+                id='kpi_views_refresh',
+                name='KPI Snapshot Views Refresh',
+                replace_existing=True,
+            )
+            print(f"[Scheduler] KPI snapshot reconcile scheduled: every {KPI_RECONCILE_MINUTES}min")
+
+            # Cubo diario de albaranes (gastos/ingresos/comisiones): reconstrucción nocturna
+            scheduler.add_job(
+                sync_albaranes_cube_rebuild,
+                trigger=CronTrigger(hour=3, minute=30),
+                id='albaranes_cube_rebuild',
+                name='Albaranes Daily Cube Rebuild',
+                replace_existing=True,
+            )
+            print("[Scheduler] Albaranes cube rebuild scheduled: daily at 03:30")
             
     except Exception as e:
         print(f"[Scheduler Error] Failed to start: {e}")
@@ -241,6 +364,7 @@ def shutdown_scheduler():
     """Shutdown the scheduler gracefully"""
     global _scheduler_initialized
     
+    stop_leader_election()
     if scheduler.running:
         scheduler.shutdown(wait=False)
         _scheduler_initialized = False
@@ -9,6 +9,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from typing import Any, Dict
+import asyncio
 import os
 
 # Load environment
@@ -83,6 +84,13 @@ from routes_alertas import router as alertas_router
 from routes_user_config import router as user_config_router
 from routes_system import router as system_router
 from scheduler_service import init_scheduler, shutdown_scheduler
+from services.scheduler_leader import release_lease as release_scheduler_lease
+from services.render_service import shutdown_render_pool
+from services.http_clients import close_http_clients
+from services.job_service import start_job_worker, stop_job_worker
+from services.webhook_outbox import start_webhook_dispatcher, stop_webhook_dispatcher
+from services.index_registry import run_ensure_indexes
+from services.query_monitor import QueryMonitorMiddleware
 from database import db
 
 app = FastAPI(title="FRUVECO - Agricultural Management System V1")
@@ -96,10 +104,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Mongo query counter per request (headers in debug mode, log over budget)
+app.add_middleware(QueryMonitorMiddleware)
+
 # Startup/Shutdown events
 @app.on_event("startup")
 async def startup_event() -> None:
     init_scheduler()
+    start_job_worker()
+    start_webhook_dispatcher()
+    # Create missing MongoDB indexes in background (never blocks startup)
+    app.state.index_task = asyncio.create_task(run_ensure_indexes())
     # Initialize RRHH routes with database
     set_rrhh_db(db)
     # Seed tipos_cultivo if empty
@@ -116,6 +131,11 @@ async def startup_event() -> None:
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
     shutdown_scheduler()
+    await release_scheduler_lease()
+    stop_job_worker()
+    stop_webhook_dispatcher()
+    shutdown_render_pool()
+    await close_http_clients()
 
 # Include routers - Core modules
 app.include_router(auth_router)
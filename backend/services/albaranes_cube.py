@@ -0,0 +1,473 @@
+"""
+Albaranes Cube - Resumen diario pre-agregado de albaranes.
+
+Los informes de gastos, ingresos y el resumen de comisiones agrupan albaranes
+por fecha, campaña, proveedor/cliente, contrato, cultivo y parcela. En lugar de
+re-agregar `albaranes` en cada petición, este servicio mantiene la colección
+`albaranes_diario`: una fila por combinación de
+
+    (fecha, tipo, operacion, campana, proveedor, cliente, contrato_id,
+     cultivo, parcela_codigo, parcela_id)
+
+con las medidas `count`, `importe`, `kilos_brutos`, `kilos_destare`,
+`kilos_netos`, `kilos_comision` e `importe_comisionable` (las dos últimas son
+las bases de cálculo de `/api/comisiones/resumen`). `fecha` es el día
+(`YYYY-MM-DD`) y `operacion` es "compra" o "venta" según el tipo del albarán.
+
+Las rutas que crean, editan o borran albaranes (`routes_extended.py`,
+`routes_bulk.py`) aplican la diferencia con un `$inc` por fila afectada. Un job
+nocturno del scheduler y el script `scripts/rebuild_albaranes_cube.py`
+reconstruyen la colección desde cero (`rebuild_albaranes_cube`).
+
+La reconstrucción recorre `albaranes` por `_id` en páginas y publica en
+`albaranes_diario_rebuild_state` hasta dónde ha leído. Los cambios en albaranes
+ya leídos se aplican también a la colección temporal, que se construye solo con
+`$inc` y sustituye a la buena al final: así no se pierden las escrituras que
+llegan durante la reconstrucción (desde cualquier proceso).
+
+Uso en rutas:
+
+    await record_albaran_insert(albaran_dict)                 # tras insert_one
+    async with track_albaran_change(albaran_id):              # update/delete
+        await albaranes_collection.update_one(...)
+    await record_albaranes_change(before_docs, [])            # borrado masivo
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database import db
+from services.index_registry import INDEX_REGISTRY
+
+CUBE_COLLECTION = "albaranes_diario"
+albaranes_diario_collection = db[CUBE_COLLECTION]
+_rebuild_tmp = db[f"{CUBE_COLLECTION}_rebuild"]
+_rebuild_state = db[f"{CUBE_COLLECTION}_rebuild_state"]
+_REBUILD_STATE_ID = "rebuild"
+# Posición tras la última página: cualquier albarán (también los nuevos) ya cuenta como leído
+_SCAN_COMPLETE = ObjectId("f" * 24)
+_albaranes = db["albaranes"]
+
+DIMENSIONS = (
+    "fecha", "tipo", "operacion", "campana", "proveedor", "cliente",
+    "contrato_id", "cultivo", "parcela_codigo", "parcela_id",
+)
+MEASURES = (
+    "count", "importe", "kilos_brutos", "kilos_destare", "kilos_netos",
+    "kilos_comision", "importe_comisionable",
+)
+
+# Campos del albarán que intervienen en la fila del cubo
+CUBE_SOURCE_FIELDS = {
+    "fecha": 1, "fecha_albaran": 1, "tipo": 1, "tipo_albaran": 1, "campana": 1,
+    "proveedor": 1, "cliente": 1, "contrato_id": 1, "cultivo": 1,
+    "parcela_codigo": 1, "parcela_id": 1, "total_albaran": 1,
+    "kilos_brutos": 1, "kilos_destare": 1, "kilos_netos": 1,
+    "items.cantidad": 1, "items.es_destare": 1,
+}
+
+_TIPOS_VENTA = ("Venta", "Salida", "Albarán de venta", "Albaran de venta")
+_REBUILD_BATCH = 1000
+
+_rebuild_lock = asyncio.Lock()
+_cube_checked = False
+
+
+def _n(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0
+    return value
+
+
+def operacion_albaran(doc: Dict[str, Any]) -> str:
+    """"compra" o "venta" (mismo criterio que el cálculo de comisiones; por defecto compra)."""
+    tipo = (doc.get("tipo_albaran") or doc.get("tipo") or "")
+    tipo = tipo.strip() if isinstance(tipo, str) else ""
+    return "venta" if tipo in _TIPOS_VENTA else "compra"
+
+
+def kilos_comision(doc: Dict[str, Any]) -> float:
+    """Kilos netos del albarán; en el formato antiguo, suma de líneas no-destare."""
+    try:
+        kilos = float(doc.get("kilos_netos") or 0)
+    except (TypeError, ValueError):
+        kilos = 0.0
+    if kilos <= 0:
+        kilos = sum(
+            _n(item.get("cantidad"))
+            for item in doc.get("items") or []
+            if isinstance(item, dict) and not item.get("es_destare")
+        )
+    return kilos
+
+
+def cube_row(doc: Dict[str, Any]) -> Tuple[str, Dict[str, Any], Dict[str, float]]:
+    """`(_id, dimensiones, medidas)` de la fila a la que contribuye un albarán."""
+    fecha = doc.get("fecha") or doc.get("fecha_albaran") or ""
+    dims: Dict[str, Any] = {
+        "fecha": str(fecha)[:10],
+        "tipo": doc.get("tipo"),
+        "operacion": operacion_albaran(doc),
+    }
+    for field in DIMENSIONS[3:]:
+        dims[field] = doc.get(field)
+    row_id = hashlib.sha1(
+        json.dumps([dims[field] for field in DIMENSIONS], default=str).encode("utf-8")
+    ).hexdigest()
+
+    importe = _n(doc.get("total_albaran"))
+    kilos = kilos_comision(doc)
+    measures = {
+        "count": 1,
+        "importe": importe,
+        "kilos_brutos": _n(doc.get("kilos_brutos")),
+        "kilos_destare": _n(doc.get("kilos_destare")),
+        "kilos_netos": _n(doc.get("kilos_netos")),
+        "kilos_comision": kilos,
+        "importe_comisionable": importe if kilos > 0 else 0,
+    }
+    return row_id, dims, measures
+
+
+def _accumulate(
+    rows: Dict[str, Tuple[Dict[str, Any], Dict[str, float]]],
+    docs: Iterable[Optional[Dict[str, Any]]],
+    sign: int,
+) -> None:
+    for doc in docs:
+        if not doc:
+            continue
+        row_id, dims, measures = cube_row(doc)
+        if row_id not in rows:
+            rows[row_id] = (dims, {m: 0 for m in MEASURES})
+        acc = rows[row_id][1]
+        for m, value in measures.items():
+            acc[m] += sign * value
+
+
+def _delta_rows(
+    before: Iterable[Optional[Dict[str, Any]]],
+    after: Iterable[Optional[Dict[str, Any]]],
+) -> Dict[str, Tuple[Dict[str, Any], Dict[str, float]]]:
+    """Filas con la contribución de `after` menos la de `before` (sin las que quedan a cero)."""
+    rows: Dict[str, Tuple[Dict[str, Any], Dict[str, float]]] = {}
+    _accumulate(rows, before, -1)
+    _accumulate(rows, after, 1)
+    return {row_id: row for row_id, row in rows.items() if any(row[1].values())}
+
+
+async def _inc_rows(collection: Any, rows: Dict[str, Tuple[Dict[str, Any], Dict[str, float]]]) -> None:
+    ops = [
+        UpdateOne({"_id": row_id}, {"$inc": measures, "$setOnInsert": dims}, upsert=True)
+        for row_id, (dims, measures) in rows.items()
+    ]
+    for i in range(0, len(ops), _REBUILD_BATCH):
+        await collection.bulk_write(ops[i:i + _REBUILD_BATCH], ordered=False)
+
+
+# ============================================================================
+# Mantenimiento incremental
+# ============================================================================
+
+async def record_albaranes_change(
+    before: Iterable[Optional[Dict[str, Any]]],
+    after: Iterable[Optional[Dict[str, Any]]],
+) -> None:
+    """Resta la contribución de `before` y suma la de `after` (un bulk_write)."""
+    before, after = list(before), list(after)
+    changed = _delta_rows(before, after)
+    if not changed:
+        return
+    try:
+        await _inc_rows(albaranes_diario_collection, changed)
+        await albaranes_diario_collection.delete_many(
+            {"_id": {"$in": list(changed)}, "count": {"$lte": 0}}
+        )
+        await _record_during_rebuild(before, after)
+    except Exception as e:
+        # El cubo nunca debe romper la escritura del albarán; la reconstrucción corrige
+        print(f"[Albaranes Cube] incremental update failed: {e}")
+
+
+async def _record_during_rebuild(
+    before: List[Optional[Dict[str, Any]]],
+    after: List[Optional[Dict[str, Any]]],
+) -> None:
+    """Con una reconstrucción en curso, aplica también al temporal los cambios en
+    albaranes que ya ha leído (los que aún no ha leído los verá con su valor nuevo)."""
+    state = await _rebuild_state.find_one({"_id": _REBUILD_STATE_ID})
+    position = state.get("position") if state else None
+    if position is None:
+        return
+
+    def scanned(doc: Optional[Dict[str, Any]]) -> bool:
+        doc_id = doc.get("_id") if doc else None
+        return isinstance(doc_id, ObjectId) and doc_id <= position
+
+    rows = _delta_rows([d for d in before if scanned(d)], [d for d in after if scanned(d)])
+    if rows:
+        await _inc_rows(_rebuild_tmp, rows)
+
+
+async def record_albaran_insert(doc: Dict[str, Any]) -> None:
+    await record_albaranes_change([], [doc])
+
+
+@asynccontextmanager
+async def track_albaran_change(albaran_id: Any) -> AsyncIterator[None]:
+    """Lee el albarán antes y después del bloque y aplica la diferencia al cubo."""
+    if isinstance(albaran_id, str):
+        albaran_id = ObjectId(albaran_id) if ObjectId.is_valid(albaran_id) else None
+    if albaran_id is None:
+        yield
+        return
+    before = await _albaranes.find_one({"_id": albaran_id}, CUBE_SOURCE_FIELDS)
+    try:
+        yield
+    finally:
+        after = await _albaranes.find_one({"_id": albaran_id}, CUBE_SOURCE_FIELDS)
+        if before is not None or after is not None:
+            await record_albaranes_change([before], [after])
+
+
+async def load_cube_sources(object_ids: List[ObjectId]) -> List[Dict[str, Any]]:
+    """Campos de cubo de varios albaranes (antes de un borrado masivo)."""
+    if not object_ids:
+        return []
+    return await _albaranes.find({"_id": {"$in": object_ids}}, CUBE_SOURCE_FIELDS).to_list(None)
+
+
+# ============================================================================
+# Reconstrucción
+# ============================================================================
+
+async def rebuild_albaranes_cube() -> Dict[str, Any]:
+    """Recalcula el cubo desde `albaranes` y lo sustituye de forma atómica (rename).
+
+    Las escrituras concurrentes no se pierden: ver `_record_during_rebuild`.
+    """
+    async with _rebuild_lock:
+        started = datetime.now(timezone.utc)
+        await _rebuild_tmp.drop()
+        await _rebuild_state.replace_one(
+            {"_id": _REBUILD_STATE_ID}, {"position": None, "started_at": started}, upsert=True
+        )
+        try:
+            albaranes = 0
+            last_id = None
+            while True:
+                query: Dict[str, Any] = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                page = await _albaranes.find(query, CUBE_SOURCE_FIELDS).sort("_id", 1).limit(_REBUILD_BATCH).to_list(None)
+                albaranes += len(page)
+                if page:
+                    last_id = page[-1]["_id"]
+                # Desde aquí, los cambios en albaranes de esta página van también al temporal
+                position = last_id if len(page) == _REBUILD_BATCH else _SCAN_COMPLETE
+                await _rebuild_state.update_one({"_id": _REBUILD_STATE_ID}, {"$set": {"position": position}})
+                rows: Dict[str, Tuple[Dict[str, Any], Dict[str, float]]] = {}
+                _accumulate(rows, page, 1)
+                await _inc_rows(_rebuild_tmp, rows)
+                if position == _SCAN_COMPLETE:
+                    break
+
+            await _rebuild_tmp.delete_many({"count": {"$lte": 0}})
+            total_rows = await _rebuild_tmp.count_documents({})
+            if total_rows:
+                await _rebuild_tmp.create_indexes([spec.to_model() for spec in INDEX_REGISTRY[CUBE_COLLECTION]])
+                await _rebuild_tmp.rename(CUBE_COLLECTION, dropTarget=True)
+            else:
+                await albaranes_diario_collection.delete_many({})
+        finally:
+            await _rebuild_state.delete_one({"_id": _REBUILD_STATE_ID})
+
+        elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+        print(f"[Albaranes Cube] rebuilt: {albaranes} albaranes -> {total_rows} rows in {elapsed:.1f}s")
+        return {"albaranes": albaranes, "rows": total_rows, "seconds": round(elapsed, 2)}
+
+
+async def ensure_albaranes_cube() -> None:
+    """Construye el cubo la primera vez que se consulta si aún no existe."""
+    global _cube_checked
+    if _cube_checked:
+        return
+    if await albaranes_diario_collection.estimated_document_count() == 0:
+        if await _albaranes.estimated_document_count() > 0 and not _rebuild_lock.locked():
+            await rebuild_albaranes_cube()
+    _cube_checked = True
+
+
+# ============================================================================
+# Consultas sobre el cubo ($match + $facet)
+# ============================================================================
+
+def cube_match(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    **dims: Any,
+) -> Dict[str, Any]:
+    """Filtro sobre las filas del cubo; las dimensiones vacías no filtran."""
+    match_query: Dict[str, Any] = {}
+    if fecha_desde or fecha_hasta:
+        match_query["fecha"] = {}
+        if fecha_desde:
+            match_query["fecha"]["$gte"] = fecha_desde
+        if fecha_hasta:
+            match_query["fecha"]["$lte"] = fecha_hasta
+    for field, value in dims.items():
+        if value:
+            match_query[field] = value
+    return match_query
+
+
+def _or_default(field: str, default: str) -> Dict[str, Any]:
+    """`doc.get(field) or default` (vacío/null/ausente → default)."""
+    return {"$cond": [{"$in": [{"$ifNull": [f"${field}", ""]}, ["", False]]}, default, f"${field}"]}
+
+
+def _to_object_id(expr: Any) -> Dict[str, Any]:
+    """Convierte un id guardado como string en ObjectId (null si no es válido)."""
+    return {"$convert": {"input": expr, "to": "objectId", "onError": None, "onNull": None}}
+
+
+_FECHAS = {
+    "primer_albaran": {"$min": "$fecha"},
+    "ultimo_albaran": {"$max": "$fecha"},
+}
+
+_BASE = {
+    "total": {"$sum": "$importe"},
+    "count": {"$sum": "$count"},
+}
+
+_SORT_TOTAL = {"$sort": {"total": -1, "_id": 1}}
+
+SIN_CULTIVO = "Sin cultivo"
+SIN_PARCELA = "Sin parcela"
+
+
+def _lookup_first(from_collection: str, local_expr: Any, as_field: str, fields: List[str]) -> List[dict]:
+    """`$lookup` por `_id` (id guardado como string) quedándose solo con `fields`."""
+    return [
+        {"$addFields": {"_lookup_oid": _to_object_id(local_expr)}},
+        {"$lookup": {
+            "from": from_collection,
+            "localField": "_lookup_oid",
+            "foreignField": "_id",
+            "as": as_field,
+        }},
+        {"$project": {"_lookup_oid": 0}},
+        {"$addFields": {
+            as_field: {"$map": {"input": f"${as_field}", "as": "d", "in": {
+                f: f"$$d.{f}" for f in fields
+            }}},
+        }},
+    ]
+
+
+def facet_totales(tercero: str, sin_tercero: str) -> List[dict]:
+    return [{"$group": {"_id": None, **_BASE}}]
+
+
+def facet_tercero(tercero: str, sin_tercero: str) -> List[dict]:
+    """Agrupación por proveedor (gastos) o cliente (ingresos)."""
+    return [
+        {"$group": {
+            "_id": _or_default(tercero, sin_tercero),
+            **_BASE,
+            "cultivos": {"$addToSet": "$cultivo"},
+            "contratos": {"$addToSet": "$contrato_id"},
+            **_FECHAS,
+        }},
+        _SORT_TOTAL,
+    ]
+
+
+def facet_contrato(tercero: str, sin_tercero: str) -> List[dict]:
+    return [
+        {"$sort": {"fecha": 1}},
+        {"$group": {
+            "_id": {"$ifNull": ["$contrato_id", None]},
+            **_BASE,
+            "tercero": {"$first": f"${tercero}"},
+            "tercero_resumen": {"$first": _or_default(tercero, sin_tercero)},
+            "cultivo": {"$first": "$cultivo"},
+            "campana": {"$first": "$campana"},
+            "parcela": {"$first": "$parcela_codigo"},
+            **_FECHAS,
+        }},
+        _SORT_TOTAL,
+        *_lookup_first("contratos", "$_id", "contrato",
+                       ["numero_contrato", "cultivo", "campana", "precio", "superficie", "cantidad"]),
+    ]
+
+
+def facet_cultivo(tercero: str, sin_tercero: str) -> List[dict]:
+    return [
+        {"$group": {
+            "_id": _or_default("cultivo", SIN_CULTIVO),
+            **_BASE,
+            "terceros": {"$addToSet": f"${tercero}"},
+            "parcelas": {"$addToSet": "$parcela_codigo"},
+            **_FECHAS,
+        }},
+        _SORT_TOTAL,
+    ]
+
+
+def facet_parcela(tercero: str, sin_tercero: str) -> List[dict]:
+    return [
+        {"$sort": {"fecha": 1}},
+        {"$group": {
+            "_id": _or_default("parcela_codigo", SIN_PARCELA),
+            **_BASE,
+            "cultivo": {"$first": "$cultivo"},
+            "cultivo_resumen": {"$first": _or_default("cultivo", SIN_CULTIVO)},
+            "tercero": {"$first": f"${tercero}"},
+            "campana": {"$first": "$campana"},
+            "parcela_id": {"$first": "$parcela_id"},
+            **_FECHAS,
+        }},
+        _SORT_TOTAL,
+        *_lookup_first("parcelas", "$parcela_id", "parcela_doc", ["superficie", "finca"]),
+    ]
+
+
+CUBE_FACETS = {
+    "totales": facet_totales,
+    "por_tercero": facet_tercero,
+    "por_contrato": facet_contrato,
+    "por_cultivo": facet_cultivo,
+    "por_parcela": facet_parcela,
+}
+
+
+def build_cube_pipeline(
+    match_query: Dict[str, Any], facets: List[str], tercero: str, sin_tercero: str
+) -> List[dict]:
+    """`$match` + `$facet` con las ramas pedidas (claves de CUBE_FACETS)."""
+    return [
+        {"$match": match_query},
+        {"$facet": {name: CUBE_FACETS[name](tercero, sin_tercero) for name in facets}},
+    ]
+
+
+async def aggregate_cube(
+    match_query: Dict[str, Any],
+    facets: List[str],
+    tercero: str = "proveedor",
+    sin_tercero: str = "Sin proveedor",
+) -> Dict[str, List[dict]]:
+    """Ejecuta el pipeline sobre el cubo y devuelve `{faceta: [grupos...]}`."""
+    await ensure_albaranes_cube()
+    pipeline = build_cube_pipeline(match_query, facets, tercero, sin_tercero)
+    result = await albaranes_diario_collection.aggregate(pipeline).to_list(1)
+    row = result[0] if result else {}
+    return {name: row.get(name, []) for name in facets}
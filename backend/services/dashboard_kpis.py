@@ -0,0 +1,745 @@
+"""
+Dashboard KPIs - Agregaciones server-side para /api/dashboard/kpis.
+
+Antes el endpoint hacía una decena de `count_documents` secuenciales y cargaba
+colecciones completas en Python con `to_list(1000)` para sumar unos pocos
+campos (truncando silenciosamente a partir de 1000 documentos). Aquí cada
+colección se resuelve con UNA agregación (`$group` / `$facet`) que proyecta
+solo los campos necesarios, y todas se lanzan en paralelo con
+`asyncio.gather`. Los totales son exactos sea cual sea el volumen.
+
+Los KPIs se dividen en dos bloques:
+
+- contadores (`compute_counters`): conteos y sumas acumulables por colección
+  (contratos por tipo, hectáreas por provincia, costes por origen,
+  superficie por cultivo...). Son los que `services/kpi_snapshots.py`
+  mantiene de forma incremental en cada escritura.
+- vistas (`compute_views`): listas "próximos N" y estadísticas por ventana de
+  fechas, que dependen del día actual y se recalculan periódicamente.
+
+`assemble_kpis` combina ambos en el formato que consume el frontend.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from database import (
+    contratos_collection, parcelas_collection, fincas_collection,
+    visitas_collection, tratamientos_collection, irrigaciones_collection,
+    cosechas_collection, tareas_collection, serialize_docs
+)
+
+
+# ---------------------------------------------------------------------------
+# Helpers de expresiones de agregación
+# ---------------------------------------------------------------------------
+
+def _num(field: str) -> Dict[str, Any]:
+    """Valor numérico del campo (0 si falta, es null o no es convertible)."""
+    return {"$convert": {"input": f"${field}", "to": "double", "onError": 0, "onNull": 0}}
+
+
+def _count_if(condition: Dict[str, Any]) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+
+def _truthy(field: str) -> Dict[str, Any]:
+    """Equivalente a la truthiness de Python para flags guardados de forma heterogénea."""
+    return {"$cond": [{"$in": [{"$ifNull": [f"${field}", False]}, [False, 0, ""]]}, False, True]}
+
+
+def _or_default(field: str, default: str) -> Dict[str, Any]:
+    """`doc.get(field) or default` (vacío/null/ausente → default)."""
+    return {"$cond": [{"$in": [{"$ifNull": [f"${field}", ""]}, ["", False]]}, default, f"${field}"]}
+
+
+def _first(facet: Dict[str, List[dict]], key: str) -> Dict[str, Any]:
+    rows = facet.get(key) or []
+    return rows[0] if rows else {}
+
+
+async def _facet(collection: Any, facets: Dict[str, List[dict]], prefix: Optional[List[dict]] = None) -> Dict[str, List[dict]]:
+    pipeline = list(prefix or []) + [{"$facet": facets}]
+    result = await collection.aggregate(pipeline).to_list(1)
+    return result[0] if result else {}
+
+
+async def _group_totals(collection: Any, sums: Dict[str, str]) -> Dict[str, Any]:
+    """`{total, <alias>: $sum(<campo>)...}` de toda la colección en un único $group."""
+    group: Dict[str, Any] = {"_id": None, "total": {"$sum": 1}}
+    group.update({alias: {"$sum": f"${field}"} for alias, field in sums.items()})
+    rows = await collection.aggregate([{"$group": group}]).to_list(1)
+    totales = rows[0] if rows else {}
+    return {"total": totales.get("total", 0), **{alias: totales.get(alias, 0) for alias in sums}}
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ---------------------------------------------------------------------------
+# Contadores (acumulables)
+# ---------------------------------------------------------------------------
+
+async def contratos_counters() -> Dict[str, Any]:
+    rows = await contratos_collection.aggregate([
+        {"$group": {"_id": None, "total": {"$sum": 1}, "venta": _count_if({"$eq": ["$tipo", "Venta"]})}},
+    ]).to_list(1)
+    totales = rows[0] if rows else {}
+    return {"total": totales.get("total", 0), "venta": totales.get("venta", 0)}
+
+
+async def parcelas_counters() -> Dict[str, Any]:
+    data = await _facet(parcelas_collection, {
+        "totales": [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "activas": _count_if({"$eq": ["$activo", True]}),
+            "superficie": {"$sum": "$superficie_total"},
+        }}],
+        "por_cultivo": [{"$group": {
+            "_id": {"$ifNull": ["$cultivo", "Unknown"]},
+            "superficie": {"$sum": "$superficie_total"},
+            "parcelas": {"$sum": 1},
+        }}],
+    })
+    totales = _first(data, "totales")
+    return {
+        "total": totales.get("total", 0),
+        "activas": totales.get("activas", 0),
+        "superficie": totales.get("superficie", 0),
+        "por_cultivo": {
+            row["_id"]: {"superficie": row["superficie"], "parcelas": row["parcelas"]}
+            for row in data.get("por_cultivo", [])
+        },
+    }
+
+
+async def fincas_counters() -> Dict[str, Any]:
+    data = await _facet(fincas_collection, {
+        "totales": [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "propias": _count_if(_truthy("finca_propia")),
+            "hectareas": {"$sum": "$hectareas"},
+            "produccion_esperada": {"$sum": "$produccion_esperada"},
+            "produccion_disponible": {"$sum": "$produccion_disponible"},
+        }}],
+        "por_provincia": [{"$group": {
+            "_id": _or_default("provincia", "Sin provincia"),
+            "count": {"$sum": 1},
+            "hectareas": {"$sum": "$hectareas"},
+            "produccion_esperada": {"$sum": "$produccion_esperada"},
+            "propias": _count_if(_truthy("finca_propia")),
+        }}],
+    })
+    totales = _first(data, "totales")
+    return {
+        "total": totales.get("total", 0),
+        "propias": totales.get("propias", 0),
+        "hectareas": totales.get("hectareas", 0),
+        "produccion_esperada": totales.get("produccion_esperada", 0),
+        "produccion_disponible": totales.get("produccion_disponible", 0),
+        "por_provincia": {
+            row["_id"]: {
+                "count": row["count"],
+                "hectareas": row["hectareas"],
+                "produccion_esperada": row["produccion_esperada"],
+                "propias": row["propias"],
+            }
+            for row in data.get("por_provincia", [])
+        },
+    }
+
+
+async def compute_counters() -> Dict[str, Any]:
+    """Conteos y sumas por colección, en paralelo (una agregación por colección)."""
+    (contratos, parcelas, fincas, tratamientos, irrigaciones, tareas, cosechas) = await asyncio.gather(
+        contratos_counters(),
+        parcelas_counters(),
+        fincas_counters(),
+        _group_totals(tratamientos_collection, {"coste": "coste_total"}),
+        _group_totals(irrigaciones_collection, {"coste": "coste"}),
+        _group_totals(tareas_collection, {"coste": "coste_total"}),
+        _group_totals(cosechas_collection, {"produccion": "cosecha_total", "ingresos": "ingreso_total"}),
+    )
+    return {
+        "contratos": contratos,
+        "parcelas": parcelas,
+        "fincas": fincas,
+        "tratamientos": tratamientos,
+        "irrigaciones": irrigaciones,
+        "tareas": tareas,
+        "cosechas": cosechas,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Vistas (dependen de la fecha actual)
+# ---------------------------------------------------------------------------
+
+def contratos_activos_match(hoy: str) -> Dict[str, Any]:
+    """Contrato activo: sin periodo completo definido, o hoy dentro del periodo."""
+    return {"$or": [
+        {"periodo_desde": {"$in": [None, ""]}},
+        {"periodo_hasta": {"$in": [None, ""]}},
+        {"periodo_desde": {"$lte": hoy}, "periodo_hasta": {"$gte": hoy}},
+    ]}
+
+
+async def contratos_activos_view() -> Dict[str, Any]:
+    valor_total = {"$multiply": [_num("cantidad"), _num("precio")]}
+    data = await _facet(contratos_collection, {
+        "top": [
+            {"$limit": 10},
+            {"$project": {
+                "serie": 1, "año": 1, "numero": 1, "tipo": 1, "proveedor": 1, "cliente": 1,
+                "cultivo": 1, "cantidad": 1, "precio": 1, "periodo_desde": 1,
+                "periodo_hasta": 1, "campana": 1,
+            }},
+        ],
+        "por_tipo": [{"$group": {
+            "_id": {"$ifNull": ["$tipo", "Compra"]},
+            "count": {"$sum": 1},
+            "cantidad_total": {"$sum": _num("cantidad")},
+            "valor_total": {"$sum": valor_total},
+        }}],
+        "por_cultivo": [{"$group": {
+            "_id": _or_default("cultivo", "Sin cultivo"),
+            "count": {"$sum": 1},
+            "cantidad": {"$sum": _num("cantidad")},
+            "valor": {"$sum": valor_total},
+        }}],
+        "total": [{"$count": "n"}],
+    }, prefix=[{"$match": contratos_activos_match(_today())}])
+
+    contratos_activos = []
+    for contrato in data.get("top", []):
+        cantidad = contrato.get("cantidad", 0)
+        precio = contrato.get("precio", 0)
+        contratos_activos.append({
+            "id": str(contrato.get("_id")),
+            "numero": f"{contrato.get('serie', 'MP')}-{contrato.get('año', '')}-{str(contrato.get('numero', 0)).zfill(3)}",
+            "tipo": contrato.get("tipo", "Compra"),
+            "proveedor": contrato.get("proveedor", ""),
+            "cliente": contrato.get("cliente", ""),
+            "cultivo": contrato.get("cultivo", ""),
+            "cantidad": cantidad,
+            "precio": precio,
+            "valor_total": (cantidad or 0) * (precio or 0),
+            "periodo_desde": contrato.get("periodo_desde", ""),
+            "periodo_hasta": contrato.get("periodo_hasta", ""),
+            "campana": contrato.get("campana", ""),
+        })
+
+    por_tipo = {row["_id"]: row for row in data.get("por_tipo", [])}
+
+    def _tipo_stats(tipo: str) -> Dict[str, Any]:
+        row = por_tipo.get(tipo, {})
+        return {
+            "count": row.get("count", 0),
+            "cantidad_total": row.get("cantidad_total", 0),
+            "valor_total": row.get("valor_total", 0),
+        }
+
+    return {
+        "contratos_activos": contratos_activos,
+        "contratos_stats": {
+            "total_activos": _first(data, "total").get("n", 0),
+            "compra": _tipo_stats("Compra"),
+            "venta": _tipo_stats("Venta"),
+            "por_cultivo": {
+                row["_id"]: {"count": row["count"], "cantidad": row["cantidad"], "valor": row["valor"]}
+                for row in data.get("por_cultivo", [])
+            },
+        },
+    }
+
+
+async def fincas_view() -> Dict[str, Any]:
+    semana_actual = datetime.now().isocalendar()[1]
+    ano_actual = datetime.now().year
+    data = await _facet(fincas_collection, {
+        "recoleccion": [
+            {"$match": {"recoleccion_semana": semana_actual, "recoleccion_ano": ano_actual}},
+            {"$limit": 20},
+            {"$project": {
+                "denominacion": 1, "nombre": 1, "provincia": 1, "hectareas": 1,
+                "produccion_esperada": 1, "recoleccion_semana": 1, "recoleccion_ano": 1,
+            }},
+        ],
+        # Parcelas existentes referenciadas por alguna finca (lookup por _id)
+        "parcelas_asignadas": [
+            {"$project": {"parcelas_ids": 1}},
+            {"$unwind": "$parcelas_ids"},
+            {"$group": {"_id": {"$convert": {"input": "$parcelas_ids", "to": "objectId", "onError": None, "onNull": None}}}},
+            {"$match": {"_id": {"$ne": None}}},
+            {"$lookup": {"from": "parcelas", "localField": "_id", "foreignField": "_id", "as": "p"}},
+            {"$match": {"p.0": {"$exists": True}}},
+            {"$count": "n"},
+        ],
+    })
+    return {
+        "parcelas_asignadas": _first(data, "parcelas_asignadas").get("n", 0),
+        "fincas_recoleccion_semana": [
+            {
+                "id": str(f.get("_id")),
+                "denominacion": f.get("denominacion", f.get("nombre", "")),
+                "provincia": f.get("provincia", ""),
+                "hectareas": f.get("hectareas", 0),
+                "produccion_esperada": f.get("produccion_esperada", 0),
+                "semana": f.get("recoleccion_semana"),
+                "ano": f.get("recoleccion_ano"),
+            }
+            for f in data.get("recoleccion", [])
+        ],
+    }
+
+
+async def proximas_cosechas_planificadas() -> List[Dict[str, Any]]:
+    cosechas = await cosechas_collection.aggregate([
+        {"$match": {"estado": {"$in": ["planificada", "en_curso"]}}},
+        {"$project": {
+            "contrato_id": 1, "proveedor": 1, "cultivo": 1, "variedad": 1,
+            "estado": 1, "parcela": 1, "planificaciones": 1,
+        }},
+        {"$unwind": "$planificaciones"},
+        {"$match": {"planificaciones.fecha_planificada": {"$gte": _today()}}},
+        {"$sort": {"planificaciones.fecha_planificada": 1}},
+        {"$limit": 10},
+    ]).to_list(10)
+    return [
+        {
+            "cosecha_id": str(c.get("_id")),
+            "contrato_id": c.get("contrato_id"),
+            "proveedor": c.get("proveedor", ""),
+            "cultivo": c.get("cultivo", ""),
+            "variedad": c.get("variedad", ""),
+            "fecha_planificada": c["planificaciones"].get("fecha_planificada", ""),
+            "kilos_estimados": c["planificaciones"].get("kilos_estimados", 0),
+            "estado": c.get("estado", "planificada"),
+            "parcela": c.get("parcela", ""),
+        }
+        for c in cosechas
+    ]
+
+
+async def proximas_siegas() -> List[Dict[str, Any]]:
+    """Parcelas con fecha de siega prevista (complementa próximas cosechas)."""
+    parcelas = await parcelas_collection.find(
+        {"fecha_prevista_siega": {"$gte": _today()}},
+        {"contrato_id": 1, "proveedor": 1, "cultivo": 1, "variedad": 1,
+         "fecha_prevista_siega": 1, "codigo_plantacion": 1},
+    ).sort("fecha_prevista_siega", 1).limit(10).to_list(10)
+    return [
+        {
+            "cosecha_id": None,
+            "contrato_id": p.get("contrato_id"),
+            "proveedor": p.get("proveedor", ""),
+            "cultivo": p.get("cultivo", ""),
+            "variedad": p.get("variedad", ""),
+            "fecha_planificada": p.get("fecha_prevista_siega", ""),
+            "kilos_estimados": 0,
+            "estado": "siega_planificada",
+            "parcela": p.get("codigo_plantacion", ""),
+        }
+        for p in parcelas
+    ]
+
+
+def merge_proximas_cosechas(cosechas: List[dict], siegas: List[dict]) -> List[dict]:
+    """Une cosechas planificadas y siegas previstas (sin duplicar parcela), top 10."""
+    proximas = list(cosechas)
+    for siega in siegas:
+        if not any(c["parcela"] == siega["parcela"] for c in proximas):
+            proximas.append(siega)
+    proximas.sort(key=lambda x: x["fecha_planificada"])
+    return proximas[:10]
+
+
+async def tratamientos_view() -> Dict[str, Any]:
+    data = await _facet(tratamientos_collection, {
+        "pendientes": [
+            {"$match": {"$or": [{"estado": "pendiente"}, {"estado": "programado"}, {"realizado": False}]}},
+            {"$sort": {"fecha_tratamiento": 1}},
+            {"$limit": 10},
+            {"$project": {
+                "tipo_tratamiento": 1, "parcela": 1, "cultivo": 1, "fecha_tratamiento": 1,
+                "superficie_aplicacion": 1, "estado": 1, "prioridad": 1,
+            }},
+        ],
+        "recientes": [{"$sort": {"created_at": -1}}, {"$limit": 5}],
+    })
+    return {
+        "tratamientos_pendientes": [
+            {
+                "id": str(t.get("_id")),
+                "tipo_tratamiento": t.get("tipo_tratamiento", ""),
+                "parcela": t.get("parcela", ""),
+                "cultivo": t.get("cultivo", ""),
+                "fecha_tratamiento": t.get("fecha_tratamiento", ""),
+                "superficie_aplicacion": t.get("superficie_aplicacion", 0),
+                "estado": t.get("estado", "pendiente"),
+                "prioridad": t.get("prioridad", "normal"),
+            }
+            for t in data.get("pendientes", [])
+        ],
+        "tratamientos_recientes": serialize_docs(data.get("recientes", [])),
+    }
+
+
+async def visitas_view() -> Dict[str, Any]:
+    hoy = _today()
+    inicio_mes = datetime.now().replace(day=1).strftime("%Y-%m-%d")
+    en_14_dias = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+    data = await _facet(visitas_collection, {
+        "totales": [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "pendientes": _count_if({"$eq": ["$realizado", False]}),
+        }}],
+        "mes": [
+            {"$match": {"fecha_visita": {"$gte": inicio_mes}}},
+            {"$group": {"_id": None, "total": {"$sum": 1}, "realizadas": _count_if({"$eq": ["$realizado", True]})}},
+        ],
+        "proximas": [
+            {"$match": {"$or": [
+                {"fecha_planificada": {"$gte": hoy, "$lte": en_14_dias}},
+                {"fecha_visita": {"$gte": hoy, "$lte": en_14_dias}, "realizado": False},
+            ]}},
+            {"$sort": {"fecha_visita": 1}},
+            {"$limit": 10},
+            {"$project": {
+                "objetivo": 1, "codigo_plantacion": 1, "proveedor": 1, "cultivo": 1,
+                "fecha_planificada": 1, "fecha_visita": 1, "realizado": 1,
+            }},
+        ],
+        "recientes": [{"$sort": {"created_at": -1}}, {"$limit": 5}],
+    })
+    totales = _first(data, "totales")
+    mes = _first(data, "mes")
+    proximas = [
+        {
+            "id": str(v.get("_id")),
+            "objetivo": v.get("objetivo", ""),
+            "parcela": v.get("codigo_plantacion", ""),
+            "proveedor": v.get("proveedor", ""),
+            "cultivo": v.get("cultivo", ""),
+            "fecha": v.get("fecha_planificada") or v.get("fecha_visita"),
+            "realizado": v.get("realizado", False),
+        }
+        for v in data.get("proximas", [])
+    ]
+    return {
+        "visitas_total": totales.get("total", 0),
+        "visitas_proximas": proximas,
+        "visitas_stats": {
+            "total_mes": mes.get("total", 0),
+            "realizadas_mes": mes.get("realizadas", 0),
+            "pendientes": totales.get("pendientes", 0),
+            "proximas_14_dias": len(proximas),
+        },
+        "visitas_recientes": serialize_docs(data.get("recientes", [])),
+    }
+
+
+async def compute_views() -> Dict[str, Any]:
+    """Listas y ventanas de fechas del dashboard, en paralelo."""
+    contratos, fincas, cosechas, siegas, tratamientos, visitas = await asyncio.gather(
+        contratos_activos_view(), fincas_view(), proximas_cosechas_planificadas(),
+        proximas_siegas(), tratamientos_view(), visitas_view(),
+    )
+    return {
+        **contratos,
+        **fincas,
+        **tratamientos,
+        **visitas,
+        "proximas_cosechas": merge_proximas_cosechas(cosechas, siegas),
+        "fecha": _today(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Ensamblado
+# ---------------------------------------------------------------------------
+
+def _section_totales(counters: Dict[str, Any], visitas_total: int) -> Dict[str, Any]:
+    contratos = counters["contratos"]
+    return {
+        "contratos": contratos["total"],
+        "contratos_venta": contratos["venta"],
+        "contratos_compra": contratos["total"] - contratos["venta"],
+        "parcelas": counters["parcelas"]["total"],
+        "parcelas_activas": counters["parcelas"]["activas"],
+        "fincas": counters["fincas"]["total"],
+        "tratamientos": counters["tratamientos"]["total"],
+        "riegos": counters["irrigaciones"]["total"],
+        "visitas": visitas_total,
+        "cosechas": counters["cosechas"]["total"],
+    }
+
+
+def _section_fincas(counters: Dict[str, Any], parcelas_asignadas: int) -> Dict[str, Any]:
+    fincas = counters["fincas"]
+    return {
+        "total": fincas["total"],
+        "propias": fincas["propias"],
+        "alquiladas": fincas["total"] - fincas["propias"],
+        "hectareas_total": fincas["hectareas"],
+        "produccion_esperada": fincas["produccion_esperada"],
+        "produccion_disponible": fincas["produccion_disponible"],
+        "por_provincia": {
+            provincia: {**datos, "alquiladas": datos["count"] - datos["propias"]}
+            for provincia, datos in fincas["por_provincia"].items()
+            if datos["count"] > 0
+        },
+        "parcelas_sin_asignar": max(counters["parcelas"]["total"] - parcelas_asignadas, 0),
+    }
+
+
+def _section_produccion(counters: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "total_kg": counters["cosechas"]["produccion"],
+        "total_ingresos": counters["cosechas"]["ingresos"],
+        "por_cultivo": {
+            cultivo: {**datos, "produccion": 0}
+            for cultivo, datos in counters["parcelas"]["por_cultivo"].items()
+            if datos["parcelas"] > 0
+        },
+    }
+
+
+def _section_costes(counters: Dict[str, Any]) -> Dict[str, Any]:
+    tratamientos = counters["tratamientos"]["coste"]
+    riegos = counters["irrigaciones"]["coste"]
+    tareas = counters["tareas"]["coste"]
+    return {"tratamientos": tratamientos, "riegos": riegos, "tareas": tareas, "total": tratamientos + riegos + tareas}
+
+
+def _section_superficie(counters: Dict[str, Any]) -> Dict[str, Any]:
+    total_superficie = counters["parcelas"]["superficie"]
+    total_parcelas = counters["parcelas"]["total"]
+    return {
+        "total_ha": total_superficie,
+        "promedio_ha_parcela": total_superficie / total_parcelas if total_parcelas > 0 else 0,
+    }
+
+
+def _section_rentabilidad(counters: Dict[str, Any]) -> Dict[str, Any]:
+    total_ingresos = counters["cosechas"]["ingresos"]
+    total_costes = _section_costes(counters)["total"]
+    total_superficie = counters["parcelas"]["superficie"]
+    return {
+        "margen_bruto": total_ingresos - total_costes,
+        "margen_por_ha": (total_ingresos - total_costes) / total_superficie if total_superficie > 0 else 0,
+    }
+
+
+def assemble_kpis(counters: Dict[str, Any], views: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta de /api/dashboard/kpis a partir de contadores y vistas."""
+    return {
+        "totales": _section_totales(counters, views["visitas_total"]),
+        "fincas": _section_fincas(counters, views["parcelas_asignadas"]),
+        "produccion": _section_produccion(counters),
+        "costes": _section_costes(counters),
+        "superficie": _section_superficie(counters),
+        "rentabilidad": _section_rentabilidad(counters),
+        "actividad_reciente": {
+            "visitas": views["visitas_recientes"],
+            "tratamientos": views["tratamientos_recientes"],
+        },
+        "proximas_cosechas": views["proximas_cosechas"],
+        "tratamientos_pendientes": views["tratamientos_pendientes"],
+        "fincas_recoleccion_semana": views["fincas_recoleccion_semana"],
+        "contratos_activos": views["contratos_activos"],
+        "contratos_stats": views["contratos_stats"],
+        "visitas_proximas": views["visitas_proximas"],
+        "visitas_stats": views["visitas_stats"],
+    }
+
+
+async def compute_dashboard_kpis() -> Dict[str, Any]:
+    """Calcula todos los KPIs del dashboard en vivo (contadores y vistas en paralelo)."""
+    counters, views = await asyncio.gather(compute_counters(), compute_views())
+    return assemble_kpis(counters, views)
+
+
+# ---------------------------------------------------------------------------
+# Widgets
+# ---------------------------------------------------------------------------
+# Cada widget del dashboard (DEFAULT_WIDGETS en routes_dashboard.py) declara
+# qué secciones de la respuesta de /kpis necesita y las calcula con solo las
+# agregaciones imprescindibles. Los widgets de una misma petición se calculan
+# en paralelo, cada uno con su timeout: un widget lento o con error no retrasa
+# ni rompe a los demás. Las agregaciones compartidas entre widgets (p. ej. los
+# contadores) se ejecutan una sola vez por petición.
+
+DASHBOARD_WIDGET_TIMEOUT = float(os.environ.get("DASHBOARD_WIDGET_TIMEOUT", "10"))
+
+
+class _SharedQueries:
+    """Memo por petición: cada agregación se lanza una vez aunque la pidan varios widgets."""
+
+    def __init__(self, counters_loader: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None) -> None:
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self._counters_loader = counters_loader or compute_counters
+
+    async def get(self, name: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        if name not in self._tasks:
+            self._tasks[name] = asyncio.ensure_future(factory())
+        # shield: el timeout de un widget no cancela la consulta que comparte con otros
+        return await asyncio.shield(self._tasks[name])
+
+    async def counters(self) -> Dict[str, Any]:
+        return await self.get("counters", self._counters_loader)
+
+    def cancel_pending(self) -> None:
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+
+async def _visitas_total() -> int:
+    return await visitas_collection.count_documents({})
+
+
+async def _widget_kpis_principales(q: _SharedQueries) -> Dict[str, Any]:
+    counters, visitas_total = await asyncio.gather(
+        q.counters(), q.get("visitas_total", _visitas_total)
+    )
+    return {
+        "totales": _section_totales(counters, visitas_total),
+        "superficie": _section_superficie(counters),
+        "produccion": _section_produccion(counters),
+        "costes": _section_costes(counters),
+        "rentabilidad": _section_rentabilidad(counters),
+    }
+
+
+async def _widget_productividad(q: _SharedQueries) -> Dict[str, Any]:
+    counters = await q.counters()
+    return {
+        "superficie": _section_superficie(counters),
+        "produccion": _section_produccion(counters),
+        "costes": _section_costes(counters),
+        "rentabilidad": _section_rentabilidad(counters),
+    }
+
+
+async def _widget_graficos_cultivos(q: _SharedQueries) -> Dict[str, Any]:
+    counters = await q.counters()
+    return {"produccion": _section_produccion(counters), "costes": _section_costes(counters)}
+
+
+async def _widget_resumen_fincas(q: _SharedQueries) -> Dict[str, Any]:
+    counters, fincas = await asyncio.gather(q.counters(), q.get("fincas_view", fincas_view))
+    return {"fincas": _section_fincas(counters, fincas["parcelas_asignadas"])}
+
+
+async def _widget_proximas_cosechas(q: _SharedQueries) -> Dict[str, Any]:
+    cosechas, siegas, fincas = await asyncio.gather(
+        q.get("proximas_cosechas", proximas_cosechas_planificadas),
+        q.get("proximas_siegas", proximas_siegas),
+        q.get("fincas_view", fincas_view),
+    )
+    return {
+        "proximas_cosechas": merge_proximas_cosechas(cosechas, siegas),
+        "fincas_recoleccion_semana": fincas["fincas_recoleccion_semana"],
+    }
+
+
+async def _widget_tratamientos_pendientes(q: _SharedQueries) -> Dict[str, Any]:
+    tratamientos = await q.get("tratamientos_view", tratamientos_view)
+    return {"tratamientos_pendientes": tratamientos["tratamientos_pendientes"]}
+
+
+async def _widget_contratos_activos(q: _SharedQueries) -> Dict[str, Any]:
+    return await q.get("contratos_activos_view", contratos_activos_view)
+
+
+async def _widget_proximas_visitas(q: _SharedQueries) -> Dict[str, Any]:
+    visitas = await q.get("visitas_view", visitas_view)
+    return {"visitas_proximas": visitas["visitas_proximas"], "visitas_stats": visitas["visitas_stats"]}
+
+
+async def _widget_actividad_reciente(q: _SharedQueries) -> Dict[str, Any]:
+    visitas, tratamientos = await asyncio.gather(
+        q.get("visitas_view", visitas_view), q.get("tratamientos_view", tratamientos_view)
+    )
+    return {"actividad_reciente": {
+        "visitas": visitas["visitas_recientes"],
+        "tratamientos": tratamientos["tratamientos_recientes"],
+    }}
+
+
+WIDGET_COMPUTERS: Dict[str, Callable[[_SharedQueries], Awaitable[Dict[str, Any]]]] = {
+    "kpis_principales": _widget_kpis_principales,
+    "productividad": _widget_productividad,
+    "graficos_cultivos": _widget_graficos_cultivos,
+    "resumen_fincas": _widget_resumen_fincas,
+    "proximas_cosechas": _widget_proximas_cosechas,
+    "tratamientos_pendientes": _widget_tratamientos_pendientes,
+    "contratos_activos": _widget_contratos_activos,
+    "proximas_visitas": _widget_proximas_visitas,
+    "actividad_reciente": _widget_actividad_reciente,
+}
+
+
+def _merge_sections(target: Dict[str, Any], sections: Dict[str, Any]) -> None:
+    for key, value in sections.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            target[key] = {**target[key], **value}
+        else:
+            target[key] = value
+
+
+async def compute_widgets(
+    widget_ids: List[str],
+    timeout: Optional[float] = None,
+    counters_loader: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
+    """Calcula en paralelo solo los widgets pedidos.
+
+    `counters_loader` permite leer los contadores de otra fuente (p. ej. el
+    snapshot incremental de services/kpi_snapshots.py) en lugar de agregarlos.
+
+    Devuelve `data` (secciones con las mismas claves que /kpis, fusionadas) y
+    `widgets` con el estado de cada uno: ok, error, timeout o no_data (widgets
+    que cargan sus datos desde su propio endpoint, p. ej. el mapa).
+    """
+    timeout = timeout if timeout is not None else DASHBOARD_WIDGET_TIMEOUT
+    queries = _SharedQueries(counters_loader)
+    loop = asyncio.get_running_loop()
+
+    async def _run(widget_id: str) -> Dict[str, Any]:
+        computer = WIDGET_COMPUTERS.get(widget_id)
+        if computer is None:
+            return {"status": "no_data", "ms": 0, "data": {}}
+        started = loop.time()
+        try:
+            data = await asyncio.wait_for(computer(queries), timeout=timeout)
+            status, error = "ok", None
+        except asyncio.TimeoutError:
+            data, status, error = {}, "timeout", f"Timeout tras {timeout:g}s"
+        except Exception as e:
+            print(f"[Dashboard] widget {widget_id} failed: {e}")
+            data, status, error = {}, "error", str(e)
+        result = {"status": status, "ms": round((loop.time() - started) * 1000, 1), "data": data}
+        if error:
+            result["error"] = error
+        return result
+
+    try:
+        results = await asyncio.gather(*(_run(widget_id) for widget_id in widget_ids))
+    finally:
+        queries.cancel_pending()
+
+    merged: Dict[str, Any] = {}
+    widgets: Dict[str, Any] = {}
+    for widget_id, result in zip(widget_ids, results):
+        _merge_sections(merged, result.pop("data"))
+        widgets[widget_id] = result
+    return {"data": merged, "widgets": widgets}
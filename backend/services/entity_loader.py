@@ -0,0 +1,140 @@
+"""
+Entity Loader - Carga por lotes de documentos relacionados (patrón DataLoader).
+
+Sustituye el patrón "un `find_one` por fila" (empleado de cada fichaje,
+agente/proveedor/cliente de cada albarán, técnico y máquina de cada
+tratamiento...) por una única consulta `$in` por colección:
+
+    loaders = Loaders()
+    empleados = loaders.get(db.empleados)
+    await empleados.load_many(f["empleado_id"] for f in fichajes)   # 1 consulta
+    for f in fichajes:
+        emp = await empleados.load(f["empleado_id"])                # memoizado
+
+- `load(id)` devuelve el documento (o None). Las llamadas hechas en el mismo
+  ciclo del event loop (p. ej. dentro de un `asyncio.gather`) se agrupan en una
+  sola consulta; las siguientes se sirven de la memoria del loader.
+- `load_many(ids)` carga todos los ids pendientes de una vez y devuelve
+  `{id: documento}`.
+- Por defecto la clave es `_id` (ids como string, igual que se guardan en las
+  referencias). Con `key=` se puede agrupar por otro campo y con `filter=`
+  añadir condiciones fijas (p. ej. la productividad de hoy por `empleado_id`);
+  si varios documentos comparten clave se queda el primero, como `find_one`.
+
+Un `Loaders` vive lo que dura una petición (o un job): se crea al principio
+del handler y se descarta al terminar, así que los datos nunca se sirven de
+una petición anterior. Los documentos devueltos son compartidos entre todas
+las llamadas del mismo loader; quien necesite modificarlos debe copiarlos.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+MAX_BATCH_SIZE = 1000
+
+
+class EntityLoader:
+    """Loader de una colección (y clave/filtro) concretos."""
+
+    def __init__(
+        self,
+        collection: Any,
+        key: str = "_id",
+        filter: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.collection = collection
+        self.key = key
+        self.filter = filter or {}
+        self.projection = projection
+        self._cache: Dict[str, "asyncio.Future[Optional[dict]]"] = {}
+        self._queue: List[str] = []
+
+    def load(self, key: Any) -> "asyncio.Future[Optional[dict]]":
+        """Documento con esa clave (None si no existe o la clave no es válida)."""
+        loop = asyncio.get_running_loop()
+        if key is None or key == "":
+            future: "asyncio.Future[Optional[dict]]" = loop.create_future()
+            future.set_result(None)
+            return future
+        key = str(key)
+        future = self._cache.get(key)
+        if future is None:
+            future = loop.create_future()
+            self._cache[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return future
+
+    async def load_many(self, keys: Iterable[Any]) -> Dict[str, Optional[dict]]:
+        """Carga todas las claves en una consulta y devuelve `{clave: documento}`."""
+        unique = list(dict.fromkeys(str(k) for k in keys if k is not None and k != ""))
+        docs = await asyncio.gather(*(self.load(k) for k in unique))
+        return dict(zip(unique, docs))
+
+    async def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        for start in range(0, len(keys), MAX_BATCH_SIZE):
+            chunk = keys[start:start + MAX_BATCH_SIZE]
+            try:
+                docs = await self._fetch(chunk)
+            except Exception as e:  # noqa: BLE001 — se propaga a quien espera
+                for k in chunk:
+                    future = self._cache.pop(k)
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for k in chunk:
+                future = self._cache[k]
+                if not future.done():
+                    future.set_result(docs.get(k))
+
+    async def _fetch(self, keys: List[str]) -> Dict[str, dict]:
+        if self.key == "_id":
+            values: List[Any] = [ObjectId(k) for k in keys if ObjectId.is_valid(k)]
+        else:
+            values = list(keys)
+        if not values:
+            return {}
+        query = {**self.filter, self.key: {"$in": values}}
+        docs: Dict[str, dict] = {}
+        async for doc in self.collection.find(query, self.projection):
+            docs.setdefault(str(doc.get(self.key)), doc)
+        return docs
+
+
+class Loaders:
+    """Conjunto de loaders de una petición, uno por colección/clave/filtro."""
+
+    def __init__(self) -> None:
+        self._loaders: Dict[Tuple[str, str, str, str], EntityLoader] = {}
+
+    def get(
+        self,
+        collection: Any,
+        key: str = "_id",
+        filter: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> EntityLoader:
+        cache_key = (collection.name, key, repr(sorted((filter or {}).items())), repr(projection))
+        loader = self._loaders.get(cache_key)
+        if loader is None:
+            loader = EntityLoader(collection, key=key, filter=filter, projection=projection)
+            self._loaders[cache_key] = loader
+        return loader
+
+
+async def iter_batches(cursor: Any, size: int = 500) -> AsyncIterator[List[dict]]:
+    """Recorre un cursor en lotes para poder precargar las relaciones de cada lote."""
+    batch: List[dict] = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
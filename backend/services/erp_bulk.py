@@ -0,0 +1,219 @@
+"""
+ERP Bulk - Utilidades para las cargas masivas NDJSON de la API de integración ERP.
+
+La sincronización nocturna del ERP daba de alta miles de parcelas con una
+petición HTTP por registro, y cada petición resolvía finca, contrato,
+proveedor y cultivo con su propio `find_one`, varios de ellos con un regex
+sin anclar a índice (`^nombre$`, insensible a mayúsculas).
+
+Los endpoints `/api/erp/{entidad}/bulk` (routes_erp_integration.py) reciben un
+flujo NDJSON (un objeto JSON por línea) y lo procesan por lotes con las piezas
+de este módulo:
+
+- `iter_ndjson`: lee el cuerpo de la petición a trozos, sin cargarlo entero en
+  memoria, y devuelve `(nº de línea, objeto)` o el error de parseo de esa línea;
+- `ErpRefs`: resuelve las referencias de un lote entero con una consulta
+  `$in` por colección y mapas en memoria. Los nombres se comparan igual que
+  antes (igualdad exacta sin distinguir mayúsculas) pero escapados: un nombre
+  con paréntesis o puntos ya no se interpreta como regex. Los proveedores y
+  clientes que se crean automáticamente se insertan de una vez y una sola vez
+  por CIF aunque aparezcan en varias líneas;
+- `bulk_write_lines`: ejecuta las escrituras del lote con un `bulk_write` no
+  ordenado y devuelve los errores por operación, para que un registro
+  inválido no impida guardar el resto.
+
+Configuración:
+    ERP_BULK_BATCH_SIZE   Líneas por lote (default: 500)
+    ERP_BULK_MAX_LINES    Líneas máximas por petición (default: 50000)
+    ERP_BULK_MAX_LINE_KB  Tamaño máximo de una línea en KB (default: 256)
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from bson.regex import Regex
+from pymongo.errors import BulkWriteError
+
+from database import db
+
+ERP_BULK_BATCH_SIZE = int(os.environ.get("ERP_BULK_BATCH_SIZE", "500"))
+ERP_BULK_MAX_LINES = int(os.environ.get("ERP_BULK_MAX_LINES", "50000"))
+ERP_BULK_MAX_LINE_BYTES = int(float(os.environ.get("ERP_BULK_MAX_LINE_KB", "256")) * 1024)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class NdjsonLineError(Exception):
+    """Línea del flujo NDJSON que no es un objeto JSON válido."""
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Union[Dict[str, Any], NdjsonLineError]]]:
+    """`(nº de línea, objeto)` por cada línea no vacía; el error si no se puede leer."""
+    buffer = b""
+    line_no = 0
+    oversized = False
+
+    def parse(raw: bytes) -> Union[Dict[str, Any], NdjsonLineError]:
+        try:
+            obj = json.loads(raw)
+        except ValueError as e:
+            return NdjsonLineError(f"JSON inválido: {e}")
+        if not isinstance(obj, dict):
+            return NdjsonLineError("Cada línea debe ser un objeto JSON")
+        return obj
+
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            raw, buffer = buffer[:newline], buffer[newline + 1:]
+            line_no += 1
+            if oversized:
+                oversized = False
+                yield line_no, NdjsonLineError("Línea demasiado larga")
+            elif raw.strip():
+                yield line_no, parse(raw)
+        if len(buffer) > ERP_BULK_MAX_LINE_BYTES:
+            # Se descarta lo leído de la línea y se sigue hasta su salto de línea
+            buffer = b""
+            oversized = True
+    if oversized:
+        yield line_no + 1, NdjsonLineError("Línea demasiado larga")
+    elif buffer.strip():
+        yield line_no + 1, parse(buffer)
+
+
+def _lower(value: Optional[str]) -> str:
+    return (value or "").lower()
+
+
+def _name_regexes(names: Iterable[str]) -> List[Regex]:
+    return [Regex(f"^{re.escape(n)}$", "i") for n in names]
+
+
+class ErpRefs:
+    """Mapas en memoria con las referencias de un lote (proveedores, cultivos, fincas...).
+
+    Se rellenan con `load` (una consulta por colección) y se consultan con los
+    métodos `proveedor`, `cliente`, `cultivo`... con la misma precedencia que
+    los endpoints de registro único: CIF antes que nombre, código antes que
+    nombre, referencia ERP antes que denominación.
+    """
+
+    def __init__(self) -> None:
+        self.proveedores_cif: Dict[str, dict] = {}
+        self.proveedores_nombre: Dict[str, dict] = {}
+        self.clientes_cif: Dict[str, dict] = {}
+        self.clientes_nombre: Dict[str, dict] = {}
+        self.cultivos_codigo: Dict[str, dict] = {}
+        self.cultivos_nombre: Dict[str, dict] = {}
+        self.agentes_codigo: Dict[str, dict] = {}
+        self.fincas_ref: Dict[str, dict] = {}
+        self.fincas_nombre: Dict[str, dict] = {}
+        self.contratos_ref: Dict[str, dict] = {}
+
+    @staticmethod
+    async def _fetch(collection: str, field: str, values: Set[str],
+                     by: Dict[str, dict], by_name: bool = False) -> None:
+        values = {v for v in values if v} - set(by)
+        if not values:
+            return
+        match: Any = {"$in": _name_regexes(values) if by_name else list(values)}
+        async for doc in db[collection].find({field: match}):
+            key = _lower(doc.get(field)) if by_name else doc.get(field)
+            by.setdefault(key, doc)  # primer documento, como find_one
+
+    async def load(
+        self,
+        *,
+        proveedor_cifs: Iterable[Optional[str]] = (),
+        proveedor_nombres: Iterable[Optional[str]] = (),
+        cliente_cifs: Iterable[Optional[str]] = (),
+        cliente_nombres: Iterable[Optional[str]] = (),
+        cultivo_codigos: Iterable[Optional[str]] = (),
+        cultivo_nombres: Iterable[Optional[str]] = (),
+        agente_codigos: Iterable[Optional[str]] = (),
+        finca_refs: Iterable[Optional[str]] = (),
+        finca_nombres: Iterable[Optional[str]] = (),
+        contrato_refs: Iterable[Optional[str]] = (),
+    ) -> "ErpRefs":
+        await self._fetch("proveedores", "cif_nif", set(filter(None, proveedor_cifs)), self.proveedores_cif)
+        await self._fetch("proveedores", "nombre", {_lower(n) for n in proveedor_nombres if n},
+                          self.proveedores_nombre, by_name=True)
+        await self._fetch("clientes", "cif_nif", set(filter(None, cliente_cifs)), self.clientes_cif)
+        await self._fetch("clientes", "nombre", {_lower(n) for n in cliente_nombres if n},
+                          self.clientes_nombre, by_name=True)
+        await self._fetch("cultivos", "codigo", set(filter(None, cultivo_codigos)), self.cultivos_codigo)
+        await self._fetch("cultivos", "nombre", {_lower(n) for n in cultivo_nombres if n},
+                          self.cultivos_nombre, by_name=True)
+        await self._fetch("agentes", "codigo", set(filter(None, agente_codigos)), self.agentes_codigo)
+        await self._fetch("fincas", "referencia_erp", set(filter(None, finca_refs)), self.fincas_ref)
+        await self._fetch("fincas", "denominacion", {_lower(n) for n in finca_nombres if n},
+                          self.fincas_nombre, by_name=True)
+        await self._fetch("contratos", "referencia_erp", set(filter(None, contrato_refs)), self.contratos_ref)
+        return self
+
+    def proveedor(self, cif: Optional[str], nombre: Optional[str] = None) -> Optional[dict]:
+        if cif:
+            return self.proveedores_cif.get(cif)
+        return self.proveedores_nombre.get(_lower(nombre)) if nombre else None
+
+    def cliente(self, cif: Optional[str], nombre: Optional[str] = None) -> Optional[dict]:
+        if cif:
+            return self.clientes_cif.get(cif)
+        return self.clientes_nombre.get(_lower(nombre)) if nombre else None
+
+    def cultivo(self, codigo: Optional[str], nombre: Optional[str]) -> Optional[dict]:
+        if codigo:
+            return self.cultivos_codigo.get(codigo)
+        return self.cultivos_nombre.get(_lower(nombre)) if nombre else None
+
+    def agente(self, codigo: Optional[str]) -> Optional[dict]:
+        return self.agentes_codigo.get(codigo) if codigo else None
+
+    def finca(self, referencia_erp: Optional[str], nombre: Optional[str]) -> Optional[dict]:
+        if referencia_erp:
+            return self.fincas_ref.get(referencia_erp)
+        return self.fincas_nombre.get(_lower(nombre)) if nombre else None
+
+    def contrato(self, referencia_erp: Optional[str]) -> Optional[dict]:
+        return self.contratos_ref.get(referencia_erp) if referencia_erp else None
+
+    async def create_missing(self, kind: str, wanted: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """Da de alta los proveedores/clientes `(cif, nombre)` que no existan, uno por CIF."""
+        by_cif = self.proveedores_cif if kind == "proveedores" else self.clientes_cif
+        label = "Proveedor" if kind == "proveedores" else "Cliente"
+        new_docs: Dict[str, dict] = {}
+        for cif, nombre in wanted:
+            if cif and cif not in by_cif and cif not in new_docs:
+                new_docs[cif] = {
+                    "nombre": nombre or f"{label} {cif}",
+                    "cif_nif": cif,
+                    "activo": True,
+                    "created_at": datetime.now(),
+                    "created_by": "ERP Integration",
+                }
+        if not new_docs:
+            return
+        docs = list(new_docs.values())
+        await db[kind].insert_many(docs)  # rellena `_id` en cada documento
+        for doc in docs:
+            by_cif[doc["cif_nif"]] = doc
+
+
+async def bulk_write_lines(collection: Any, ops: List[Any]) -> Dict[int, str]:
+    """`bulk_write` no ordenado. Devuelve `{índice de la operación: error}` de las que fallan."""
+    if not ops:
+        return {}
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        return {err["index"]: err.get("errmsg", "Error de escritura")
+                for err in e.details.get("writeErrors", [])}
+    return {}
@@ -0,0 +1,264 @@
+"""
+Excel Export - Exportador Excel en streaming común a las rutas /export/excel.
+
+Las exportaciones cargaban hasta 1000/5000 documentos con `to_list`, construían
+un `Workbook()` completo en memoria y daban estilo celda a celda. Este módulo:
+
+- consume el cursor de Motor por lotes (sin límite de filas);
+- escribe con openpyxl en modo `write_only`, que vuelca las filas a disco a
+  medida que se añaden, así que la memoria no crece con el número de filas;
+- usa estilos con nombre (cabecera, celda, título, totales) registrados una vez
+  por libro en lugar de crear Font/Border por celda;
+- hace el trabajo de openpyxl en el pool de hilos de render
+  (`services/render_service.py`) para no bloquear el event loop;
+- guarda el libro en un fichero temporal y lo sirve en streaming con
+  `FileResponse`, borrándolo al terminar.
+
+Uso:
+
+    xl = ExcelExport(header_color="2E7D32")
+    ws = xl.add_sheet("Proveedores", ["Nombre", "CIF/NIF"], widths=[25, 15])
+    await ws.write(proveedores_collection.find(query).sort("nombre", 1),
+                   lambda p: [p.get("nombre", ""), p.get("cif_nif", "")])
+    return await xl.response(f"proveedores_{fecha}.xlsx")
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from datetime import date, datetime
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union,
+)
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse
+
+from services.render_service import run_render_thread
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_BATCH_SIZE = int(os.environ.get("EXCEL_EXPORT_BATCH_SIZE", "500"))
+
+HEADER = "xl_header"
+CELL = "xl_cell"
+TITLE = "xl_title"
+SUBTITLE = "xl_subtitle"
+TOTAL = "xl_total"
+PLAIN = "xl_plain"
+
+_THIN = Side(style="thin")
+_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+
+
+class StyledRow(NamedTuple):
+    """Fila con estilo propio, para devolver desde `to_row` en `ExcelSheet.write`."""
+
+    values: Sequence[Any]
+    style: str = CELL
+    cell_styles: Optional[Dict[int, str]] = None
+
+
+def _cell_value(value: Any) -> Any:
+    """Convierte a un tipo que openpyxl sepa escribir."""
+    if value is None or isinstance(value, (str, int, float, bool, datetime, date)):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        return ", ".join(str(v) for v in value)
+    return str(value)
+
+
+async def _aiter(docs: Union[AsyncIterable[Any], Iterable[Any]]) -> AsyncIterator[Any]:
+    if isinstance(docs, AsyncIterable):
+        async for doc in docs:
+            yield doc
+    else:
+        for doc in docs:
+            yield doc
+
+
+class ExcelSheet:
+    """Hoja de un `ExcelExport`. Las filas solo se pueden añadir al final."""
+
+    def __init__(
+        self,
+        export: "ExcelExport",
+        title: str,
+        headers: Sequence[str],
+        widths: Union[float, Sequence[float]],
+        number_formats: Optional[Dict[int, str]],
+        preamble: Sequence[str],
+    ) -> None:
+        self._export = export
+        self._ws = export.workbook.create_sheet(title=title[:31])
+        self._number_formats = dict(number_formats or {})
+        self._last_column = max(len(headers), 1)
+        self.rows = 0
+        self._sheet_rows = 0
+
+        column_widths = [widths] * len(headers) if isinstance(widths, (int, float)) else list(widths)
+        for col, width in enumerate(column_widths, 1):
+            self._ws.column_dimensions[get_column_letter(col)].width = width
+
+        for i, text in enumerate(preamble):
+            self._append_styled([text], TITLE if i == 0 else SUBTITLE)
+            self.merge_last_row()
+        if preamble:
+            self._append_styled([], CELL)
+        if headers:
+            self._append_styled(headers, HEADER)
+        self.rows = 0
+
+    @property
+    def row_number(self) -> int:
+        """Nº de fila (1-based) de la última fila escrita, para fórmulas."""
+        return self._sheet_rows
+
+    def _append_styled(
+        self,
+        values: Sequence[Any],
+        style: str,
+        cell_styles: Optional[Dict[int, str]] = None,
+        number_formats: Optional[Dict[int, str]] = None,
+    ) -> None:
+        cells = []
+        for i, value in enumerate(values):
+            cell = WriteOnlyCell(self._ws, value=_cell_value(value))
+            base = cell_styles.get(i, style) if cell_styles else style
+            if number_formats and i in number_formats:
+                base = self._export.style_for(base, number_formats[i])
+            cell.style = base
+            cells.append(cell)
+        self._ws.append(cells)
+        self._sheet_rows += 1
+        self.rows += 1
+
+    def append(self, values: Sequence[Any], style: str = CELL, cell_styles: Optional[Dict[int, str]] = None) -> None:
+        """Añade una fila (para filas sueltas: subtotales, totales, separadores).
+
+        `cell_styles` cambia el estilo de columnas concretas (índice 0-based).
+        Los formatos numéricos de la hoja se aplican con cualquier estilo.
+        """
+        self._append_styled(values, style, cell_styles, self._number_formats)
+
+    def merge_last_row(self, first_column: int = 1, last_column: Optional[int] = None) -> None:
+        """Combina celdas de la última fila escrita (por defecto, todo el ancho de la cabecera)."""
+        row = self._sheet_rows
+        first = get_column_letter(first_column)
+        last = get_column_letter(last_column or self._last_column)
+        self._ws.merged_cells.add(f"{first}{row}:{last}{row}")
+
+    def _append_many(self, rows: Iterable[Sequence[Any]], style: str) -> None:
+        for values in rows:
+            if isinstance(values, StyledRow):
+                self.append(values.values, values.style, values.cell_styles)
+            else:
+                self.append(values, style)
+
+    async def write(
+        self,
+        docs: Union[AsyncIterable[Any], Iterable[Any]],
+        to_row: Callable[[Any], Optional[Sequence[Any]]],
+        style: str = CELL,
+        batch_size: int = EXPORT_BATCH_SIZE,
+    ) -> int:
+        """Escribe una fila por documento (`to_row` puede devolver None para saltarlo
+        o un `StyledRow` para cambiar el estilo de esa fila).
+
+        Acepta un cursor de Motor o cualquier iterable; devuelve el nº de filas.
+        """
+        written = 0
+        batch: List[Sequence[Any]] = []
+
+        async def flush() -> None:
+            nonlocal batch, written
+            if batch:
+                rows, batch = batch, []
+                await run_render_thread(self._append_many, rows, style)
+                written += len(rows)
+
+        async for doc in _aiter(docs):
+            row = to_row(doc)
+            if row is not None:
+                batch.append(row)
+            if len(batch) >= batch_size:
+                await flush()
+        await flush()
+        return written
+
+
+class ExcelExport:
+    """Libro Excel `write_only` con los estilos comunes de las exportaciones."""
+
+    def __init__(self, header_color: str = "2E7D32", total_color: str = "E8F5E9") -> None:
+        self.workbook = Workbook(write_only=True)
+        self._styles: Dict[str, NamedStyle] = {}
+        self._register(NamedStyle(
+            name=HEADER,
+            font=Font(bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color=header_color, end_color=header_color, fill_type="solid"),
+            alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+            border=_BORDER,
+        ))
+        self._register(NamedStyle(name=CELL, border=_BORDER))
+        self._register(NamedStyle(name=PLAIN))
+        self._register(NamedStyle(name=TITLE, font=Font(bold=True, size=14), alignment=Alignment(horizontal="center")))
+        self._register(NamedStyle(name=SUBTITLE, font=Font(italic=True, color="666666"),
+                                  alignment=Alignment(horizontal="center")))
+        self._register(NamedStyle(
+            name=TOTAL,
+            font=Font(bold=True),
+            fill=PatternFill(start_color=total_color, end_color=total_color, fill_type="solid"),
+            border=_BORDER,
+        ))
+
+    def _register(self, style: NamedStyle) -> None:
+        self.workbook.add_named_style(style)
+        self._styles[style.name] = style
+
+    def add_style(self, name: str, base: str = CELL, **attrs: Any) -> str:
+        """Registra un estilo derivado de `base` (font, fill, alignment...)."""
+        if name not in self._styles:
+            parent = self._styles[base]
+            values = dict(font=parent.font, fill=parent.fill, border=parent.border,
+                          alignment=parent.alignment, number_format=parent.number_format)
+            values.update(attrs)
+            self._register(NamedStyle(name=name, **values))
+        return name
+
+    def style_for(self, base: str, number_format: str) -> str:
+        """Estilo con nombre `base` + formato numérico (se crea una vez por libro)."""
+        return self.add_style(f"{base}|{number_format}", base, number_format=number_format)
+
+    def add_sheet(
+        self,
+        title: str,
+        headers: Sequence[str],
+        widths: Union[float, Sequence[float]] = 18,
+        number_formats: Optional[Dict[int, str]] = None,
+        preamble: Sequence[str] = (),
+    ) -> ExcelSheet:
+        """Nueva hoja con cabecera. `preamble`: líneas de título sobre la cabecera.
+
+        `number_formats` asigna formato numérico por índice de columna (0-based).
+        """
+        return ExcelSheet(self, title, headers, widths, number_formats, preamble)
+
+    async def response(self, filename: str) -> FileResponse:
+        """Guarda el libro en un temporal y lo devuelve como descarga."""
+        fd, path = tempfile.mkstemp(prefix="export_", suffix=".xlsx")
+        os.close(fd)
+        try:
+            await run_render_thread(self.workbook.save, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        return FileResponse(
+            path,
+            media_type=XLSX_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+            background=BackgroundTask(os.remove, path),
+        )
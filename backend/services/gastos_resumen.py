@@ -0,0 +1,159 @@
+"""
+Agregaciones de los informes de gastos (/api/gastos).
+
+Todas las vistas agrupadas (resumen, por proveedor, contrato, cultivo y
+parcela) salen de un único pipeline sobre el cubo diario de albaranes
+(`services/albaranes_cube.py`): un `$match` con los filtros del informe
+seguido de un `$facet` con una rama por agrupación. El enriquecimiento con los
+datos del contrato se resuelve con un `$lookup` sobre contratos dentro de la
+rama por contrato, de modo que el coste de la consulta no depende del número
+de contratos distintos y los totales son exactos sea cual sea el volumen.
+"""
+from typing import Any, Dict, List, Optional
+
+from services.albaranes_cube import aggregate_cube, cube_match
+
+
+SIN_PROVEEDOR = "Sin proveedor"
+
+# Nombre de la faceta en el informe de gastos -> faceta genérica del cubo
+_FACETS = {
+    "totales": "totales",
+    "por_proveedor": "por_tercero",
+    "por_contrato": "por_contrato",
+    "por_cultivo": "por_cultivo",
+    "por_parcela": "por_parcela",
+}
+
+
+def build_gastos_match(
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    campana: Optional[str] = None,
+    contrato_id: Optional[str] = None,
+    cultivo: Optional[str] = None,
+    proveedor: Optional[str] = None,
+    parcela_codigo: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Filtro común a todos los informes de gastos (sobre las filas del cubo)."""
+    return cube_match(
+        fecha_desde, fecha_hasta, campana=campana, contrato_id=contrato_id,
+        cultivo=cultivo, proveedor=proveedor, parcela_codigo=parcela_codigo,
+    )
+
+
+async def aggregate_gastos(match_query: Dict[str, Any], facets: List[str]) -> Dict[str, List[dict]]:
+    """Ejecuta el pipeline de gastos y devuelve `{faceta: [grupos...]}`."""
+    result = await aggregate_cube(
+        match_query, [_FACETS[name] for name in facets], tercero="proveedor", sin_tercero=SIN_PROVEEDOR
+    )
+    return {name: result[_FACETS[name]] for name in facets}
+
+
+# ============================================================================
+# Formato de respuesta de cada informe
+# ============================================================================
+
+def _truthy_count(values: List[Any]) -> int:
+    return len([v for v in values or [] if v])
+
+
+def format_proveedor(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "proveedor": r["_id"],
+        "total": r["total"],
+        "count": r["count"],
+        "cultivos": [c for c in r["cultivos"] if c],
+        "num_contratos": _truthy_count(r["contratos"]),
+        "primer_albaran": r["primer_albaran"],
+        "ultimo_albaran": r["ultimo_albaran"],
+    }
+
+
+def format_contrato(r: Dict[str, Any]) -> Dict[str, Any]:
+    contrato = (r.get("contrato") or [{}])[0]
+    contrato_info = {}
+    if r.get("contrato"):
+        contrato_info = {
+            "numero_contrato": contrato.get("numero_contrato"),
+            "precio": contrato.get("precio"),
+            "superficie": contrato.get("superficie"),
+        }
+    return {
+        "contrato_id": r["_id"],
+        **contrato_info,
+        "proveedor": r["tercero"],
+        "cultivo": r["cultivo"],
+        "campana": r["campana"],
+        "parcela": r["parcela"],
+        "total": r["total"],
+        "count": r["count"],
+        "primer_albaran": r["primer_albaran"],
+        "ultimo_albaran": r["ultimo_albaran"],
+    }
+
+
+def format_contrato_resumen(r: Dict[str, Any]) -> Dict[str, Any]:
+    contrato = (r.get("contrato") or [{}])[0]
+    return {
+        "contrato_id": r["_id"],
+        "numero_contrato": contrato.get("numero_contrato"),
+        "proveedor": r["tercero_resumen"],
+        "cultivo": contrato.get("cultivo"),
+        "campana": contrato.get("campana"),
+        "total": r["total"],
+        "count": r["count"],
+    }
+
+
+def format_cultivo(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "cultivo": r["_id"],
+        "total": r["total"],
+        "count": r["count"],
+        "num_proveedores": _truthy_count(r["terceros"]),
+        "num_parcelas": _truthy_count(r["parcelas"]),
+        "primer_albaran": r["primer_albaran"],
+        "ultimo_albaran": r["ultimo_albaran"],
+    }
+
+
+def format_parcela(r: Dict[str, Any]) -> Dict[str, Any]:
+    parcela_info = dict((r.get("parcela_doc") or [{}])[0])
+    superficie = parcela_info.get("superficie")
+    coste_por_ha = None
+    if isinstance(superficie, (int, float)) and superficie > 0:
+        coste_por_ha = round(r["total"] / superficie, 2)
+    return {
+        "parcela_codigo": r["_id"],
+        "cultivo": r["cultivo"],
+        "proveedor": r["tercero"],
+        "campana": r["campana"],
+        **parcela_info,
+        "total": r["total"],
+        "count": r["count"],
+        "coste_por_ha": coste_por_ha,
+        "primer_albaran": r["primer_albaran"],
+        "ultimo_albaran": r["ultimo_albaran"],
+    }
+
+
+def format_resumen(facets: Dict[str, List[dict]]) -> Dict[str, Any]:
+    totales = (facets.get("totales") or [{}])[0]
+    return {
+        "total_general": totales.get("total", 0),
+        "total_albaranes": totales.get("count", 0),
+        "por_proveedor": [
+            {"proveedor": r["_id"], "total": r["total"], "count": r["count"], "albaranes": []}
+            for r in facets.get("por_proveedor", [])
+        ],
+        "por_contrato": [format_contrato_resumen(r) for r in facets.get("por_contrato", []) if r["_id"]],
+        "por_cultivo": [
+            {"cultivo": r["_id"], "total": r["total"], "count": r["count"]}
+            for r in facets.get("por_cultivo", [])
+        ],
+        "por_parcela": [
+            {"parcela": r["_id"], "total": r["total"], "count": r["count"], "cultivo": r["cultivo_resumen"]}
+            for r in facets.get("por_parcela", [])
+        ],
+    }
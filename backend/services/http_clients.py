@@ -0,0 +1,184 @@
+"""
+HTTP Clients - Registro de clientes httpx compartidos para integraciones externas.
+
+SIGPAC, OpenWeatherMap, MAPA y los webhooks del ERP creaban un
+`httpx.AsyncClient` por llamada: cada petición pagaba DNS, TCP y TLS y no se
+reutilizaba ninguna conexión. Este módulo mantiene un cliente por integración
+durante toda la vida de la aplicación:
+
+- pool de conexiones propio por integración (httpx agrupa las conexiones por
+  host dentro de cada cliente), con límites configurables;
+- HTTP/2 si el paquete `h2` está instalado (si no, HTTP/1.1 con keep-alive);
+- timeout por defecto de la integración, que cada llamada puede ajustar;
+- reintentos con backoff exponencial y jitter ante errores de red y
+  respuestas 429/502/503/504. Solo se reintentan métodos idempotentes; en los
+  POST (webhooks) solo se reintentan los fallos de conexión, cuando la
+  petición no llegó a enviarse;
+- métricas de latencia por integración (`get_http_metrics`, expuestas en
+  `/api/system/http-clients`).
+
+Uso:
+
+    resp = await http_request("sigpac", "GET", url, timeout=12.0)
+
+Para añadir una integración basta con registrarla en `INTEGRATIONS`.
+Los clientes se cierran en el apagado de la aplicación (`close_http_clients`).
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+
+try:  # HTTP/2 requiere el extra `httpx[http2]`
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_RETRY_BACKOFF_SECONDS = float(os.environ.get("HTTP_RETRY_BACKOFF_SECONDS", "0.5"))
+
+RETRY_STATUS = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+_LATENCY_WINDOW = 200
+
+
+@dataclass(frozen=True)
+class Integration:
+    timeout: float
+    retries: int = 2
+    max_connections: int = HTTP_MAX_CONNECTIONS
+    user_agent: str = "FRUVECO/1.0"
+
+
+INTEGRATIONS: Dict[str, Integration] = {
+    "sigpac": Integration(timeout=15.0, retries=2),
+    "openweather": Integration(timeout=float(os.environ.get("WEATHER_TIMEOUT_SECONDS", "10")), retries=1,
+                               max_connections=int(os.environ.get("WEATHER_MAX_CONCURRENCY", "8"))),
+    "mapa": Integration(timeout=30.0, retries=1),
+    "webhooks": Integration(timeout=10.0, retries=1),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_metrics: Dict[str, Dict[str, Any]] = {}
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def _integration(name: str) -> Integration:
+    try:
+        return INTEGRATIONS[name]
+    except KeyError:
+        raise ValueError(f"Integración HTTP no registrada: {name}")
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Cliente compartido de la integración (se crea en el primer uso)."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        cfg = _integration(name)
+        client = httpx.AsyncClient(
+            timeout=cfg.timeout,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=cfg.max_connections,
+                max_keepalive_connections=cfg.max_connections,
+                keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+            ),
+            headers={"User-Agent": cfg.user_agent},
+        )
+        _clients[name] = client
+    return client
+
+
+def _record(name: str, elapsed: float, status: Optional[int], retries: int) -> None:
+    m = _metrics.setdefault(name, {"requests": 0, "errors": 0, "retries": 0,
+                                   "total_seconds": 0.0, "max_seconds": 0.0, "by_status": {}})
+    m["requests"] += 1
+    m["retries"] += retries
+    m["total_seconds"] += elapsed
+    m["max_seconds"] = max(m["max_seconds"], elapsed)
+    if status is None or status >= 500:
+        m["errors"] += 1
+    key = str(status) if status is not None else "network_error"
+    m["by_status"][key] = m["by_status"].get(key, 0) + 1
+    _latencies.setdefault(name, deque(maxlen=_LATENCY_WINDOW)).append(elapsed)
+
+
+def _backoff(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), 10.0)
+    return HTTP_RETRY_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random())
+
+
+async def http_request(name: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """Petición con el cliente compartido de `name`, reintentos y métricas.
+
+    Acepta los mismos argumentos que `httpx.AsyncClient.request` (params,
+    json, headers, timeout, follow_redirects...). Si se agotan los reintentos
+    devuelve la última respuesta o relanza la última excepción de httpx.
+    """
+    cfg = _integration(name)
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    client = get_http_client(name)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            # Un fallo de conexión no llegó a enviar la petición: se puede reintentar siempre
+            retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if attempt >= cfg.retries or not retryable:
+                _record(name, time.monotonic() - started, None, attempt)
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code in RETRY_STATUS and idempotent and attempt < cfg.retries:
+            await response.aclose()
+            await asyncio.sleep(_backoff(attempt, response))
+            attempt += 1
+            continue
+
+        _record(name, time.monotonic() - started, response.status_code, attempt)
+        return response
+
+
+def get_http_metrics() -> Dict[str, Any]:
+    """Métricas por integración: peticiones, errores, reintentos y latencias."""
+    integraciones: Dict[str, Any] = {}
+    for name, cfg in INTEGRATIONS.items():
+        m = _metrics.get(name, {"requests": 0, "errors": 0, "retries": 0,
+                                "total_seconds": 0.0, "max_seconds": 0.0, "by_status": {}})
+        recent = sorted(_latencies.get(name, ()))
+        integraciones[name] = {
+            **m,
+            "avg_seconds": round(m["total_seconds"] / m["requests"], 4) if m["requests"] else 0.0,
+            "p50_seconds": round(recent[len(recent) // 2], 4) if recent else None,
+            "p95_seconds": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)], 4) if recent else None,
+            "timeout_seconds": cfg.timeout,
+            "max_retries": cfg.retries,
+            "client_open": name in _clients and not _clients[name].is_closed,
+        }
+    return {"http2": HTTP2_AVAILABLE, "integrations": integraciones}
+
+
+async def close_http_clients() -> None:
+    """Cierra todos los clientes compartidos (apagado de la aplicación)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        if not client.is_closed:
+            await client.aclose()
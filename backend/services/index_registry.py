@@ -0,0 +1,332 @@
+"""
+Index Registry - Índices MongoDB declarados por colección.
+
+Cada patrón de consulta "caliente" de la app tiene aquí su índice. Al arrancar
+la app (`server.py`) se lanza `ensure_indexes` en segundo plano: compara los
+índices existentes con los declarados, crea los que faltan (idempotente) y
+guarda un informe de drift consultable en `GET /api/system/indexes`.
+
+`REGISTERED_QUERIES` contiene una consulta representativa por índice; el
+script `scripts/explain_indexes.py` imprime su plan `explain()` para comprobar
+que efectivamente usan IXSCAN y no COLLSCAN.
+
+Para añadir un índice: declararlo en `INDEX_REGISTRY` y (opcional) su consulta
+en `REGISTERED_QUERIES`. Nunca se borran índices automáticamente; los que
+existen en Mongo pero no están declarados se reportan como `unexpected`.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import IndexModel
+
+from database import db
+
+IndexKeys = List[Tuple[str, int]]
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    keys: IndexKeys
+    unique: bool = False
+    sparse: bool = False
+    partial_filter: Optional[Dict[str, Any]] = None
+    expire_after_seconds: Optional[int] = None
+    name: Optional[str] = None
+
+    @property
+    def index_name(self) -> str:
+        return self.name or "idx_" + "_".join(f"{k}_{d}" for k, d in self.keys).replace(".", "_")
+
+    def to_model(self) -> IndexModel:
+        options: Dict[str, Any] = {"name": self.index_name}
+        if self.unique:
+            options["unique"] = True
+        if self.sparse:
+            options["sparse"] = True
+        if self.partial_filter:
+            options["partialFilterExpression"] = self.partial_filter
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return IndexModel(self.keys, **options)
+
+
+@dataclass
+class RegisteredQuery:
+    collection: str
+    description: str
+    filter: Dict[str, Any]
+    sort: Optional[IndexKeys] = None
+    projection: Optional[Dict[str, Any]] = field(default=None)
+
+
+INDEX_REGISTRY: Dict[str, List[IndexSpec]] = {
+    "tratamientos": [
+        IndexSpec([("parcelas_ids", 1), ("fecha_tratamiento", 1)]),
+        IndexSpec([("contrato_id", 1), ("fecha_tratamiento", 1)]),
+        IndexSpec([("created_at", -1)]),
+        IndexSpec([("created_at", -1), ("_id", -1)]),
+    ],
+    "visitas": [
+        IndexSpec([("parcela_id", 1), ("numero_visita", 1), ("fecha_visita", 1)]),
+        IndexSpec([("codigo_plantacion", 1), ("numero_visita", 1), ("fecha_visita", 1)]),
+        IndexSpec([("contrato_id", 1), ("numero_visita", 1), ("fecha_visita", 1)]),
+        IndexSpec([("created_at", -1)]),
+    ],
+    "fichajes": [
+        IndexSpec([("empleado_id", 1), ("fecha", -1)]),
+        IndexSpec([("fecha", -1), ("hora", -1)]),
+    ],
+    "productividad": [
+        IndexSpec([("empleado_id", 1), ("fecha", -1)]),
+        IndexSpec([("fecha", -1)]),
+    ],
+    "albaranes": [
+        IndexSpec([("contrato_id", 1)]),
+        IndexSpec([("fecha", -1)]),
+        IndexSpec([("fecha", -1), ("_id", -1)]),
+        IndexSpec([("campana", 1), ("fecha", -1)]),
+    ],
+    # Ordenaciones de los listados paginados por cursor (services/pagination.py)
+    "cosechas": [
+        IndexSpec([("created_at", -1), ("_id", -1)]),
+    ],
+    "evaluaciones": [
+        IndexSpec([("created_at", -1), ("_id", -1)]),
+    ],
+    "irrigaciones": [
+        IndexSpec([("fecha", -1), ("_id", -1)]),
+    ],
+    "clientes": [
+        IndexSpec([("codigo_num", 1), ("_id", 1)]),
+        # Referencias de la API de integración ERP (cargas masivas: `$in` por lote)
+        IndexSpec([("referencia_erp", 1)], sparse=True),
+        IndexSpec([("cif_nif", 1)]),
+    ],
+    "fincas": [
+        IndexSpec([("denominacion", 1), ("nombre", 1), ("_id", 1)]),
+        IndexSpec([("referencia_erp", 1)], sparse=True),
+    ],
+    "contratos": [
+        IndexSpec([("referencia_erp", 1)], sparse=True),
+    ],
+    "parcelas": [
+        IndexSpec([("referencia_erp", 1)], sparse=True),
+    ],
+    "proveedores": [
+        IndexSpec([("referencia_erp", 1)], sparse=True),
+        IndexSpec([("cif_nif", 1)]),
+    ],
+    "cultivos": [
+        IndexSpec([("codigo", 1)]),
+    ],
+    "agentes": [
+        IndexSpec([("codigo", 1)]),
+    ],
+    "comisiones_generadas": [
+        IndexSpec([("albaran_id", 1)]),
+        # Resumen de comisiones desde el ledger y su desglose paginado por agente
+        IndexSpec([("agente_id", 1), ("tipo_agente", 1), ("fecha_albaran", -1), ("_id", -1)]),
+        IndexSpec([("campana", 1), ("tipo_agente", 1)]),
+    ],
+    "albaranes_diario": [
+        IndexSpec([("fecha", -1)]),
+        IndexSpec([("campana", 1), ("fecha", -1)]),
+        IndexSpec([("tipo", 1), ("fecha", -1)]),
+        IndexSpec([("contrato_id", 1), ("operacion", 1)]),
+    ],
+    "notificaciones": [
+        IndexSpec([("destinatarios", 1), ("created_at", -1)]),
+        IndexSpec([("created_at", -1)]),
+        IndexSpec(
+            [("_dedup_key", 1)],
+            unique=True,
+            partial_filter={"_dedup_key": {"$exists": True}},
+        ),
+    ],
+    "alertas_clima": [
+        IndexSpec([("parcela_id", 1), ("regla_id", 1), ("created_at", -1)]),
+        IndexSpec([("created_at", -1)]),
+        IndexSpec(
+            [("_dedup_key", 1)],
+            unique=True,
+            partial_filter={"_dedup_key": {"$exists": True}},
+        ),
+    ],
+    "datos_clima": [
+        IndexSpec([("parcela_id", 1), ("timestamp", -1)]),
+    ],
+    "fitosanitarios_usos": [
+        IndexSpec([("fitosanitario_id", 1), ("cultivo", 1), ("plaga", 1)]),
+        IndexSpec([("cultivo", 1), ("plaga", 1)]),
+    ],
+    "users": [
+        IndexSpec([("email", 1)], unique=True),
+    ],
+    "background_jobs": [
+        IndexSpec([("status", 1), ("created_at", 1)]),
+        IndexSpec([("user.id", 1), ("kind", 1), ("created_at", -1)]),
+    ],
+    "sigpac_cache": [
+        # Caducidad dura de las respuestas cacheadas (SIGPAC_CACHE_MAX_AGE_DAYS)
+        IndexSpec([("expires_at", 1)], expire_after_seconds=0),
+    ],
+    "pdf_cache_entries": [
+        IndexSpec([("kind", 1), ("subject_id", 1)]),
+        IndexSpec([("last_used_at", 1)]),
+    ],
+    "erp_webhook_outbox": [
+        # Entregas vencidas por webhook (dispatcher) y listado de dead letters
+        IndexSpec([("webhook_id", 1), ("status", 1), ("next_attempt_at", 1)]),
+        IndexSpec([("status", 1), ("next_attempt_at", 1)]),
+        IndexSpec([("claim_token", 1)], sparse=True),
+        IndexSpec([("created_at", -1)]),
+        # Caducidad de las entregas hechas (WEBHOOK_OUTBOX_RETENTION_DAYS)
+        IndexSpec([("expires_at", 1)], expire_after_seconds=0),
+    ],
+    "scheduler_runs": [
+        IndexSpec([("job_id", 1), ("started_at", -1)]),
+        IndexSpec([("started_at", -1)]),
+        # Caducidad del historial (SCHEDULER_RUNS_TTL_DAYS, fijada en cada registro)
+        IndexSpec([("expires_at", 1)], expire_after_seconds=0),
+    ],
+}
+
+
+REGISTERED_QUERIES: List[RegisteredQuery] = [
+    RegisteredQuery("tratamientos", "Tratamientos de una parcela (PDF evaluación)",
+                    {"parcelas_ids": "<parcela_id>"}, sort=[("fecha_tratamiento", 1)]),
+    RegisteredQuery("tratamientos", "Tratamientos por contrato (fallback PDF)",
+                    {"contrato_id": "<contrato_id>"}, sort=[("fecha_tratamiento", 1)]),
+    RegisteredQuery("visitas", "Visitas de una parcela",
+                    {"parcela_id": "<parcela_id>"}, sort=[("numero_visita", 1), ("fecha_visita", 1)]),
+    RegisteredQuery("visitas", "Visitas por código de plantación",
+                    {"codigo_plantacion": "<codigo>"}, sort=[("numero_visita", 1), ("fecha_visita", 1)]),
+    RegisteredQuery("visitas", "Actividad reciente (dashboard)", {}, sort=[("created_at", -1)]),
+    RegisteredQuery("tratamientos", "Actividad reciente (dashboard)", {}, sort=[("created_at", -1)]),
+    RegisteredQuery("fichajes", "Fichajes de un empleado en un rango",
+                    {"empleado_id": "<empleado_id>", "fecha": {"$gte": "2026-01-01", "$lte": "2026-01-31"}},
+                    sort=[("fecha", -1)]),
+    RegisteredQuery("fichajes", "Fichajes de hoy", {"fecha": "2026-01-01"}, sort=[("hora", -1)]),
+    RegisteredQuery("productividad", "Productividad de un empleado",
+                    {"empleado_id": "<empleado_id>", "fecha": "2026-01-01"}),
+    RegisteredQuery("albaranes", "Albaranes de un contrato", {"contrato_id": "<contrato_id>"}),
+    RegisteredQuery("albaranes", "Albaranes por rango de fechas",
+                    {"fecha": {"$gte": "2026-01-01", "$lte": "2026-12-31"}}),
+    RegisteredQuery("albaranes", "Albaranes de una campaña", {"campana": "2025/26"}, sort=[("fecha", -1)]),
+    RegisteredQuery("comisiones_generadas", "Comisión de un albarán", {"albaran_id": "<albaran_id>"}),
+    RegisteredQuery("comisiones_generadas", "Albaranes de un agente en el resumen de comisiones",
+                    {"agente_id": "<agente_id>", "tipo_agente": "compra", "estado": {"$ne": "anulada"}},
+                    sort=[("fecha_albaran", -1), ("_id", -1)]),
+    RegisteredQuery("albaranes_diario", "Informe de gastos/ingresos por rango de fechas",
+                    {"fecha": {"$gte": "2024-01-01", "$lte": "2026-12-31"}}),
+    RegisteredQuery("albaranes_diario", "Informe de ingresos de una campaña",
+                    {"tipo": "Albarán de venta", "fecha": {"$gte": "2026-01-01"}}),
+    RegisteredQuery("notificaciones", "Notificaciones de un usuario",
+                    {"$or": [{"destinatarios": None}, {"destinatarios": "<user_id>"}]},
+                    sort=[("created_at", -1)]),
+    RegisteredQuery("notificaciones", "Deduplicación de notificaciones", {"_dedup_key": "<dedup>"}),
+    RegisteredQuery("alertas_clima", "Alerta abierta por parcela y regla",
+                    {"parcela_id": "<parcela_id>", "regla_id": "<regla>",
+                     "created_at": {"$gte": datetime(2026, 1, 1)}}),
+    RegisteredQuery("datos_clima", "Último dato climático manual de las parcelas",
+                    {"parcela_id": {"$in": ["<parcela_id>"]}}, sort=[("timestamp", -1)]),
+    RegisteredQuery("fitosanitarios_usos", "Usos de un producto",
+                    {"fitosanitario_id": "<id>"}, sort=[("cultivo", 1), ("plaga", 1)]),
+    RegisteredQuery("users", "Login / get_current_user", {"email": "<email>"}),
+    RegisteredQuery("background_jobs", "Siguiente job pendiente",
+                    {"status": "pending"}, sort=[("created_at", 1)]),
+    RegisteredQuery("erp_webhook_outbox", "Entregas de webhook vencidas",
+                    {"webhook_id": "<webhook_id>", "status": "pending",
+                     "next_attempt_at": {"$lte": datetime(2026, 1, 1)}}, sort=[("created_at", 1)]),
+    RegisteredQuery("parcelas", "Parcelas existentes de un lote NDJSON del ERP",
+                    {"referencia_erp": {"$in": ["<referencia_erp>"]}}),
+    RegisteredQuery("proveedores", "Proveedores de un lote del ERP por CIF/NIF",
+                    {"cif_nif": {"$in": ["<cif_nif>"]}}),
+    RegisteredQuery("scheduler_runs", "Historial de un job programado",
+                    {"job_id": "climate_check"}, sort=[("started_at", -1)]),
+]
+
+
+# Último informe generado por ensure_indexes (None hasta el primer arranque)
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def _normalize_keys(keys: Any) -> List[Tuple[str, Any]]:
+    return [(k, int(d) if isinstance(d, (int, float)) else d) for k, d in keys]
+
+
+async def ensure_indexes(database: Any = None) -> Dict[str, Any]:
+    """Crea los índices declarados que falten y devuelve un informe de drift.
+
+    - created: índices que no existían y se han creado ahora.
+    - errors: índices que no se han podido crear (p. ej. duplicados en un único).
+    - mismatched: mismo nombre/claves que uno declarado pero distintas opciones.
+    - unexpected: índices existentes que no están en el registro.
+    """
+    global _last_report
+    database = database if database is not None else db
+    report: Dict[str, Any] = {
+        "checked_at": datetime.now(timezone.utc).isoformat(),
+        "created": [],
+        "errors": [],
+        "mismatched": [],
+        "unexpected": [],
+        "ok": [],
+    }
+
+    for collection_name, specs in INDEX_REGISTRY.items():
+        coll = database[collection_name]
+        try:
+            existing = await coll.index_information()
+        except Exception as e:
+            report["errors"].append({"collection": collection_name, "error": str(e)})
+            continue
+
+        existing_by_keys = {tuple(_normalize_keys(info["key"])): (name, info) for name, info in existing.items()}
+        declared_keys = set()
+        for spec in specs:
+            keys = tuple(_normalize_keys(spec.keys))
+            declared_keys.add(keys)
+            entry = {"collection": collection_name, "index": spec.index_name}
+            if keys in existing_by_keys:
+                name, info = existing_by_keys[keys]
+                if bool(info.get("unique")) != spec.unique or info.get("partialFilterExpression") != spec.partial_filter:
+                    report["mismatched"].append({**entry, "existing": name})
+                else:
+                    report["ok"].append(entry)
+                continue
+            try:
+                await coll.create_indexes([spec.to_model()])
+                report["created"].append(entry)
+            except Exception as e:
+                report["errors"].append({**entry, "error": str(e)})
+
+        for keys, (name, _info) in existing_by_keys.items():
+            if name != "_id_" and keys not in declared_keys:
+                report["unexpected"].append({"collection": collection_name, "index": name})
+
+    _last_report = report
+    print(
+        f"[Indexes] ok={len(report['ok'])} created={len(report['created'])} "
+        f"mismatched={len(report['mismatched'])} errors={len(report['errors'])} "
+        f"unexpected={len(report['unexpected'])}"
+    )
+    for err in report["errors"]:
+        print(f"[Indexes] error {err}")
+    return report
+
+
+async def run_ensure_indexes() -> None:
+    """Wrapper para `asyncio.create_task` en el startup (nunca propaga errores)."""
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        print(f"[Indexes] ensure_indexes failed: {e}")
+
+
+def get_index_report() -> Optional[Dict[str, Any]]:
+    """Último informe de drift (o None si aún no se ha ejecutado)."""
+    return _last_report
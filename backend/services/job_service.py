@@ -0,0 +1,382 @@
+"""
+Job Service - Cola persistente de trabajos en segundo plano.
+
+Los trabajos largos (exportaciones masivas, regeneraciones...) se registran en
+la colección `background_jobs` y los ejecuta un worker asíncrono que arranca
+con la app. El endpoint HTTP solo crea el job y devuelve su id; el cliente
+consulta el estado/progreso y descarga el resultado cuando está listo.
+
+- Cada tipo de job (`kind`) registra su handler con `register_job_handler`.
+- El worker reclama jobs de forma atómica (`find_one_and_update`), por lo que
+  varios procesos uvicorn pueden compartir la misma cola sin duplicar trabajo.
+  Los jobs cuyo worker deja de emitir heartbeat se vuelven a encolar; tras
+  `_MAX_ATTEMPTS` intentos se marcan como `failed` para que quien consulta su
+  estado deje de esperar y `purge_expired_jobs` pueda eliminarlos.
+- Si el handler devuelve un `JobFile`, el fichero se guarda en GridFS
+  (bucket `job_results`) y puede descargarse varias veces hasta que caduca
+  (`JOB_RESULT_TTL_HOURS`). `purge_expired_jobs` elimina jobs y ficheros
+  caducados.
+
+Configuración (variables de entorno):
+    JOB_WORKER_CONCURRENCY   Jobs simultáneos por proceso (default: 2)
+    JOB_RESULT_TTL_HOURS     Horas que se conserva el resultado (default: 24)
+    JOB_STALE_SECONDS        Sin heartbeat durante este tiempo → re-encolar (default: 600)
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from database import db, serialize_doc
+
+JOB_WORKER_CONCURRENCY = int(os.environ.get("JOB_WORKER_CONCURRENCY", "2") or 2)
+JOB_RESULT_TTL_HOURS = float(os.environ.get("JOB_RESULT_TTL_HOURS", "24") or 24)
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "600") or 600)
+_POLL_INTERVAL_SECONDS = 2.0
+_HEARTBEAT_SECONDS = 30.0
+_MAX_ATTEMPTS = 3
+_ABANDONED_SWEEP_SECONDS = 60.0
+
+jobs_collection = db['background_jobs']
+_results_bucket: Optional[AsyncIOMotorGridFSBucket] = None
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_handlers: Dict[str, Callable[["JobContext"], Awaitable[Any]]] = {}
+_worker_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+@dataclass
+class JobFile:
+    """Resultado binario de un job (se persiste en GridFS)."""
+    filename: str
+    media_type: str
+    content: bytes
+
+
+class JobCancelled(Exception):
+    """El job fue cancelado por el usuario mientras se ejecutaba."""
+
+
+class JobContext:
+    """Contexto que recibe el handler: parámetros, usuario y reporte de progreso."""
+
+    def __init__(self, job: dict):
+        self.job_id: ObjectId = job["_id"]
+        self.kind: str = job["kind"]
+        self.params: Dict[str, Any] = job.get("params") or {}
+        self.user: Dict[str, Any] = job.get("user") or {}
+
+    async def progress(self, done: int, total: int, message: Optional[str] = None) -> None:
+        """Actualiza el progreso (y el heartbeat). Lanza JobCancelled si se canceló."""
+        update: Dict[str, Any] = {
+            "progress.done": done,
+            "progress.total": total,
+            "progress.percent": round(done * 100 / total, 1) if total else 0.0,
+            "heartbeat_at": _now(),
+        }
+        if message is not None:
+            update["progress.message"] = message
+        job = await jobs_collection.find_one_and_update(
+            {"_id": self.job_id},
+            {"$set": update},
+            projection={"cancel_requested": 1},
+        )
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _get_bucket() -> AsyncIOMotorGridFSBucket:
+    global _results_bucket
+    if _results_bucket is None:
+        _results_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="job_results")
+    return _results_bucket
+
+
+def register_job_handler(kind: str, handler: Callable[[JobContext], Awaitable[Any]]) -> None:
+    """Registra el handler que ejecuta los jobs de tipo `kind`."""
+    _handlers[kind] = handler
+
+
+def serialize_job(job: dict) -> dict:
+    """Representación pública de un job (sin datos internos del worker)."""
+    data = serialize_doc(dict(job))
+    data["job_id"] = data.pop("_id")
+    for key in ("worker_id", "heartbeat_at", "cancel_requested"):
+        data.pop(key, None)
+    if data.get("result_file_id") is not None:
+        data["result_file_id"] = str(data["result_file_id"])
+    data["download_ready"] = job.get("status") == "completed" and job.get("result_file_id") is not None
+    return data
+
+
+async def submit_job(kind: str, params: Dict[str, Any], current_user: dict) -> dict:
+    """Encola un job nuevo y despierta al worker local."""
+    if kind not in _handlers:
+        raise ValueError(f"Tipo de job desconocido: {kind}")
+    now = _now()
+    job = {
+        "kind": kind,
+        "params": params,
+        "status": "pending",
+        "progress": {"done": 0, "total": 0, "percent": 0.0, "message": None},
+        "user": {
+            "id": current_user.get("_id"),
+            "email": current_user.get("email"),
+            "full_name": current_user.get("full_name"),
+        },
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "expires_at": now + timedelta(hours=JOB_RESULT_TTL_HOURS),
+        "error": None,
+        "result": None,
+        "result_file_id": None,
+        "cancel_requested": False,
+    }
+    result = await jobs_collection.insert_one(job)
+    job["_id"] = result.inserted_id
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await jobs_collection.find_one({"_id": ObjectId(job_id)})
+
+
+async def list_jobs(user_id: Optional[str] = None, kind: Optional[str] = None, limit: int = 50) -> List[dict]:
+    query: Dict[str, Any] = {}
+    if user_id:
+        query["user.id"] = user_id
+    if kind:
+        query["kind"] = kind
+    return await jobs_collection.find(query).sort("created_at", -1).to_list(limit)
+
+
+async def cancel_job(job: dict) -> None:
+    """Cancela un job pendiente o marca para cancelar uno en ejecución."""
+    if job.get("status") == "pending":
+        await jobs_collection.update_one(
+            {"_id": job["_id"], "status": "pending"},
+            {"$set": {"status": "cancelled", "finished_at": _now()}},
+        )
+    else:
+        await jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"cancel_requested": True}})
+
+
+async def delete_job(job: dict) -> None:
+    """Elimina un job y su fichero de resultado."""
+    await _delete_result_file(job.get("result_file_id"))
+    await jobs_collection.delete_one({"_id": job["_id"]})
+
+
+async def open_job_result(job: dict) -> AsyncIterator[bytes]:
+    """Itera el fichero de resultado desde GridFS por chunks."""
+    stream = await _get_bucket().open_download_stream(job["result_file_id"])
+    while True:
+        chunk = await stream.readchunk()
+        if not chunk:
+            break
+        yield chunk
+
+
+async def purge_expired_jobs() -> int:
+    """Elimina jobs caducados y sus ficheros en GridFS. Devuelve nº eliminados."""
+    removed = 0
+    async for job in jobs_collection.find(
+        {"expires_at": {"$lt": _now()}, "status": {"$nin": ["pending", "running"]}},
+        {"result_file_id": 1},
+    ):
+        await _delete_result_file(job.get("result_file_id"))
+        await jobs_collection.delete_one({"_id": job["_id"]})
+        removed += 1
+    return removed
+
+
+async def _delete_result_file(file_id: Any) -> None:
+    if file_id is None:
+        return
+    try:
+        await _get_bucket().delete(file_id)
+    except Exception as e:
+        print(f"[Jobs] failed to delete result file {file_id}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+async def _claim_next_job() -> Optional[dict]:
+    now = _now()
+    return await jobs_collection.find_one_and_update(
+        {
+            "$or": [
+                {"status": "pending"},
+                # Jobs huérfanos: el worker que los tenía dejó de dar señales
+                {
+                    "status": "running",
+                    "heartbeat_at": {"$lt": now - timedelta(seconds=JOB_STALE_SECONDS)},
+                    "attempts": {"$lt": _MAX_ATTEMPTS},
+                },
+            ],
+            "kind": {"$in": list(_handlers.keys())},
+        },
+        {"$set": {"status": "running", "worker_id": _WORKER_ID, "started_at": now, "heartbeat_at": now},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=True,
+    )
+
+
+async def fail_abandoned_jobs() -> int:
+    """Marca como `failed` los jobs huérfanos que ya agotaron sus intentos. Devuelve cuántos."""
+    now = _now()
+    result = await jobs_collection.update_many(
+        {
+            "status": "running",
+            "heartbeat_at": {"$lt": now - timedelta(seconds=JOB_STALE_SECONDS)},
+            "attempts": {"$gte": _MAX_ATTEMPTS},
+        },
+        {"$set": {
+            "status": "failed",
+            "error": f"El proceso que ejecutaba el trabajo dejó de responder {_MAX_ATTEMPTS} veces; "
+                     "no se volverá a intentar",
+            "finished_at": now,
+            "expires_at": now + timedelta(hours=JOB_RESULT_TTL_HOURS),
+        }},
+    )
+    if result.modified_count:
+        print(f"[Jobs] {result.modified_count} abandoned job(s) marked as failed")
+    return result.modified_count
+
+
+async def _heartbeat(job_id: ObjectId) -> None:
+    while True:
+        await asyncio.sleep(_HEARTBEAT_SECONDS)
+        try:
+            await jobs_collection.update_one(
+                {"_id": job_id, "worker_id": _WORKER_ID},
+                {"$set": {"heartbeat_at": _now()}},
+            )
+        except Exception as e:
+            # Un fallo puntual de Mongo no debe parar el latido: el job seguiría
+            # corriendo y el barrido lo daría por abandonado
+            print(f"[Jobs] heartbeat failed for {job_id}: {e}")
+
+
+async def _run_job(job: dict) -> None:
+    ctx = JobContext(job)
+    heartbeat = asyncio.create_task(_heartbeat(job["_id"]))
+    update: Dict[str, Any]
+    try:
+        outcome = await _handlers[job["kind"]](ctx)
+        update = {"status": "completed", "progress.percent": 100.0}
+        if isinstance(outcome, JobFile):
+            file_id = await _get_bucket().upload_from_stream(
+                outcome.filename,
+                outcome.content,
+                metadata={"job_id": str(job["_id"]), "media_type": outcome.media_type},
+            )
+            update.update({
+                "result_file_id": file_id,
+                "result": {"filename": outcome.filename, "media_type": outcome.media_type, "size": len(outcome.content)},
+            })
+        else:
+            update["result"] = outcome
+    except JobCancelled:
+        update = {"status": "cancelled"}
+    except Exception as e:
+        print(f"[Jobs] {job['kind']} {job['_id']} failed: {e}")
+        update = {"status": "failed", "error": getattr(e, "detail", None) or str(e)}
+    finally:
+        heartbeat.cancel()
+    now = _now()
+    update.update({"finished_at": now, "expires_at": now + timedelta(hours=JOB_RESULT_TTL_HOURS)})
+    await jobs_collection.update_one({"_id": job["_id"], "worker_id": _WORKER_ID}, {"$set": update})
+
+
+async def _worker_loop() -> None:
+    assert _wakeup is not None
+    slots = asyncio.Semaphore(JOB_WORKER_CONCURRENCY)
+    running: set = set()
+    try:
+        await purge_expired_jobs()
+    except Exception as e:
+        print(f"[Jobs] purge failed: {e}")
+    loop = asyncio.get_running_loop()
+    next_sweep = 0.0
+
+    def _done(t: asyncio.Task) -> None:
+        running.discard(t)
+        slots.release()
+
+    while True:
+        # El slot se libera una sola vez: aquí si no llega a arrancar un job,
+        # en `_done` si lo arranca
+        acquired = False
+        try:
+            if loop.time() >= next_sweep:
+                next_sweep = loop.time() + _ABANDONED_SWEEP_SECONDS
+                try:
+                    await fail_abandoned_jobs()
+                except Exception as e:
+                    print(f"[Jobs] abandoned-job sweep failed: {e}")
+            await slots.acquire()
+            acquired = True
+            job = await _claim_next_job()
+            if job is None:
+                slots.release()
+                acquired = False
+                _wakeup.clear()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), _POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(_run_job(job))
+            acquired = False
+            running.add(task)
+            task.add_done_callback(_done)
+        except asyncio.CancelledError:
+            for task in running:
+                task.cancel()
+            raise
+        except Exception as e:
+            print(f"[Jobs] worker loop error: {e}")
+            await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+        finally:
+            if acquired:
+                slots.release()
+
+
+def start_job_worker() -> None:
+    """Arranca el worker de jobs (startup de la app)."""
+    global _worker_task, _wakeup
+    if _worker_task is not None and not _worker_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _worker_task = asyncio.create_task(_worker_loop())
+    print(f"[Jobs] Worker {_WORKER_ID} started (concurrency={JOB_WORKER_CONCURRENCY})")
+
+
+def stop_job_worker() -> None:
+    """Detiene el worker de jobs (shutdown de la app)."""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        _worker_task = None
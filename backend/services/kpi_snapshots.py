@@ -0,0 +1,403 @@
+"""
+KPI Snapshots - Contadores del dashboard mantenidos de forma incremental.
+
+`/api/dashboard/kpis` es la página de inicio de todos los usuarios; incluso
+con agregaciones (`services/dashboard_kpis.py`) recorrer todas las
+colecciones en cada carga no escala. Este servicio mantiene un único
+documento en `kpi_snapshots` (`_id: "dashboard"`) con:
+
+- `counters`: conteos y sumas por colección (contratos por tipo, hectáreas por
+  provincia, costes por origen, superficie por cultivo...). Las rutas de
+  creación/edición/borrado de contratos, parcelas, fincas, tratamientos,
+  irrigaciones, tareas y cosechas aplican un `$inc` con la diferencia entre el
+  documento antes y después de la escritura.
+- `views`: listas "próximos N" y ventanas de fechas (dependen del día). Se
+  recalculan en segundo plano tras una escritura (con debounce), cuando cambia
+  el día y como mucho cada KPI_VIEWS_MAX_AGE_SECONDS.
+
+La lectura es un `find_one` por `_id`. Un job periódico del scheduler
+(`reconcile_kpi_snapshot`) recalcula todo desde cero y corrige cualquier
+deriva (escrituras por rutas no instrumentadas, imports, fallos entre la
+escritura y el `$inc`...).
+
+Uso en rutas:
+
+    await record_kpi_insert("parcelas", parcela_dict)         # tras insert_one
+    async with track_kpi_change("parcelas", parcela_id):      # update/delete
+        await parcelas_collection.update_one(...)
+    await record_kpi_change("contratos", old_doc, updated)    # si ya se tienen ambos
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from database import db
+from services.dashboard_kpis import assemble_kpis, compute_counters, compute_views
+
+kpi_snapshots_collection = db["kpi_snapshots"]
+
+KPI_SNAPSHOT_ID = "dashboard"
+KPI_VIEWS_MAX_AGE_SECONDS = int(os.environ.get("KPI_VIEWS_MAX_AGE_SECONDS", "300"))
+KPI_VIEWS_DEBOUNCE_SECONDS = float(os.environ.get("KPI_VIEWS_DEBOUNCE_SECONDS", "2"))
+KPI_RECONCILE_MINUTES = int(os.environ.get("KPI_RECONCILE_MINUTES", "30"))
+
+# Claves de agrupación (cultivo, provincia) que irán como nombres de campo:
+# Mongo no admite "." ni "$" inicial ni cadenas vacías en rutas de $inc.
+_EMPTY_KEY = "∅"
+
+
+def _escape_key(key: Any) -> str:
+    key = str(key)
+    if key == "":
+        return _EMPTY_KEY
+    key = key.replace(".", "．")
+    return "＄" + key[1:] if key.startswith("$") else key
+
+
+def _unescape_key(key: str) -> str:
+    if key == _EMPTY_KEY:
+        return ""
+    key = key.replace("．", ".")
+    return "$" + key[1:] if key.startswith("＄") else key
+
+
+def _n(value: Any) -> float:
+    """Valor numérico como lo suma `$sum` (ignora null, textos y booleanos)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0
+    return value
+
+
+def _truthy(value: Any) -> bool:
+    return value not in (None, False, 0, "")
+
+
+# ---------------------------------------------------------------------------
+# Contribución de un documento a los contadores
+# ---------------------------------------------------------------------------
+# Debe reflejar exactamente la semántica de services/dashboard_kpis.compute_counters.
+
+def _contratos(doc: dict) -> Dict[str, float]:
+    return {"total": 1, "venta": 1 if doc.get("tipo") == "Venta" else 0}
+
+
+def _parcelas(doc: dict) -> Dict[str, float]:
+    cultivo = doc.get("cultivo")
+    cultivo = _escape_key("Unknown" if cultivo is None else cultivo)
+    superficie = _n(doc.get("superficie_total"))
+    return {
+        "total": 1,
+        "activas": 1 if doc.get("activo") is True else 0,
+        "superficie": superficie,
+        f"por_cultivo.{cultivo}.superficie": superficie,
+        f"por_cultivo.{cultivo}.parcelas": 1,
+    }
+
+
+def _fincas(doc: dict) -> Dict[str, float]:
+    provincia = _escape_key(doc.get("provincia") or "Sin provincia")
+    propia = 1 if _truthy(doc.get("finca_propia")) else 0
+    hectareas = _n(doc.get("hectareas"))
+    produccion_esperada = _n(doc.get("produccion_esperada"))
+    return {
+        "total": 1,
+        "propias": propia,
+        "hectareas": hectareas,
+        "produccion_esperada": produccion_esperada,
+        "produccion_disponible": _n(doc.get("produccion_disponible")),
+        f"por_provincia.{provincia}.count": 1,
+        f"por_provincia.{provincia}.hectareas": hectareas,
+        f"por_provincia.{provincia}.produccion_esperada": produccion_esperada,
+        f"por_provincia.{provincia}.propias": propia,
+    }
+
+
+def _coste(field: str) -> Callable[[dict], Dict[str, float]]:
+    return lambda doc: {"total": 1, "coste": _n(doc.get(field))}
+
+
+def _cosechas(doc: dict) -> Dict[str, float]:
+    return {
+        "total": 1,
+        "produccion": _n(doc.get("cosecha_total")),
+        "ingresos": _n(doc.get("ingreso_total")),
+    }
+
+
+_CONTRIBUTIONS: Dict[str, Callable[[dict], Dict[str, float]]] = {
+    "contratos": _contratos,
+    "parcelas": _parcelas,
+    "fincas": _fincas,
+    "tratamientos": _coste("coste_total"),
+    "irrigaciones": _coste("coste"),
+    "tareas": _coste("coste_total"),
+    "cosechas": _cosechas,
+}
+
+# Campos leídos por track_kpi_change (proyección mínima)
+_TRACKED_FIELDS: Dict[str, Dict[str, int]] = {
+    "contratos": {"tipo": 1},
+    "parcelas": {"cultivo": 1, "superficie_total": 1, "activo": 1},
+    "fincas": {"provincia": 1, "finca_propia": 1, "hectareas": 1,
+               "produccion_esperada": 1, "produccion_disponible": 1},
+    "tratamientos": {"coste_total": 1},
+    "irrigaciones": {"coste": 1},
+    "tareas": {"coste_total": 1},
+    "cosechas": {"cosecha_total": 1, "ingreso_total": 1},
+}
+
+
+def compute_kpi_delta(collection_name: str, before: Optional[dict], after: Optional[dict]) -> Dict[str, float]:
+    """Diferencia de contadores entre dos versiones de un documento (None = no existe)."""
+    contribution = _CONTRIBUTIONS[collection_name]
+    delta: Dict[str, float] = defaultdict(int)
+    if after is not None:
+        for path, value in contribution(after).items():
+            delta[f"{collection_name}.{path}"] += value
+    if before is not None:
+        for path, value in contribution(before).items():
+            delta[f"{collection_name}.{path}"] -= value
+    return {path: value for path, value in delta.items() if value}
+
+
+# ---------------------------------------------------------------------------
+# Escritura incremental
+# ---------------------------------------------------------------------------
+
+_views_refresh_task: Optional[asyncio.Task] = None
+
+
+async def record_kpi_change(collection_name: str, before: Optional[dict], after: Optional[dict]) -> None:
+    """Aplica al snapshot el cambio de un documento. Nunca propaga errores a la ruta."""
+    try:
+        delta = compute_kpi_delta(collection_name, before, after)
+        update: Dict[str, Any] = {"$set": {"views_stale": True, "updated_at": datetime.now(timezone.utc)}}
+        if delta:
+            update["$inc"] = {f"counters.{path}": value for path, value in delta.items()}
+        # Sin upsert: si aún no hay snapshot, la primera lectura lo construye completo
+        await kpi_snapshots_collection.update_one({"_id": KPI_SNAPSHOT_ID}, update)
+        _schedule_views_refresh()
+    except Exception as e:
+        print(f"[KPI Snapshot] incremental update failed for {collection_name}: {e}")
+
+
+async def record_kpi_insert(collection_name: str, doc: dict) -> None:
+    await record_kpi_change(collection_name, None, doc)
+
+
+async def record_kpi_changes(collection_name: str, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> None:
+    """Como `record_kpi_change` para muchos documentos (cargas masivas): un solo update."""
+    try:
+        total: Dict[str, float] = defaultdict(int)
+        for before, after in changes:
+            for path, value in compute_kpi_delta(collection_name, before, after).items():
+                total[path] += value
+        update: Dict[str, Any] = {"$set": {"views_stale": True, "updated_at": datetime.now(timezone.utc)}}
+        delta = {path: value for path, value in total.items() if value}
+        if delta:
+            update["$inc"] = {f"counters.{path}": value for path, value in delta.items()}
+        await kpi_snapshots_collection.update_one({"_id": KPI_SNAPSHOT_ID}, update)
+        _schedule_views_refresh()
+    except Exception as e:
+        print(f"[KPI Snapshot] incremental update failed for {collection_name}: {e}")
+
+
+async def touch_kpi_views() -> None:
+    """Marca las vistas como obsoletas (escrituras que no afectan a los contadores)."""
+    try:
+        await kpi_snapshots_collection.update_one({"_id": KPI_SNAPSHOT_ID}, {"$set": {"views_stale": True}})
+        _schedule_views_refresh()
+    except Exception as e:
+        print(f"[KPI Snapshot] touch views failed: {e}")
+
+
+async def load_kpi_sources(collection_name: str, doc_ids: List[ObjectId]) -> List[dict]:
+    """Campos con peso en los KPI de los documentos dados ([] si la colección no cuenta).
+
+    Para borrados masivos: leer antes del delete y pasar `(doc, None)` a `record_kpi_changes`.
+    """
+    projection = _TRACKED_FIELDS.get(collection_name)
+    if projection is None or not doc_ids:
+        return []
+    return await db[collection_name].find({"_id": {"$in": doc_ids}}, projection).to_list(None)
+
+
+@asynccontextmanager
+async def track_kpi_change(collection_name: str, doc_id: Any) -> AsyncIterator[None]:
+    """Lee el documento antes y después del bloque y aplica la diferencia."""
+    if isinstance(doc_id, str):
+        doc_id = ObjectId(doc_id) if ObjectId.is_valid(doc_id) else None
+    if doc_id is None:
+        yield
+        return
+    collection = db[collection_name]
+    projection = _TRACKED_FIELDS[collection_name]
+    before = await collection.find_one({"_id": doc_id}, projection)
+    try:
+        yield
+    finally:
+        after = await collection.find_one({"_id": doc_id}, projection)
+        if before is not None or after is not None:
+            await record_kpi_change(collection_name, before, after)
+
+
+def _schedule_views_refresh() -> None:
+    """Recalcula las vistas poco después de una escritura (agrupa ráfagas)."""
+    global _views_refresh_task
+    if _views_refresh_task is not None and not _views_refresh_task.done():
+        return
+
+    async def _run() -> None:
+        await asyncio.sleep(KPI_VIEWS_DEBOUNCE_SECONDS)
+        await refresh_kpi_views(force=True)
+
+    try:
+        _views_refresh_task = asyncio.get_running_loop().create_task(_run())
+    except RuntimeError:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Recalculo completo y vistas
+# ---------------------------------------------------------------------------
+
+def _encode_counters(counters: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = {name: dict(values) for name, values in counters.items()}
+    encoded["parcelas"]["por_cultivo"] = {
+        _escape_key(k): v for k, v in counters["parcelas"]["por_cultivo"].items()
+    }
+    encoded["fincas"]["por_provincia"] = {
+        _escape_key(k): v for k, v in counters["fincas"]["por_provincia"].items()
+    }
+    return encoded
+
+
+def _clean_number(value: Any) -> Any:
+    # Los $inc con decimales acumulan residuos (0.1 + 0.2 - 0.1 ...)
+    return round(value, 6) if isinstance(value, float) else value
+
+
+def _decode_counters(counters: Dict[str, Any]) -> Dict[str, Any]:
+    decoded: Dict[str, Any] = {}
+    for name, values in counters.items():
+        decoded[name] = {}
+        for key, value in values.items():
+            if isinstance(value, dict):
+                decoded[name][key] = {
+                    _unescape_key(group): {k: _clean_number(v) for k, v in fields.items()}
+                    for group, fields in value.items()
+                }
+            else:
+                decoded[name][key] = _clean_number(value)
+    return decoded
+
+
+def _count_drift(old: Dict[str, Any], new: Dict[str, Any]) -> int:
+    drift = 0
+    for key in set(old) | set(new):
+        a, b = old.get(key, 0), new.get(key, 0)
+        if isinstance(a, dict) or isinstance(b, dict):
+            drift += _count_drift(a if isinstance(a, dict) else {}, b if isinstance(b, dict) else {})
+        elif abs(_n(a) - _n(b)) > 1e-6:
+            drift += 1
+    return drift
+
+
+async def reconcile_kpi_snapshot() -> Dict[str, Any]:
+    """Recalcula contadores y vistas desde las colecciones y reemplaza el snapshot."""
+    previous = await kpi_snapshots_collection.find_one({"_id": KPI_SNAPSHOT_ID}, {"counters": 1})
+    counters, views = await asyncio.gather(compute_counters(), compute_views())
+    encoded = _encode_counters(counters)
+    now = datetime.now(timezone.utc)
+    snapshot = {
+        "_id": KPI_SNAPSHOT_ID,
+        "counters": encoded,
+        "views": views,
+        "views_stale": False,
+        "views_refreshed_at": now,
+        "reconciled_at": now,
+        "updated_at": now,
+    }
+    await kpi_snapshots_collection.replace_one({"_id": KPI_SNAPSHOT_ID}, snapshot, upsert=True)
+    if previous and previous.get("counters"):
+        drift = _count_drift(previous["counters"], encoded)
+        if drift:
+            print(f"[KPI Snapshot] reconciled, {drift} counter(s) had drifted")
+    return snapshot
+
+
+async def refresh_kpi_views(force: bool = False) -> bool:
+    """Recalcula solo las vistas si están marcadas como obsoletas, caducadas o son de otro día."""
+    snapshot = await kpi_snapshots_collection.find_one(
+        {"_id": KPI_SNAPSHOT_ID}, {"views.fecha": 1, "views_stale": 1, "views_refreshed_at": 1}
+    )
+    if not snapshot:
+        await reconcile_kpi_snapshot()
+        return True
+    if not force and not _views_outdated(snapshot):
+        return False
+    views = await compute_views()
+    await kpi_snapshots_collection.update_one(
+        {"_id": KPI_SNAPSHOT_ID},
+        {"$set": {"views": views, "views_stale": False, "views_refreshed_at": datetime.now(timezone.utc)}},
+    )
+    return True
+
+
+def _views_outdated(snapshot: Dict[str, Any]) -> bool:
+    if snapshot.get("views_stale"):
+        return True
+    if (snapshot.get("views") or {}).get("fecha") != datetime.now().strftime("%Y-%m-%d"):
+        return True
+    refreshed = snapshot.get("views_refreshed_at")
+    if refreshed is None:
+        return True
+    if refreshed.tzinfo is None:
+        refreshed = refreshed.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - refreshed).total_seconds() > KPI_VIEWS_MAX_AGE_SECONDS
+
+
+# ---------------------------------------------------------------------------
+# Lectura
+# ---------------------------------------------------------------------------
+
+async def get_dashboard_kpis_snapshot() -> Dict[str, Any]:
+    """KPIs del dashboard desde el snapshot (lectura de un único documento)."""
+    snapshot = await kpi_snapshots_collection.find_one({"_id": KPI_SNAPSHOT_ID})
+    if not snapshot or not snapshot.get("counters") or not snapshot.get("views"):
+        snapshot = await reconcile_kpi_snapshot()
+    elif (snapshot.get("views") or {}).get("fecha") != datetime.now().strftime("%Y-%m-%d"):
+        # Primera lectura del día: las ventanas de fechas ya no son válidas
+        await refresh_kpi_views(force=True)
+        snapshot = await kpi_snapshots_collection.find_one({"_id": KPI_SNAPSHOT_ID})
+    return assemble_kpis(_decode_counters(snapshot["counters"]), snapshot["views"])
+
+
+async def get_snapshot_counters() -> Dict[str, Any]:
+    """Solo los contadores del snapshot (para los widgets que no necesitan vistas)."""
+    snapshot = await kpi_snapshots_collection.find_one({"_id": KPI_SNAPSHOT_ID}, {"counters": 1})
+    if not snapshot or not snapshot.get("counters"):
+        snapshot = await reconcile_kpi_snapshot()
+    return _decode_counters(snapshot["counters"])
+
+
+async def get_kpi_snapshot_status() -> Dict[str, Any]:
+    snapshot = await kpi_snapshots_collection.find_one(
+        {"_id": KPI_SNAPSHOT_ID}, {"views_stale": 1, "views_refreshed_at": 1, "reconciled_at": 1, "updated_at": 1}
+    )
+    if not snapshot:
+        return {"exists": False}
+    return {
+        "exists": True,
+        "views_stale": snapshot.get("views_stale", False),
+        "views_refreshed_at": snapshot.get("views_refreshed_at"),
+        "reconciled_at": snapshot.get("reconciled_at"),
+        "updated_at": snapshot.get("updated_at"),
+    }
@@ -0,0 +1,282 @@
+"""
+Map Render Cache - Teselas satélite y mapas de parcela cacheados en disco.
+
+El PDF de evaluación (`generate_evaluacion_pdf`) dibujaba cada vez el mapa de
+la parcela con `staticmap`: descargaba las teselas de Esri World Imagery,
+renderizaba el polígono con Pillow dentro del event loop y escribía un PNG
+temporal que luego había que borrar. Regenerar el PDF de una misma parcela
+repetía todo el trabajo.
+
+Dos cachés en disco, ambas acotadas por tamaño con expulsión LRU (la fecha de
+modificación del fichero hace de reloj: cada acierto la actualiza):
+
+- teselas en `MAP_CACHE_DIR/tiles/<proveedor>/<z>/<x>/<y>.png`
+  (MAP_TILE_CACHE_MAX_MB, 512 MB). `CachedStaticMap` sustituye la descarga
+  de `staticmap` por esta caché;
+- mapas ya renderizados en `MAP_CACHE_DIR/renders/<hash>.png`
+  (MAP_RENDER_CACHE_MAX_MB, 256 MB), con el hash de la geometría, el tamaño,
+  el proveedor de teselas y MAP_RENDER_STYLE_VERSION. Hay que subir esa versión
+  al cambiar el dibujo (colores, marcador, brújula, escala) para invalidar
+  los mapas antiguos.
+
+Uso:
+
+    png_path, cached = await get_parcel_map_png(geometria)  # [{lat, lng}, ...]
+
+El render corre en el pool de hilos de `services/render_service.py`. El PNG
+devuelto pertenece a la caché: se puede leer (file:// en WeasyPrint), pero
+no borrar.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from services.render_service import run_render_thread
+
+MAP_CACHE_DIR = os.environ.get("MAP_CACHE_DIR", "/app/uploads/cache/maps")
+MAP_TILE_CACHE_MAX_MB = float(os.environ.get("MAP_TILE_CACHE_MAX_MB", "512"))
+MAP_RENDER_CACHE_MAX_MB = float(os.environ.get("MAP_RENDER_CACHE_MAX_MB", "256"))
+MAP_TILE_TIMEOUT_SECONDS = float(os.environ.get("MAP_TILE_TIMEOUT_SECONDS", "10"))
+MAP_RENDER_STYLE_VERSION = "1"
+
+ESRI_WORLD_IMAGERY = "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
+MAP_WIDTH, MAP_HEIGHT = 900, 540
+
+
+class DiskLRU:
+    """Directorio de ficheros con tamaño máximo y expulsión del menos usado."""
+
+    def __init__(self, directory: str, max_bytes: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def path(self, relpath: str) -> str:
+        return os.path.join(self.directory, relpath)
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                full = os.path.join(root, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, full))
+        return files
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(size for _m, size, _p in self._scan())
+        return self._size
+
+    def get(self, relpath: str) -> Optional[str]:
+        """Ruta del fichero si está en caché (y lo marca como usado)."""
+        full = self.path(relpath)
+        try:
+            os.utime(full)
+        except OSError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return full
+
+    def put(self, relpath: str, content: bytes) -> str:
+        """Guarda `content` de forma atómica y expulsa lo más antiguo si se supera el límite."""
+        full = self.path(relpath)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = f"{full}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp, full)
+        with self._lock:
+            self._size = self._current_size() + len(content)
+            if self._size > self.max_bytes:
+                self._evict()
+        return full
+
+    def _evict(self) -> None:
+        # Bajar al 90 % del límite para no expulsar en cada escritura
+        target = self.max_bytes * 0.9
+        files = sorted(self._scan())
+        size = sum(s for _m, s, _p in files)
+        for _mtime, file_size, full in files:
+            if size <= target:
+                break
+            try:
+                os.remove(full)
+                size -= file_size
+                self.stats["evictions"] += 1
+            except OSError:
+                pass
+        self._size = size
+
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, "bytes": self._current_size(), "max_bytes": int(self.max_bytes),
+                "directory": self.directory}
+
+
+tile_cache = DiskLRU(os.path.join(MAP_CACHE_DIR, "tiles"), MAP_TILE_CACHE_MAX_MB * 1024 * 1024)
+render_cache = DiskLRU(os.path.join(MAP_CACHE_DIR, "renders"), MAP_RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _template_regex(url_template: str) -> "re.Pattern[str]":
+    pattern = re.escape(url_template)
+    for name in ("z", "x", "y"):
+        pattern = pattern.replace(re.escape("{" + name + "}"), f"(?P<{name}>\\d+)")
+    return re.compile(pattern + "$")
+
+
+@lru_cache(maxsize=None)
+def _cached_static_map_class() -> Any:
+    from staticmap import StaticMap
+
+    class CachedStaticMap(StaticMap):
+        """StaticMap que lee y guarda las teselas en `tile_cache` (z/x/y)."""
+
+        def __init__(self, *args: Any, provider: str = "esri", **kwargs: Any):
+            super().__init__(*args, **kwargs)
+            self.provider = provider
+            self._url_re = _template_regex(self.url_template)
+
+        def get(self, url: str, **kwargs: Any) -> Tuple[int, bytes]:
+            match = self._url_re.match(url)
+            if not match:
+                res = requests.get(url, **kwargs)
+                return res.status_code, res.content
+            relpath = os.path.join(self.provider, match["z"], match["x"], f"{match['y']}.png")
+            cached = tile_cache.get(relpath)
+            if cached:
+                with open(cached, "rb") as fh:
+                    return 200, fh.read()
+            res = requests.get(url, **kwargs)
+            if res.status_code == 200 and res.content:
+                tile_cache.put(relpath, res.content)
+            return res.status_code, res.content
+
+    return CachedStaticMap
+
+
+def _ring(geometria: List[Dict[str, Any]]) -> List[Tuple[float, float]]:
+    pts = [(float(p.get('lng', 0)), float(p.get('lat', 0))) for p in geometria]
+    # Cerrar el anillo si no viene cerrado
+    if pts and pts[0] != pts[-1]:
+        pts.append(pts[0])
+    return pts
+
+
+def map_cache_key(geometria: List[Dict[str, Any]], url_template: str = ESRI_WORLD_IMAGERY) -> str:
+    payload = {
+        "pts": [(round(lng, 7), round(lat, 7)) for lng, lat in _ring(geometria)],
+        "size": (MAP_WIDTH, MAP_HEIGHT),
+        "tiles": url_template,
+        "style": MAP_RENDER_STYLE_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _draw_overlay(img: Any, zoom: int, center_lat: float) -> None:
+    """Overlay estilo SIGPAC: brújula N↑ y barra de escala."""
+    from PIL import ImageDraw, ImageFont
+
+    draw = ImageDraw.Draw(img, 'RGBA')
+    try:
+        font_bold = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 16)
+        font_scale = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 12)
+    except Exception:
+        font_bold = ImageFont.load_default()
+        font_scale = ImageFont.load_default()
+    W, H = img.size
+
+    # --- Brújula (esquina superior derecha) ---
+    cx, cy, r = W - 45, 45, 26
+    # Halo blanco semitransparente + círculo blanco con borde
+    draw.ellipse((cx-r-2, cy-r-2, cx+r+2, cy+r+2), fill=(255, 255, 255, 220), outline=(60, 60, 60, 255), width=2)
+    # Flecha norte (roja arriba, gris abajo) — polígono romboidal
+    draw.polygon([(cx, cy-r+6), (cx+7, cy+2), (cx, cy-2), (cx-7, cy+2)], fill=(198, 40, 40, 255))
+    draw.polygon([(cx, cy+r-6), (cx+7, cy-2), (cx, cy+2), (cx-7, cy-2)], fill=(90, 90, 90, 255))
+    # Etiqueta N en negrita encima
+    draw.text((cx-5, cy-r-2), "N", fill=(20, 20, 20, 255), font=font_bold)
+
+    # --- Barra de escala (esquina inferior izquierda) ---
+    # metros/pixel (Web Mercator): 156543.03392 * cos(lat) / 2^zoom
+    lat_rad = math.radians(center_lat)
+    mpp = 156543.03392 * math.cos(lat_rad) / (2 ** zoom)
+    # Elegir una distancia "bonita" ≈ 150 px
+    target_px = 150
+    target_m = target_px * mpp
+    nice_values_m = [50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+    scale_m = min(nice_values_m, key=lambda v: abs(v - target_m))
+    scale_px = int(round(scale_m / mpp))
+    label = f"{scale_m/1000:.1f} km" if scale_m >= 1000 else f"{scale_m} m"
+
+    bx, by = 20, H - 40
+    bw, bh = scale_px, 10
+    # Fondo blanco semitransparente
+    draw.rectangle((bx-6, by-22, bx+bw+6, by+bh+6), fill=(255, 255, 255, 220), outline=(60, 60, 60, 255), width=1)
+    # Barra bicolor: mitad blanca / mitad negra
+    half = bw // 2
+    draw.rectangle((bx, by, bx+half, by+bh), fill=(255, 255, 255, 255), outline=(20, 20, 20, 255), width=1)
+    draw.rectangle((bx+half, by, bx+bw, by+bh), fill=(20, 20, 20, 255), outline=(20, 20, 20, 255), width=1)
+    # Etiquetas: 0 · mitad · total
+    draw.text((bx-3, by-16), "0", fill=(20, 20, 20, 255), font=font_scale)
+    draw.text((bx+bw-len(label)*6, by-16), label, fill=(20, 20, 20, 255), font=font_scale)
+
+
+def render_parcel_map_png(geometria: List[Dict[str, Any]]) -> Tuple[str, bool]:
+    """Ruta del PNG del mapa satélite de la parcela y si ya estaba en la caché."""
+    import io
+
+    from staticmap import CircleMarker, Polygon as SmPolygon
+
+    relpath = f"{map_cache_key(geometria)}.png"
+    cached = render_cache.get(relpath)
+    if cached:
+        return cached, True
+
+    lats = [p.get('lat', 0) for p in geometria]
+    lngs = [p.get('lng', 0) for p in geometria]
+    center_lat = sum(lats) / len(lats)
+    center_lng = sum(lngs) / len(lngs)
+
+    sm = _cached_static_map_class()(MAP_WIDTH, MAP_HEIGHT, url_template=ESRI_WORLD_IMAGERY,
+                                     tile_request_timeout=MAP_TILE_TIMEOUT_SECONDS)
+    # Polígono verde translúcido con borde oscuro
+    # NOTA: staticmap/PIL requieren color hex (#rrggbbaa) — no acepta rgba(..., 0.85)
+    # Polygon(coords, fill_color, outline_color)
+    sm.add_polygon(SmPolygon(_ring(geometria), '#4CAF5066', '#2E7D32', simplify=False))
+    # Marcador de centro (azul con núcleo blanco tipo Leaflet)
+    sm.add_marker(CircleMarker((center_lng, center_lat), '#1565C0', 14))
+    sm.add_marker(CircleMarker((center_lng, center_lat), '#FFFFFF', 8))
+    img = sm.render()
+    try:
+        _draw_overlay(img, sm.zoom, center_lat)
+    except Exception as e:
+        print(f"[PDF] map overlay (compass/scale) failed: {e}")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return render_cache.put(relpath, buffer.getvalue()), False
+
+
+async def get_parcel_map_png(geometria: List[Dict[str, Any]]) -> Tuple[str, bool]:
+    """`render_parcel_map_png` fuera del event loop (pool de hilos de render)."""
+    return await run_render_thread(render_parcel_map_png, geometria)
+
+
+def get_map_cache_stats() -> Dict[str, Any]:
+    return {"tiles": tile_cache.info(), "renders": render_cache.info(),
+            "style_version": MAP_RENDER_STYLE_VERSION}
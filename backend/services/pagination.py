@@ -0,0 +1,159 @@
+"""
+Paginación por cursor (keyset) para los listados.
+
+Los listados paginaban con `skip(skip).limit(limit)`: cada página profunda
+recorre todos los documentos anteriores y, si se insertan registros mientras
+se pagina, las páginas se desplazan (duplicados u omisiones). Con keyset la
+página siguiente se pide "a partir del último documento visto", usando el
+índice de la ordenación, y el coste no depende de la profundidad.
+
+Uso en una ruta:
+
+    page = await paginate(parcelas_collection, query, [("_id", 1)],
+                          limit=limit, skip=skip, cursor=cursor, count=count)
+    return {"parcelas": serialize_docs(page["items"]), "total": page["total"],
+            "next_cursor": page["next_cursor"]}
+
+- `next_cursor` es un token opaco (base64 de los valores de ordenación del
+  último documento + `_id`); None cuando no quedan más páginas. Se pasa tal
+  cual en `?cursor=` para la página siguiente.
+- El token lleva una huella de la ordenación y del filtro: un cursor usado con
+  otros filtros o en otro listado se rechaza con 400.
+- `skip`/`limit` siguen funcionando como antes (compatibilidad); si llega
+  `cursor`, `skip` se ignora.
+- `count`: "exact" (count_documents), "estimated" (metadatos de la colección
+  sin filtro; con filtro, conteo acotado a ESTIMATED_COUNT_CAP) o "none". Por
+  defecto "exact" en la primera página y "none" al paginar con cursor, para no
+  repetir el conteo en cada página.
+
+La ordenación siempre termina en `_id` (se añade si falta) para que el orden
+sea total. Los campos de ordenación deben tener un tipo homogéneo; los valores
+nulos o ausentes se tratan como los ordena Mongo (antes que cualquier valor en
+orden ascendente).
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bson import json_util
+from fastapi import HTTPException
+
+ESTIMATED_COUNT_CAP = 10000
+COUNT_MODES = ("exact", "estimated", "none")
+
+SortSpec = List[Tuple[str, int]]
+
+
+def _full_sort(sort: Sequence[Tuple[str, int]]) -> SortSpec:
+    spec = [(field, direction) for field, direction in sort]
+    if not spec or spec[-1][0] != "_id":
+        spec = [s for s in spec if s[0] != "_id"]
+        spec.append(("_id", spec[-1][1] if spec else 1))
+    return spec
+
+
+def _fingerprint(sort: SortSpec, query: Dict[str, Any]) -> str:
+    raw = json_util.dumps({"sort": sort, "query": query}, sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def _get_path(doc: Dict[str, Any], field: str) -> Any:
+    value: Any = doc
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def encode_cursor(doc: Dict[str, Any], sort: SortSpec, query: Dict[str, Any]) -> str:
+    payload = {"v": [_get_path(doc, field) for field, _ in sort], "f": _fingerprint(sort, query)}
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: SortSpec, query: Dict[str, Any]) -> List[Any]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values = payload["v"]
+        fingerprint = payload["f"]
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if fingerprint != _fingerprint(sort, query) or len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="El cursor no corresponde a este listado o a estos filtros")
+    return list(values)
+
+
+def _after(field: str, direction: int, value: Any) -> Optional[Dict[str, Any]]:
+    """Condición "estrictamente después de `value`" para un campo."""
+    if value is None:
+        # null/ausente va primero en ascendente y último en descendente
+        return {field: {"$ne": None}} if direction == 1 else None
+    if direction == 1:
+        return {field: {"$gt": value}}
+    return {"$or": [{field: {"$lt": value}}, {field: None}]}
+
+
+def keyset_filter(sort: SortSpec, values: List[Any]) -> Dict[str, Any]:
+    """Filtro de los documentos posteriores a `values` en el orden `sort`."""
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        condition = _after(field, direction, values[i])
+        if condition is None:
+            continue
+        equal = [{f: values[j]} for j, (f, _) in enumerate(sort[:i])]
+        branches.append({"$and": [*equal, condition]} if equal else condition)
+    return {"$or": branches} if branches else {"_id": {"$exists": False}}
+
+
+async def count_total(collection: Any, query: Dict[str, Any], mode: str) -> Optional[int]:
+    if mode == "none":
+        return None
+    if mode == "estimated":
+        if not query:
+            return await collection.estimated_document_count()
+        return await collection.count_documents(query, limit=ESTIMATED_COUNT_CAP)
+    return await collection.count_documents(query)
+
+
+async def paginate(
+    collection: Any,
+    query: Dict[str, Any],
+    sort: Sequence[Tuple[str, int]],
+    *,
+    limit: int,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Una página del listado: `{"items", "next_cursor", "total"}`."""
+    if count is not None and count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count debe ser uno de: {', '.join(COUNT_MODES)}")
+    count_mode = count or ("none" if cursor else "exact")
+    spec = _full_sort(sort)
+    limit = max(int(limit), 1)
+
+    find_query = query
+    if cursor:
+        after = keyset_filter(spec, decode_cursor(cursor, spec, query))
+        find_query = {"$and": [query, after]} if query else after
+
+    find = collection.find(find_query, projection).sort(spec)
+    if not cursor and skip:
+        find = find.skip(skip)
+    docs = await find.limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], spec, query)
+
+    return {
+        "items": docs,
+        "next_cursor": next_cursor,
+        "total": await count_total(collection, query, count_mode),
+    }
@@ -0,0 +1,198 @@
+"""
+PDF Cache - Caché direccionada por contenido de los PDF generados.
+
+La Hoja de Evaluación / Cuaderno de Campo (`generate_evaluacion_pdf`) lee la
+evaluación, la parcela, el catálogo de cultivos, hasta 100 visitas y 100
+tratamientos (con su técnico aplicador y su máquina) y la renderiza con
+WeasyPrint en cada descarga y en cada envío por email. El render tarda varios
+segundos aunque nada haya cambiado desde la última vez.
+
+Este módulo guarda los PDF ya renderizados en GridFS (bucket `pdf_cache`),
+indexados por una huella de sus datos de entrada:
+
+- la huella es un SHA-256 de los documentos que alimentan el PDF, tal y como
+  se leyeron de Mongo (incluidos `updated_at`), más PDF_TEMPLATE_VERSION.
+  Cualquier cambio en cualquiera de ellos produce otra huella, aunque la
+  colección no mantenga `updated_at`. Hay que subir PDF_TEMPLATE_VERSION al
+  cambiar la plantilla HTML/CSS para invalidar los PDF antiguos;
+- al guardar un PDF nuevo se borran los anteriores del mismo documento
+  (`subject_id`): quedaron obsoletos porque algún dato cambió;
+- expulsión LRU cuando el total supera PDF_CACHE_MAX_MB (256 MB) y borrado de
+  las entradas sin uso en PDF_CACHE_TTL_DAYS días (30).
+
+Los metadatos (huella, tamaño, último uso, aciertos) viven en la colección
+`pdf_cache_entries`; el fichero, en GridFS. No se usa un índice TTL porque
+Mongo no borraría los chunks de GridFS.
+
+Uso:
+
+    fingerprint = pdf_fingerprint("evaluacion", evaluacion, parcela, visitas, ...)
+    pdf = await get_cached_pdf("evaluacion", fingerprint)
+    if pdf is None:
+        pdf = await render_html_pdf(html)
+        await store_pdf("evaluacion", fingerprint, evaluacion_id, pdf)
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+PDF_CACHE_MAX_MB = float(os.environ.get("PDF_CACHE_MAX_MB", "256"))
+PDF_CACHE_TTL_DAYS = float(os.environ.get("PDF_CACHE_TTL_DAYS", "30"))
+PDF_CACHE_ENABLED = os.environ.get("PDF_CACHE_ENABLED", "1") not in ("0", "false", "False")
+
+# Subir al cambiar la plantilla de los PDF cacheados
+PDF_TEMPLATE_VERSION = "1"
+
+entries_collection = db["pdf_cache_entries"]
+_bucket: Optional[AsyncIOMotorGridFSBucket] = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0, "evicted": 0, "errors": 0}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _get_bucket() -> AsyncIOMotorGridFSBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = AsyncIOMotorGridFSBucket(db, bucket_name="pdf_cache")
+    return _bucket
+
+
+def pdf_fingerprint(kind: str, *inputs: Any) -> str:
+    """Huella de los datos de entrada de un PDF (documentos Mongo, listas, dicts)."""
+    payload = json_util.dumps([kind, PDF_TEMPLATE_VERSION, *inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_id(kind: str, fingerprint: str) -> str:
+    return f"{kind}:{fingerprint}"
+
+
+async def get_cached_pdf(kind: str, fingerprint: str) -> Optional[bytes]:
+    """PDF cacheado para esa huella, o None. Actualiza el último uso."""
+    if not PDF_CACHE_ENABLED:
+        return None
+    try:
+        entry = await entries_collection.find_one_and_update(
+            {"_id": _entry_id(kind, fingerprint)},
+            {"$set": {"last_used_at": _now()}, "$inc": {"hits": 1}},
+        )
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        stream = await _get_bucket().open_download_stream(entry["file_id"])
+        content = await stream.read()
+    except Exception as e:
+        # Entrada sin fichero (borrado a medias) o Mongo caído: se vuelve a renderizar
+        print(f"[PDF Cache] lookup failed for {kind}:{fingerprint[:12]}: {e}")
+        _stats["errors"] += 1
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    return content
+
+
+async def store_pdf(kind: str, fingerprint: str, subject_id: str, content: bytes,
+                    filename: str = "document.pdf") -> None:
+    """Guarda un PDF recién renderizado y borra las versiones anteriores del documento."""
+    if not PDF_CACHE_ENABLED or not content:
+        return
+    bucket = _get_bucket()
+    try:
+        file_id = await bucket.upload_from_stream(
+            filename, content, metadata={"kind": kind, "fingerprint": fingerprint},
+        )
+        now = _now()
+        try:
+            await entries_collection.insert_one({
+                "_id": _entry_id(kind, fingerprint),
+                "kind": kind,
+                "subject_id": subject_id,
+                "file_id": file_id,
+                "filename": filename,
+                "size": len(content),
+                "created_at": now,
+                "last_used_at": now,
+                "hits": 0,
+            })
+        except DuplicateKeyError:
+            # Otra petición renderizó el mismo PDF a la vez: nos quedamos con el suyo
+            await bucket.delete(file_id)
+            return
+        _stats["stores"] += 1
+        await _delete_entries({
+            "kind": kind, "subject_id": subject_id, "_id": {"$ne": _entry_id(kind, fingerprint)},
+        }, "invalidated")
+        await prune_pdf_cache()
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"[PDF Cache] failed to store {kind}:{fingerprint[:12]}: {e}")
+
+
+async def _delete_entries(query: Dict[str, Any], counter: str) -> int:
+    removed = 0
+    async for entry in entries_collection.find(query, {"file_id": 1}):
+        try:
+            await _get_bucket().delete(entry["file_id"])
+        except Exception as e:
+            print(f"[PDF Cache] failed to delete file {entry['file_id']}: {e}")
+        await entries_collection.delete_one({"_id": entry["_id"]})
+        removed += 1
+    _stats[counter] += removed
+    return removed
+
+
+async def invalidate_pdf_cache(kind: str, subject_id: str) -> int:
+    """Borra los PDF cacheados de un documento. Devuelve nº de entradas borradas."""
+    return await _delete_entries({"kind": kind, "subject_id": subject_id}, "invalidated")
+
+
+async def prune_pdf_cache() -> int:
+    """Aplica la caducidad (PDF_CACHE_TTL_DAYS) y el tope de tamaño (LRU)."""
+    removed = await _delete_entries(
+        {"last_used_at": {"$lt": _now() - timedelta(days=PDF_CACHE_TTL_DAYS)}}, "evicted",
+    )
+    max_bytes = int(PDF_CACHE_MAX_MB * 1024 * 1024)
+    total = await _total_bytes()
+    if total <= max_bytes:
+        return removed
+    # Expulsar hasta el 90 % del tope para no podar en cada escritura
+    target = int(max_bytes * 0.9)
+    async for entry in entries_collection.find({}, {"size": 1}).sort("last_used_at", 1):
+        if total <= target:
+            break
+        removed += await _delete_entries({"_id": entry["_id"]}, "evicted")
+        total -= entry.get("size", 0)
+    return removed
+
+
+async def _total_bytes() -> int:
+    rows = await entries_collection.aggregate([
+        {"$group": {"_id": None, "bytes": {"$sum": "$size"}, "entries": {"$sum": 1}}},
+    ]).to_list(1)
+    return rows[0]["bytes"] if rows else 0
+
+
+async def get_pdf_cache_stats() -> Dict[str, Any]:
+    rows = await entries_collection.aggregate([
+        {"$group": {"_id": "$kind", "bytes": {"$sum": "$size"}, "entries": {"$sum": 1}}},
+    ]).to_list(None)
+    return {
+        **_stats,
+        "enabled": PDF_CACHE_ENABLED,
+        "by_kind": {row["_id"]: {"entries": row["entries"], "bytes": row["bytes"]} for row in rows},
+        "bytes": sum(row["bytes"] for row in rows),
+        "max_bytes": int(PDF_CACHE_MAX_MB * 1024 * 1024),
+        "ttl_days": PDF_CACHE_TTL_DAYS,
+        "template_version": PDF_TEMPLATE_VERSION,
+    }
@@ -0,0 +1,156 @@
+"""
+Principal Cache - Caché en proceso del usuario autenticado.
+
+`routes_auth.get_current_user` (y por tanto todos los guards de
+`rbac_guards.py`) resolvía el usuario con un `find_one` en cada petición; el
+dashboard lanza decenas de llamadas por vista. Esta caché guarda el documento
+del usuario por `sub` del token (email) con:
+
+- TTL (PRINCIPAL_CACHE_TTL_SECONDS, 60 s por defecto) y tamaño máximo LRU
+  (PRINCIPAL_CACHE_MAX_ENTRIES). TTL 0 desactiva la caché.
+- Invalidación explícita (`invalidate_principal`) desde las rutas que
+  modifican usuarios: edición, contraseña, permisos de menú, tipo de operación,
+  vinculación de empleado, configuración del dashboard y borrado.
+- Versión en el token: el usuario guarda `token_version` (se incrementa en cada
+  cambio de permisos/contraseña) y el JWT lleva el claim `ver`. Si un token
+  trae una versión mayor que la cacheada, la entrada está obsoleta (el cambio
+  se hizo en otro proceso) y se recarga.
+- Las peticiones concurrentes de un mismo usuario sin caché comparten una única
+  lectura a Mongo.
+
+Cada llamada recibe una copia del documento, de modo que las rutas pueden
+modificar `current_user` sin afectar a la caché.
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.environ.get("PRINCIPAL_CACHE_MAX_ENTRIES", "1000"))
+
+# email -> (expira_en, documento del usuario)
+_entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+# _id del usuario -> email (para invalidar por id desde las rutas de /users/{id})
+_emails_by_id: Dict[str, str] = {}
+# email -> lectura en curso
+_inflight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+# email -> nº de invalidaciones (descarta lecturas en curso que quedaron obsoletas)
+_generations: Dict[str, int] = {}
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def token_version(user: Optional[Dict[str, Any]]) -> int:
+    """Versión de credenciales/permisos del usuario (claim `ver` del token)."""
+    if not user:
+        return 0
+    try:
+        return int(user.get("token_version") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _get_fresh(email: str, min_version: Optional[int]) -> Optional[Dict[str, Any]]:
+    entry = _entries.get(email)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if expires_at <= time.monotonic() or (min_version is not None and token_version(user) < min_version):
+        _drop(email)
+        return None
+    _entries.move_to_end(email)
+    return user
+
+
+def _drop(email: str) -> None:
+    entry = _entries.pop(email, None)
+    if entry is not None:
+        user_id = str(entry[1].get("_id", ""))
+        if _emails_by_id.get(user_id) == email:
+            _emails_by_id.pop(user_id, None)
+
+
+def _store(email: str, user: Dict[str, Any]) -> None:
+    _drop(email)
+    _entries[email] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, user)
+    if user.get("_id") is not None:
+        _emails_by_id[str(user["_id"])] = email
+    while len(_entries) > PRINCIPAL_CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+
+
+async def get_principal(
+    email: str,
+    loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+    min_version: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """Usuario por email desde la caché o, si no está/caducó, con `loader()`."""
+    if PRINCIPAL_CACHE_TTL_SECONDS <= 0:
+        return await loader()
+
+    user = _get_fresh(email, min_version)
+    if user is not None:
+        _stats["hits"] += 1
+        return copy.deepcopy(user)
+
+    _stats["misses"] += 1
+    task = _inflight.get(email)
+    if task is None:
+        task = asyncio.ensure_future(_load(email, loader))
+        _inflight[email] = task
+        task.add_done_callback(lambda t: _finish_load(email, t))
+    loaded = await asyncio.shield(task)
+    return copy.deepcopy(loaded) if loaded is not None else None
+
+
+async def _load(
+    email: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+) -> Optional[Dict[str, Any]]:
+    generation = _generations.get(email, 0)
+    loaded = await loader()
+    # Si se invalidó mientras leíamos, el documento puede ser anterior al cambio
+    if loaded is not None and _generations.get(email, 0) == generation:
+        _store(email, loaded)
+    return loaded
+
+
+def _finish_load(email: str, task: "asyncio.Future[Optional[Dict[str, Any]]]") -> None:
+    if _inflight.get(email) is task:
+        _inflight.pop(email, None)
+    if not task.cancelled():
+        task.exception()  # evita el aviso "exception was never retrieved"
+
+
+def invalidate_principal(email: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    """Elimina de la caché al usuario (por email y/o por _id)."""
+    emails = set()
+    if email:
+        emails.add(email)
+    if user_id:
+        cached_email = _emails_by_id.get(str(user_id))
+        if cached_email:
+            emails.add(cached_email)
+    for e in emails:
+        _generations[e] = _generations.get(e, 0) + 1
+        _drop(e)
+        _stats["invalidations"] += 1
+
+
+def clear_principal_cache() -> None:
+    for email in list(_entries):
+        _generations[email] = _generations.get(email, 0) + 1
+    _entries.clear()
+    _emails_by_id.clear()
+
+
+def get_principal_cache_stats() -> Dict[str, Any]:
+    return {
+        "entries": len(_entries),
+        "ttl_seconds": PRINCIPAL_CACHE_TTL_SECONDS,
+        "max_entries": PRINCIPAL_CACHE_MAX_ENTRIES,
+        **_stats,
+    }
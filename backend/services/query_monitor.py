@@ -0,0 +1,189 @@
+"""
+Query Monitor - Contador de consultas Mongo por petición y detector de N+1.
+
+Se engancha al command monitoring de PyMongo (`event_listeners` del cliente en
+`database.py`) y atribuye cada comando a la petición HTTP en curso mediante un
+`ContextVar` (Motor copia el contexto al ejecutar en su pool de hilos). Por
+petición se cuentan:
+
+- consultas: comandos de lectura/escritura (find, aggregate, update...);
+- round-trips: todos los comandos, incluidos getMore/killCursors;
+- tiempo total en Mongo (ms).
+
+Configuración (variables de entorno):
+
+- MONGO_QUERY_MONITOR: "0" desactiva el listener (por defecto activo).
+- MONGO_QUERY_DEBUG_HEADERS: "1" añade las cabeceras X-DB-Queries,
+  X-DB-Roundtrips y X-DB-Time-Ms a cada respuesta.
+- MONGO_QUERY_BUDGET: nº máximo de consultas por petición (50). Si se supera se
+  registra la petición junto con las formas de consulta que más se repiten,
+  que es como se ve un bucle N+1 (p. ej. `120x find empleados {"_id": "?"}`).
+
+La "forma" de una consulta es el comando, la colección y el filtro con todos
+los valores sustituidos por "?", de modo que las consultas que solo difieren
+en el id caen en la misma forma.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, List, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MONGO_QUERY_MONITOR = os.environ.get("MONGO_QUERY_MONITOR", "1") != "0"
+MONGO_QUERY_DEBUG_HEADERS = os.environ.get("MONGO_QUERY_DEBUG_HEADERS", "0") == "1"
+MONGO_QUERY_BUDGET = int(os.environ.get("MONGO_QUERY_BUDGET", "50"))
+
+# Comandos que cuentan como round-trip pero no como consulta nueva
+_CURSOR_COMMANDS = {"getMore", "killCursors"}
+# Comandos internos del driver que no se atribuyen a la petición
+_IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue",
+                     "endSessions", "buildInfo", "getLastError"}
+_SHAPE_MAX_LENGTH = 200
+
+
+class RequestQueryStats:
+    """Contadores de una petición. Se actualiza desde los hilos de Motor."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.roundtrips = 0
+        self.duration_ms = 0.0
+        self.shapes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record_started(self, shape: Optional[str]) -> None:
+        with self._lock:
+            self.roundtrips += 1
+            if shape is not None:
+                self.queries += 1
+                self.shapes[shape] += 1
+
+    def record_duration(self, micros: int) -> None:
+        with self._lock:
+            self.duration_ms += micros / 1000.0
+
+    def repeated_shapes(self, limit: int = 3) -> List[Tuple[str, int]]:
+        return [(shape, n) for shape, n in self.shapes.most_common(limit) if n > 1]
+
+    def headers(self) -> List[Tuple[bytes, bytes]]:
+        return [
+            (b"x-db-queries", str(self.queries).encode()),
+            (b"x-db-roundtrips", str(self.roundtrips).encode()),
+            (b"x-db-time-ms", f"{self.duration_ms:.1f}".encode()),
+        ]
+
+
+_current_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("mongo_query_stats", default=None)
+
+
+def get_request_query_stats() -> Optional[RequestQueryStats]:
+    """Contadores de la petición en curso (None fuera de una petición HTTP)."""
+    return _current_stats.get()
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Los $in de N ids tienen la misma forma sea cual sea N
+        if value and all(not isinstance(v, (dict, list, tuple)) for v in value):
+            return ["?"]
+        return [_normalize(v) for v in value]
+    return "?"
+
+
+def query_shape(command_name: str, command: Any) -> str:
+    """Forma normalizada del comando: `<comando> <colección> <filtro sin valores>`."""
+    collection = command.get(command_name) if hasattr(command, "get") else None
+    if command_name == "find":
+        detail: Any = command.get("filter", {})
+    elif command_name == "aggregate":
+        detail = [_normalize(stage) if "$match" in stage else next(iter(stage), "?")
+                  for stage in command.get("pipeline", [])]
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        detail = statements[0].get("q", {})
+    elif command_name in ("count", "distinct"):
+        detail = command.get("query", {})
+    elif command_name == "findAndModify":
+        detail = command.get("query", {})
+    else:
+        detail = None
+    shape = f"{command_name} {collection if isinstance(collection, str) else ''}".rstrip()
+    if detail is not None:
+        shape += " " + json.dumps(_normalize(detail), sort_keys=True, default=str)
+    return shape[:_SHAPE_MAX_LENGTH]
+
+
+class QueryMonitorListener(monitoring.CommandListener):
+    """Listener de PyMongo que acumula los comandos en la petición en curso."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        stats = _current_stats.get()
+        if stats is None or event.command_name in _IGNORED_COMMANDS:
+            return
+        if event.command_name in _CURSOR_COMMANDS:
+            stats.record_started(None)
+        else:
+            stats.record_started(query_shape(event.command_name, event.command))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        stats = _current_stats.get()
+        if stats is not None and event.command_name not in _IGNORED_COMMANDS:
+            stats.record_duration(event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        stats = _current_stats.get()
+        if stats is not None and event.command_name not in _IGNORED_COMMANDS:
+            stats.record_duration(event.duration_micros)
+
+
+def mongo_event_listeners() -> List[monitoring.CommandListener]:
+    """`event_listeners` para los AsyncIOMotorClient de la aplicación."""
+    return [QueryMonitorListener()] if MONGO_QUERY_MONITOR else []
+
+
+def _report(method: str, path: str, stats: RequestQueryStats, elapsed_ms: float) -> None:
+    if stats.queries <= MONGO_QUERY_BUDGET:
+        return
+    repeated = "; ".join(f"{n}x {shape}" for shape, n in stats.repeated_shapes()) or "-"
+    print(
+        f"[QueryMonitor] {method} {path}: {stats.queries} consultas "
+        f"(presupuesto {MONGO_QUERY_BUDGET}), {stats.roundtrips} round-trips, "
+        f"{stats.duration_ms:.1f} ms en Mongo / {elapsed_ms:.1f} ms total. Repetidas: {repeated}"
+    )
+
+
+class QueryMonitorMiddleware:
+    """Middleware ASGI que abre un contador por petición HTTP."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not MONGO_QUERY_MONITOR:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = _current_stats.set(stats)
+        started_at = time.perf_counter()
+
+        async def send_with_headers(message: Message) -> None:
+            if MONGO_QUERY_DEBUG_HEADERS and message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), *stats.headers()]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current_stats.reset(token)
+            _report(scope.get("method", ""), scope.get("path", ""), stats,
+                    (time.perf_counter() - started_at) * 1000)
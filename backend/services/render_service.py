@@ -0,0 +1,257 @@
+"""
+Render Service - Generación de PDF/Excel fuera del event loop.
+
+Todas las exportaciones (WeasyPrint, ReportLab, openpyxl) envían aquí el
+trabajo pesado en lugar de ejecutarlo dentro del handler async. Así un
+Cuaderno de Campo de 30 páginas ya no congela el worker de uvicorn para el
+resto de usuarios.
+
+- HTML → PDF (WeasyPrint): el HTML es un string serializable, así que se
+  renderiza en un ProcessPoolExecutor acotado (CPU-bound, sin competir por
+  el GIL del proceso de la API).
+- Documentos ReportLab / Workbooks openpyxl: los objetos se construyen en el
+  handler y no son serializables de forma fiable entre procesos, por lo que
+  `build()`/`save()` se ejecutan en un pool de hilos dedicado.
+
+Ambos pools comparten el mismo límite de concurrencia, timeout por job y
+métricas de cola (ver `get_render_metrics`).
+
+Configuración (variables de entorno):
+    RENDER_WORKERS       Nº de workers por pool (default: nº CPUs / 2, mín. 1)
+    RENDER_JOB_TIMEOUT   Timeout por job en segundos (default: 120)
+    RENDER_MAX_QUEUE     Máx. jobs esperando turno; por encima → 503 (default: 64)
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+RENDER_WORKERS = max(1, int(os.environ.get("RENDER_WORKERS", "0") or 0) or (os.cpu_count() or 2) // 2)
+RENDER_JOB_TIMEOUT = float(os.environ.get("RENDER_JOB_TIMEOUT", "120") or 120)
+RENDER_MAX_QUEUE = int(os.environ.get("RENDER_MAX_QUEUE", "64") or 64)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+_metrics: Dict[str, Any] = {
+    "queued": 0,
+    "running": 0,
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0,
+    "max_queued": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+    "by_kind": {},
+}
+
+
+# ---------------------------------------------------------------------------
+# Funciones ejecutadas dentro de los workers (deben ser top-level/picklables)
+# ---------------------------------------------------------------------------
+
+def _html_to_pdf_bytes(html: str, base_url: Optional[str]) -> bytes:
+    from weasyprint import HTML
+
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def _build_reportlab_doc(doc: Any, elements: list) -> None:
+    doc.build(elements)
+
+
+def _save_workbook_bytes(wb: Any) -> bytes:
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Pools
+# ---------------------------------------------------------------------------
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # `spawn` evita heredar por fork los hilos de Motor/APScheduler.
+        _process_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def _discard_process_pool(executor: Executor) -> None:
+    global _process_pool
+    if _process_pool is executor:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+    return _thread_pool
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(RENDER_WORKERS)
+    return _slots
+
+
+def _record(kind: str, outcome: str, elapsed: float) -> None:
+    _metrics[outcome] += 1
+    _metrics["total_seconds"] += elapsed
+    _metrics["max_seconds"] = max(_metrics["max_seconds"], elapsed)
+    per_kind = _metrics["by_kind"].setdefault(kind, {"completed": 0, "failed": 0, "timeouts": 0, "total_seconds": 0.0})
+    per_kind[outcome] += 1
+    per_kind["total_seconds"] += elapsed
+
+
+async def _submit(executor: Executor, kind: str, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    """Encola `fn(*args)` en `executor` respetando el límite de workers.
+
+    El slot del semáforo se libera cuando termina el future subyacente (no
+    cuando vence el timeout), de modo que un render colgado sigue contando
+    contra el límite y el pool nunca se sobresuscribe.
+    """
+    if _metrics["queued"] >= RENDER_MAX_QUEUE:
+        _metrics["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="El servicio de exportación está saturado. Inténtalo de nuevo en unos segundos.",
+        )
+
+    loop = asyncio.get_running_loop()
+    slots = _get_slots()
+    _metrics["submitted"] += 1
+    _metrics["queued"] += 1
+    _metrics["max_queued"] = max(_metrics["max_queued"], _metrics["queued"])
+    try:
+        await slots.acquire()
+    finally:
+        _metrics["queued"] -= 1
+
+    _metrics["running"] += 1
+    started = time.monotonic()
+
+    def _on_done() -> None:
+        _metrics["running"] -= 1
+        slots.release()
+
+    def _release(_: Future) -> None:
+        # Los done-callbacks corren en el hilo del executor: volver al loop.
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(_on_done)
+
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _metrics["running"] -= 1
+        slots.release()
+        _discard_process_pool(executor)
+        raise HTTPException(status_code=500, detail="Error interno generando el documento")
+    except Exception:
+        _metrics["running"] -= 1
+        slots.release()
+        raise
+    future.add_done_callback(_release)
+
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout or RENDER_JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        _record(kind, "timeouts", time.monotonic() - started)
+        raise HTTPException(status_code=504, detail="La generación del documento ha excedido el tiempo máximo")
+    except BrokenProcessPool:
+        # Un worker murió (OOM, segfault de Pango...): descartar el pool para
+        # que el siguiente job arranque uno nuevo en lugar de fallar siempre.
+        _record(kind, "failed", time.monotonic() - started)
+        _discard_process_pool(executor)
+        raise HTTPException(status_code=500, detail="Error interno generando el documento")
+    except Exception:
+        _record(kind, "failed", time.monotonic() - started)
+        raise
+    _record(kind, "completed", time.monotonic() - started)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# API pública
+# ---------------------------------------------------------------------------
+
+async def render_html_pdf(html: str, base_url: Optional[str] = None, timeout: Optional[float] = None) -> bytes:
+    """Renderiza HTML a PDF con WeasyPrint en el pool de procesos."""
+    return await _submit(_get_process_pool(), "weasyprint", _html_to_pdf_bytes, html, base_url, timeout=timeout)
+
+
+async def build_pdf(doc: Any, elements: list, timeout: Optional[float] = None) -> None:
+    """Ejecuta `doc.build(elements)` de ReportLab fuera del event loop."""
+    await _submit(_get_thread_pool(), "reportlab", _build_reportlab_doc, doc, elements, timeout=timeout)
+
+
+async def save_workbook(wb: Any, timeout: Optional[float] = None) -> io.BytesIO:
+    """Serializa un Workbook de openpyxl fuera del event loop.
+
+    Devuelve un BytesIO posicionado al inicio, listo para StreamingResponse.
+    """
+    data = await _submit(_get_thread_pool(), "openpyxl", _save_workbook_bytes, wb, timeout=timeout)
+    return io.BytesIO(data)
+
+
+async def run_render_process(fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    """Ejecuta una función top-level (picklable) en el pool de procesos."""
+    return await _submit(_get_process_pool(), getattr(fn, "__name__", "process"), fn, *args, timeout=timeout)
+
+
+async def run_render_thread(fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    """Ejecuta un callable arbitrario en el pool de hilos de render."""
+    return await _submit(_get_thread_pool(), getattr(fn, "__name__", "thread"), fn, *args, timeout=timeout)
+
+
+def get_render_metrics() -> Dict[str, Any]:
+    """Snapshot de las métricas del subsistema de render."""
+    finished = _metrics["completed"] + _metrics["failed"] + _metrics["timeouts"]
+    return {
+        "workers": RENDER_WORKERS,
+        "job_timeout_seconds": RENDER_JOB_TIMEOUT,
+        "max_queue": RENDER_MAX_QUEUE,
+        "queue_depth": _metrics["queued"],
+        "running": _metrics["running"],
+        "max_queue_depth": _metrics["max_queued"],
+        "submitted": _metrics["submitted"],
+        "completed": _metrics["completed"],
+        "failed": _metrics["failed"],
+        "timeouts": _metrics["timeouts"],
+        "rejected": _metrics["rejected"],
+        "avg_seconds": round(_metrics["total_seconds"] / finished, 3) if finished else 0.0,
+        "max_seconds": round(_metrics["max_seconds"], 3),
+        "by_kind": {
+            kind: {**values, "total_seconds": round(values["total_seconds"], 3)}
+            for kind, values in _metrics["by_kind"].items()
+        },
+    }
+
+
+def shutdown_render_pool() -> None:
+    """Cierra los pools de render (shutdown de la app)."""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
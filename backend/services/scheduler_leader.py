@@ -0,0 +1,229 @@
+"""
+Scheduler Leader - Elección de líder para las tareas programadas.
+
+`scheduler_service.init_scheduler` arranca APScheduler en cada proceso uvicorn;
+con N workers la verificación climática, el aviso MAPA, las limpiezas, etc.
+se ejecutaban N veces (N veces las llamadas a la API del tiempo y alertas y
+notificaciones duplicadas). Con este módulo solo un proceso, el líder, ejecuta
+las tareas:
+
+- El liderazgo es un "lease" en Mongo (colección `scheduler_leases`, documento
+  `_id: "scheduler"`) con titular y fecha de caducidad. Cada proceso intenta
+  adquirirlo o renovarlo cada SCHEDULER_LEASE_SECONDS / 3 con un
+  `find_one_and_update` atómico; solo lo consigue si está libre, caducado o ya
+  es suyo.
+- Si el líder muere deja de renovar y, al caducar el lease
+  (SCHEDULER_LEASE_SECONDS, 30 s por defecto), otro proceso lo adquiere.
+- Al apagarse ordenadamente, el líder libera el lease para que el relevo sea
+  inmediato.
+- `on_change(es_lider)` avisa al scheduler para reanudar/pausar sus jobs, y
+  `is_leader()` permite a cada job comprobarlo justo antes de ejecutarse.
+
+Historial: `track_job_run(job_id, coro)` ejecuta una tarea y guarda en
+`scheduler_runs` su duración, resultado (ok/error), elementos
+procesados y el proceso que la ejecutó. Los registros caducan a los
+SCHEDULER_RUNS_TTL_DAYS días (índice TTL en `services/index_registry.py`).
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db, serialize_doc
+
+SCHEDULER_LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "30") or 30)
+SCHEDULER_RUNS_TTL_DAYS = int(os.environ.get("SCHEDULER_RUNS_TTL_DAYS", "30") or 30)
+
+LEASE_ID = "scheduler"
+leases_collection = db["scheduler_leases"]
+runs_collection = db["scheduler_runs"]
+
+_HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_is_leader = False
+_loop_task: Optional["asyncio.Task[None]"] = None
+
+
+def holder_id() -> str:
+    return _HOLDER_ID
+
+
+def is_leader() -> bool:
+    """True si este proceso tiene el lease vigente."""
+    return _is_leader
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def try_acquire_lease() -> bool:
+    """Adquiere o renueva el lease. Devuelve True si este proceso es el líder."""
+    now = _now()
+    try:
+        doc = await leases_collection.find_one_and_update(
+            {"_id": LEASE_ID, "$or": [{"holder": _HOLDER_ID}, {"expires_at": {"$lt": now}}]},
+            {
+                "$set": {"holder": _HOLDER_ID, "expires_at": now + timedelta(seconds=SCHEDULER_LEASE_SECONDS),
+                         "renewed_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # El documento existe y lo tiene otro proceso (el upsert chocó con su _id)
+        return False
+    if doc is None or doc.get("holder") != _HOLDER_ID:
+        return False
+    if not _is_leader:
+        # Lease recién adquirido (nuevo o heredado de un titular caducado)
+        await leases_collection.update_one({"_id": LEASE_ID, "holder": _HOLDER_ID}, {"$set": {"acquired_at": now}})
+    return True
+
+
+async def release_lease() -> None:
+    """Libera el lease si es de este proceso (apagado ordenado)."""
+    global _is_leader
+    _is_leader = False
+    try:
+        await leases_collection.delete_one({"_id": LEASE_ID, "holder": _HOLDER_ID})
+    except Exception as e:
+        print(f"[Scheduler] Failed to release lease: {e}")
+
+
+async def _lease_loop(on_change: Callable[[bool], None]) -> None:
+    global _is_leader
+    interval = max(SCHEDULER_LEASE_SECONDS / 3, 1.0)
+    while True:
+        try:
+            leader = await try_acquire_lease()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Sin Mongo no se puede garantizar la exclusividad: dejar de ser líder
+            print(f"[Scheduler] Lease check failed: {e}")
+            leader = False
+        if leader != _is_leader:
+            _is_leader = leader
+            print(f"[Scheduler] {_HOLDER_ID} {'is now the leader' if leader else 'lost leadership'}")
+            try:
+                on_change(leader)
+            except Exception as e:
+                print(f"[Scheduler] Leadership change handler failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_leader_election(on_change: Callable[[bool], None]) -> None:
+    """Arranca el bucle de adquisición/renovación del lease (startup de la app)."""
+    global _loop_task
+    if _loop_task is not None and not _loop_task.done():
+        return
+    _loop_task = asyncio.create_task(_lease_loop(on_change))
+
+
+def stop_leader_election() -> None:
+    global _loop_task, _is_leader
+    if _loop_task is not None:
+        _loop_task.cancel()
+        _loop_task = None
+    _is_leader = False
+
+
+async def get_lease_status() -> Dict[str, Any]:
+    lease = await leases_collection.find_one({"_id": LEASE_ID})
+    vigente = bool(lease and lease.get("expires_at") and
+                   lease["expires_at"].replace(tzinfo=lease["expires_at"].tzinfo or timezone.utc) > _now())
+    return {
+        "lider": lease.get("holder") if lease and vigente else None,
+        "lease_expira": lease["expires_at"].isoformat() if lease and lease.get("expires_at") else None,
+        "lider_desde": lease["acquired_at"].isoformat() if lease and lease.get("acquired_at") else None,
+        "este_proceso": _HOLDER_ID,
+        "este_proceso_es_lider": _is_leader,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Historial de ejecuciones
+# -----------------------------------------------------------------------------
+
+def _items_from_result(result: Any) -> Optional[int]:
+    if isinstance(result, bool):
+        return int(result)
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        for key in ("items", "parcelas_procesadas", "total"):
+            if isinstance(result.get(key), int):
+                return result[key]
+    return None
+
+
+async def track_job_run(
+    job_id: str,
+    run: Callable[[], Awaitable[Any]],
+    trigger: str = "scheduler",
+    require_leader: bool = True,
+) -> Any:
+    """Ejecuta `run()` y guarda el registro en `scheduler_runs`.
+
+    Con `require_leader` (ejecuciones programadas) la tarea se omite si este
+    proceso no es el líder. Las excepciones se registran y no se propagan,
+    igual que hacían los wrappers del scheduler.
+    """
+    if require_leader and not _is_leader:
+        return None
+
+    started_at = _now()
+    t0 = time.perf_counter()
+    outcome, error, result = "ok", None, None
+    try:
+        result = await run()
+    except Exception as e:
+        outcome, error = "error", str(e)
+        print(f"[Scheduler Error] {job_id} failed: {e}")
+
+    record = {
+        "job_id": job_id,
+        "trigger": trigger,
+        "worker": _HOLDER_ID,
+        "started_at": started_at,
+        "finished_at": _now(),
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "outcome": outcome,
+        "items": _items_from_result(result),
+        "error": error,
+        "expires_at": started_at + timedelta(days=SCHEDULER_RUNS_TTL_DAYS),
+    }
+    try:
+        await runs_collection.insert_one(record)
+    except Exception as e:
+        print(f"[Scheduler] Failed to record run of {job_id}: {e}")
+    return result
+
+
+async def get_job_runs(job_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """Últimas ejecuciones (de un job o de todos), más recientes primero."""
+    query = {"job_id": job_id} if job_id else {}
+    runs = await runs_collection.find(query, {"expires_at": 0}).sort("started_at", -1).limit(limit).to_list(limit)
+    return [serialize_doc(r) for r in runs]
+
+
+async def get_last_runs_by_job() -> Dict[str, Dict[str, Any]]:
+    """Última ejecución de cada job."""
+    pipeline = [
+        {"$sort": {"started_at": -1}},
+        {"$group": {"_id": "$job_id", "run": {"$first": "$$ROOT"}}},
+    ]
+    result = {}
+    async for row in runs_collection.aggregate(pipeline):
+        run = row["run"]
+        run.pop("expires_at", None)
+        result[row["_id"]] = serialize_doc(run)
+    return result
@@ -0,0 +1,227 @@
+"""
+Sequences - Contadores atómicos para numeraciones de negocio.
+
+Los números ACM de los albaranes de comisión, los números de contrato por año,
+el `codigo_proveedor`, los códigos de agentes y artículos y los FIN-/PAR- de
+las fincas y parcelas que llegan del ERP se calculaban
+buscando el máximo existente (regex de prefijo + sort) y sumando uno. Sin
+índice era un recorrido de la colección en cada alta y, con dos altas a la
+vez, ambas obtenían el mismo número.
+
+Este módulo guarda cada contador en la colección `counters` y lo incrementa
+con `find_one_and_update` + `$inc`, que Mongo aplica de forma atómica:
+
+- secuencias con nombre registradas en `SEQUENCES`, opcionalmente con ámbito
+  (`scope`): el año para los contratos, el prefijo para agentes y artículos;
+- reserva de bloques para importaciones masivas (`allocate_block`,
+  `SequenceBlock`): un solo `$inc` para N números;
+- siembra desde el máximo actual de la colección. Se hace sola la primera vez
+  que se usa cada contador y también en bloque con
+  `scripts/seed_sequences.py` (migración de una sola vez; volver a lanzarla
+  no hace daño porque la siembra usa `$max`);
+- `ensure_at_least` para cuando se guardan números que vienen de fuera
+  (importación de contratos desde Excel con su número original).
+
+Uso:
+
+    numero = await next_value("contratos", scope=2025)
+    async with SequenceBlock("proveedores") as block:
+        codigo = await block.next()
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+counters_collection = db["counters"]
+
+
+@dataclass(frozen=True)
+class SequenceSpec:
+    """De dónde sale el máximo actual de una secuencia (para sembrarla).
+
+    - `pattern`: regex sobre `field` con un grupo `n` (el número) y, si la
+      secuencia tiene ámbito, un grupo `scope`;
+    - `scope_field`: campo numérico que hace de ámbito (p. ej. el año); en
+      ese caso `field` ya es numérico.
+    """
+    collection: str
+    field: str
+    pattern: Optional[str] = None
+    scope_field: Optional[str] = None
+
+
+SEQUENCES: Dict[str, SequenceSpec] = {
+    "albaranes_comision": SequenceSpec("comisiones_generadas", "numero_albaran_comision",
+                                       pattern=r"^ACM-(?P<n>\d+)$"),
+    "contratos": SequenceSpec("contratos", "numero", scope_field="año"),
+    "proveedores": SequenceSpec("proveedores", "codigo_proveedor", pattern=r"^(?P<n>\d+)$"),
+    "agentes": SequenceSpec("agentes", "codigo", pattern=r"^(?P<scope>A[CV])-(?P<n>\d+)$"),
+    "articulos": SequenceSpec("articulos_explotacion", "codigo",
+                              pattern=r"^(?P<scope>[A-Z]+)-(?P<n>\d+)$"),
+    # Códigos FIN-001 / PAR-001 que asigna la API de integración ERP
+    "fincas": SequenceSpec("fincas", "codigo", pattern=r"^FIN-(?P<n>\d+)$"),
+    "parcelas": SequenceSpec("parcelas", "codigo", pattern=r"^PAR-(?P<n>\d+)$"),
+}
+
+# Contadores que ya sabemos que existen en este proceso (evita un find_one por alta)
+_seeded: Set[str] = set()
+
+
+def _spec(name: str) -> SequenceSpec:
+    try:
+        return SEQUENCES[name]
+    except KeyError:
+        raise ValueError(f"Secuencia no registrada: {name}")
+
+
+def _counter_id(name: str, scope: Any = None) -> str:
+    return f"{name}:{scope}" if scope is not None else name
+
+
+async def current_maxima(name: str) -> Dict[Optional[str], int]:
+    """Máximo actual por ámbito, calculado recorriendo la colección de origen."""
+    spec = _spec(name)
+    coll = db[spec.collection]
+    maxima: Dict[Optional[str], int] = {}
+    if spec.scope_field:
+        async for row in coll.aggregate([
+            {"$match": {spec.field: {"$type": "number"}, spec.scope_field: {"$ne": None}}},
+            {"$group": {"_id": f"${spec.scope_field}", "max": {"$max": f"${spec.field}"}}},
+        ]):
+            maxima[str(row["_id"])] = int(row["max"] or 0)
+        return maxima
+    regex = re.compile(spec.pattern or r"^(?P<n>\d+)$")
+    async for doc in coll.find({spec.field: {"$type": "string"}}, {spec.field: 1, "_id": 0}):
+        m = regex.match(str(doc.get(spec.field) or "").strip())
+        if not m:
+            continue
+        scope = m.groupdict().get("scope")
+        maxima[scope] = max(maxima.get(scope, 0), int(m.group("n")))
+    return maxima
+
+
+async def _ensure_seeded(name: str, scope: Any) -> str:
+    counter_id = _counter_id(name, scope)
+    if counter_id in _seeded:
+        return counter_id
+    if await counters_collection.find_one({"_id": counter_id}, {"_id": 1}) is None:
+        maxima = await current_maxima(name)
+        start = maxima.get(str(scope) if scope is not None else None, 0)
+        try:
+            await counters_collection.update_one(
+                {"_id": counter_id},
+                {"$setOnInsert": {"name": name, "scope": scope, "value": start,
+                                  "seeded_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass  # otro worker lo sembró a la vez
+    _seeded.add(counter_id)
+    return counter_id
+
+
+async def allocate_block(name: str, count: int, scope: Any = None) -> range:
+    """Reserva `count` números consecutivos con un solo `$inc`."""
+    if count < 1:
+        return range(0)
+    counter_id = await _ensure_seeded(name, scope)
+    doc = await counters_collection.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"value": count}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    last = int(doc["value"])
+    return range(last - count + 1, last + 1)
+
+
+async def next_value(name: str, scope: Any = None) -> int:
+    """Siguiente número de la secuencia (atómico entre workers)."""
+    return (await allocate_block(name, 1, scope))[0]
+
+
+async def peek_next(name: str, scope: Any = None) -> int:
+    """Número que daría `next_value` ahora mismo, sin reservarlo (previsualización)."""
+    counter_id = await _ensure_seeded(name, scope)
+    doc = await counters_collection.find_one({"_id": counter_id}, {"value": 1})
+    return int((doc or {}).get("value", 0)) + 1
+
+
+async def ensure_at_least(name: str, value: int, scope: Any = None) -> None:
+    """Adelanta el contador si se ha guardado un número externo mayor."""
+    counter_id = await _ensure_seeded(name, scope)
+    await counters_collection.update_one(
+        {"_id": counter_id}, {"$max": {"value": int(value)}}, upsert=True,
+    )
+
+
+class SequenceBlock:
+    """Reparte números de bloques reservados de `size` en `size`.
+
+    Para importaciones: un `$inc` por bloque en vez de uno por fila. Al salir
+    del `async with` se devuelven los números sobrantes del último bloque si
+    nadie ha reservado otros después; si no, quedan como hueco.
+    """
+
+    def __init__(self, name: str, scope: Any = None, size: int = 50) -> None:
+        self.name = name
+        self.scope = scope
+        self.size = max(int(size), 1)
+        self._block: range = range(0)
+        self._pos = 0
+
+    async def next(self) -> int:
+        if self._pos >= len(self._block):
+            self._block = await allocate_block(self.name, self.size, self.scope)
+            self._pos = 0
+        value = self._block[self._pos]
+        self._pos += 1
+        return value
+
+    async def release(self) -> None:
+        if not self._block or self._pos >= len(self._block):
+            return
+        await counters_collection.update_one(
+            {"_id": _counter_id(self.name, self.scope), "value": self._block[-1]},
+            {"$set": {"value": self._block[self._pos] - 1}},
+        )
+        self._block = range(0)
+
+    async def __aenter__(self) -> "SequenceBlock":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.release()
+
+
+async def seed_sequences() -> Dict[str, int]:
+    """Siembra todos los contadores desde los máximos actuales (migración).
+
+    Usa `$max`: nunca hace retroceder un contador que ya esté en uso.
+    Devuelve `{counter_id: valor}`.
+    """
+    seeded: Dict[str, int] = {}
+    now = datetime.now(timezone.utc)
+    for name in SEQUENCES:
+        for scope, value in (await current_maxima(name)).items():
+            scope_value: Any = scope
+            if scope is not None and SEQUENCES[name].scope_field and scope.isdigit():
+                scope_value = int(scope)
+            counter_id = _counter_id(name, scope_value)
+            await counters_collection.update_one(
+                {"_id": counter_id},
+                {"$max": {"value": value},
+                 "$setOnInsert": {"name": name, "scope": scope_value, "seeded_at": now}},
+                upsert=True,
+            )
+            _seeded.add(counter_id)
+            seeded[counter_id] = value
+    return seeded
@@ -0,0 +1,272 @@
+"""
+SIGPAC Cache - Caché en dos niveles de las respuestas de sigpac-hubcloud.es.
+
+Los datos de SIGPAC (recintos, geometrías, municipios) cambian como mucho una
+vez al año, pero cada consulta y cada clic en el mapa hacía una o dos llamadas
+en directo con timeouts de 10-15 s. Este módulo guarda las respuestas 200:
+
+1. en memoria, en un LRU por proceso (SIGPAC_CACHE_LRU_SIZE entradas);
+2. en Mongo, en la colección `sigpac_cache`, compartida entre workers y que
+   sobrevive a los reinicios. Un índice TTL la purga a los
+   SIGPAC_CACHE_MAX_AGE_DAYS días (365).
+
+Una entrada es fresca durante SIGPAC_CACHE_FRESH_DAYS días (30). Pasado ese
+tiempo se sirve igualmente ("stale-while-revalidate") y se refresca en
+segundo plano. Si SIGPAC falla o va lento, se sigue sirviendo la copia
+antigua. Las peticiones simultáneas de una misma clave comparten una sola
+llamada.
+
+Claves:
+
+- por referencia normalizada: `ref_key("refcat.json", pr, mu, ag, zo, po, pa)`
+  (provincia a 2 dígitos, municipio a 3, el resto sin ceros a la izquierda);
+- por tesela para las consultas por punto: `point_tile(lat, lng)` ajusta el
+  punto a una rejilla de SIGPAC_POINT_TILE_DEGREES (0.001°, ~100 m). Se
+  cachea la consulta de la tesela completa y el recinto se elige después con
+  las coordenadas exactas del clic.
+
+Uso:
+
+    status, data = await sigpac_get_json(key, url, timeout=15.0)
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from database import db
+from services.http_clients import http_request
+
+SIGPAC_CACHE_FRESH_DAYS = float(os.environ.get("SIGPAC_CACHE_FRESH_DAYS", "30"))
+SIGPAC_CACHE_MAX_AGE_DAYS = float(os.environ.get("SIGPAC_CACHE_MAX_AGE_DAYS", "365"))
+SIGPAC_CACHE_LRU_SIZE = int(os.environ.get("SIGPAC_CACHE_LRU_SIZE", "2000"))
+SIGPAC_POINT_TILE_DEGREES = float(os.environ.get("SIGPAC_POINT_TILE_DEGREES", "0.001"))
+
+cache_collection = db["sigpac_cache"]
+
+# clave -> (fetched_at epoch, data)
+_lru: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_inflight: Dict[str, "asyncio.Future[Tuple[int, Any]]"] = {}
+_refreshing: set = set()
+_stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "stale_served": 0,
+          "refreshes": 0, "errors": 0}
+
+
+def _norm(value: Any, width: int = 0) -> str:
+    text = str(value if value is not None else "0").strip()
+    if text.isdigit():
+        text = str(int(text))
+        return text.zfill(width) if width else text
+    return text.upper()
+
+
+def ref_key(kind: str, provincia: Any, municipio: Any, agregado: Any = 0, zona: Any = 0,
+            poligono: Any = 0, parcela: Any = 0, recinto: Any = None) -> str:
+    """Clave normalizada de una referencia SIGPAC (`kind` distingue el endpoint)."""
+    parts = [_norm(provincia, 2), _norm(municipio, 3), _norm(agregado), _norm(zona),
+             _norm(poligono), _norm(parcela)]
+    if recinto is not None:
+        parts.append(_norm(recinto))
+    return f"{kind}:{'/'.join(parts)}"
+
+
+def point_tile(lat: float, lng: float) -> Tuple[float, float, float, float]:
+    """Tesela que contiene el punto: (min_lng, min_lat, max_lng, max_lat)."""
+    step = SIGPAC_POINT_TILE_DEGREES
+    lat0 = (float(lat) // step) * step
+    lng0 = (float(lng) // step) * step
+    return (round(lng0, 6), round(lat0, 6), round(lng0 + step, 6), round(lat0 + step, 6))
+
+
+def tile_key(tile: Tuple[float, float, float, float]) -> str:
+    return "tile:" + ",".join(f"{v:.6f}" for v in tile)
+
+
+def _is_fresh(fetched_at: float) -> bool:
+    return time.time() - fetched_at < SIGPAC_CACHE_FRESH_DAYS * 86400
+
+
+def _remember(key: str, fetched_at: float, data: Any) -> None:
+    _lru[key] = (fetched_at, data)
+    _lru.move_to_end(key)
+    while len(_lru) > max(SIGPAC_CACHE_LRU_SIZE, 0):
+        _lru.popitem(last=False)
+
+
+async def _lookup(key: str) -> Optional[Tuple[float, Any]]:
+    entry = _lru.get(key)
+    if entry is not None:
+        if time.time() - entry[0] < SIGPAC_CACHE_MAX_AGE_DAYS * 86400:
+            _lru.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return entry
+        _lru.pop(key, None)
+    try:
+        doc = await cache_collection.find_one({"_id": key})
+    except Exception as e:
+        print(f"[SIGPAC Cache] Mongo lookup failed for {key}: {e}")
+        return None
+    if not doc:
+        return None
+    fetched = doc["fetched_at"]
+    if fetched.tzinfo is None:
+        fetched = fetched.replace(tzinfo=timezone.utc)
+    entry = (fetched.timestamp(), doc.get("data"))
+    if time.time() - entry[0] >= SIGPAC_CACHE_MAX_AGE_DAYS * 86400:
+        return None
+    _stats["mongo_hits"] += 1
+    _remember(key, *entry)
+    return entry
+
+
+async def _fetch_and_store(key: str, url: str, timeout: float, headers: Optional[Dict[str, str]]) -> Tuple[int, Any]:
+    resp = await http_request("sigpac", "GET", url, timeout=timeout, headers=headers)
+    if resp.status_code != 200:
+        return resp.status_code, None
+    data = resp.json()
+    now = datetime.now(timezone.utc)
+    _remember(key, now.timestamp(), data)
+    try:
+        await cache_collection.replace_one(
+            {"_id": key},
+            {"data": data, "url": url, "fetched_at": now,
+             "expires_at": now + timedelta(days=SIGPAC_CACHE_MAX_AGE_DAYS)},
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"[SIGPAC Cache] Failed to persist {key}: {e}")
+    return 200, data
+
+
+def _fetch_shared(key: str, url: str, timeout: float, headers: Optional[Dict[str, str]]) -> "asyncio.Future[Tuple[int, Any]]":
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_fetch_and_store(key, url, timeout, headers))
+        _inflight[key] = future
+        future.add_done_callback(lambda _f, k=key: _inflight.pop(k, None))
+    return future
+
+
+async def _refresh(key: str, url: str, timeout: float, headers: Optional[Dict[str, str]]) -> None:
+    try:
+        _stats["refreshes"] += 1
+        await _fetch_shared(key, url, timeout, headers)
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"[SIGPAC Cache] Background refresh failed for {key}: {e}")
+    finally:
+        _refreshing.discard(key)
+
+
+async def sigpac_get_json(
+    key: str,
+    url: str,
+    timeout: float = 15.0,
+    headers: Optional[Dict[str, str]] = None,
+    refresh: bool = False,
+) -> Tuple[int, Any]:
+    """`(status, json)` de una URL de SIGPAC, servida desde caché si es posible.
+
+    Solo se cachean las respuestas 200. Sin copia en caché, los errores de
+    SIGPAC (status != 200 o excepciones de httpx) llegan tal cual al llamador.
+    `refresh=True` fuerza la llamada (pre-calentamiento) salvo que la entrada
+    siga fresca.
+    """
+    entry = await _lookup(key)
+    if entry is not None:
+        fetched_at, data = entry
+        if _is_fresh(fetched_at):
+            return 200, data
+        if not refresh:
+            _stats["stale_served"] += 1
+            if key not in _refreshing:
+                _refreshing.add(key)
+                asyncio.ensure_future(_refresh(key, url, timeout, headers))
+            return 200, data
+
+    _stats["misses"] += 1
+    try:
+        return await asyncio.shield(_fetch_shared(key, url, timeout, headers))
+    except Exception:
+        _stats["errors"] += 1
+        if entry is not None:
+            return 200, entry[1]
+        raise
+
+
+def _point_in_ring(lng: float, lat: float, ring: Iterable[Any]) -> bool:
+    inside = False
+    pts = [p for p in ring if len(p) >= 2]
+    j = len(pts) - 1
+    for i in range(len(pts)):
+        xi, yi = pts[i][0], pts[i][1]
+        xj, yj = pts[j][0], pts[j][1]
+        if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / ((yj - yi) or 1e-12) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def geometry_contains(geometry: Optional[Dict[str, Any]], lat: float, lng: float) -> bool:
+    """True si el punto está dentro de un Polygon/MultiPolygon GeoJSON ([lng, lat])."""
+    if not geometry:
+        return False
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry.get("coordinates") or []]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry.get("coordinates") or []
+    else:
+        return False
+    for rings in polygons:
+        if rings and _point_in_ring(lng, lat, rings[0]) and \
+                not any(_point_in_ring(lng, lat, hole) for hole in rings[1:]):
+            return True
+    return False
+
+
+def geometry_tiles(geometry: Optional[Dict[str, Any]], max_tiles: int = 25) -> list:
+    """Teselas que cubren el bbox de una geometría (acotado a `max_tiles`)."""
+    coords: list = []
+
+    def collect(node: Any) -> None:
+        if isinstance(node, (list, tuple)) and node and isinstance(node[0], (int, float)):
+            coords.append(node)
+        elif isinstance(node, (list, tuple)):
+            for child in node:
+                collect(child)
+
+    collect((geometry or {}).get("coordinates"))
+    if not coords:
+        return []
+    step = SIGPAC_POINT_TILE_DEGREES
+    lat_range = range(int(min(c[1] for c in coords) // step), int(max(c[1] for c in coords) // step) + 1)
+    lng_range = range(int(min(c[0] for c in coords) // step), int(max(c[0] for c in coords) // step) + 1)
+    tiles = []
+    for i in lat_range:
+        for j in lng_range:
+            if len(tiles) >= max_tiles:
+                return tiles
+            tiles.append(point_tile((i + 0.5) * step, (j + 0.5) * step))
+    return tiles
+
+
+def get_sigpac_cache_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "memory_entries": len(_lru),
+        "inflight": len(_inflight),
+        "fresh_days": SIGPAC_CACHE_FRESH_DAYS,
+        "max_age_days": SIGPAC_CACHE_MAX_AGE_DAYS,
+        "tile_degrees": SIGPAC_POINT_TILE_DEGREES,
+    }
+
+
+async def clear_sigpac_cache() -> int:
+    """Vacía ambos niveles. Devuelve las entradas borradas de Mongo."""
+    _lru.clear()
+    result = await cache_collection.delete_many({})
+    return result.deleted_count
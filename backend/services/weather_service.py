@@ -0,0 +1,175 @@
+"""
+Weather Service - Datos de OpenWeatherMap agrupados por celda de rejilla.
+
+Las verificaciones de clima (`/api/alertas-clima/verificar-todas` y la tarea
+programada de `routes_notificaciones`) pedían el tiempo parcela a parcela, con
+un `httpx.AsyncClient` nuevo por llamada y esperando cada respuesta antes de
+pasar a la siguiente. Las parcelas de una misma finca reciben el mismo dato,
+así que se gastaba cuota repitiendo peticiones idénticas.
+
+Este módulo:
+
+- redondea las coordenadas a una celda de rejilla (WEATHER_GRID_DEGREES, 0.05°
+  por defecto, unos 5 km) y pide el tiempo del centro de la celda;
+- guarda cada celda en caché durante WEATHER_CACHE_TTL_SECONDS (600 s; el dato
+  de OpenWeatherMap se actualiza cada ~10 min). TTL 0 desactiva la caché;
+- agrupa las peticiones simultáneas de una misma celda en una sola llamada;
+- usa el cliente compartido "openweather" de `services/http_clients.py` (pool
+  de conexiones, reintentos y métricas) y limita las llamadas en paralelo a
+  WEATHER_MAX_CONCURRENCY (8).
+
+Uso:
+
+    datos = await obtener_clima(lat, lon)                 # una ubicación
+    por_parcela = await obtener_clima_parcelas(parcelas)  # {parcela_id: datos}
+
+Los errores de la API no se cachean: se devuelve None y la siguiente
+verificación lo vuelve a intentar.
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from services.http_clients import http_request
+
+OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "")
+OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+WEATHER_GRID_DEGREES = float(os.environ.get("WEATHER_GRID_DEGREES", "0.05"))
+WEATHER_CACHE_TTL_SECONDS = float(os.environ.get("WEATHER_CACHE_TTL_SECONDS", "600"))
+WEATHER_MAX_CONCURRENCY = int(os.environ.get("WEATHER_MAX_CONCURRENCY", "8"))
+
+Cell = Tuple[float, float]
+
+# celda -> (expira_en, datos)
+_cache: Dict[Cell, Tuple[float, Dict[str, Any]]] = {}
+# celda -> petición en curso
+_inflight: Dict[Cell, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+_stats = {"hits": 0, "misses": 0, "errors": 0}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def grid_cell(lat: float, lon: float) -> Cell:
+    """Centro de la celda de rejilla que contiene (lat, lon)."""
+    step = WEATHER_GRID_DEGREES
+    if step <= 0:
+        return (round(float(lat), 6), round(float(lon), 6))
+    return (
+        round((int(float(lat) // step) + 0.5) * step, 6),
+        round((int(float(lon) // step) + 0.5) * step, 6),
+    )
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(WEATHER_MAX_CONCURRENCY, 1))
+    return _semaphore
+
+
+async def _fetch(lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    """Llamada a OpenWeatherMap (sin caché)."""
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "appid": OPENWEATHER_API_KEY,
+        "units": "metric",
+        "lang": "es"
+    }
+    try:
+        async with _get_semaphore():
+            response = await http_request("openweather", "GET", OPENWEATHER_BASE_URL, params=params)
+        if response.status_code != 200:
+            print(f"[Weather] OpenWeatherMap API error: {response.status_code}")
+            return None
+        data = response.json()
+        return {
+            "temperatura": data["main"]["temp"],
+            "humedad": data["main"]["humidity"],
+            "lluvia": data.get("rain", {}).get("1h", 0),
+            "viento": data["wind"]["speed"] * 3.6,  # m/s -> km/h
+            "descripcion": data["weather"][0]["description"],
+            "icono": data["weather"][0]["icon"],
+            "ubicacion": data.get("name", ""),
+            "fuente": "openweathermap",
+            "timestamp": datetime.utcnow()
+        }
+    except Exception as e:
+        print(f"[Weather] Error fetching weather data: {e}")
+        return None
+
+
+async def _load_cell(cell: Cell) -> Optional[Dict[str, Any]]:
+    datos = await _fetch(*cell)
+    if datos is None:
+        _stats["errors"] += 1
+    elif WEATHER_CACHE_TTL_SECONDS > 0:
+        _cache[cell] = (time.monotonic() + WEATHER_CACHE_TTL_SECONDS, datos)
+    return datos
+
+
+async def obtener_clima(lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    """Tiempo actual de la celda que contiene (lat, lon), o None si la API falla.
+
+    Devuelve una copia: quien la reciba puede modificarla sin tocar la caché.
+    """
+    cell = grid_cell(lat, lon)
+    entry = _cache.get(cell)
+    if entry is not None:
+        if entry[0] > time.monotonic():
+            _stats["hits"] += 1
+            return copy.deepcopy(entry[1])
+        _cache.pop(cell, None)
+
+    _stats["misses"] += 1
+    future = _inflight.get(cell)
+    if future is None:
+        future = asyncio.ensure_future(_load_cell(cell))
+        _inflight[cell] = future
+        future.add_done_callback(lambda _f, c=cell: _inflight.pop(c, None))
+    datos = await asyncio.shield(future)
+    return copy.deepcopy(datos) if datos is not None else None
+
+
+async def obtener_clima_parcelas(parcelas: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Tiempo de cada parcela con coordenadas: `{str(parcela._id): datos}`.
+
+    Se hace una petición por celda distinta, en paralelo (acotado por
+    WEATHER_MAX_CONCURRENCY). Las parcelas sin coordenadas o cuya celda falló
+    no aparecen en el resultado.
+    """
+    celdas: Dict[Cell, list] = {}
+    for parcela in parcelas:
+        lat, lon = parcela.get("latitud"), parcela.get("longitud")
+        if lat and lon:
+            celdas.setdefault(grid_cell(lat, lon), []).append(str(parcela["_id"]))
+
+    cells = list(celdas)
+    resultados = await asyncio.gather(*(obtener_clima(*cell) for cell in cells))
+
+    por_parcela: Dict[str, Dict[str, Any]] = {}
+    for cell, datos in zip(cells, resultados):
+        if datos is None:
+            continue
+        for parcela_id in celdas[cell]:
+            por_parcela[parcela_id] = dict(datos)
+    return por_parcela
+
+
+def get_weather_cache_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "entries": len(_cache),
+        "inflight": len(_inflight),
+        "grid_degrees": WEATHER_GRID_DEGREES,
+        "ttl_seconds": WEATHER_CACHE_TTL_SECONDS,
+    }
+
+
+def clear_weather_cache() -> None:
+    _cache.clear()
@@ -0,0 +1,455 @@
+"""
+Webhook Outbox - Cola persistente de entregas de webhooks al ERP.
+
+`dispatch_webhook` recorría los webhooks suscritos uno tras otro dentro de la
+petición que provocaba el evento: una llamada HTTP de hasta 5 s por webhook,
+dos escrituras de log por envío y ningún reintento. Un ERP lento ralentizaba
+nuestras propias altas y un ERP caído perdía los eventos para siempre.
+
+Con este módulo las rutas solo encolan (`enqueue_webhook_event`): un
+`insert_many` en la colección `erp_webhook_outbox` con una entrega por webhook
+suscrito. Si la ruta usa una sesión/transacción de Mongo puede pasarla en
+`session` y el evento queda confirmado junto con el dato. Un dispatcher que
+arranca con la app entrega lo pendiente en segundo plano:
+
+- reclama las entregas vencidas agrupadas por webhook (como mucho
+  WEBHOOK_BATCH_SIZE, 50, por ronda), con un token de reclamación para que varios
+  procesos uvicorn no envíen dos veces lo mismo;
+- cada webhook se vacía en su propia tarea, con WEBHOOK_ENDPOINT_CONCURRENCY
+  (2) peticiones a la vez como mucho, y WEBHOOK_MAX_CONCURRENCY (16) en total.
+  Un ERP lento solo retrasa sus propias entregas. Se usa el cliente httpx
+  compartido de `http_clients` (pool de conexiones y keep-alive);
+- los webhooks con `max_batch` > 1 reciben varios eventos en un solo POST
+  (`{"event": "batch", "events": [...]}`); con `max_batch` = 1 (por defecto)
+  el payload es el de siempre;
+- si falla, reintento con backoff exponencial y jitter (WEBHOOK_RETRY_BASE_SECONDS,
+  tope WEBHOOK_RETRY_MAX_SECONDS). Tras WEBHOOK_MAX_ATTEMPTS (8) intentos, o
+  ante un 4xx que no sea 408/429, la entrega pasa a `dead` y se puede
+  reintentar a mano (`retry_dead_deliveries`);
+- las entregas hechas caducan con un índice TTL a los
+  WEBHOOK_OUTBOX_RETENTION_DAYS días (7). Las `dead` se conservan.
+
+Firma: `X-Webhook-Signature: sha256=<hex>`, un HMAC-SHA256 con el secret del
+webhook sobre `"{X-Webhook-Timestamp}.{cuerpo}"`, donde el cuerpo son los bytes
+exactos del POST. Sustituye a `sha256(secret + str(payload))`, que no era un
+HMAC y además dependía de la representación Python del dict.
+
+Uso:
+
+    await enqueue_webhook_event("update", "contratos", serialize_doc(contrato))
+
+Solo encolan eventos los módulos de WEBHOOK_MODULES; al añadir
+`enqueue_webhook_event` a otras rutas hay que añadir su módulo ahí para que se
+pueda suscribir un webhook.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import db
+from services.http_clients import http_request
+
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_ENDPOINT_CONCURRENCY = int(os.environ.get("WEBHOOK_ENDPOINT_CONCURRENCY", "2"))
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get("WEBHOOK_MAX_CONCURRENCY", "16"))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.environ.get("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.environ.get("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_OUTBOX_RETENTION_DAYS = float(os.environ.get("WEBHOOK_OUTBOX_RETENTION_DAYS", "7"))
+# Módulos cuyas rutas llaman a enqueue_webhook_event (routes_contratos, routes_fincas)
+WEBHOOK_MODULES = ("contratos", "fincas")
+WEBHOOK_EVENTS = ("create", "update", "delete")
+_SUBSCRIPTIONS_TTL_SECONDS = 30.0
+_POLL_INTERVAL_SECONDS = 2.0
+# Una entrega reclamada por un worker que muere vuelve a estar disponible tras esto
+_LEASE_SECONDS = WEBHOOK_TIMEOUT_SECONDS * 3 + 30
+
+outbox_collection = db["erp_webhook_outbox"]
+webhooks_collection = db["erp_webhooks"]
+sync_log_collection = db["erp_sync_log"]
+
+_subscriptions: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+_slots: Optional[asyncio.Semaphore] = None
+_dispatcher_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_stats = {"enqueued": 0, "delivered": 0, "failed_attempts": 0, "dead": 0, "requests": 0}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ---------------------------------------------------------------------------
+# Firma
+# ---------------------------------------------------------------------------
+
+def encode_webhook_body(payload: Dict[str, Any]) -> bytes:
+    """Cuerpo JSON canónico (el que se firma y se envía)."""
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True,
+                      ensure_ascii=False, default=str).encode("utf-8")
+
+
+def sign_webhook_body(secret: str, timestamp: str, body: bytes) -> str:
+    """Valor de `X-Webhook-Signature`: HMAC-SHA256 de `"{timestamp}.{body}"`."""
+    mac = hmac.new((secret or "").encode("utf-8"), timestamp.encode("ascii") + b"." + body,
+                   hashlib.sha256)
+    return "sha256=" + mac.hexdigest()
+
+
+def webhook_headers(secret: str, event: str, body: bytes,
+                    delivery_id: Optional[str] = None) -> Dict[str, str]:
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        "X-Webhook-Event": event,
+        "X-Webhook-Timestamp": timestamp,
+        "X-Webhook-Signature": sign_webhook_body(secret, timestamp, body),
+    }
+    if delivery_id:
+        headers["X-Webhook-Id"] = delivery_id
+    return headers
+
+
+# ---------------------------------------------------------------------------
+# Encolado (camino de escritura)
+# ---------------------------------------------------------------------------
+
+def invalidate_webhook_subscriptions() -> None:
+    """Olvida la lista de webhooks (alta, baja o activación de un webhook)."""
+    global _subscriptions
+    _subscriptions = None
+
+
+async def _webhook_subscriptions() -> List[Dict[str, Any]]:
+    global _subscriptions
+    if _subscriptions is not None and time.monotonic() - _subscriptions[0] < _SUBSCRIPTIONS_TTL_SECONDS:
+        return _subscriptions[1]
+    webhooks = await webhooks_collection.find(
+        {}, {"activo": 1, "eventos": 1, "modulos": 1},
+    ).to_list(None)
+    _subscriptions = (time.monotonic(), webhooks)
+    return webhooks
+
+
+async def _active_webhooks() -> List[Dict[str, Any]]:
+    return [wh for wh in await _webhook_subscriptions() if wh.get("activo") is True]
+
+
+async def _inactive_webhook_ids() -> List[Any]:
+    return [wh["_id"] for wh in await _webhook_subscriptions() if wh.get("activo") is False]
+
+
+async def enqueue_webhook_event(event: str, module: str, data: Dict[str, Any],
+                                session: Any = None) -> int:
+    """Encola el evento para cada webhook activo suscrito. Devuelve nº de entregas.
+
+    No hace ninguna llamada HTTP: el envío lo hace el dispatcher. Los fallos al
+    encolar se registran y no interrumpen la escritura que provocó el evento.
+    """
+    try:
+        webhooks = [
+            wh for wh in await _active_webhooks()
+            if event in (wh.get("eventos") or []) and module in (wh.get("modulos") or [])
+        ]
+        if not webhooks:
+            return 0
+        now = _now()
+        event_id = uuid.uuid4().hex
+        await outbox_collection.insert_many([{
+            "event_id": event_id,
+            "webhook_id": wh["_id"],
+            "event": event,
+            "module": module,
+            "data": data,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+        } for wh in webhooks], session=session)
+    except Exception as e:
+        print(f"[Webhooks] failed to enqueue {module}.{event}: {e}")
+        return 0
+    _stats["enqueued"] += len(webhooks)
+    if _wakeup is not None:
+        _wakeup.set()
+    return len(webhooks)
+
+
+# ---------------------------------------------------------------------------
+# Dispatcher
+# ---------------------------------------------------------------------------
+
+def _retry_delay(attempts: int) -> float:
+    delay = WEBHOOK_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    return min(delay, WEBHOOK_RETRY_MAX_SECONDS) * (0.5 + random.random())
+
+
+def _is_permanent(status: int) -> bool:
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+async def _due_webhooks(now: datetime) -> List[Any]:
+    """Webhooks con entregas vencidas. Los desactivados no se miran: su cola espera
+    a que se reactiven (los borrados sí, para pasar lo pendiente a dead)."""
+    rows = await outbox_collection.aggregate([
+        {"$match": {"webhook_id": {"$nin": await _inactive_webhook_ids()}, "$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lt": now}},
+        ]}},
+        {"$group": {"_id": "$webhook_id", "oldest": {"$min": "$next_attempt_at"}}},
+        {"$sort": {"oldest": 1}},
+    ]).to_list(None)
+    return [row["_id"] for row in rows]
+
+
+async def _claim_batch(webhook_id: Any, limit: int) -> List[Dict[str, Any]]:
+    now = _now()
+    due = {"webhook_id": webhook_id, "$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "sending", "lease_until": {"$lt": now}},
+    ]}
+    ids = [d["_id"] async for d in outbox_collection.find(due, {"_id": 1})
+           .sort("created_at", 1).limit(limit)]
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Repetir el filtro de vencimiento evita robar entregas que otro worker acaba de reclamar
+    await outbox_collection.update_many(
+        {"_id": {"$in": ids}, "$or": due["$or"]},
+        {"$set": {"status": "sending", "claim_token": token,
+                  "lease_until": now + timedelta(seconds=_LEASE_SECONDS)}},
+    )
+    return await outbox_collection.find({"claim_token": token}).sort("created_at", 1).to_list(None)
+
+
+def _event_payload(delivery: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": delivery["event_id"],
+        "event": delivery["event"],
+        "module": delivery["module"],
+        "timestamp": delivery["created_at"].isoformat(),
+        "data": delivery.get("data"),
+    }
+
+
+async def _post(webhook: Dict[str, Any], deliveries: List[Dict[str, Any]]) -> Tuple[int, Optional[str]]:
+    if len(deliveries) == 1:
+        payload = _event_payload(deliveries[0])
+        event = deliveries[0]["event"]
+    else:
+        payload = {"event": "batch", "events": [_event_payload(d) for d in deliveries]}
+        event = "batch"
+    body = encode_webhook_body(payload)
+    headers = webhook_headers(webhook.get("secret", ""), event, body,
+                              delivery_id=str(deliveries[0]["_id"]))
+    _stats["requests"] += 1
+    try:
+        resp = await http_request("webhooks", "POST", webhook["url"], content=body,
+                                  headers=headers, timeout=WEBHOOK_TIMEOUT_SECONDS)
+    except Exception as e:
+        return 0, f"{type(e).__name__}: {e}"
+    await resp.aclose()
+    return resp.status_code, None
+
+
+async def _settle(webhook: Dict[str, Any], deliveries: List[Dict[str, Any]],
+                  status: int, error: Optional[str]) -> None:
+    now = _now()
+    ok = 200 <= status < 300
+    ids = [d["_id"] for d in deliveries]
+    if ok:
+        await outbox_collection.update_many(
+            {"_id": {"$in": ids}},
+            {"$set": {"status": "delivered", "delivered_at": now, "last_status": status,
+                      "expires_at": now + timedelta(days=WEBHOOK_OUTBOX_RETENTION_DAYS)},
+             "$unset": {"claim_token": "", "lease_until": "", "last_error": ""},
+             "$inc": {"attempts": 1}},
+        )
+        _stats["delivered"] += len(ids)
+    else:
+        _stats["failed_attempts"] += len(ids)
+        # Los intentos van por entrega: un lote puede mezclar entregas nuevas y reintentos
+        attempts = max(d.get("attempts", 0) for d in deliveries) + 1
+        dead = attempts >= WEBHOOK_MAX_ATTEMPTS or _is_permanent(status)
+        update: Dict[str, Any] = {"last_status": status, "last_error": error or f"HTTP {status}",
+                                  "last_attempt_at": now}
+        if dead:
+            update.update({"status": "dead", "dead_at": now})
+            _stats["dead"] += len(ids)
+        else:
+            update.update({"status": "pending",
+                           "next_attempt_at": now + timedelta(seconds=_retry_delay(attempts))})
+        await outbox_collection.update_many(
+            {"_id": {"$in": ids}},
+            {"$set": update, "$unset": {"claim_token": "", "lease_until": ""},
+             "$inc": {"attempts": 1}},
+        )
+    await webhooks_collection.update_one(
+        {"_id": webhook["_id"]},
+        {"$set": {"last_triggered": now, "last_status": status},
+         "$inc": {"trigger_count": len(ids)}},
+    )
+    await sync_log_collection.insert_one({
+        "tipo": "webhook",
+        "modulo": ",".join(sorted({d["module"] for d in deliveries})),
+        "evento": ",".join(sorted({d["event"] for d in deliveries})),
+        "webhook_url": webhook["url"],
+        "estado": "ok" if ok else "error",
+        "status_code": status,
+        "eventos": len(ids),
+        "timestamp": now,
+    })
+
+
+async def _deliver_endpoint(webhook_id: Any) -> int:
+    """Una ronda de envíos a un webhook, sin pasar de su límite de concurrencia.
+
+    Reclama solo lo que cabe en una ronda (`max_batch` x concurrencia) para que
+    todo se envíe antes de que venza el lease.
+    """
+    webhook = await webhooks_collection.find_one({"_id": webhook_id})
+    if webhook is None:
+        # Webhook borrado: lo pendiente queda aparcado como dead
+        await outbox_collection.update_many(
+            {"webhook_id": webhook_id, "status": {"$in": ["pending", "sending"]}},
+            {"$set": {"status": "dead", "dead_at": _now(), "last_error": "webhook eliminado"},
+             "$unset": {"claim_token": "", "lease_until": ""}},
+        )
+        return 0
+    if not webhook.get("activo", True):
+        return 0  # desactivado: la cola se conserva hasta que se reactive
+    max_batch = max(min(int(webhook.get("max_batch") or 1), WEBHOOK_BATCH_SIZE), 1)
+    deliveries = await _claim_batch(webhook_id, min(max_batch * WEBHOOK_ENDPOINT_CONCURRENCY,
+                                                    WEBHOOK_BATCH_SIZE))
+
+    async def send(chunk: List[Dict[str, Any]]) -> None:
+        async with _global_slots():
+            status, error = await _post(webhook, chunk)
+        await _settle(webhook, chunk, status, error)
+
+    await asyncio.gather(*(send(deliveries[i:i + max_batch])
+                           for i in range(0, len(deliveries), max_batch)))
+    return len(deliveries)
+
+
+def _global_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
+    return _slots
+
+
+async def _drain_endpoint(webhook_id: Any) -> int:
+    """Entrega lo vencido de un webhook hasta vaciarlo. Los reintentos quedan para más tarde."""
+    sent = 0
+    try:
+        while True:
+            done = await _deliver_endpoint(webhook_id)
+            if not done:
+                return sent
+            sent += done
+    except Exception as e:
+        print(f"[Webhooks] delivery to {webhook_id} failed: {e}")
+        return sent
+
+
+async def dispatch_due_deliveries() -> int:
+    """Entrega todo lo vencido y espera a que termine. Devuelve nº de entregas."""
+    webhook_ids = await _due_webhooks(_now())
+    return sum(await asyncio.gather(*(_drain_endpoint(wid) for wid in webhook_ids)))
+
+
+async def _dispatcher_loop() -> None:
+    assert _wakeup is not None
+    # Una tarea por webhook: un ERP lento solo retrasa sus propias entregas
+    running: Dict[str, asyncio.Task] = {}
+    try:
+        while True:
+            try:
+                for webhook_id in await _due_webhooks(_now()):
+                    key = str(webhook_id)
+                    if key not in running:
+                        task = asyncio.create_task(_drain_endpoint(webhook_id))
+                        running[key] = task
+                        task.add_done_callback(lambda _t, k=key: running.pop(k, None))
+            except Exception as e:
+                print(f"[Webhooks] dispatcher error: {e}")
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), _POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    except asyncio.CancelledError:
+        for task in list(running.values()):
+            task.cancel()
+        raise
+
+
+def start_webhook_dispatcher() -> None:
+    """Arranca el dispatcher de webhooks (startup de la app)."""
+    global _dispatcher_task, _wakeup
+    if _dispatcher_task is not None and not _dispatcher_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _dispatcher_task = asyncio.create_task(_dispatcher_loop())
+    print(f"[Webhooks] Dispatcher started (per endpoint={WEBHOOK_ENDPOINT_CONCURRENCY}, "
+          f"total={WEBHOOK_MAX_CONCURRENCY})")
+
+
+def stop_webhook_dispatcher() -> None:
+    """Detiene el dispatcher (shutdown de la app). Lo reclamado vuelve a la cola al vencer el lease."""
+    global _dispatcher_task
+    if _dispatcher_task is not None:
+        _dispatcher_task.cancel()
+        _dispatcher_task = None
+
+
+# ---------------------------------------------------------------------------
+# Dead letters y estado
+# ---------------------------------------------------------------------------
+
+async def retry_dead_deliveries(query: Dict[str, Any]) -> int:
+    """Devuelve a la cola las entregas `dead` que cumplan `query`."""
+    result = await outbox_collection.update_many(
+        {**query, "status": "dead"},
+        {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": _now()},
+         "$unset": {"dead_at": ""}},
+    )
+    if result.modified_count and _wakeup is not None:
+        _wakeup.set()
+    return result.modified_count
+
+
+async def get_outbox_stats() -> Dict[str, Any]:
+    rows = await outbox_collection.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    oldest = await outbox_collection.find_one(
+        {"status": "pending"}, {"created_at": 1}, sort=[("created_at", 1)],
+    )
+    lag = None
+    if oldest:
+        created = oldest["created_at"]
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        lag = round((_now() - created).total_seconds(), 1)
+    return {
+        **_stats,
+        "by_status": {row["_id"]: row["count"] for row in rows},
+        "oldest_pending_seconds": lag,
+        "dispatcher_running": _dispatcher_task is not None and not _dispatcher_task.done(),
+        "batch_size": WEBHOOK_BATCH_SIZE,
+        "endpoint_concurrency": WEBHOOK_ENDPOINT_CONCURRENCY,
+        "max_concurrency": WEBHOOK_MAX_CONCURRENCY,
+        "max_attempts": WEBHOOK_MAX_ATTEMPTS,
+    }
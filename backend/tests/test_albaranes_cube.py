@@ -0,0 +1,103 @@
+"""
+Test Albaranes Cube - Daily rollup behind gastos/ingresos/comisiones
+Tests for:
+- Creating, editing and deleting an albaran moves /api/gastos/resumen immediately
+- Albaranes de venta show up in /api/ingresos/resumen
+- /api/comisiones/resumen returns agent totals; detalle=true adds the albaranes list
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestAlbaranesCube:
+    """Tests for the incrementally maintained albaranes cube"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _albaran(self, tipo, tercero, cantidad, precio):
+        return {
+            "tipo": tipo,
+            "fecha": "2026-01-15",
+            "proveedor": tercero if tipo != "Albarán de venta" else None,
+            "cliente": tercero if tipo == "Albarán de venta" else None,
+            "cultivo": "TEST_CUBE",
+            "campana": "2025/26",
+            "items": [{"descripcion": "Test", "cantidad": cantidad, "unidad": "kg",
+                       "precio_unitario": precio, "total": cantidad * precio}],
+        }
+
+    def test_gastos_follow_albaran_writes(self):
+        """Create/update/delete are reflected in the gastos summary without a rebuild"""
+        proveedor = f"TEST_CUBE_{uuid.uuid4().hex[:8]}"
+        created = self.session.post(f"{BASE_URL}/api/albaranes",
+                                    json=self._albaran("Albarán de compra", proveedor, 100, 2.0))
+        assert created.status_code == 200, f"Create failed: {created.text}"
+        albaran_id = created.json()["data"]["_id"]
+        try:
+            resumen = self.session.get(f"{BASE_URL}/api/gastos/resumen", params={"proveedor": proveedor}).json()
+            assert resumen["total_albaranes"] == 1
+            assert resumen["total_general"] == pytest.approx(200.0)
+
+            updated = self.session.put(f"{BASE_URL}/api/albaranes/{albaran_id}",
+                                       json=self._albaran("Albarán de compra", proveedor, 50, 2.0))
+            assert updated.status_code == 200, f"Update failed: {updated.text}"
+            resumen = self.session.get(f"{BASE_URL}/api/gastos/resumen", params={"proveedor": proveedor}).json()
+            assert resumen["total_albaranes"] == 1
+            assert resumen["total_general"] == pytest.approx(100.0)
+        finally:
+            deleted = self.session.delete(f"{BASE_URL}/api/albaranes/{albaran_id}")
+            assert deleted.status_code == 200
+
+        resumen = self.session.get(f"{BASE_URL}/api/gastos/resumen", params={"proveedor": proveedor}).json()
+        assert resumen["total_albaranes"] == 0
+        assert resumen["por_proveedor"] == []
+
+    def test_ingresos_from_cube(self):
+        """Albaranes de venta are counted in ingresos, grouped by cliente"""
+        cliente = f"TEST_CUBE_{uuid.uuid4().hex[:8]}"
+        created = self.session.post(f"{BASE_URL}/api/albaranes",
+                                    json=self._albaran("Albarán de venta", cliente, 10, 3.0))
+        assert created.status_code == 200, f"Create failed: {created.text}"
+        albaran_id = created.json()["data"]["_id"]
+        try:
+            resumen = self.session.get(f"{BASE_URL}/api/ingresos/resumen", params={"cliente": cliente}).json()
+            assert resumen["total_albaranes"] == 1
+            assert resumen["por_cliente"][0]["cliente"] == cliente
+            assert resumen["total_general"] == pytest.approx(30.0)
+        finally:
+            self.session.delete(f"{BASE_URL}/api/albaranes/{albaran_id}")
+
+    def test_comisiones_resumen_totals_and_detalle(self):
+        """Summary returns num_albaranes; detalle=true returns the per-albaran list"""
+        resumen = self.session.get(f"{BASE_URL}/api/comisiones/resumen")
+        assert resumen.status_code == 200
+        data = resumen.json()
+        assert data["success"] is True
+        for agente in data["comisiones"]:
+            assert "num_albaranes" in agente
+            assert agente["albaranes"] == []
+
+        detalle = self.session.get(f"{BASE_URL}/api/comisiones/resumen", params={"detalle": "true"}).json()
+        por_agente = {(a["agente_id"], a["tipo"]): a for a in detalle["comisiones"]}
+        for agente in data["comisiones"]:
+            completo = por_agente.get((agente["agente_id"], agente["tipo"]))
+            assert completo is not None
+            assert len(completo["albaranes"]) == agente["num_albaranes"]
+            assert agente["total_kg"] == pytest.approx(completo["total_kg"])
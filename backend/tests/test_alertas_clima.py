@@ -259,7 +259,37 @@ class TestVerificarTodas:
         assert "message" in data
         assert "parcelas_procesadas" in data
         assert "alertas_generadas" in data
-    
+
+    def test_verificar_todas_reuses_weather_cache(self, api_client):
+        """A second run is served from the per-grid-cell weather cache"""
+        first = api_client.post(f"{BASE_URL}/api/alertas-clima/verificar-todas")
+        assert first.status_code == 200
+        before = api_client.get(f"{BASE_URL}/api/system/weather-cache").json()
+
+        second = api_client.post(f"{BASE_URL}/api/alertas-clima/verificar-todas")
+        assert second.status_code == 200
+        after = api_client.get(f"{BASE_URL}/api/system/weather-cache").json()
+
+        assert after["entries"] >= before["entries"]
+        # Only cells whose API call failed in the first run are requested again
+        assert after["misses"] - before["misses"] <= after["errors"] - before["errors"]
+
+    def test_verificar_todas_does_not_duplicate_open_alerts(self, api_client):
+        """Running the batch twice keeps one open alert per parcela and rule"""
+        for _ in range(2):
+            response = api_client.post(f"{BASE_URL}/api/alertas-clima/verificar-todas")
+            assert response.status_code == 200
+
+        response = api_client.get(f"{BASE_URL}/api/alertas-clima?estado=pendiente&limit=1000")
+        assert response.status_code == 200
+        recientes = [
+            (a["parcela_id"], a["regla_id"]) for a in response.json()["alertas"]
+            if a["created_at"][:10] == datetime.utcnow().strftime("%Y-%m-%d")
+        ]
+        assert len(recientes) == len(set(recientes))
+        for alerta in response.json()["alertas"]:
+            assert "_dedup_key" not in alerta
+
     def test_verificar_todas_unauthorized(self):
         """Test verifying without authentication"""
         response = requests.post(f"{BASE_URL}/api/alertas-clima/verificar-todas")
@@ -112,6 +112,35 @@ class TestComisionesResumen:
             
             assert abs(com.get("total_comision", 0) - calculated_total) < 0.01
 
+    def test_resumen_ledger_matches_campaign_breakdown(self, authenticated_client):
+        """fuente=ledger totals per agent equal the sum of their campaign rows"""
+        response = authenticated_client.get(f"{BASE_URL}/api/comisiones/resumen?fuente=ledger")
+        assert response.status_code == 200
+        data = response.json()
+        assert data.get("fuente") == "ledger"
+        for com in data.get("comisiones", []):
+            assert abs(com["total_comision"] - sum(c["total_comision"] for c in com["campanas"])) < 0.05
+            assert com["num_albaranes"] == sum(c["num_albaranes"] for c in com["campanas"])
+
+    def test_resumen_ledger_drill_down_is_paged(self, authenticated_client):
+        """Line items of an agent come paged and add up to num_albaranes"""
+        data = authenticated_client.get(f"{BASE_URL}/api/comisiones/resumen?fuente=ledger").json()
+        if not data.get("comisiones"):
+            pytest.skip("No comisiones_generadas available")
+        com = data["comisiones"][0]
+        url = f"{BASE_URL}/api/comisiones/resumen/albaranes?agente_id={com['agente_id']}&tipo_agente={com['tipo']}&limit=50"
+        page = authenticated_client.get(url).json()
+        assert page["total"] == com["num_albaranes"]
+        vistos = len(page["albaranes"])
+        while page.get("next_cursor"):
+            page = authenticated_client.get(f"{url}&cursor={page['next_cursor']}").json()
+            vistos += len(page["albaranes"])
+        assert vistos == com["num_albaranes"]
+
+    def test_resumen_invalid_fuente_returns_400(self, authenticated_client):
+        response = authenticated_client.get(f"{BASE_URL}/api/comisiones/resumen?fuente=otra")
+        assert response.status_code == 400
+
 
 class TestComisionesAgentes:
     """Tests for /api/comisiones/agentes endpoint"""
@@ -202,6 +231,35 @@ class TestLiquidacionPdf:
         assert len(response.content) > 1000  # PDF should have reasonable size
 
 
+class TestRegenerarAlbaranesComision:
+    """Tests for the background regeneration of albaranes de comisión"""
+
+    def test_regenerar_runs_as_job(self, authenticated_client):
+        """POST /regenerar returns a job whose status ends with the summary"""
+        import time
+
+        response = authenticated_client.post(f"{BASE_URL}/api/albaranes-comision/regenerar?solo_faltantes=true")
+        assert response.status_code == 202
+        job = response.json()
+        assert job.get("job_id")
+
+        for _ in range(60):
+            if job.get("status") not in ("pending", "running"):
+                break
+            time.sleep(1)
+            status = authenticated_client.get(f"{BASE_URL}/api/albaranes-comision/regenerar/{job['job_id']}")
+            assert status.status_code == 200
+            job = status.json()
+
+        assert job.get("status") == "completed", job
+        for key in ("creados", "actualizados", "saltados", "errores"):
+            assert key in job["result"]
+
+    def test_regenerar_unknown_job_returns_404(self, authenticated_client):
+        response = authenticated_client.get(f"{BASE_URL}/api/albaranes-comision/regenerar/000000000000000000000000")
+        assert response.status_code == 404
+
+
 class TestContratoComisiones:
     """Tests for contract commission fields"""
     
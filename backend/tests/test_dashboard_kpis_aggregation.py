@@ -0,0 +1,82 @@
+"""
+Test Dashboard KPIs - Server-side aggregation of /api/dashboard/kpis
+Tests for:
+- Response shape unchanged (keys consumed by the dashboard widgets)
+- Totals are exact (match paginated/count endpoints, no 1000-doc truncation)
+- Derived values are consistent (costes.total, alquiladas, rentabilidad)
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+TOP_LEVEL_KEYS = [
+    "totales", "fincas", "produccion", "costes", "superficie", "rentabilidad",
+    "actividad_reciente", "proximas_cosechas", "tratamientos_pendientes",
+    "fincas_recoleccion_semana", "contratos_activos", "contratos_stats",
+    "visitas_proximas", "visitas_stats",
+]
+
+
+class TestDashboardKpisAggregation:
+    """Tests for the aggregated dashboard KPIs"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _kpis(self):
+        response = self.session.get(f"{BASE_URL}/api/dashboard/kpis")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        return response.json()
+
+    def test_response_shape(self):
+        """All keys used by the dashboard widgets are present"""
+        data = self._kpis()
+        for key in TOP_LEVEL_KEYS:
+            assert key in data, f"Missing '{key}' in KPIs response"
+        for key in ("total", "propias", "alquiladas", "hectareas_total", "por_provincia", "parcelas_sin_asignar"):
+            assert key in data["fincas"], f"Missing fincas.{key}"
+        for key in ("total_activos", "compra", "venta", "por_cultivo"):
+            assert key in data["contratos_stats"], f"Missing contratos_stats.{key}"
+        assert len(data["contratos_activos"]) <= 10
+        assert len(data["proximas_cosechas"]) <= 10
+        assert len(data["actividad_reciente"]["visitas"]) <= 5
+
+    def test_derived_values_consistent(self):
+        """Totals derived from the aggregations add up"""
+        data = self._kpis()
+        costes = data["costes"]
+        assert costes["total"] == pytest.approx(costes["tratamientos"] + costes["riegos"] + costes["tareas"])
+        fincas = data["fincas"]
+        assert fincas["propias"] + fincas["alquiladas"] == fincas["total"]
+        assert sum(p["count"] for p in fincas["por_provincia"].values()) == fincas["total"]
+        totales = data["totales"]
+        assert totales["contratos_venta"] + totales["contratos_compra"] == totales["contratos"]
+        assert 0 <= fincas["parcelas_sin_asignar"] <= totales["parcelas"]
+        stats = data["contratos_stats"]
+        assert stats["compra"]["count"] + stats["venta"]["count"] <= stats["total_activos"]
+        assert sum(c["count"] for c in stats["por_cultivo"].values()) == stats["total_activos"]
+
+    def test_totals_are_exact(self):
+        """Counts match the collection totals reported by the list endpoints"""
+        data = self._kpis()
+        parcelas = self.session.get(f"{BASE_URL}/api/parcelas", params={"limit": 100000})
+        assert parcelas.status_code == 200
+        body = parcelas.json()
+        total = body.get("total", len(body.get("parcelas", [])))
+        assert data["totales"]["parcelas"] == total
+        por_cultivo = data["produccion"]["por_cultivo"]
+        assert sum(c["parcelas"] for c in por_cultivo.values()) == data["totales"]["parcelas"]
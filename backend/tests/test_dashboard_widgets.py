@@ -0,0 +1,82 @@
+"""
+Test Dashboard Widgets - Widget-scoped dashboard data
+Tests for:
+- GET /api/dashboard/widgets - Only visible widgets from dashboard_config
+- GET /api/dashboard/widgets?widgets=a,b - Explicit widget selection
+- GET /api/dashboard/widgets/{widget_id} - Single widget
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestDashboardWidgets:
+    """Tests for the per-widget dashboard endpoints"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+        yield
+        self.session.post(f"{BASE_URL}/api/dashboard/config/reset")
+
+    def test_explicit_widgets(self):
+        """Only the requested widgets' sections are returned"""
+        response = self.session.get(f"{BASE_URL}/api/dashboard/widgets",
+                                    params={"widgets": "tratamientos_pendientes,proximas_visitas"})
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        data = response.json()
+        assert set(data["widgets"]) == {"tratamientos_pendientes", "proximas_visitas"}
+        for widget in data["widgets"].values():
+            assert widget["status"] == "ok"
+            assert "ms" in widget
+        assert "tratamientos_pendientes" in data["data"]
+        assert "visitas_stats" in data["data"]
+        assert "fincas" not in data["data"], "Hidden widget sections should not be computed"
+        assert "proximas_cosechas" not in data["data"]
+
+    def test_honors_saved_config(self):
+        """Without widgets=, hidden widgets in dashboard_config are skipped"""
+        self.session.post(f"{BASE_URL}/api/dashboard/config", json={
+            "widgets": [
+                {"widget_id": "kpis_principales", "visible": True, "order": 0},
+                {"widget_id": "resumen_fincas", "visible": False, "order": 1},
+                {"widget_id": "proximas_cosechas", "visible": False, "order": 2},
+                {"widget_id": "actividad_reciente", "visible": False, "order": 3},
+            ],
+            "layout": "default"
+        })
+        response = self.session.get(f"{BASE_URL}/api/dashboard/widgets")
+        assert response.status_code == 200
+        data = response.json()
+        assert "kpis_principales" in data["widgets"]
+        for hidden in ("resumen_fincas", "proximas_cosechas", "actividad_reciente"):
+            assert hidden not in data["widgets"], f"{hidden} is hidden and should not be computed"
+        assert "totales" in data["data"]
+        assert "fincas" not in data["data"]
+
+    def test_single_widget_matches_kpis(self):
+        """A single widget returns the same values as the full /kpis payload"""
+        response = self.session.get(f"{BASE_URL}/api/dashboard/widgets/resumen_fincas")
+        assert response.status_code == 200
+        widget = response.json()
+        assert widget["status"] == "ok"
+        kpis = self.session.get(f"{BASE_URL}/api/dashboard/kpis").json()
+        assert widget["data"]["fincas"]["total"] == kpis["fincas"]["total"]
+
+    def test_unknown_widget(self):
+        """Unknown widget ids are rejected"""
+        response = self.session.get(f"{BASE_URL}/api/dashboard/widgets", params={"widgets": "no_existe"})
+        assert response.status_code == 400
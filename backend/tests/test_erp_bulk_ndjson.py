@@ -0,0 +1,94 @@
+"""
+Unit tests for the NDJSON reader behind the ERP bulk endpoints (services/erp_bulk.py)
+Tests for:
+- iter_ndjson: line numbers, blank lines, chunks split mid-line
+- Oversized line reported as an error without stopping the stream
+- Final line without a trailing newline
+- Invalid UTF-8 and non-object lines reported per line
+- _procesar_bulk: lines past ERP_BULK_MAX_LINES get a 413 and the summary says truncado
+No server or database needed.
+"""
+
+import asyncio
+import json
+
+import routes_erp_integration
+from services import erp_bulk
+from services.erp_bulk import NdjsonLineError, iter_ndjson
+
+
+async def _chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def _read(data, size=7):
+    async def collect():
+        return [item async for item in iter_ndjson(_chunks(data, size))]
+    return asyncio.run(collect())
+
+
+class TestIterNdjson:
+    """iter_ndjson over a fake async chunk iterator"""
+
+    def test_lines_split_across_chunks(self):
+        data = b'{"a": 1}\n\n{"b": "\xc3\xb1"}\n'
+        for size in (1, 3, 64):
+            assert _read(data, size) == [(1, {"a": 1}), (3, {"b": "ñ"})]
+
+    def test_final_line_without_newline(self):
+        assert _read(b'{"a": 1}\n{"a": 2}') == [(1, {"a": 1}), (2, {"a": 2})]
+
+    def test_oversized_line_is_reported_and_skipped(self, monkeypatch):
+        monkeypatch.setattr(erp_bulk, "ERP_BULK_MAX_LINE_BYTES", 16)
+        data = b'{"a": 1}\n' + b'{"big": "' + b"x" * 100 + b'"}\n' + b'{"a": 3}\n'
+        result = _read(data, 5)
+        assert result[0] == (1, {"a": 1})
+        assert result[1][0] == 2 and isinstance(result[1][1], NdjsonLineError)
+        assert result[2] == (3, {"a": 3})
+
+    def test_oversized_final_line_without_newline(self, monkeypatch):
+        monkeypatch.setattr(erp_bulk, "ERP_BULK_MAX_LINE_BYTES", 16)
+        result = _read(b'{"a": 1}\n' + b"x" * 100, 5)
+        assert result[0] == (1, {"a": 1})
+        assert result[1][0] == 2 and isinstance(result[1][1], NdjsonLineError)
+
+    def test_invalid_utf8_is_a_line_error(self):
+        result = _read(b'{"a": "\xff\xfe"}\n{"a": 2}\n')
+        assert result[0][0] == 1 and isinstance(result[0][1], NdjsonLineError)
+        assert result[1] == (2, {"a": 2})
+
+    def test_non_object_and_bad_json_lines(self):
+        result = _read(b'[1, 2]\n{not json\n"text"\n')
+        assert [line for line, _ in result] == [1, 2, 3]
+        assert all(isinstance(obj, NdjsonLineError) for _, obj in result)
+
+
+class _FakeRequest:
+    def __init__(self, data):
+        self._data = data
+
+    def stream(self):
+        return _chunks(self._data, 5)
+
+
+class TestProcesarBulkLimits:
+    """_procesar_bulk stops at ERP_BULK_MAX_LINES"""
+
+    def test_lines_over_limit_get_413(self, monkeypatch):
+        monkeypatch.setattr(routes_erp_integration, "ERP_BULK_MAX_LINES", 2)
+        procesados = []
+
+        async def procesar(lote, modo, auth):
+            procesados.extend(item.codigo for _, item in lote)
+            return [{"line": line, "codigo": item.codigo, "status": "created"} for line, item in lote]
+
+        data = "".join(json.dumps({"codigo": f"C{i}", "nombre": f"Cultivo {i}"}) + "\n" for i in range(4))
+        response = asyncio.run(routes_erp_integration._procesar_bulk(
+            _FakeRequest(data.encode()), routes_erp_integration.CultivoERP, "codigo", "upsert", {}, procesar,
+        ))
+        lines = [json.loads(line) for line in response.body.decode().splitlines()]
+        assert procesados == ["C0", "C1"]
+        assert lines[2]["line"] == 3 and lines[2]["status_code"] == 413
+        assert lines[-1]["resumen"] == {"lineas": 2, "creados": 2, "actualizados": 0,
+                                        "errores": 1, "truncado": True}
@@ -5,11 +5,13 @@ Tests for:
 - ERP Webhooks management (CRUD, toggle, test)
 - ERP Export functionality (modules, data export)
 - ERP Sync History and Stats
+- ERP NDJSON bulk upserts
 - SIGPAC Consulta (parcel search)
 - SIGPAC Import (import parcel to system)
 - SIGPAC Reference data (provincias, usos)
 """
 
+import json
 import pytest
 import requests
 import os
@@ -20,6 +22,7 @@ BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 # Test credentials
 TEST_EMAIL = os.environ.get("TEST_EMAIL", "")
 TEST_PASSWORD = os.environ.get("TEST_PASSWORD", "")
+ERP_API_KEY = os.environ.get("ERP_API_KEY", "fruveco-erp-key-2026")
 
 
 @pytest.fixture(scope="module")
@@ -130,7 +133,7 @@ class TestERPWebhooks:
             "url": "https://example.com/webhook/test",
             "nombre": "TEST_Webhook",
             "eventos": ["create", "update"],
-            "modulos": ["contratos", "parcelas"],
+            "modulos": ["contratos", "fincas"],
             "activo": True
         }
         response = requests.post(f"{BASE_URL}/api/erp/sync/webhooks", json=payload, headers=auth_headers)
@@ -142,6 +145,17 @@ class TestERPWebhooks:
         TestERPWebhooks.created_webhook_id = data["data"]["id"]
         print(f"Created webhook: {data['data']['id']} - {data['data']['nombre']}")
     
+    def test_create_webhook_rejects_module_without_events(self, auth_headers):
+        """Only modules that emit webhook events can be subscribed"""
+        response = requests.post(f"{BASE_URL}/api/erp/sync/webhooks", json={
+            "url": "https://example.com/webhook/test",
+            "nombre": "TEST_Webhook_Invalid",
+            "eventos": ["create"],
+            "modulos": ["contratos", "parcelas"],
+        }, headers=auth_headers)
+        assert response.status_code == 422
+        assert "parcelas" in response.json()["detail"]
+    
     def test_toggle_webhook(self, auth_headers):
         """POST /api/erp/sync/webhooks/{id}/toggle toggles active state"""
         if not TestERPWebhooks.created_webhook_id:
@@ -171,6 +185,166 @@ class TestERPWebhooks:
         print(f"Deleted webhook: {TestERPWebhooks.created_webhook_id}")
 
 
+class TestERPWebhookOutbox:
+    """Webhook events are queued in the outbox; the write path never waits for the ERP"""
+    
+    def test_write_enqueues_delivery(self, auth_headers):
+        """POST /api/fincas queues one delivery per subscribed webhook"""
+        wh = requests.post(f"{BASE_URL}/api/erp/sync/webhooks", json={
+            "url": "https://erp.invalid/webhook",
+            "nombre": "TEST_Outbox",
+            "eventos": ["create"],
+            "modulos": ["fincas"],
+            "max_batch": 10,
+        }, headers=auth_headers)
+        assert wh.status_code == 200
+        webhook_id = wh.json()["data"]["id"]
+        finca_id = None
+        try:
+            start = datetime.now()
+            resp = requests.post(f"{BASE_URL}/api/fincas", json={
+                "denominacion": f"TEST_Outbox {os.urandom(4).hex()}",
+            }, headers=auth_headers)
+            elapsed = (datetime.now() - start).total_seconds()
+            assert resp.status_code == 200
+            finca_id = resp.json()["data"].get("_id")
+            assert elapsed < 5, f"Finca create took {elapsed:.1f}s"
+            
+            outbox = requests.get(f"{BASE_URL}/api/erp/sync/outbox",
+                                  params={"webhook_id": webhook_id}, headers=auth_headers)
+            assert outbox.status_code == 200
+            items = outbox.json()["data"]
+            assert len(items) == 1
+            assert items[0]["event"] == "create" and items[0]["module"] == "fincas"
+            assert items[0]["status"] in ("pending", "sending", "dead")
+            
+            stats = requests.get(f"{BASE_URL}/api/erp/sync/outbox/stats", headers=auth_headers)
+            assert stats.status_code == 200
+            assert "by_status" in stats.json()["data"]
+        finally:
+            if finca_id:
+                requests.delete(f"{BASE_URL}/api/fincas/{finca_id}", headers=auth_headers)
+            requests.delete(f"{BASE_URL}/api/erp/sync/webhooks/{webhook_id}", headers=auth_headers)
+    
+    def test_outbox_requires_valid_webhook_id(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/erp/sync/outbox",
+                                params={"webhook_id": "nope"}, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestERPBulk:
+    """NDJSON bulk upserts for the ERP integration API: one result line per input line"""
+    
+    def test_cultivos_bulk_per_line_results(self, auth_headers):
+        """POST /api/erp/cultivos/bulk creates, updates and reports bad lines without failing the batch"""
+        codigo = f"TEST_BULK_{os.urandom(3).hex()}"
+        body = "\n".join([
+            json.dumps({"codigo": codigo, "nombre": "TEST Bulk"}),
+            "{not json",
+            json.dumps({"codigo": f"{codigo}_X"}),
+            json.dumps({"codigo": codigo, "nombre": "TEST Bulk 2"}),
+        ]) + "\n"
+        response = requests.post(f"{BASE_URL}/api/erp/cultivos/bulk", data=body.encode(), headers={
+            "X-API-Key": ERP_API_KEY,
+            "Content-Type": "application/x-ndjson",
+        })
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        try:
+            assert [r["line"] for r in lines[:-1]] == [1, 2, 3, 4]
+            assert lines[0]["status"] == "created" and lines[0]["codigo"] == codigo
+            assert lines[1]["status_code"] == 400
+            assert lines[2]["status_code"] == 422
+            assert lines[3]["status"] == "updated" and lines[3]["id"] == lines[0]["id"]
+            assert lines[-1]["resumen"] == {"lineas": 4, "creados": 1, "actualizados": 1,
+                                            "errores": 2, "truncado": False}
+        finally:
+            if lines[0].get("id"):
+                requests.delete(f"{BASE_URL}/api/cultivos/{lines[0]['id']}", headers=auth_headers)
+    
+    def _bulk(self, entidad, lines, **params):
+        body = "".join(json.dumps(line) + "\n" for line in lines)
+        response = requests.post(f"{BASE_URL}/api/erp/{entidad}/bulk", params=params, data=body.encode(), headers={
+            "X-API-Key": ERP_API_KEY,
+            "Content-Type": "application/x-ndjson",
+        })
+        assert response.status_code == 200, response.text
+        return [json.loads(line) for line in response.text.splitlines()]
+    
+    def test_parcelas_bulk_creates_proveedor_once(self, auth_headers):
+        """A new proveedor CIF repeated across lines is created a single time"""
+        tag = os.urandom(3).hex()
+        cif = f"TESTB{tag}".upper()
+        lines = self._bulk("parcelas", [
+            {"referencia_erp": f"TEST_BULK_PAR_{tag}_{i}", "nombre": f"TEST Bulk {i}",
+             "cultivo_nombre": "TEST Bulk", "campana": "2025/26", "superficie": 1.0,
+             "proveedor_cif": cif, "proveedor_nombre": f"TEST Bulk Proveedor {tag}"}
+            for i in range(3)
+        ])
+        ids = [r["id"] for r in lines[:-1] if r.get("id")]
+        proveedor_ids = set()
+        try:
+            assert [r["status"] for r in lines[:-1]] == ["created"] * 3
+            for r in lines[:-1]:
+                parcela = requests.get(f"{BASE_URL}/api/erp/parcelas/{r['referencia_erp']}",
+                                       headers={"X-API-Key": ERP_API_KEY}).json()["data"]
+                proveedor_ids.add(parcela["proveedor_id"])
+            assert len(proveedor_ids) == 1 and None not in proveedor_ids
+            
+            proveedores = requests.get(f"{BASE_URL}/api/proveedores", headers=auth_headers).json()["proveedores"]
+            assert sum(1 for p in proveedores if p.get("cif_nif") == cif) == 1
+        finally:
+            for parcela_id in ids:
+                requests.delete(f"{BASE_URL}/api/parcelas/{parcela_id}", headers=auth_headers)
+            for proveedor_id in proveedor_ids - {None}:
+                requests.delete(f"{BASE_URL}/api/proveedores/{proveedor_id}", headers=auth_headers)
+    
+    def test_contratos_bulk_consecutive_numbers(self, auth_headers):
+        """Contracts created in one batch get consecutive numero_contrato values"""
+        tag = os.urandom(3).hex()
+        lines = self._bulk("contratos", [
+            {"referencia_erp": f"TEST_BULK_CON_{tag}_{i}", "campana": "2025/26",
+             "fecha_contrato": "2026-01-15", "periodo_desde": "2026-02-01", "periodo_hasta": "2026-06-30",
+             "cultivo_nombre": "TEST Bulk", "proveedor_nombre": "TEST Bulk Proveedor"}
+            for i in range(3)
+        ])
+        ids = [r["id"] for r in lines[:-1] if r.get("id")]
+        try:
+            assert [r["status"] for r in lines[:-1]] == ["created"] * 3
+            numeros = [r["numero_contrato"] for r in lines[:-1]]
+            prefijos = {n.rsplit("-", 1)[0] for n in numeros}
+            assert len(prefijos) == 1
+            secuencia = [int(n.rsplit("-", 1)[1]) for n in numeros]
+            assert secuencia == list(range(secuencia[0], secuencia[0] + 3))
+        finally:
+            for contrato_id in ids:
+                requests.delete(f"{BASE_URL}/api/contratos/{contrato_id}", headers=auth_headers)
+    
+    def test_proveedores_bulk_duplicate_cif_conflict(self, auth_headers):
+        """Two new proveedores with the same CIF: the first is created, the second gets 409"""
+        tag = os.urandom(3).hex()
+        cif = f"TESTC{tag}".upper()
+        lines = self._bulk("proveedores", [
+            {"referencia_erp": f"TEST_BULK_PROV_{tag}_{i}", "nombre": f"TEST Bulk {i}", "cif_nif": cif}
+            for i in range(2)
+        ], modo="create")
+        try:
+            assert lines[0]["status"] == "created"
+            assert lines[1]["status"] == "error" and lines[1]["status_code"] == 409
+        finally:
+            if lines[0].get("id"):
+                requests.delete(f"{BASE_URL}/api/proveedores/{lines[0]['id']}", headers=auth_headers)
+    
+    def test_bulk_rejects_unknown_modo(self):
+        response = requests.post(f"{BASE_URL}/api/erp/cultivos/bulk", params={"modo": "merge"},
+                                 data=b"", headers={"X-API-Key": ERP_API_KEY})
+        assert response.status_code == 400
+    
+    def test_bulk_requires_api_key(self):
+        response = requests.post(f"{BASE_URL}/api/erp/cultivos/bulk", data=b"{}\n")
+        assert response.status_code in [401, 422]
+
+
 # ==================== ERP EXPORT TESTS ====================
 
 class TestERPExport:
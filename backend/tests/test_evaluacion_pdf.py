@@ -89,6 +89,48 @@ class TestEvaluacionPDFGeneration:
         # PDF should start with %PDF
         assert pdf_content[:4] == b'%PDF', "Response is not a valid PDF file"
 
+    def _touch_evaluacion(self, headers):
+        """Same estado, new updated_at: the next PDF download misses the PDF cache"""
+        evaluacion = requests.get(f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}", headers=headers).json()
+        response = requests.patch(
+            f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}/estado",
+            params={"estado": evaluacion.get("estado") or "borrador"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+    def test_regenerated_pdf_reuses_cached_map(self, headers):
+        """Re-rendering the PDF of the same parcela reuses the cached map: no new render, no tiles"""
+        self._touch_evaluacion(headers)
+        first = requests.get(f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}/pdf", headers=headers)
+        assert first.status_code == 200
+        assert first.headers.get("X-PDF-Cache") == "miss"
+        # The test parcela has a geometry: its map is rendered now or was already cached
+        assert first.headers.get("X-Map-Cache") in ("hit", "miss")
+
+        self._touch_evaluacion(headers)
+        second = requests.get(f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}/pdf", headers=headers)
+        assert second.status_code == 200
+        assert second.headers.get("X-PDF-Cache") == "miss"
+        # The map comes from the render cache, so no tile is fetched either
+        assert second.headers.get("X-Map-Cache") == "hit"
+
+    def test_repeat_download_is_served_from_pdf_cache(self, headers):
+        """Downloading the same unchanged evaluación twice returns the cached PDF"""
+        first = requests.get(f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}/pdf", headers=headers)
+        assert first.status_code == 200
+        if first.headers.get("X-Map-Cache") == "failed":
+            # Satellite render failed (SVG fallback): that PDF is never cached
+            assert first.headers.get("X-PDF-Cache") == "bypass"
+            pytest.skip("Satellite map unavailable; PDF not cacheable")
+        second = requests.get(f"{BASE_URL}/api/evaluaciones/{TEST_EVALUACION_ID}/pdf", headers=headers)
+        assert second.status_code == 200
+        assert second.headers.get("X-PDF-Cache") == "hit"
+        assert second.content == first.content
+
+        stats = requests.get(f"{BASE_URL}/api/system/pdf-cache", headers=headers).json()
+        assert stats["by_kind"]["evaluacion"]["entries"] >= 1
+
 
 class TestVisitasInPDF:
     """Tests for visitas data in the PDF"""
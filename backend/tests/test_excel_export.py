@@ -0,0 +1,85 @@
+"""
+Test Excel Export - Shared streaming exporter behind the /export/excel routes
+Tests for:
+- Exports download as xlsx files that openpyxl can open
+- Exports include every record (no hidden 1000/5000 row cap)
+- Export styling: bold header row and number formats on the totals row
+"""
+import io
+import pytest
+import requests
+import os
+from openpyxl import load_workbook
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class TestExcelExport:
+    """Tests for the streaming Excel exports"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _download(self, path, params=None):
+        response = self.session.get(f"{BASE_URL}{path}", params=params or {})
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"].startswith(XLSX_MEDIA_TYPE)
+        assert "attachment; filename=" in response.headers.get("content-disposition", "")
+        return load_workbook(io.BytesIO(response.content))
+
+    def _total(self, path):
+        response = self.session.get(f"{BASE_URL}{path}", params={"limit": 1, "count": "exact"})
+        assert response.status_code == 200, response.text
+        return response.json()["total"]
+
+    def test_parcelas_export_has_every_row(self):
+        """The parcelas export has one row per parcela, with no row cap"""
+        ws = self._download("/api/parcelas/export/excel").active
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0] == "Codigo"
+        assert len(rows) - 1 == self._total("/api/parcelas")
+        assert ws["A1"].font.bold
+
+    def test_proveedores_export_has_every_row(self):
+        """The proveedores export has one row per proveedor"""
+        ws = self._download("/api/proveedores/export/excel").active
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0] == "Nombre"
+        assert len(rows) - 1 == self._total("/api/proveedores")
+
+    @pytest.mark.parametrize("path", [
+        "/api/clientes/export/excel",
+        "/api/maquinaria/export/excel",
+        "/api/tratamientos/export/excel",
+        "/api/visitas/export/excel",
+        "/api/irrigaciones/export/excel",
+        "/api/evaluaciones/export/excel",
+        "/api/recetas/export/excel",
+        "/api/gastos/export/excel",
+    ])
+    def test_export_opens(self, path):
+        """Every converted export returns a workbook with a header row"""
+        wb = self._download(path)
+        ws = wb.worksheets[0]
+        assert ws.max_row >= 1
+
+    def test_comisiones_export_totals(self):
+        """The comisiones export ends with the general total row"""
+        ws = self._download("/api/comisiones-generadas/excel").active
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0] == "LISTADO DE COMISIONES"
+        assert rows[-1][4] == "TOTAL GENERAL:"
+        assert ws.cell(row=ws.max_row, column=8).number_format == '#,##0.00 €'
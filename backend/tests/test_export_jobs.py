@@ -0,0 +1,106 @@
+"""
+Test Export Jobs - Asynchronous exports with persisted results
+Tests for:
+- POST /api/exports/jobs - Queue an export job (returns job_id, 202)
+- GET /api/exports/jobs/{job_id} - Poll status/progress
+- GET /api/exports/jobs/{job_id}/download - Download the result (repeatable)
+- GET /api/exports/jobs - List own jobs
+- DELETE /api/exports/jobs/{job_id} - Delete job and stored file
+"""
+import time
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestExportJobs:
+    """Tests for the export jobs API"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _wait_for_job(self, job_id, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = self.session.get(f"{BASE_URL}/api/exports/jobs/{job_id}")
+            assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+            job = response.json()
+            if job["status"] in ("completed", "failed", "cancelled"):
+                return job
+            time.sleep(1)
+        pytest.fail(f"Export job {job_id} did not finish in {timeout}s")
+
+    def test_create_job_invalid_modules(self):
+        """POST /api/exports/jobs with unknown modules returns 400"""
+        response = self.session.post(f"{BASE_URL}/api/exports/jobs", json={
+            "modules": ["no_existe"],
+            "format": "excel"
+        })
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+
+    def test_excel_job_lifecycle(self):
+        """Queue an Excel job, poll until completed and download it twice"""
+        response = self.session.post(f"{BASE_URL}/api/exports/jobs", json={
+            "modules": ["contratos", "parcelas"],
+            "format": "excel"
+        })
+        assert response.status_code == 202, f"Expected 202, got {response.status_code}: {response.text}"
+        job = response.json()
+        assert job.get("job_id"), "Response should contain job_id"
+        assert job["status"] == "pending"
+        assert job["params"]["modules"] == ["contratos", "parcelas"]
+
+        job = self._wait_for_job(job["job_id"])
+        assert job["status"] == "completed", f"Job should complete, got {job}"
+        assert job["download_ready"] is True
+        assert job["progress"]["percent"] == 100.0
+
+        for _ in range(2):
+            download = self.session.get(f"{BASE_URL}/api/exports/jobs/{job['job_id']}/download")
+            assert download.status_code == 200, f"Expected 200, got {download.status_code}"
+            assert download.content[:2] == b'PK', "Excel file should start with PK magic bytes"
+            assert ".xlsx" in download.headers.get("Content-Disposition", "")
+
+        listing = self.session.get(f"{BASE_URL}/api/exports/jobs")
+        assert listing.status_code == 200
+        assert job["job_id"] in [j["job_id"] for j in listing.json()["jobs"]]
+
+        deleted = self.session.delete(f"{BASE_URL}/api/exports/jobs/{job['job_id']}")
+        assert deleted.status_code == 200
+        missing = self.session.get(f"{BASE_URL}/api/exports/jobs/{job['job_id']}")
+        assert missing.status_code == 404
+
+    def test_pdf_job_single_module(self):
+        """Any MODULES_CONFIG module can be exported as a single-module PDF job"""
+        response = self.session.post(f"{BASE_URL}/api/exports/jobs", json={
+            "modules": ["maquinaria"],
+            "format": "pdf"
+        })
+        assert response.status_code == 202, f"Expected 202, got {response.status_code}: {response.text}"
+        job = self._wait_for_job(response.json()["job_id"])
+        assert job["status"] == "completed", f"Job should complete, got {job}"
+        assert job["result"]["media_type"] == "application/pdf"
+
+        download = self.session.get(f"{BASE_URL}/api/exports/jobs/{job['job_id']}/download")
+        assert download.status_code == 200
+        assert download.content[:4] == b'%PDF', "PDF file should start with %PDF"
+
+    def test_job_not_found(self):
+        """Unknown job ids return 404"""
+        response = self.session.get(f"{BASE_URL}/api/exports/jobs/000000000000000000000000")
+        assert response.status_code == 404
@@ -0,0 +1,75 @@
+"""
+Test Gastos Resumen - $match + $facet aggregation for expense reports
+Tests for:
+- GET /api/gastos/resumen - Totals are exact (no 1000-albaran truncation)
+- GET /api/gastos/por-proveedor|por-contrato|por-cultivo|por-parcela - Shapes unchanged
+- Grouped views add up to the same totals as /resumen
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestGastosResumen:
+    """Tests for the aggregated expense reports"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _get(self, path, **params):
+        response = self.session.get(f"{BASE_URL}/api/gastos/{path}", params=params)
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        return response.json()
+
+    def test_resumen_is_exact(self):
+        """total_albaranes and total_general match /detalle-albaranes"""
+        resumen = self._get("resumen")
+        detalle = self._get("detalle-albaranes", limit=1)
+        assert resumen["total_albaranes"] == detalle["total_count"]
+        assert resumen["total_general"] == pytest.approx(detalle["total_sum"] or 0)
+        for key in ("por_proveedor", "por_cultivo", "por_parcela"):
+            assert sum(g["count"] for g in resumen[key]) == resumen["total_albaranes"], f"{key} does not add up"
+
+    def test_resumen_sorted_by_total(self):
+        """Every grouping is sorted by total descending"""
+        resumen = self._get("resumen")
+        for key in ("por_proveedor", "por_contrato", "por_cultivo", "por_parcela"):
+            totals = [g["total"] for g in resumen[key]]
+            assert totals == sorted(totals, reverse=True), f"{key} is not sorted by total"
+
+    def test_grouped_endpoints_match_resumen(self):
+        """The por-* endpoints agree with the /resumen breakdown"""
+        resumen = self._get("resumen")
+        proveedores = self._get("por-proveedor")["gastos_por_proveedor"]
+        assert sum(p["count"] for p in proveedores) == resumen["total_albaranes"]
+        for p in proveedores:
+            for key in ("proveedor", "total", "count", "cultivos", "num_contratos", "primer_albaran", "ultimo_albaran"):
+                assert key in p, f"Missing gastos_por_proveedor.{key}"
+
+        cultivos = self._get("por-cultivo")["gastos_por_cultivo"]
+        assert {c["cultivo"]: c["count"] for c in cultivos} == {c["cultivo"]: c["count"] for c in resumen["por_cultivo"]}
+
+        parcelas = self._get("por-parcela")["gastos_por_parcela"]
+        assert sum(p["count"] for p in parcelas) == resumen["total_albaranes"]
+        for p in parcelas:
+            assert "coste_por_ha" in p
+
+        contratos = self._get("por-contrato")["gastos_por_contrato"]
+        con_contrato = {c["contrato_id"]: c for c in contratos if c["contrato_id"]}
+        for c in resumen["por_contrato"]:
+            assert con_contrato[c["contrato_id"]]["count"] == c["count"]
+            assert con_contrato[c["contrato_id"]].get("numero_contrato") == c["numero_contrato"]
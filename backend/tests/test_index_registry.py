@@ -0,0 +1,65 @@
+"""
+Test Index Registry - Declarative MongoDB indexes created at startup
+Tests for:
+- GET /api/system/indexes - Last drift report (Admin only)
+- POST /api/system/indexes/ensure - Idempotent re-run of the registry
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+HOT_INDEXES = [
+    ("tratamientos", "idx_parcelas_ids_1_fecha_tratamiento_1"),
+    ("visitas", "idx_parcela_id_1_numero_visita_1_fecha_visita_1"),
+    ("fichajes", "idx_empleado_id_1_fecha_-1"),
+    ("albaranes", "idx_contrato_id_1"),
+    ("comisiones_generadas", "idx_albaran_id_1"),
+    ("notificaciones", "idx__dedup_key_1"),
+    ("alertas_clima", "idx_parcela_id_1_regla_id_1_created_at_-1"),
+    ("fitosanitarios_usos", "idx_fitosanitario_id_1_cultivo_1_plaga_1"),
+]
+
+
+class TestIndexRegistry:
+    """Tests for the index registry endpoints"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def test_ensure_is_idempotent(self):
+        """Running the registry twice creates nothing the second time"""
+        first = self.session.post(f"{BASE_URL}/api/system/indexes/ensure")
+        assert first.status_code == 200, f"Expected 200, got {first.status_code}: {first.text}"
+        second = self.session.post(f"{BASE_URL}/api/system/indexes/ensure")
+        assert second.status_code == 200
+        report = second.json()
+        assert report["created"] == [], f"Second run should not create indexes: {report['created']}"
+        for key in ("ok", "errors", "mismatched", "unexpected", "checked_at"):
+            assert key in report, f"Missing '{key}' in drift report"
+
+    def test_hot_indexes_present(self):
+        """Every hot query pattern has its index in place"""
+        self.session.post(f"{BASE_URL}/api/system/indexes/ensure")
+        report = self.session.get(f"{BASE_URL}/api/system/indexes").json()
+        present = {(e["collection"], e["index"]) for e in report["ok"] + report["created"]}
+        for expected in HOT_INDEXES:
+            assert expected in present, f"Index {expected} should exist"
+
+    def test_indexes_requires_auth(self):
+        """GET /api/system/indexes without token is rejected"""
+        response = requests.get(f"{BASE_URL}/api/system/indexes")
+        assert response.status_code in (401, 403)
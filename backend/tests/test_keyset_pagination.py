@@ -0,0 +1,92 @@
+"""
+Test Keyset Pagination - Opaque cursors on list endpoints
+Tests for:
+- Walking /api/parcelas, /api/albaranes and /api/clientes with next_cursor returns every record once
+- skip/limit keep working and the first page still returns the exact total
+- A cursor reused with different filters is rejected with 400
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestKeysetPagination:
+    """Tests for cursor based pagination"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _walk(self, path, key, page_size=5):
+        params = {"limit": page_size}
+        first = self.session.get(f"{BASE_URL}{path}", params=params)
+        assert first.status_code == 200, first.text
+        data = first.json()
+        total = data["total"]
+        ids = [d["_id"] for d in data[key]]
+        cursor = data.get("next_cursor")
+        while cursor:
+            page = self.session.get(f"{BASE_URL}{path}", params={**params, "cursor": cursor})
+            assert page.status_code == 200, page.text
+            page_data = page.json()
+            assert page_data["total"] is None, "Cursor pages should not count by default"
+            ids.extend(d["_id"] for d in page_data[key])
+            cursor = page_data.get("next_cursor")
+        return total, ids
+
+    @pytest.mark.parametrize("path,key", [
+        ("/api/parcelas", "parcelas"),
+        ("/api/albaranes", "albaranes"),
+        ("/api/clientes", "clientes"),
+    ])
+    def test_cursor_walk_returns_every_record_once(self, path, key):
+        """Following next_cursor visits every document exactly once"""
+        total, ids = self._walk(path, key)
+        assert len(ids) == len(set(ids)), "Duplicated records across pages"
+        assert len(ids) == total
+
+    def test_skip_limit_still_supported(self):
+        """Legacy skip/limit keeps returning the exact total"""
+        response = self.session.get(f"{BASE_URL}/api/contratos", params={"skip": 0, "limit": 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data["total"], int)
+        assert len(data["contratos"]) <= 2
+        assert "next_cursor" in data
+
+    def test_estimated_count(self):
+        """count=estimated returns a number on cursor pages too"""
+        first = self.session.get(f"{BASE_URL}/api/parcelas", params={"limit": 1}).json()
+        if not first.get("next_cursor"):
+            pytest.skip("Not enough parcelas to paginate")
+        page = self.session.get(f"{BASE_URL}/api/parcelas",
+                                params={"limit": 1, "cursor": first["next_cursor"], "count": "estimated"})
+        assert page.status_code == 200
+        assert isinstance(page.json()["total"], int)
+
+    def test_cursor_with_other_filters_is_rejected(self):
+        """A cursor is bound to the filters it was issued for"""
+        first = self.session.get(f"{BASE_URL}/api/albaranes", params={"limit": 1}).json()
+        if not first.get("next_cursor"):
+            pytest.skip("Not enough albaranes to paginate")
+        response = self.session.get(f"{BASE_URL}/api/albaranes",
+                                    params={"limit": 1, "cursor": first["next_cursor"], "tipo": "Albarán de venta"})
+        assert response.status_code == 400
+
+    def test_invalid_cursor(self):
+        """Garbage cursors return 400 instead of 500"""
+        response = self.session.get(f"{BASE_URL}/api/parcelas", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
@@ -0,0 +1,116 @@
+"""
+Test KPI Snapshots - Incrementally maintained dashboard counters
+Tests for:
+- GET /api/dashboard/kpis - Served from the kpi_snapshots document
+- Create/delete parcela updates the counters without a full rescan
+- POST /api/bulk-delete/parcelas decrements the counters too
+- POST /api/dashboard/kpis/reconcile - Full recalculation (Admin)
+- GET /api/dashboard/kpis/snapshot - Snapshot status
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestKpiSnapshots:
+    """Tests for the incremental KPI snapshot"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _kpis(self):
+        response = self.session.get(f"{BASE_URL}/api/dashboard/kpis")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        return response.json()
+
+    def test_reconcile_and_status(self):
+        """Reconcile rebuilds the snapshot and reports its timestamps"""
+        response = self.session.post(f"{BASE_URL}/api/dashboard/kpis/reconcile")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        data = response.json()
+        assert data["success"] is True
+        assert data["exists"] is True
+        assert data["reconciled_at"]
+
+        status = self.session.get(f"{BASE_URL}/api/dashboard/kpis/snapshot")
+        assert status.status_code == 200
+        assert status.json()["exists"] is True
+
+    def test_parcela_write_updates_counters(self):
+        """Creating and deleting a parcela moves totals and superficie incrementally"""
+        before = self._kpis()
+        created = self.session.post(f"{BASE_URL}/api/parcelas", json={
+            "proveedor": "TEST_KPI_SNAPSHOT",
+            "codigo_plantacion": "TEST-KPI-001",
+            "finca": "TEST",
+            "cultivo": "TEST_KPI_CULTIVO",
+            "variedad": "TEST",
+            "superficie_total": 2.5,
+            "num_plantas": 1,
+            "campana": "2026"
+        })
+        assert created.status_code == 200, f"Create failed: {created.text}"
+        parcela_id = created.json()["data"]["_id"]
+        try:
+            after = self._kpis()
+            assert after["totales"]["parcelas"] == before["totales"]["parcelas"] + 1
+            assert after["superficie"]["total_ha"] == pytest.approx(before["superficie"]["total_ha"] + 2.5)
+            assert after["produccion"]["por_cultivo"]["TEST_KPI_CULTIVO"]["parcelas"] == 1
+        finally:
+            deleted = self.session.delete(f"{BASE_URL}/api/parcelas/{parcela_id}")
+            assert deleted.status_code == 200
+
+        final = self._kpis()
+        assert final["totales"]["parcelas"] == before["totales"]["parcelas"]
+        assert "TEST_KPI_CULTIVO" not in final["produccion"]["por_cultivo"]
+
+    def test_bulk_delete_parcela_updates_counters(self):
+        """Bulk-deleting a parcela takes it out of totals and superficie"""
+        created = self.session.post(f"{BASE_URL}/api/parcelas", json={
+            "proveedor": "TEST_KPI_SNAPSHOT",
+            "codigo_plantacion": "TEST-KPI-BULK-001",
+            "finca": "TEST",
+            "cultivo": "TEST_KPI_BULK_CULTIVO",
+            "variedad": "TEST",
+            "superficie_total": 1.5,
+            "num_plantas": 1,
+            "campana": "2026"
+        })
+        assert created.status_code == 200, f"Create failed: {created.text}"
+        parcela_id = created.json()["data"]["_id"]
+        before = self._kpis()
+
+        deleted = self.session.post(f"{BASE_URL}/api/bulk-delete/parcelas", json={"ids": [parcela_id]})
+        if deleted.status_code == 403:
+            self.session.delete(f"{BASE_URL}/api/parcelas/{parcela_id}")
+            pytest.skip("Test user lacks can_bulk_delete")
+        assert deleted.status_code == 200, f"Bulk delete failed: {deleted.text}"
+        assert deleted.json()["deleted_count"] == 1
+
+        after = self._kpis()
+        assert after["totales"]["parcelas"] == before["totales"]["parcelas"] - 1
+        assert after["superficie"]["total_ha"] == pytest.approx(before["superficie"]["total_ha"] - 1.5)
+        assert "TEST_KPI_BULK_CULTIVO" not in after["produccion"]["por_cultivo"]
+
+    def test_snapshot_matches_reconcile(self):
+        """Incremental counters agree with a full recalculation"""
+        incremental = self._kpis()
+        self.session.post(f"{BASE_URL}/api/dashboard/kpis/reconcile")
+        full = self._kpis()
+        for key in ("contratos", "parcelas", "fincas", "tratamientos", "riegos", "cosechas"):
+            assert incremental["totales"][key] == full["totales"][key], f"Drift in totales.{key}"
+        assert incremental["costes"]["total"] == pytest.approx(full["costes"]["total"])
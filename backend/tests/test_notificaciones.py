@@ -385,7 +385,29 @@ class TestSchedulerAPI:
         
         assert data.get("success") == True
         assert "iniciada" in data.get("message", "").lower() or "background" in data.get("message", "").lower()
-    
+
+    def test_scheduler_status_leader_and_history(self):
+        """Test manual runs are recorded in the history shown by /scheduler/status"""
+        response = self.session.post(f"{BASE_URL}/api/notificaciones/scheduler/ejecutar")
+        assert response.status_code == 200
+        time.sleep(2)
+
+        response = self.session.get(f"{BASE_URL}/api/notificaciones/scheduler/status")
+        assert response.status_code == 200
+        data = response.json()
+
+        lider = data.get("lider", {})
+        assert "este_proceso" in lider
+        assert isinstance(lider.get("este_proceso_es_lider"), bool)
+        assert isinstance(data.get("jobs"), list)
+
+        manuales = [r for r in data.get("historial", []) if r.get("trigger") == "manual"]
+        assert manuales, "Manual run not recorded in scheduler history"
+        run = manuales[0]
+        assert run["job_id"] == "climate_check"
+        assert run["outcome"] in ("ok", "error")
+        assert isinstance(run["duration_ms"], (int, float))
+
     def test_email_disabled_without_api_key(self):
         """Test that email is disabled when RESEND_API_KEY is not set"""
         response = self.session.get(f"{BASE_URL}/api/notificaciones/scheduler/config")
@@ -0,0 +1,86 @@
+"""
+Test Principal Cache - Cached authenticated user in get_current_user
+Tests for:
+- Tokens carry the `ver` claim and /api/auth/me keeps working on repeated calls
+- Changing tipo-operacion / menu-permissions is visible to the user immediately
+- A deleted user is rejected right away
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestPrincipalCache:
+    """Tests for the principal cache invalidation"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    @pytest.fixture
+    def test_user(self):
+        """Create a throwaway user and return (user_id, session logged in as that user)"""
+        email = f"test_principal_{uuid.uuid4().hex[:8]}@example.com"
+        password = "Test1234!"
+        created = self.session.post(f"{BASE_URL}/api/auth/register", json={
+            "email": email, "password": password, "full_name": "TEST Principal", "role": "Viewer"
+        })
+        assert created.status_code == 200, f"Register failed: {created.text}"
+        user_id = created.json()["user"]["_id"]
+
+        user_session = requests.Session()
+        login = user_session.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": password})
+        assert login.status_code == 200, f"Login failed: {login.text}"
+        user_session.headers.update({"Authorization": f"Bearer {login.json()['access_token']}"})
+        yield user_id, user_session
+        self.session.delete(f"{BASE_URL}/api/auth/users/{user_id}")
+
+    def test_me_is_stable(self):
+        """Repeated /me calls return the same principal"""
+        first = self.session.get(f"{BASE_URL}/api/auth/me").json()
+        for _ in range(5):
+            assert self.session.get(f"{BASE_URL}/api/auth/me").json() == first
+
+    def test_tipo_operacion_change_is_immediate(self, test_user):
+        """/me reflects a tipo_operacion change without waiting for the TTL"""
+        user_id, user_session = test_user
+        assert user_session.get(f"{BASE_URL}/api/auth/me").json()["tipo_operacion"] == "ambos"
+
+        response = self.session.put(f"{BASE_URL}/api/auth/users/{user_id}/tipo-operacion",
+                                    json={"tipo_operacion": "compra"})
+        assert response.status_code == 200
+        assert user_session.get(f"{BASE_URL}/api/auth/me").json()["tipo_operacion"] == "compra"
+
+    def test_menu_permissions_change_is_immediate(self, test_user):
+        """/me reflects menu permission changes right away"""
+        user_id, user_session = test_user
+        user_session.get(f"{BASE_URL}/api/auth/me")
+
+        response = self.session.put(f"{BASE_URL}/api/auth/users/{user_id}/menu-permissions",
+                                    json={"menu_permissions": {"/parcelas": False}})
+        assert response.status_code == 200
+        me = user_session.get(f"{BASE_URL}/api/auth/me").json()
+        assert me["menu_permissions"]["/parcelas"] is False
+
+    def test_deleted_user_is_rejected(self, test_user):
+        """Deleting a user invalidates its cached principal"""
+        user_id, user_session = test_user
+        assert user_session.get(f"{BASE_URL}/api/auth/me").status_code == 200
+
+        deleted = self.session.delete(f"{BASE_URL}/api/auth/users/{user_id}")
+        assert deleted.status_code == 200
+        assert user_session.get(f"{BASE_URL}/api/auth/me").status_code == 401
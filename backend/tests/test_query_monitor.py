@@ -0,0 +1,107 @@
+"""
+Test Query Monitor - Per-request Mongo query counters
+Tests for:
+- X-DB-Queries / X-DB-Roundtrips / X-DB-Time-Ms headers (only with MONGO_QUERY_DEBUG_HEADERS=1)
+- Endpoints keep responding normally with the middleware installed
+- query_shape: literal values collapse to "?" and $in lists of any length share a shape
+- Requests over MONGO_QUERY_BUDGET are logged with their repeated shapes
+The query_shape and budget tests are unit tests and need no server.
+"""
+import pytest
+import requests
+import os
+
+from services import query_monitor
+from services.query_monitor import QueryMonitorListener, RequestQueryStats, query_shape
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestQueryMonitor:
+    """Tests for the Mongo command monitoring middleware"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def test_debug_headers(self):
+        """When debug headers are enabled they carry consistent counters"""
+        response = self.session.get(f"{BASE_URL}/api/contratos")
+        assert response.status_code == 200
+        if "X-DB-Queries" not in response.headers:
+            pytest.skip("MONGO_QUERY_DEBUG_HEADERS is not enabled on the server")
+        queries = int(response.headers["X-DB-Queries"])
+        roundtrips = int(response.headers["X-DB-Roundtrips"])
+        assert queries >= 1
+        assert roundtrips >= queries
+        assert float(response.headers["X-DB-Time-Ms"]) >= 0
+
+
+class TestQueryShape:
+    """query_shape normalizes commands so N+1 loops share one shape"""
+
+    def test_literals_collapse(self):
+        a = query_shape("find", {"find": "empleados", "filter": {"_id": "abc", "activo": True}})
+        b = query_shape("find", {"find": "empleados", "filter": {"_id": "xyz", "activo": False}})
+        assert a == b == 'find empleados {"_id": "?", "activo": "?"}'
+
+    def test_in_lists_of_different_lengths_share_a_shape(self):
+        short = query_shape("find", {"find": "parcelas", "filter": {"_id": {"$in": [1]}}})
+        long = query_shape("find", {"find": "parcelas", "filter": {"_id": {"$in": list(range(50))}}})
+        assert short == long == 'find parcelas {"_id": {"$in": ["?"]}}'
+
+    def test_different_fields_give_different_shapes(self):
+        a = query_shape("find", {"find": "empleados", "filter": {"_id": 1}})
+        b = query_shape("find", {"find": "empleados", "filter": {"dni_nie": 1}})
+        assert a != b
+
+
+class _Event:
+    def __init__(self, command_name, command):
+        self.command_name = command_name
+        self.command = command
+
+
+class TestQueryBudget:
+    """Requests over MONGO_QUERY_BUDGET are logged with their repeated shapes"""
+
+    def _stats(self, n):
+        stats = RequestQueryStats()
+        token = query_monitor._current_stats.set(stats)
+        try:
+            listener = QueryMonitorListener()
+            for i in range(n):
+                listener.started(_Event("find", {"find": "empleados", "filter": {"_id": i}}))
+            listener.started(_Event("getMore", {"getMore": 1}))
+        finally:
+            query_monitor._current_stats.reset(token)
+        return stats
+
+    def test_over_budget_is_logged(self, monkeypatch, capsys):
+        monkeypatch.setattr(query_monitor, "MONGO_QUERY_BUDGET", 3)
+        stats = self._stats(5)
+        assert stats.queries == 5 and stats.roundtrips == 6
+        query_monitor._report("GET", "/api/rrhh/fichajes", stats, 12.0)
+        out = capsys.readouterr().out
+        assert "[QueryMonitor] GET /api/rrhh/fichajes: 5 consultas (presupuesto 3)" in out
+        assert '5x find empleados {"_id": "?"}' in out
+
+    def test_within_budget_is_silent(self, monkeypatch, capsys):
+        monkeypatch.setattr(query_monitor, "MONGO_QUERY_BUDGET", 5)
+        query_monitor._report("GET", "/api/rrhh/fichajes", self._stats(5), 12.0)
+        assert capsys.readouterr().out == ""
+
+    def test_outside_a_request_nothing_is_recorded(self):
+        QueryMonitorListener().started(_Event("find", {"find": "empleados", "filter": {}}))
+        assert query_monitor.get_request_query_stats() is None
@@ -0,0 +1,83 @@
+"""
+Test Render Pool - PDF/Excel generation off the event loop
+Tests for:
+- GET /api/system/render-metrics - Queue depth / throughput of the shared render pool
+- Exports (Excel via openpyxl, PDF via ReportLab and WeasyPrint) go through the pool
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestRenderPool:
+    """Tests for the shared render worker pool"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup authentication for tests"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        login_response = self.session.post(f"{BASE_URL}/api/auth/login", json={
+            "email": os.environ.get("TEST_EMAIL", ""),
+            "password": os.environ.get("TEST_PASSWORD", "")
+        })
+        assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+        token = login_response.json().get("access_token")
+        assert token, "No access_token in login response"
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def _metrics(self):
+        response = self.session.get(f"{BASE_URL}/api/system/render-metrics")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        return response.json()
+
+    def test_render_metrics_requires_auth(self):
+        """GET /api/system/render-metrics without token is rejected"""
+        response = requests.get(f"{BASE_URL}/api/system/render-metrics")
+        assert response.status_code in (401, 403), f"Expected 401/403, got {response.status_code}"
+
+    def test_render_metrics_structure(self):
+        """GET /api/system/render-metrics returns pool configuration and counters"""
+        data = self._metrics()
+        for key in ("workers", "job_timeout_seconds", "max_queue", "queue_depth", "running",
+                    "submitted", "completed", "failed", "timeouts", "rejected", "by_kind"):
+            assert key in data, f"Missing '{key}' in render metrics"
+        assert data["workers"] >= 1
+        assert data["queue_depth"] >= 0
+        print(f"✓ Render pool: {data['workers']} workers, {data['completed']} jobs completed")
+
+    def test_excel_export_goes_through_pool(self):
+        """An Excel export increments the openpyxl counter of the render pool"""
+        before = self._metrics()["by_kind"].get("openpyxl", {}).get("completed", 0)
+        response = self.session.post(f"{BASE_URL}/api/exports/combined", json={
+            "modules": ["fincas"],
+            "format": "excel"
+        })
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        assert response.content[:2] == b'PK', "Excel file should start with PK magic bytes"
+        after = self._metrics()["by_kind"].get("openpyxl", {}).get("completed", 0)
+        assert after >= before + 1, f"openpyxl jobs should increase ({before} -> {after})"
+
+    def test_pdf_export_goes_through_pool(self):
+        """A ReportLab PDF export increments the reportlab counter of the render pool"""
+        before = self._metrics()["by_kind"].get("reportlab", {}).get("completed", 0)
+        response = self.session.post(f"{BASE_URL}/api/exports/combined", json={
+            "modules": ["fincas"],
+            "format": "pdf"
+        })
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        assert response.content[:4] == b'%PDF', "PDF file should start with %PDF"
+        after = self._metrics()["by_kind"].get("reportlab", {}).get("completed", 0)
+        assert after >= before + 1, f"reportlab jobs should increase ({before} -> {after})"
+
+    def test_weasyprint_export_goes_through_pool(self):
+        """A WeasyPrint PDF (informe de gastos) is rendered in the process pool"""
+        before = self._metrics()["by_kind"].get("weasyprint", {}).get("completed", 0)
+        response = self.session.get(f"{BASE_URL}/api/gastos/export/pdf")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        assert response.content[:4] == b'%PDF', "PDF file should start with %PDF"
+        after = self._metrics()["by_kind"].get("weasyprint", {}).get("completed", 0)
+        assert after >= before + 1, f"weasyprint jobs should increase ({before} -> {after})"
@@ -0,0 +1,136 @@
+"""
+Tests for the batched employee lookups (services/entity_loader.py) in RRHH listings:
+- GET /api/rrhh/fichajes - empleado_nombre resolved per row
+- GET /api/rrhh/fichajes/hoy - empleado_nombre / empleado_foto
+- GET /api/rrhh/productividad - empleado_nombre resolved per row
+- GET /api/rrhh/productividad/tiempo-real - employee and today's production
+Rows pointing to an unknown or malformed empleado_id are still returned,
+just without the employee name.
+"""
+
+import pytest
+import requests
+import os
+import uuid
+from datetime import datetime
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://campo-export-pro.preview.emergentagent.com').rstrip('/')
+
+UNKNOWN_EMPLEADO_ID = "000000000000000000000000"
+INVALID_EMPLEADO_ID = "not-an-object-id"
+
+
+@pytest.fixture
+def empleado(authenticated_client):
+    """Create an employee, yield it, then soft-delete it"""
+    unique_id = uuid.uuid4().hex[:8]
+    response = authenticated_client.post(f"{BASE_URL}/api/rrhh/empleados", json={
+        "nombre": "TEST_Loader",
+        "apellidos": f"Empleado_{unique_id}",
+        "dni_nie": f"TEST{unique_id}",
+        "fecha_alta": datetime.now().strftime("%Y-%m-%d"),
+        "tipo_contrato": "Temporal",
+        "puesto": "Operario",
+    })
+    assert response.status_code == 200, response.text
+    emp = response.json()["data"]
+    yield emp
+    authenticated_client.delete(f"{BASE_URL}/api/rrhh/empleados/{emp['_id']}")
+
+
+def _nombre(emp):
+    return f"{emp.get('nombre', '')} {emp.get('apellidos', '')}"
+
+
+class TestFichajesEmpleadoNombre:
+    """GET /api/rrhh/fichajes resolves employees in one batch"""
+    
+    def test_fichajes_list_resolves_names(self, authenticated_client, empleado):
+        """Known, unknown and malformed empleado_id in the same listing"""
+        tag = f"TEST_LOADER_{uuid.uuid4().hex[:8]}"
+        base = {"tipo": "entrada", "fecha": "2001-01-01", "hora": "08:00:00",
+                "metodo_identificacion": "manual", "parcela_id": tag}
+        response = authenticated_client.post(f"{BASE_URL}/api/rrhh/fichajes/sync", json=[
+            {**base, "empleado_id": empleado["_id"]},
+            {**base, "empleado_id": UNKNOWN_EMPLEADO_ID},
+            {**base, "empleado_id": INVALID_EMPLEADO_ID},
+        ])
+        assert response.status_code == 200
+        assert response.json()["synced"] == 3
+        
+        response = authenticated_client.get(f"{BASE_URL}/api/rrhh/fichajes", params={"parcela_id": tag})
+        assert response.status_code == 200
+        by_empleado = {f["empleado_id"]: f for f in response.json()["fichajes"]}
+        assert set(by_empleado) == {empleado["_id"], UNKNOWN_EMPLEADO_ID, INVALID_EMPLEADO_ID}
+        assert by_empleado[empleado["_id"]]["empleado_nombre"] == _nombre(empleado)
+        # Unknown employee: the row is kept without a name (unchanged behaviour).
+        assert "empleado_nombre" not in by_empleado[UNKNOWN_EMPLEADO_ID]
+        # Malformed id: used to raise a 500; now the row is kept without a name.
+        assert "empleado_nombre" not in by_empleado[INVALID_EMPLEADO_ID]
+    
+    def test_fichajes_hoy_resolves_names(self, authenticated_client, empleado):
+        """Today's fichajes and the real-time view carry the employee name and production"""
+        now = datetime.now()
+        response = authenticated_client.post(f"{BASE_URL}/api/rrhh/fichajes", json={
+            "empleado_id": empleado["_id"], "tipo": "entrada",
+            "fecha": now.strftime("%Y-%m-%d"), "hora": now.strftime("%H:%M:%S"),
+            "metodo_identificacion": "manual",
+        })
+        assert response.status_code == 200
+        fichaje_id = response.json()["data"]["_id"]
+        
+        response = authenticated_client.get(f"{BASE_URL}/api/rrhh/fichajes/hoy")
+        assert response.status_code == 200
+        fichaje = next(f for f in response.json()["fichajes"] if f["_id"] == fichaje_id)
+        assert fichaje["empleado_nombre"] == _nombre(empleado)
+        assert "empleado_foto" in fichaje
+        
+        response = authenticated_client.post(f"{BASE_URL}/api/rrhh/productividad", json={
+            "empleado_id": empleado["_id"], "fecha": now.strftime("%Y-%m-%d"),
+            "tipo_trabajo": "TEST_Loader", "kilos_recogidos": 123,
+        })
+        assert response.status_code == 200
+        registro_id = response.json()["data"]["_id"]
+        try:
+            response = authenticated_client.get(f"{BASE_URL}/api/rrhh/productividad/tiempo-real")
+            assert response.status_code == 200
+            trabajando = {e["empleado_id"]: e for e in response.json()["empleados_trabajando"]}
+            assert trabajando[empleado["_id"]]["empleado_nombre"] == _nombre(empleado)
+            assert trabajando[empleado["_id"]]["kilos_hoy"] == 123
+        finally:
+            authenticated_client.delete(f"{BASE_URL}/api/rrhh/productividad/{registro_id}")
+
+
+class TestProductividadEmpleadoNombre:
+    """GET /api/rrhh/productividad resolves employees in one batch"""
+    
+    def test_productividad_list_resolves_names(self, authenticated_client, empleado):
+        """Known, unknown and malformed empleado_id in the same listing"""
+        tag = f"TEST_LOADER_{uuid.uuid4().hex[:8]}"
+        base = {"fecha": "2001-01-01", "tipo_trabajo": tag, "kilos_recogidos": 10}
+        created = []
+        try:
+            for emp_id in (empleado["_id"], UNKNOWN_EMPLEADO_ID):
+                response = authenticated_client.post(f"{BASE_URL}/api/rrhh/productividad",
+                                                     json={**base, "empleado_id": emp_id})
+                assert response.status_code == 200
+                created.append(response.json()["data"]["_id"])
+            # A malformed id cannot go through POST (it looks the employee up); set it afterwards.
+            response = authenticated_client.post(f"{BASE_URL}/api/rrhh/productividad", json=base)
+            assert response.status_code == 200
+            created.append(response.json()["data"]["_id"])
+            response = authenticated_client.put(f"{BASE_URL}/api/rrhh/productividad/{created[-1]}",
+                                                json={"empleado_id": INVALID_EMPLEADO_ID})
+            assert response.status_code == 200
+            
+            response = authenticated_client.get(f"{BASE_URL}/api/rrhh/productividad",
+                                                params={"tipo_trabajo": tag})
+            assert response.status_code == 200
+            by_empleado = {r["empleado_id"]: r for r in response.json()["registros"]}
+            assert set(by_empleado) == {empleado["_id"], UNKNOWN_EMPLEADO_ID, INVALID_EMPLEADO_ID}
+            assert by_empleado[empleado["_id"]]["empleado_nombre"] == _nombre(empleado)
+            assert "empleado_nombre" not in by_empleado[UNKNOWN_EMPLEADO_ID]
+            assert "empleado_nombre" not in by_empleado[INVALID_EMPLEADO_ID]
+        finally:
+            for registro_id in created:
+                authenticated_client.delete(f"{BASE_URL}/api/rrhh/productividad/{registro_id}")
@@ -248,6 +248,60 @@ class TestSIGPACIntegrationFlow:
                 if uso_codigo == "TA":
                     assert uso_codigo in uso_names
 
+    def test_consulta_recorded_in_http_client_metrics(self, api_session):
+        """SIGPAC calls go through the shared 'sigpac' client and are counted"""
+        before = api_session.get(f"{BASE_URL}/api/system/http-clients")
+        assert before.status_code == 200
+        sigpac_before = before.json()["integrations"]["sigpac"]["requests"]
+
+        response = api_session.get(f"{BASE_URL}/api/sigpac/consulta", params={
+            "provincia": "41",
+            "municipio": "053",
+            "poligono": "5",
+            "parcela": "12"
+        })
+        assert response.status_code == 200
+
+        after = api_session.get(f"{BASE_URL}/api/system/http-clients").json()
+        sigpac = after["integrations"]["sigpac"]
+        # Several workers may serve the requests; only this worker's counters are visible
+        assert sigpac["requests"] >= sigpac_before
+        assert "p95_seconds" in sigpac and "retries" in sigpac
+        assert isinstance(after["http2"], bool)
+
+
+
+class TestSIGPACCache:
+    """Test the two-tier SIGPAC response cache"""
+
+    def test_repeated_consulta_served_from_cache(self, api_session):
+        params = {"provincia": "41", "municipio": "053", "poligono": "5", "parcela": "12"}
+        first = api_session.get(f"{BASE_URL}/api/sigpac/consulta", params=params)
+        assert first.status_code == 200
+        if not first.json().get("success"):
+            pytest.skip("SIGPAC external API not available")
+
+        # Same reference with different zero padding hits the same cache entry
+        second = api_session.get(f"{BASE_URL}/api/sigpac/consulta", params={**params, "municipio": "53", "poligono": "05"})
+        assert second.status_code == 200
+        assert second.json() == {**first.json(), "referencia": second.json()["referencia"]}
+
+        stats = api_session.get(f"{BASE_URL}/api/sigpac/cache/stats").json()
+        assert stats["success"] is True
+        assert stats["mongo_entries"] >= 1
+
+    def test_prewarm_queues_background_job(self, api_session):
+        response = api_session.post(f"{BASE_URL}/api/sigpac/cache/prewarm",
+                                    json={"provincia": "41", "municipio": "053", "max_referencias": 5})
+        if response.status_code == 403:
+            pytest.skip("Prewarm requires an Admin user")
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        status = api_session.get(f"{BASE_URL}/api/sigpac/cache/prewarm/{job_id}")
+        assert status.status_code == 200
+        assert status.json()["status"] in ("pending", "running", "completed", "failed")
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])
@@ -129,6 +129,28 @@ def test_smoke_agentes(headers):
     )
 
 
+def test_concurrent_agentes_get_distinct_codes(headers):
+    """Altas simultáneas de agentes reciben códigos distintos (contador atómico)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def create(_):
+        r = requests.post(
+            f"{API_URL}/api/agentes", headers=headers, timeout=TIMEOUT,
+            json={"nombre": f"SMOKE-Agente-{uuid.uuid4().hex[:8]}", "tipo": "Compra", "activo": True},
+        )
+        assert r.status_code == 200, r.text[:200]
+        return r.json()["data"]
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        created = list(pool.map(create, range(5)))
+    try:
+        codigos = [a["codigo"] for a in created]
+        assert len(set(codigos)) == len(codigos), codigos
+    finally:
+        for a in created:
+            requests.delete(f"{API_URL}/api/agentes/{a['_id']}", headers=headers, timeout=TIMEOUT)
+
+
 def test_smoke_fincas(headers):
     _crud_cycle(
         headers,
@@ -14,6 +14,14 @@ import { useBulkSelect, BulkActionBar, BulkCheckboxHeader, BulkCheckboxCell, bul
 import '../App.css';
 import { notify } from '../lib/notify';
 
+// Consulta del job de regeneración: cada cuánto, hasta cuándo y cuántos
+// errores de red seguidos se toleran antes de dejar de esperar.
+const REGENERAR_POLL_MS = 1500;
+const REGENERAR_MAX_WAIT_MS = 15 * 60 * 1000;
+const REGENERAR_MAX_POLL_ERRORS = 5;
+
+const regenerarError = (message) => Object.assign(new Error(message), { userMessage: message });
+
 const AlbaranesComision = () => {
   const { token, user } = useAuth();
   const canBulkDelete = !!user?.can_bulk_delete;
@@ -97,16 +105,50 @@ const AlbaranesComision = () => {
     }
   }, [activeTab, fetchHistorico]);
 
+  // La regeneración corre como job en segundo plano: se lanza y se consulta
+  // su estado hasta que termina. Devuelve el resumen (creados, saltados...).
+  const runRegenerar = async () => {
+    const res = await api.post('/api/albaranes-comision/regenerar?solo_faltantes=true');
+    let job = res?.data ?? res;
+    const deadline = Date.now() + REGENERAR_MAX_WAIT_MS;
+    let pollErrors = 0;
+    while (job.status === 'pending' || job.status === 'running') {
+      if (Date.now() > deadline) {
+        throw regenerarError(
+          `La regeneración sigue en curso tras ${REGENERAR_MAX_WAIT_MS / 60000} minutos. `
+          + 'Continúa en segundo plano: recarga la página más tarde para ver el resultado.'
+        );
+      }
+      await new Promise((resolve) => setTimeout(resolve, REGENERAR_POLL_MS));
+      try {
+        const st = await api.get(`/api/albaranes-comision/regenerar/${job.job_id}`);
+        job = st?.data ?? st;
+        pollErrors = 0;
+      } catch (err) {
+        pollErrors += 1;
+        if (pollErrors >= REGENERAR_MAX_POLL_ERRORS) {
+          throw regenerarError(
+            'No se pudo consultar el estado de la regeneración (error de conexión). '
+            + 'Puede seguir en curso en el servidor: recarga la página más tarde.'
+          );
+        }
+      }
+    }
+    if (job.status !== 'completed') {
+      throw regenerarError(`La regeneración no se completó: ${job.error || job.status}`);
+    }
+    return job.result || {};
+  };
+
   const handleRegenerar = async () => {
     if (!window.confirm('¿Generar automáticamente los albaranes de comisión que falten para los albaranes existentes? No se modifican los ya pagados.')) return;
     setRegenerating(true);
     try {
-      const res = await api.post('/api/albaranes-comision/regenerar?solo_faltantes=true');
-      const r = res?.data ?? res;
+      const r = await runRegenerar();
       notify.error(`Regeneración completada.\n• Creados: ${r.creados ?? 0}\n• Saltados: ${r.saltados ?? 0}${r.errores?.length ? `\n• Errores: ${r.errores.length}` : ''}`);
       await fetchAlbaranes();
     } catch (err) {
-      notify.error('Error regenerando albaranes de comisión');
+      notify.error(err?.userMessage || 'Error regenerando albaranes de comisión');
     } finally {
       setRegenerating(false);
     }
@@ -295,11 +337,10 @@ const AlbaranesComision = () => {
       clearSelection();
       if (regenerateAfterDelete) {
         try {
-          const res = await api.post('/api/albaranes-comision/regenerar?solo_faltantes=true');
-          const r = res?.data ?? res;
+          const r = await runRegenerar();
           notify.success(`Eliminación masiva completada.\nRegenerados automáticamente: ${r.creados ?? 0} albarán(es) de comisión.`);
-        } catch {
-          notify.error('Eliminación completada, pero hubo un error al regenerar.');
+        } catch (err) {
+          notify.error(`Eliminación completada, pero hubo un error al regenerar.${err?.userMessage ? `\n${err.userMessage}` : ''}`);
         }
       }
       await fetchAlbaranes();
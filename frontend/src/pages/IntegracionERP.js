@@ -14,6 +14,9 @@ const MODULOS_DISPONIBLES = [
   'albaranes', 'maquinaria', 'tecnicos_aplicadores', 'evaluaciones', 'agentes'
 ];
 
+// Modulos que emiten eventos de webhook (WEBHOOK_MODULES en services/webhook_outbox.py)
+const MODULOS_WEBHOOK = ['contratos', 'fincas'];
+
 const EVENTOS = ['create', 'update', 'delete'];
 
 // =============== TAB: API KEYS ===============
@@ -259,7 +262,7 @@ const TabWebhooks = () => {
             <div>
               <label className="form-label">Modulos a monitorear</label>
               <div style={{ display: 'flex', flexWrap: 'wrap', gap: '0.5rem' }}>
-                {MODULOS_DISPONIBLES.map(mod => (
+                {MODULOS_WEBHOOK.map(mod => (
                   <label key={mod} style={{ display: 'flex', alignItems: 'center', gap: '0.25rem', cursor: 'pointer', fontSize: '0.85rem', padding: '2px 6px', borderRadius: '4px', backgroundColor: form.modulos.includes(mod) ? 'hsl(var(--primary) / 0.1)' : 'transparent' }}>
                     <input type="checkbox" checked={form.modulos.includes(mod)} onChange={() => toggleModulo(mod)} />
                     {mod}
@@ -555,7 +558,7 @@ const TabDocumentacion = () => {
     },
     {
       key: 'import', title: 'Importar datos (ERP → FRUVECO)', icon: <Database size={16} />,
-      content: `POST ${baseUrl}/api/erp/contratos      → Crear contrato\nPUT  ${baseUrl}/api/erp/contratos/{ref} → Actualizar contrato\nGET  ${baseUrl}/api/erp/contratos/{ref} → Obtener contrato\nDEL  ${baseUrl}/api/erp/contratos/{ref} → Cancelar contrato\n\nMismos endpoints para: /proveedores, /clientes, /fincas, /parcelas, /cultivos\n\nVer documentacion interactiva: ${baseUrl}/docs#/erp-integration`
+      content: `POST ${baseUrl}/api/erp/contratos      → Crear contrato\nPUT  ${baseUrl}/api/erp/contratos/{ref} → Actualizar contrato\nGET  ${baseUrl}/api/erp/contratos/{ref} → Obtener contrato\nDEL  ${baseUrl}/api/erp/contratos/{ref} → Cancelar contrato\nPOST ${baseUrl}/api/erp/contratos/bulk → Carga masiva NDJSON (?modo=upsert|create|update)\n\nMismos endpoints para: /proveedores, /clientes, /fincas, /parcelas, /cultivos\n\nVer documentacion interactiva: ${baseUrl}/docs#/erp-integration`
     },
     {
       key: 'export', title: 'Exportar datos (FRUVECO → ERP)', icon: <FileDown size={16} />,
@@ -563,7 +566,7 @@ const TabDocumentacion = () => {
     },
     {
       key: 'webhooks_doc', title: 'Webhooks', icon: <Webhook size={16} />,
-      content: `FRUVECO puede notificar a tu ERP cuando se crean, actualizan o eliminan registros.\n\nPayload que recibiras:\n{\n  "event": "create",\n  "module": "contratos",\n  "timestamp": "2026-02-10T12:00:00Z",\n  "data": { ... }\n}\n\nHeaders que recibes:\n  X-Webhook-Signature: HMAC-SHA256 del payload con tu secret\n  X-Webhook-Event: nombre del evento\n\nConfigura webhooks en la seccion "Webhooks" de esta pagina.`
+      content: `FRUVECO puede notificar a tu ERP cuando se crean, actualizan o eliminan registros.\n\nPayload que recibiras:\n{\n  "id": "<event_id>",\n  "event": "create",\n  "module": "contratos",\n  "timestamp": "2026-02-10T12:00:00Z",\n  "data": { ... }\n}\n\nHeaders que recibes:\n  X-Webhook-Signature: sha256=<hex>\n  X-Webhook-Timestamp: segundos Unix del envio\n  X-Webhook-Event: nombre del evento\n  X-Webhook-Id: id de la entrega (para descartar duplicados)\n\nVerificar la firma (Python):\n  msg = timestamp.encode() + b"." + cuerpo_crudo\n  esperado = "sha256=" + hmac.new(secret.encode(), msg, hashlib.sha256).hexdigest()\n  hmac.compare_digest(esperado, header_signature)\n\nLos envios se hacen en segundo plano y se reintentan con backoff si tu ERP no responde 2xx. Con "max_batch" > 1 recibes {"event": "batch", "events": [...]}.\n\nConfigura webhooks en la seccion "Webhooks" de esta pagina.`
     },
   ];
 
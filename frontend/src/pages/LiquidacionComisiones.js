@@ -19,6 +19,8 @@ const LiquidacionComisiones = () => {
 
   // UX profesional: tarjetas colapsables + busqueda rapida
   const [expandedIds, setExpandedIds] = useState(new Set());
+  // Albaranes de cada agente: se cargan al expandir su tarjeta (el resumen solo trae totales)
+  const [detalles, setDetalles] = useState({});
   const [quickSearch, setQuickSearch] = useState('');
 
   // Filtros
@@ -66,6 +68,7 @@ const LiquidacionComisiones = () => {
       
       const data = await api.get(`/api/comisiones/resumen?${params}`);
       if (data.success) {
+        setDetalles({});
         setComisiones(data.comisiones || []);
         setTotales(data.totales || { total_comision_compra: 0, total_comision_venta: 0, total_general: 0 });
       }
@@ -74,6 +77,24 @@ const LiquidacionComisiones = () => {
     }
   };
   
+  const fetchDetalle = async (agente) => {
+    const key = `${agente.agente_id}-${agente.tipo}`;
+    setDetalles(prev => ({ ...prev, [key]: null }));
+    try {
+      const params = new URLSearchParams();
+      if (filters.campana) params.append('campana', filters.campana);
+      params.append('agente_id', agente.agente_id);
+      params.append('tipo_agente', agente.tipo);
+      params.append('detalle', 'true');
+      const data = await api.get(`/api/comisiones/resumen?${params}`);
+      const match = (data.comisiones || []).find(c => c.tipo === agente.tipo);
+      setDetalles(prev => ({ ...prev, [key]: match?.albaranes || [] }));
+    } catch (error) {
+      console.error('[LiquidacionComisiones.js]', error);
+      setDetalles(prev => ({ ...prev, [key]: [] }));
+    }
+  };
+  
   const downloadPdf = async (agenteId, tipoAgente, agenteNombre) => {
     setGeneratingPdf(`${agenteId}-${tipoAgente}`);
     try {
@@ -106,6 +127,8 @@ const LiquidacionComisiones = () => {
   // Helpers UX
   const cardKey = (a) => `${a.agente_id}-${a.tipo}`;
   const toggleExpand = (key) => {
+    const agente = comisionesAgrupadas[key];
+    if (agente && !expandedIds.has(key) && !(key in detalles)) fetchDetalle(agente);
     setExpandedIds(prev => {
       const s = new Set(prev);
       if (s.has(key)) s.delete(key); else s.add(key);
@@ -123,7 +146,10 @@ const LiquidacionComisiones = () => {
     return filtered.sort((a, b) => (b.total_comision || 0) - (a.total_comision || 0));
   }, [comisionesAgrupadas, quickSearch]);
 
-  const expandAll = () => setExpandedIds(new Set(agentesVisibles.map(cardKey)));
+  const expandAll = () => {
+    agentesVisibles.filter(a => !(cardKey(a) in detalles)).forEach(fetchDetalle);
+    setExpandedIds(new Set(agentesVisibles.map(cardKey)));
+  };
   const collapseAll = () => setExpandedIds(new Set());
   
   return (
@@ -326,7 +352,7 @@ const LiquidacionComisiones = () => {
                   <div style={{ display: 'flex', gap: '2rem', alignItems: 'center' }}>
                     <div style={{ textAlign: 'right' }}>
                       <div style={{ fontSize: '0.7rem', color: 'hsl(var(--muted-foreground))' }}>Albaranes</div>
-                      <div style={{ fontSize: '1rem', fontWeight: '600' }}>{agente.albaranes?.length || 0}</div>
+                      <div style={{ fontSize: '1rem', fontWeight: '600' }}>{agente.num_albaranes ?? agente.albaranes?.length ?? 0}</div>
                     </div>
                     <div style={{ textAlign: 'right' }}>
                       <div style={{ fontSize: '0.7rem', color: 'hsl(var(--muted-foreground))' }}>Kilos</div>
@@ -382,7 +408,14 @@ const LiquidacionComisiones = () => {
                       </tr>
                     </thead>
                     <tbody>
-                      {agente.albaranes?.map((albaran, cIdx) => (
+                      {detalles[key] === null && (
+                        <tr>
+                          <td colSpan={11} style={{ textAlign: 'center' }}>
+                            <Loader2 className="animate-spin" size={16} />
+                          </td>
+                        </tr>
+                      )}
+                      {(detalles[key] || []).map((albaran, cIdx) => (
                         <tr key={cIdx}>
                           <td style={{ fontWeight: '500' }}>{albaran.numero}</td>
                           <td>{albaran.fecha}</td>
@@ -7,24 +7,15 @@ import sys
 sys.path.insert(0, '/app/backend')
 
 from database import db
+from services.sequences import SequenceBlock
 proveedores_collection = db['proveedores']
 cultivos_collection = db['cultivos']
 
 
 async def main():
     # ---- Proveedores ----
-    # 1) Averiguar el siguiente codigo_proveedor libre
-    last = await proveedores_collection.find_one(
-        {"codigo_proveedor": {"$exists": True, "$ne": None}},
-        sort=[("codigo_proveedor", -1)],
-    )
-    if last and last.get("codigo_proveedor"):
-        try:
-            next_num = int(last["codigo_proveedor"]) + 1
-        except (ValueError, TypeError):
-            next_num = (await proveedores_collection.count_documents({})) + 1
-    else:
-        next_num = 1
+    # 1) Los códigos salen del contador atómico compartido con la API
+    codigos = SequenceBlock("proveedores")
 
     # 2) Proveedores sin codigo_proveedor → asignar uno único
     cursor = proveedores_collection.find({
@@ -32,13 +23,13 @@ async def main():
     }).sort([("nombre", 1)])
     fixed_cp = 0
     async for p in cursor:
-        codigo = str(next_num).zfill(6)
+        codigo = str(await codigos.next()).zfill(6)
         await proveedores_collection.update_one(
             {"_id": p["_id"]},
             {"$set": {"codigo_proveedor": codigo, "activo": True}},
         )
-        next_num += 1
         fixed_cp += 1
+    await codigos.release()
 
     # 3) Proveedores con codigo pero sin activo → activo=True
     r_activo = await proveedores_collection.update_many(
@@ -0,0 +1,87 @@
+"""
+Print the `explain()` plan of every query registered in the index registry.
+
+For each entry of `REGISTERED_QUERIES` (backend/services/index_registry.py)
+shows the winning plan stage (IXSCAN / COLLSCAN), the index used and the
+docs/keys examined, so a missing or unused index is obvious at a glance.
+
+Usage:
+    python scripts/explain_indexes.py              # all registered queries
+    python scripts/explain_indexes.py albaranes    # only one collection
+    python scripts/explain_indexes.py --ensure     # create missing indexes first
+    python scripts/explain_indexes.py --verbose    # dump the full winning plan
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+sys.path.insert(0, "/app/backend")
+from database import db  # noqa: E402
+from services.index_registry import REGISTERED_QUERIES, ensure_indexes  # noqa: E402
+
+
+def _stages(plan):
+    """Flatten the nested winningPlan into a list of stage names."""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage", "?"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+def _index_name(plan):
+    while plan:
+        if plan.get("indexName"):
+            return plan["indexName"]
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("collection", nargs="?", help="Limit to one collection")
+    parser.add_argument("--ensure", action="store_true", help="Run ensure_indexes() before explaining")
+    parser.add_argument("--verbose", action="store_true", help="Print the full winning plan")
+    args = parser.parse_args()
+
+    if args.ensure:
+        report = await ensure_indexes()
+        print(f"Created: {len(report['created'])}  Errors: {len(report['errors'])}  "
+              f"Mismatched: {len(report['mismatched'])}  Unexpected: {len(report['unexpected'])}\n")
+
+    collscans = 0
+    for query in REGISTERED_QUERIES:
+        if args.collection and query.collection != args.collection:
+            continue
+        cursor = db[query.collection].find(query.filter, query.projection)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explain = await cursor.explain()
+        planner = explain.get("queryPlanner", {})
+        winning = planner.get("winningPlan", {})
+        # Mongo 7+ (SBE) anida el plan clásico en queryPlan
+        winning = winning.get("queryPlan", winning)
+        stats = explain.get("executionStats", {})
+        stages = _stages(winning)
+        if "COLLSCAN" in stages:
+            collscans += 1
+
+        print(f"[{query.collection}] {query.description}")
+        print(f"    filter : {json.dumps(query.filter, default=str)}")
+        if query.sort:
+            print(f"    sort   : {query.sort}")
+        print(f"    plan   : {' <- '.join(stages)}")
+        print(f"    index  : {_index_name(winning) or '-'}")
+        if stats:
+            print(f"    examined: keys={stats.get('totalKeysExamined')} docs={stats.get('totalDocsExamined')} "
+                  f"returned={stats.get('nReturned')} ms={stats.get('executionTimeMillis')}")
+        if args.verbose:
+            print(json.dumps(winning, indent=2, default=str))
+        print()
+
+    print(f"Done. {collscans} registered quer{'y uses' if collscans == 1 else 'ies use'} COLLSCAN.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
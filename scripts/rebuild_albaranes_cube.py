@@ -0,0 +1,21 @@
+"""
+Rebuild the `albaranes_diario` cube (daily rollup of albaranes) from scratch.
+
+The cube backs /api/gastos/*, /api/ingresos/* and /api/comisiones/resumen.
+Routes keep it up to date incrementally; run this after bulk imports, direct
+database edits or whenever the reports disagree with the raw albaranes.
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, "/app/backend")
+from services.albaranes_cube import rebuild_albaranes_cube  # noqa: E402
+
+
+async def main():
+    result = await rebuild_albaranes_cube()
+    print(f"Done. {result['albaranes']} albaranes -> {result['rows']} cube rows in {result['seconds']}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,24 @@
+"""
+Seed the atomic counters (`counters` collection) from the current maxima.
+
+One-time migration for services/sequences.py: ACM numbers, contract numbers
+per year, codigo_proveedor and agente/artículo codes. Counters also seed
+themselves on first use, so this only makes the switch explicit. Re-running
+it is safe: counters are only ever moved forward ($max).
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, "/app/backend")
+from services.sequences import seed_sequences  # noqa: E402
+
+
+async def main():
+    seeded = await seed_sequences()
+    for counter_id, value in sorted(seeded.items()):
+        print(f"{counter_id}: {value}")
+    print(f"Done. {len(seeded)} counters seeded")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())